@@ -0,0 +1,16 @@
+"""
+ベンチマーク・負荷試験ハーネス
+
+有料APIを呼ばずに chat_api / save_conversation / search_conversations の
+スループットとレイテンシを計測するためのツール群です。
+
+- fake_openai: OpenAI互換のローカルスタブ（遅延・ストリーミング・失敗率を設定可能）
+- corpus: 合成会話コーパスの生成（10k / 100k / 1M 件）
+- scenarios: chat / search / ingest / memory の各シナリオ
+- run: シナリオ実行と結果(JSON)出力、しきい値による回帰判定
+
+使用例:
+    python -m bench.fake_openai --port 8765 --latency-ms 300
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_BASE=http://127.0.0.1:8765/v1 \\
+        python -m bench.run --scenarios search,ingest --requests 500 --output bench_results.json
+"""
@@ -0,0 +1,95 @@
+"""
+合成会話コーパスの生成
+実データを使わずに 10k / 100k / 1M 件規模の会話を決定的に生成します。
+生成はジェネレータで行うため、1M件でもメモリ使用量は一定です。
+
+使用例:
+    python -m bench.corpus --scale 100k --output data/bench_corpus_100k.jsonl
+"""
+from datetime import datetime, timedelta
+from typing import Iterator
+import argparse
+import json
+import random
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+_TOPICS = [
+    "Pythonの非同期処理", "Djangoのミドルウェア", "ベクトル検索の精度", "週末の旅行計画",
+    "プロジェクトの進捗報告", "データベースの移行", "機械学習モデルの評価", "料理のレシピ",
+    "API設計のレビュー", "ログ解析", "キャッシュ戦略", "テストの自動化",
+]
+_QUESTIONS = [
+    "{topic}について教えてください",
+    "{topic}で困っています。どうすればいいですか",
+    "{topic}のベストプラクティスは何ですか",
+    "昨日話した{topic}の続きをお願いします",
+    "Can you summarize {topic} for me?",
+]
+_ANSWERS = [
+    "{topic}については、まず全体像を把握することが重要です。",
+    "{topic}の場合、次の3つの点に注意してください。",
+    "以前の会話によると、{topic}は段階的に進めるのがよさそうです。",
+    "Here is a short summary of {topic}: start small and measure.",
+]
+# プライバシー判定が働くよう一定割合で含める語句
+_SENSITIVE = ["password は共有しないでください", "email: user{n}@example.com",
+              "phone 090-1234-{n:04d}", "confidential な資料です"]
+
+
+def generate(count: int, seed: int = 42, start: datetime = None) -> Iterator[dict]:
+    """
+    会話レコードを順に生成する
+
+    Args:
+        count: 生成件数
+        seed: 乱数シード（同じシードなら同じコーパス）
+        start: 最初の会話のタイムスタンプ（デフォルト: 1年前）
+    Yields:
+        dict: {"message", "response", "timestamp"}
+    """
+    rng = random.Random(seed)
+    start = start or (datetime.now() - timedelta(days=365))
+    step = timedelta(days=365) / max(count, 1)
+    for i in range(count):
+        topic = rng.choice(_TOPICS)
+        message = rng.choice(_QUESTIONS).format(topic=topic)
+        response = rng.choice(_ANSWERS).format(topic=topic)
+        # 約5%は直前とほぼ同じ質問を繰り返す（重複排除の評価用）
+        if rng.random() < 0.05:
+            message = message + "（再質問）"
+        if rng.random() < 0.1:
+            response += " " + rng.choice(_SENSITIVE).format(n=i % 10000)
+        # 応答長にばらつきを持たせる
+        response += " 詳細:" + "。".join(rng.choice(_TOPICS) for _ in range(rng.randint(0, 8)))
+        yield {
+            "message": message,
+            "response": response,
+            "timestamp": (start + step * i).isoformat(),
+        }
+
+
+def parse_scale(value: str) -> int:
+    """"10k" / "100k" / "1m" または整数文字列を件数に変換する"""
+    key = value.lower()
+    if key in SCALES:
+        return SCALES[key]
+    return int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="合成会話コーパスを JSON Lines で出力")
+    parser.add_argument("--scale", default="10k", help="10k / 100k / 1m または件数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args(argv)
+
+    count = parse_scale(args.scale)
+    with open(args.output, "w", encoding="utf-8") as f:
+        for record in generate(count, seed=args.seed):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"{count}件の会話を出力しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+OpenAI互換のローカルスタブサーバー
+/v1/chat/completions（通常・ストリーミング）、/v1/embeddings、/v1/models を提供します。
+応答内容は入力から決定的に生成されるため、同じ入力には常に同じ応答を返します。
+
+使用例:
+    python -m bench.fake_openai --port 8765 --latency-ms 300 --token-delay-ms 5 --failure-rate 0.01
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+import argparse
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+
+
+@dataclass
+class StubConfig:
+    """
+    スタブの挙動設定
+
+    Attributes:
+        latency_ms: 応答（ストリーミング時は最初のトークン）までの基本遅延
+        jitter_ms: 遅延に加える一様乱数の幅
+        token_delay_ms: ストリーミング時のトークン間遅延
+        embedding_latency_ms: 埋め込みAPIの遅延
+        failure_rate: 500/429 エラーを返す確率
+        embedding_dim: 埋め込みベクトルの次元数
+        reply_tokens: 生成する応答のトークン（単語）数
+    """
+    latency_ms: float = 200.0
+    jitter_ms: float = 50.0
+    token_delay_ms: float = 5.0
+    embedding_latency_ms: float = 20.0
+    failure_rate: float = 0.0
+    embedding_dim: int = 1536
+    reply_tokens: int = 40
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    """
+    テキストから決定的な単位ベクトルを生成する
+
+    単語ごとのハッシュベクトルを足し合わせるため、語彙が重なる文ほど類似度が高くなる。
+    """
+    vec = [0.0] * dim
+    for word in text.lower().split() or [""]:
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=16).digest()
+        seed = struct.unpack("<Q", digest[:8])[0]
+        rng = random.Random(seed)
+        for _ in range(8):
+            vec[rng.randrange(dim)] += rng.choice((-1.0, 1.0))
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+
+def fake_reply(messages: list, num_tokens: int) -> List[str]:
+    """最後のユーザー発話から決定的な応答トークン列を生成する"""
+    last = next((m.get("content", "") for m in reversed(messages)
+                 if m.get("role") == "user"), "")
+    rng = random.Random(hashlib.sha256(str(last).encode("utf-8")).hexdigest())
+    words = ["了解", "です", "context", "memory", "search", "応答", "test", "data", "chat", "ok"]
+    return [rng.choice(words) + " " for _ in range(num_tokens)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    # ThreadingHTTPServer から参照する設定
+    config: StubConfig = StubConfig()
+    on_request: Optional[Callable[[str, dict], Optional[dict]]] = None
+
+    def log_message(self, format, *args):
+        # アクセスログはベンチ結果を汚すため出力しない
+        pass
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b"{}"
+        return json.loads(body or b"{}")
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _sleep(self, base_ms: float):
+        jitter = random.uniform(0, self.config.jitter_ms) if self.config.jitter_ms else 0
+        time.sleep(max(0.0, base_ms + jitter) / 1000)
+
+    def _maybe_fail(self) -> bool:
+        if self.config.failure_rate and random.random() < self.config.failure_rate:
+            status = random.choice((429, 500))
+            self._send_json(status, {"error": {"message": "injected failure",
+                                               "type": "server_error", "code": status}})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [
+                {"id": "fake-model", "object": "model", "owned_by": "bench"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        try:
+            body = self._read_json()
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+        if self.path.endswith("/chat/completions"):
+            self._chat(body)
+        elif self.path.endswith("/embeddings"):
+            self._embeddings(body)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def _chat(self, body: dict):
+        if self._maybe_fail():
+            return
+        messages = body.get("messages", [])
+        model = body.get("model", "fake-model")
+        # on_request フックで応答内容と遅延を差し替え可能（記録済み応答の再生用）
+        override = (self.on_request("chat", body) if self.on_request else None) or {}
+        tokens = override.get("tokens") or fake_reply(messages, self.config.reply_tokens)
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 + 1 for m in messages)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+        created = int(time.time())
+        completion_id = "chatcmpl-" + hashlib.md5(json.dumps(messages).encode()).hexdigest()[:12]
+
+        self._sleep(override.get("latency_ms", self.config.latency_ms))
+        if not body.get("stream"):
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created,
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def emit(chunk: dict):
+            self.wfile.write(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        base = {"id": completion_id, "object": "chat.completion.chunk",
+                "created": created, "model": model}
+        for i, token in enumerate(tokens):
+            if i and self.config.token_delay_ms:
+                time.sleep(self.config.token_delay_ms / 1000)
+            emit({**base, "choices": [{"index": 0, "delta": {"content": token},
+                                       "finish_reason": None}]})
+        emit({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            emit({**base, "choices": [], "usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _embeddings(self, body: dict):
+        if self._maybe_fail():
+            return
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        self._sleep(self.config.embedding_latency_ms)
+        data = []
+        for i, item in enumerate(inputs):
+            # tiktoken でトークン化された入力（整数列）にも対応
+            text = item if isinstance(item, str) else " ".join(str(t) for t in item)
+            data.append({"object": "embedding", "index": i,
+                         "embedding": fake_embedding(text, self.config.embedding_dim)})
+        tokens = sum(len(str(t)) // 4 + 1 for t in inputs)
+        self._send_json(200, {"object": "list", "data": data, "model": body.get("model", ""),
+                              "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+
+class FakeOpenAIServer:
+    """
+    スタブサーバーをバックグラウンドスレッドで起動・停止するヘルパー
+
+    Attributes:
+        base_url: OPENAI_BASE_URL に設定するURL（例: http://127.0.0.1:8765/v1）
+    """
+
+    def __init__(self, config: Optional[StubConfig] = None, host: str = "127.0.0.1",
+                 port: int = 0, on_request=None):
+        handler = type("ConfiguredHandler", (_Handler,), {
+            "config": config or StubConfig(),
+            "on_request": staticmethod(on_request) if on_request else None,
+        })
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI互換のローカルスタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--token-delay-ms", type=float, default=5.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    args = parser.parse_args(argv)
+
+    config = StubConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        token_delay_ms=args.token_delay_ms, embedding_latency_ms=args.embedding_latency_ms,
+        failure_rate=args.failure_rate, embedding_dim=args.embedding_dim,
+        reply_tokens=args.reply_tokens,
+    )
+    server = FakeOpenAIServer(config, host=args.host, port=args.port)
+    print(f"Fake OpenAI server: {server.base_url}")
+    print(f"  OPENAI_BASE_URL={server.base_url} OPENAI_API_BASE={server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+内部IFメッセージ符号化のマイクロベンチマーク
+従来のテキスト形式とバイナリフレームについて、符号化・解析・ストリーム解析の
+メッセージ/秒を比較します。
+
+使用例:
+    python -m bench.internal_if_bench --messages 200000 --data-bytes 256
+"""
+import argparse
+import json
+import time
+
+from core.internal_if_codec import (
+    APIPayload, FrameParser, decode_frame, decode_text, encode_frame, encode_text,
+)
+
+
+def build_payloads(count: int, data_bytes: int) -> list:
+    """トレース付きのペイロードを作る（text 形式が壊れないようカンマは含めない）"""
+    data = ("x" * data_bytes)
+    trace = "00-" + "a" * 32 + "-" + "b" * 16 + "-01"
+    return [APIPayload("12", "25", f"save{i % 10}", "1", data, trace) for i in range(count)]
+
+
+def rate(func, items, repeat: int) -> float:
+    """func(items) の最良実行時間からメッセージ/秒を求める"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(items)
+        best = min(best, time.perf_counter() - start)
+    return len(items) / best
+
+
+def stream_parse(frames: list, chunk_size: int) -> int:
+    """連結したフレームを任意の位置で分割して FrameParser に流し込む"""
+    stream = b"".join(frames)
+    parser = FrameParser()
+    count = 0
+    with memoryview(stream) as view:
+        for i in range(0, len(stream), chunk_size):
+            for _ in parser.feed(view[i:i + chunk_size]):
+                count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="内部IFメッセージ符号化の比較")
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--data-bytes", type=int, default=128)
+    parser.add_argument("--chunk-size", type=int, default=64 * 1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    payloads = build_payloads(args.messages, args.data_bytes)
+    texts = [encode_text(p) for p in payloads]
+    frames = [encode_frame(p) for p in payloads]
+    assert decode_text(texts[0]) == payloads[0] and decode_frame(frames[0]) == payloads[0]
+
+    results = {
+        "messages": args.messages,
+        "data_bytes": args.data_bytes,
+        "text_bytes_per_msg": len(texts[0].encode("utf-8")),
+        "binary_bytes_per_msg": len(frames[0]),
+        "text_encode_msg_per_s": round(rate(lambda ps: [encode_text(p) for p in ps],
+                                            payloads, args.repeat)),
+        "binary_encode_msg_per_s": round(rate(lambda ps: [encode_frame(p) for p in ps],
+                                              payloads, args.repeat)),
+        "text_decode_msg_per_s": round(rate(lambda ms: [decode_text(m) for m in ms],
+                                            texts, args.repeat)),
+        "binary_decode_msg_per_s": round(rate(lambda ms: [decode_frame(m) for m in ms],
+                                              frames, args.repeat)),
+        "binary_stream_msg_per_s": round(rate(lambda fs: stream_parse(fs, args.chunk_size),
+                                              frames, args.repeat)),
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+PrivacyAnalyzer のスループット計測
+旧実装（キーワードごとの部分文字列走査）と、結合正規表現による現実装を
+大きなテキストで比較し、MB/s を出力します。同じルールセットを素朴に走査した場合と、
+合成キーワードでルール数を増やした場合の比較も行います。
+
+使用例:
+    python -m bench.privacy_bench --size-mb 8 --repeat 3
+"""
+import argparse
+import json
+import time
+
+from bench import corpus
+from core.privacy_analyzer import DEFAULT_RULES, PrivacyAnalyzer
+
+_LEGACY_KEYWORDS = {
+    'high': ['password', 'secret', 'private', 'confidential'],
+    'medium': ['email', 'phone', 'address'],
+    'low': ['name', 'company', 'public'],
+}
+
+
+def legacy_analyze(text: str) -> str:
+    """旧実装と同じ判定（比較用）"""
+    text_lower = text.lower()
+    for level, keywords in _LEGACY_KEYWORDS.items():
+        if any(keyword in text_lower for keyword in keywords):
+            return level
+    return 'low'
+
+
+def naive_analyzer(rules: dict):
+    """同じルールセットをキーワードごと・パターンごとに走査する素朴な実装（比較用）"""
+    import re
+    levels = []
+    for level in ('high', 'medium', 'low'):
+        rule = rules.get(level, {})
+        patterns = [re.compile(spec if isinstance(spec, str) else spec['pattern'])
+                    for spec in rule.get('patterns', {}).values()]
+        levels.append((level, [k.lower() for k in rule.get('keywords', [])], patterns))
+
+    def analyze(text: str) -> str:
+        text_lower = text.lower()
+        for level, keywords, patterns in levels:
+            if any(k in text_lower for k in keywords) or any(p.search(text_lower) for p in patterns):
+                return level
+        return 'low'
+    return analyze
+
+
+def with_extra_keywords(rules: dict, count: int) -> dict:
+    """ルール数の増加に対する性能を見るため、合成キーワードを追加したルールを作る"""
+    extended = {level: {"keywords": list(rule.get("keywords", [])),
+                        "patterns": dict(rule.get("patterns", {}))}
+                for level, rule in rules.items()}
+    for i in range(count):
+        extended["medium"]["keywords"].append(f"zqx{i:04d}term")
+    return extended
+
+
+def build_texts(size_mb: float, doc_chars: int) -> list:
+    """合成コーパスから機密語を含まない文書を指定サイズ分作る（最悪ケース=全走査）"""
+    target = int(size_mb * 1024 * 1024)
+    texts, total, buf = [], 0, []
+    for record in corpus.generate(10 ** 9, seed=7):
+        chunk = (record["message"] + " " + record["response"]).split(" 詳細:")[0]
+        if any(k in chunk.lower() for k in ("password", "email", "phone", "confidential")):
+            continue
+        buf.append(chunk)
+        if sum(len(b) for b in buf) >= doc_chars:
+            doc = " ".join(buf)
+            texts.append(doc)
+            total += len(doc.encode("utf-8"))
+            buf = []
+            if total >= target:
+                break
+    return texts
+
+
+def measure(func, texts, repeat: int) -> float:
+    size = sum(len(t.encode("utf-8")) for t in texts)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(texts)
+        best = min(best, time.perf_counter() - start)
+    return size / (1024 * 1024) / best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PrivacyAnalyzer のスループット計測")
+    parser.add_argument("--size-mb", type=float, default=4.0)
+    parser.add_argument("--doc-chars", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--extra-keywords", type=int, default=200,
+                        help="スケーリング計測用に追加する合成キーワード数")
+    args = parser.parse_args(argv)
+
+    texts = build_texts(args.size_mb, args.doc_chars)
+    analyzer = PrivacyAnalyzer()
+    scaled_rules = with_extra_keywords(DEFAULT_RULES, args.extra_keywords)
+    scaled = PrivacyAnalyzer(scaled_rules)
+    naive = naive_analyzer(DEFAULT_RULES)
+    naive_scaled = naive_analyzer(scaled_rules)
+    results = {
+        "documents": len(texts),
+        "size_mb": round(sum(len(t.encode("utf-8")) for t in texts) / 1024 / 1024, 2),
+        "legacy_mb_per_s": round(measure(lambda ts: [legacy_analyze(t) for t in ts],
+                                         texts, args.repeat), 2),
+        "compiled_mb_per_s": round(measure(analyzer.classify_batch, texts, args.repeat), 2),
+        "naive_same_rules_mb_per_s": round(measure(lambda ts: [naive(t) for t in ts],
+                                                   texts, args.repeat), 2),
+        "legacy_rule_count": sum(len(v) for v in _LEGACY_KEYWORDS.values()),
+        "compiled_rule_count": len(analyzer._keywords) + len(analyzer._patterns),
+        "scaled_rule_count": len(scaled._keywords) + len(scaled._patterns),
+        "naive_scaled_mb_per_s": round(measure(lambda ts: [naive_scaled(t) for t in ts],
+                                               texts, args.repeat), 2),
+        "compiled_scaled_mb_per_s": round(measure(scaled.classify_batch, texts, args.repeat), 2),
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+記録済みトラフィックの再生CLI
+core.traffic_recorder が出力したログを、元の到着間隔を N 倍速で再現しながら
+対象サーバーへ送信し、記録時とのレイテンシ・スループットの差を報告します。
+
+プロバイダー応答は以下から選択できます:
+    recorded: 記録された応答テキストとTTFTをスタブから返す（決定的な再生）
+    stub:     スタブの合成応答を返す
+    none:     スタブを起動しない（対象サーバーの設定に従う）
+スタブを使う場合、対象サーバーは OPENAI_BASE_URL=http://127.0.0.1:<stub-port>/v1 で起動してください。
+
+使用例:
+    python -m bench.replay logs/traffic.jsonl --speed 4 --provider recorded \\
+        --base-url http://127.0.0.1:8000 --output replay_report.json --compare previous.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlencode
+import argparse
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from bench.fake_openai import FakeOpenAIServer, StubConfig
+from bench.stats import compare_runs, summarize
+from core.traffic_recorder import read_log
+
+_TOKEN_RE = re.compile(r"\S+\s*|\s+")
+
+
+def _key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def build_provider_hook(records: list):
+    """
+    記録済みのプロバイダー応答をスタブから返すためのフックを作る
+
+    最後のユーザー発話（匿名化済みメッセージ）をキーに応答を引き当てる。
+    同じ発話が複数回記録されている場合は記録順に返す。
+    """
+    responses = {}
+    for record in records:
+        if record.get("k") != "chat" or not record.get("p"):
+            continue
+        responses.setdefault(_key(record["q"].get("message", "")), []).extend(record["p"])
+    cursors = {}
+    lock = threading.Lock()
+
+    def hook(kind, body):
+        messages = body.get("messages", [])
+        last = next((m.get("content", "") for m in reversed(messages)
+                     if m.get("role") == "user"), "")
+        key = _key(str(last))
+        candidates = responses.get(key)
+        if not candidates:
+            return None
+        with lock:
+            index = cursors.get(key, 0)
+            cursors[key] = index + 1
+        call = candidates[index % len(candidates)]
+        override = {"tokens": _TOKEN_RE.findall(call.get("text") or "") or [""]}
+        if call.get("ttft_ms") is not None:
+            override["latency_ms"] = call["ttft_ms"]
+        return override
+    return hook
+
+
+def send(base_url: str, record: dict, timeout: float) -> int:
+    """1レコード分のリクエストを送信し、HTTPステータスを返す"""
+    if record["k"] == "chat":
+        body = json.dumps({"message": record["q"].get("message", "")}).encode("utf-8")
+        req = urllib.request.Request(base_url + "/chat/api/", data=body, method="POST",
+                                     headers={"Content-Type": "application/json"})
+    else:
+        params = [("query", record["q"].get("query", ""))]
+        if record["q"].get("privacy_level"):
+            params.append(("privacy_level", record["q"]["privacy_level"]))
+        params += [("tags[]", t) for t in record["q"].get("tags") or []]
+        req = urllib.request.Request(base_url + "/chat/api/memory/search/?" + urlencode(params))
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def replay(records: list, base_url: str, speed: float, workers: int, timeout: float) -> dict:
+    """
+    記録の到着間隔を 1/speed に縮めて再生し、種別ごとの集計を返す
+    """
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+
+    def run(record):
+        start = time.perf_counter()
+        try:
+            status = send(base_url, record, timeout)
+        except Exception:
+            status = 0
+        elapsed = time.perf_counter() - start
+        with lock:
+            if 200 <= status < 400:
+                latencies.setdefault(record["k"], []).append(elapsed)
+            else:
+                errors[record["k"]] = errors.get(record["k"], 0) + 1
+
+    origin = records[0]["t"] if records else 0.0
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for record in records:
+            delay = (record["t"] - origin) / speed - (time.perf_counter() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run, record)
+    wall = time.perf_counter() - wall_start
+
+    kinds = set(latencies) | set(errors)
+    return {k: summarize(latencies.get(k, []), errors.get(k, 0), wall) for k in sorted(kinds)}
+
+
+def summarize_recorded(records: list) -> dict:
+    """記録時点のサーバー側処理時間とスループットを種別ごとに集計する"""
+    by_kind = {}
+    for record in records:
+        by_kind.setdefault(record["k"], []).append(record)
+    span = (records[-1]["t"] - records[0]["t"]) if len(records) > 1 else 0.0
+    result = {}
+    for kind, items in sorted(by_kind.items()):
+        ok = [r["ms"] / 1000 for r in items if 200 <= r.get("s", 0) < 400]
+        result[kind] = summarize(ok, len(items) - len(ok), span)
+    return result
+
+
+def diff(before: dict, after: dict) -> dict:
+    """2つの集計結果の差分（after - before）を返す"""
+    out = {}
+    for kind in sorted(set(before) & set(after)):
+        out[kind] = {
+            key: round(after[kind][key] - before[kind][key], 3)
+            for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "error_rate")
+        }
+    return out
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="記録済みトラフィックの再生")
+    parser.add_argument("log", help="TRAFFIC_RECORD_PATH で記録したファイル")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="再生速度の倍率")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--kinds", default="chat,search")
+    parser.add_argument("--provider", choices=("recorded", "stub", "none"), default="recorded")
+    parser.add_argument("--stub-port", type=int, default=8765)
+    parser.add_argument("--output", default="replay_report.json")
+    parser.add_argument("--compare", help="比較対象の過去の再生レポート")
+    parser.add_argument("--max-regression-pct", type=float, default=20.0)
+    args = parser.parse_args(argv)
+
+    kinds = set(args.kinds.split(","))
+    records = sorted((r for r in read_log(args.log) if r.get("k") in kinds),
+                     key=lambda r: r["t"])
+    if not records:
+        print("再生対象のレコードがありません")
+        return 1
+
+    stub = None
+    if args.provider != "none":
+        hook = build_provider_hook(records) if args.provider == "recorded" else None
+        stub = FakeOpenAIServer(StubConfig(jitter_ms=0), port=args.stub_port,
+                                on_request=hook).start()
+        print(f"プロバイダースタブ: {stub.base_url}")
+
+    try:
+        replayed = replay(records, args.base_url.rstrip("/"), args.speed,
+                          args.workers, args.timeout)
+    finally:
+        if stub:
+            stub.stop()
+
+    recorded = summarize_recorded(records)
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "log": args.log,
+        "speed": args.speed,
+        "provider": args.provider,
+        "records": len(records),
+        "recorded": recorded,
+        "results": replayed,
+        "diff_vs_recorded": diff(recorded, replayed),
+    }
+    regressions = []
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        report["diff_vs_previous"] = diff(previous["results"], replayed)
+        regressions = compare_runs(previous["results"], replayed, args.max_regression_pct)
+        report["regressions"] = regressions
+    Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2),
+                                 encoding="utf-8")
+    print(json.dumps(report["diff_vs_recorded"], ensure_ascii=False, indent=2))
+    print(f"レポートを出力しました: {args.output}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
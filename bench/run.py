@@ -0,0 +1,152 @@
+"""
+ベンチマーク実行CLI
+シナリオを指定した並列度で実行し、p50/p95/p99・スループット・エラー率を
+JSONで出力します。しきい値や前回結果との比較で回帰があれば終了コード1を返します。
+
+使用例:
+    python -m bench.run --scenarios ingest,search,memory --requests 500 --concurrency 8 \\
+        --stub --output bench_results.json --thresholds bench/thresholds.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from bench import scenarios as scenario_registry
+from bench.fake_openai import FakeOpenAIServer, StubConfig
+from bench.stats import check_thresholds, compare_runs, summarize
+
+
+def run_scenario(scenario, requests: int, concurrency: int, warmup: int = 0) -> dict:
+    """
+    1つのシナリオを実行して集計結果を返す
+
+    Args:
+        scenario: Scenario インスタンス
+        requests: 計測するリクエスト数
+        concurrency: 同時実行数
+        warmup: 計測前に捨てるリクエスト数
+    """
+    scenario.setup()
+    for i in range(warmup):
+        try:
+            scenario.operation(i)
+        except Exception:
+            pass
+
+    latencies = []
+    errors = []
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            scenario.operation(i)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            return
+        latencies.append(time.perf_counter() - start)
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - wall_start
+    scenario.teardown()
+
+    result = summarize(latencies, len(errors), wall)
+    result["concurrency"] = concurrency
+    if errors:
+        result["sample_errors"] = errors[:5]
+    return result
+
+
+def _apply_stub_env(base_url: str):
+    """アプリ側のOpenAIクライアントがスタブを向くよう環境変数を設定する"""
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_BASE"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench-000000000000000000000000")
+    os.environ.setdefault("MODEL_NAME", "fake-model")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="チャット／記憶システムのベンチマーク")
+    parser.add_argument("--scenarios", default="ingest,search,memory",
+                        help="カンマ区切り: " + ",".join(scenario_registry.SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--preload", type=int, default=0,
+                        help="search/memory の前に投入する会話数")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000",
+                        help="chat シナリオの対象サーバー")
+    parser.add_argument("--db-dir", default=None,
+                        help="DB保存先（省略時は一時ディレクトリ）")
+    parser.add_argument("--stub", action="store_true",
+                        help="プロセス内でOpenAIスタブを起動して使用する")
+    parser.add_argument("--stub-latency-ms", type=float, default=200.0)
+    parser.add_argument("--stub-failure-rate", type=float, default=0.0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--thresholds", help="しきい値JSONファイル")
+    parser.add_argument("--baseline", help="比較対象の前回結果JSONファイル")
+    parser.add_argument("--max-regression-pct", type=float, default=20.0)
+    args = parser.parse_args(argv)
+
+    stub = None
+    if args.stub:
+        stub = FakeOpenAIServer(StubConfig(latency_ms=args.stub_latency_ms,
+                                           failure_rate=args.stub_failure_rate)).start()
+        _apply_stub_env(stub.base_url)
+
+    db_dir = args.db_dir or tempfile.mkdtemp(prefix="bench_chroma_")
+    options = {
+        "requests": args.requests,
+        "preload": args.preload,
+        "base_url": args.base_url,
+        "db_dir": db_dir,
+    }
+
+    results = {}
+    try:
+        for scenario in scenario_registry.build(args.scenarios.split(","), options):
+            print(f"=== {scenario.name} ===")
+            results[scenario.name] = run_scenario(
+                scenario, args.requests, args.concurrency, args.warmup)
+            print(json.dumps(results[scenario.name], ensure_ascii=False))
+    finally:
+        if stub:
+            stub.stop()
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {k: v for k, v in vars(args).items()},
+        "results": results,
+    }
+    violations = []
+    if args.thresholds:
+        violations += check_thresholds(results, json.loads(Path(args.thresholds).read_text()))
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        violations += compare_runs(baseline.get("results", baseline), results,
+                                   args.max_regression_pct)
+    report["violations"] = violations
+    Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2),
+                                 encoding="utf-8")
+    print(f"結果を出力しました: {args.output}")
+
+    if violations:
+        print("回帰を検出しました:")
+        for v in violations:
+            print(f"  - {v}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
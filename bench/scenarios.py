@@ -0,0 +1,127 @@
+"""
+ベンチマークシナリオ定義
+各シナリオは setup() で準備を行い、operation(i) を1リクエストとして計測します。
+
+- chat: 起動中のDjangoサーバーの /chat/api/ に POST（HTTP経由）
+- ingest: ConversationDBManager.save_conversation を直接呼び出し
+- search: ConversationDBManager.search_conversations を直接呼び出し
+- memory: 記憶一覧画面相当の get_all_conversations を呼び出し
+"""
+from typing import Callable, Dict, List
+import json
+import urllib.request
+
+from bench import corpus
+
+
+class Scenario:
+    """シナリオの基底クラス"""
+    name = "base"
+
+    def __init__(self, options: dict):
+        self.options = options
+
+    def setup(self):
+        """計測前の準備（計測対象外）"""
+
+    def operation(self, i: int):
+        """1リクエスト分の処理。失敗時は例外を送出する"""
+        raise NotImplementedError
+
+    def teardown(self):
+        """計測後の後片付け"""
+
+
+class _DBScenario(Scenario):
+    """ConversationDBManager を直接呼び出すシナリオの共通処理"""
+
+    _shared_db = None
+    _preloaded = False
+
+    def _db(self):
+        # シナリオ間で同じDBを共有し、ingest した内容を search で使えるようにする
+        if _DBScenario._shared_db is None:
+            from core.db_manager import ConversationDBManager
+            _DBScenario._shared_db = ConversationDBManager(
+                persist_directory=self.options.get("db_dir")
+            )
+        return _DBScenario._shared_db
+
+    def _preload(self, count: int):
+        if _DBScenario._preloaded:
+            return
+        _DBScenario._preloaded = True
+        db = self._db()
+        for record in corpus.generate(count, seed=self.options.get("seed", 42) + 1):
+            db.save_conversation(record["message"], record["response"])
+
+
+class ChatScenario(Scenario):
+    name = "chat"
+
+    def setup(self):
+        self.url = self.options.get("base_url", "http://127.0.0.1:8000").rstrip("/") + "/chat/api/"
+        self.messages = [r["message"] for r in corpus.generate(
+            min(self.options["requests"], 10_000), seed=self.options.get("seed", 42))]
+
+    def operation(self, i: int):
+        body = json.dumps({"message": self.messages[i % len(self.messages)]}).encode("utf-8")
+        req = urllib.request.Request(self.url, data=body, method="POST",
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.options.get("timeout", 60)) as resp:
+            payload = json.loads(resp.read())
+        if "error" in payload:
+            raise RuntimeError(payload["error"])
+
+
+class IngestScenario(_DBScenario):
+    name = "ingest"
+
+    def setup(self):
+        self.records = list(corpus.generate(self.options["requests"],
+                                            seed=self.options.get("seed", 42)))
+        self._db()
+
+    def operation(self, i: int):
+        record = self.records[i % len(self.records)]
+        if not self._db().save_conversation(record["message"], record["response"]):
+            raise RuntimeError("save_conversation が失敗しました")
+
+
+class SearchScenario(_DBScenario):
+    name = "search"
+
+    def setup(self):
+        preload = self.options.get("preload", 0)
+        if preload:
+            self._preload(preload)
+        self.queries = [r["message"] for r in corpus.generate(
+            min(self.options["requests"], 1000), seed=self.options.get("seed", 42) + 2)]
+
+    def operation(self, i: int):
+        self._db().search_conversations(self.queries[i % len(self.queries)], limit=5)
+
+
+class MemoryScenario(_DBScenario):
+    name = "memory"
+
+    def setup(self):
+        preload = self.options.get("preload", 0)
+        if preload:
+            self._preload(preload)
+
+    def operation(self, i: int):
+        self._db().get_all_conversations()
+
+
+SCENARIOS: Dict[str, Callable[[dict], Scenario]] = {
+    cls.name: cls for cls in (ChatScenario, IngestScenario, SearchScenario, MemoryScenario)
+}
+
+
+def build(names: List[str], options: dict) -> List[Scenario]:
+    """シナリオ名の一覧からインスタンスを生成する"""
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        raise ValueError(f"未知のシナリオです: {', '.join(unknown)}")
+    return [SCENARIOS[n](options) for n in names]
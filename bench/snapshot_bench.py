@@ -0,0 +1,99 @@
+"""
+増分スナップショットのベンチマーク
+Chroma の永続化ディレクトリを模した SQLite と HNSW セグメントファイルを作り、
+初回スナップショット・一部更新後の増分スナップショット・復元の速度と保存先の容量を測ります。
+
+使用例:
+    python -m bench.snapshot_bench --rows 50000 --segment-mb 64 --change-ratio 0.01
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from core.snapshot import Snapshotter, SnapshotStore
+
+
+def build_source(root: str, rows: int, segment_mb: int, seed: int = 0):
+    """SQLite（本文とメタデータ）とセグメントファイル（ランダムなベクトル）を作る"""
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(root, "segment"), exist_ok=True)
+    conn = sqlite3.connect(os.path.join(root, "chroma.sqlite3"))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE embeddings (id TEXT PRIMARY KEY, document TEXT, metadata TEXT)")
+    conn.executemany("INSERT INTO embeddings VALUES (?, ?, ?)", (
+        (f"id{i}", f"User: 質問{i} " * 8, json.dumps({"privacy_level": "low", "n": i}))
+        for i in range(rows)))
+    conn.commit()
+    conn.close()
+    with open(os.path.join(root, "segment", "data_level0.bin"), "wb") as f:
+        f.write(rng.randbytes(segment_mb << 20))
+
+
+def mutate(root: str, rows: int, change_ratio: float, seed: int = 1):
+    """一部の行とセグメントの末尾を更新する（稼働中の追記を模す）"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(os.path.join(root, "chroma.sqlite3"))
+    changed = max(1, int(rows * change_ratio))
+    conn.executemany("UPDATE embeddings SET document = ? WHERE id = ?", (
+        (f"更新 {rng.random()}", f"id{rng.randrange(rows)}") for _ in range(changed)))
+    conn.commit()
+    conn.close()
+    with open(os.path.join(root, "segment", "data_level0.bin"), "ab") as f:
+        f.write(rng.randbytes(1 << 20))
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, n)) for d, _, names in os.walk(path) for n in names)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="増分スナップショットの速度と容量")
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--segment-mb", type=int, default=32)
+    parser.add_argument("--change-ratio", type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    work = tempfile.mkdtemp(prefix="snapshot-bench-")
+    try:
+        source = os.path.join(work, "chroma_db")
+        build_source(source, args.rows, args.segment_mb)
+        store = SnapshotStore(os.path.join(work, "snapshots"))
+        snapshotter = Snapshotter(source, store)
+
+        full = snapshotter.create()
+        size_full = dir_size(store.root)
+        mutate(source, args.rows, args.change_ratio)
+        time.sleep(0.01)
+        incremental = snapshotter.create()
+        size_incremental = dir_size(store.root) - size_full
+
+        started = time.perf_counter()
+        snapshotter.restore(os.path.join(work, "restored"))
+        restore_sec = time.perf_counter() - started
+
+        mib = 2 ** 20
+        results = {
+            "source_mib": round(full.size / mib, 1),
+            "full": {"sec": round(full.elapsed, 3),
+                     "mib_per_sec": round(full.bytes_read / mib / full.elapsed, 1),
+                     "store_mib": round(size_full / mib, 1)},
+            "incremental": {"sec": round(incremental.elapsed, 3),
+                            "new_chunks": incremental.new_chunks,
+                            "reused_chunks": incremental.reused_chunks,
+                            "store_added_mib": round(size_incremental / mib, 2)},
+            "restore": {"sec": round(restore_sec, 3),
+                        "mib_per_sec": round(incremental.size / mib / restore_sec, 1)},
+        }
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return results
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
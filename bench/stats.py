@@ -0,0 +1,92 @@
+"""
+ベンチマーク結果の集計と回帰判定
+"""
+from typing import Dict, List, Sequence
+import math
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """
+    ソート済みの値から線形補間でパーセンタイルを求める
+
+    Args:
+        sorted_values: 昇順に並んだ値
+        pct: 0〜100 のパーセンタイル
+    """
+    if not sorted_values:
+        return 0.0
+    if len(sorted_values) == 1:
+        return float(sorted_values[0])
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    if low == high:
+        return float(sorted_values[low])
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def summarize(latencies_s: List[float], errors: int, wall_time_s: float) -> Dict[str, float]:
+    """
+    レイテンシ（秒）の一覧から集計値を作る
+
+    Returns:
+        dict: count, errors, throughput_rps, mean_ms, p50_ms, p95_ms, p99_ms, max_ms
+    """
+    values = sorted(v * 1000 for v in latencies_s)
+    count = len(values)
+    return {
+        "count": count,
+        "errors": errors,
+        "error_rate": round(errors / (count + errors), 4) if count + errors else 0.0,
+        "throughput_rps": round(count / wall_time_s, 2) if wall_time_s > 0 else 0.0,
+        "mean_ms": round(sum(values) / count, 3) if count else 0.0,
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "max_ms": round(values[-1], 3) if values else 0.0,
+    }
+
+
+def check_thresholds(results: Dict[str, dict], thresholds: Dict[str, dict]) -> List[str]:
+    """
+    集計結果をしきい値と比較し、違反内容の一覧を返す
+
+    thresholds の形式:
+        {"search": {"p95_ms": 200, "error_rate": 0.01, "min_throughput_rps": 50}}
+    "min_" で始まるキーは下限、それ以外は上限として扱う。
+    """
+    violations = []
+    for scenario, limits in thresholds.items():
+        result = results.get(scenario)
+        if result is None:
+            continue
+        for key, limit in limits.items():
+            if key.startswith("min_"):
+                metric = key[4:]
+                value = result.get(metric)
+                if value is not None and value < limit:
+                    violations.append(f"{scenario}.{metric}={value} < {limit}")
+            else:
+                value = result.get(key)
+                if value is not None and value > limit:
+                    violations.append(f"{scenario}.{key}={value} > {limit}")
+    return violations
+
+
+def compare_runs(baseline: Dict[str, dict], current: Dict[str, dict],
+                 max_regression_pct: float) -> List[str]:
+    """
+    前回結果と比較し、p95/p99 が指定割合以上悪化したシナリオを返す
+    """
+    regressions = []
+    for scenario, result in current.items():
+        base = baseline.get(scenario)
+        if not base:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            before, after = base.get(key), result.get(key)
+            if before and after and (after - before) / before * 100 > max_regression_pct:
+                regressions.append(
+                    f"{scenario}.{key}: {before} -> {after} (+{(after - before) / before * 100:.1f}%)"
+                )
+    return regressions
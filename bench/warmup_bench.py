@@ -0,0 +1,95 @@
+"""
+起動直後の最初のリクエストのレイテンシ（コールド / ウォームアップ後）の比較
+プロセスを新しく起動して config.wsgi を読み込み、最初の /chat/api/ の処理時間を測ります。
+OpenAI はローカルのスタブ（bench.fake_openai）に向けるため、有料APIは呼びません。
+
+- cold: WARMUP=0。最初のリクエストがAIタスク・Chroma・HTTP接続の初期化を負担する
+- warm: WARMUP=1。ウォームアップの完了（/ready が 200）を待ってからリクエストする
+
+使用例:
+    python -m bench.warmup_bench --runs 3 --stub-latency-ms 50
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.fake_openai import FakeOpenAIServer, StubConfig
+
+
+def child(mode: str) -> dict:
+    """新しいプロセスで最初のリクエストの処理時間を測る"""
+    started = time.perf_counter()
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    from config.wsgi import application  # noqa: F401  ウォームアップを開始する
+    from core.warmup import READINESS
+    from django.test import Client
+    boot = time.perf_counter() - started
+
+    ready_after = None
+    if mode == "warm":
+        READINESS.wait(timeout=120)
+        ready_after = time.perf_counter() - started
+    client = Client()
+    request_started = time.perf_counter()
+    response = client.post("/chat/api/", data=json.dumps({"message": "こんにちは"}),
+                           content_type="application/json")
+    first = time.perf_counter() - request_started
+    request_started = time.perf_counter()
+    client.post("/chat/api/", data=json.dumps({"message": "もう一度こんにちは"}),
+                content_type="application/json")
+    second = time.perf_counter() - request_started
+    return {"mode": mode, "status": response.status_code, "boot": boot,
+            "ready_after": ready_after, "first_request": first, "second_request": second,
+            "warmup": READINESS.snapshot()}
+
+
+def run_child(mode: str, env: dict) -> dict:
+    env = dict(env, WARMUP="1" if mode == "warm" else "0")
+    output = subprocess.run([sys.executable, "-m", "bench.warmup_bench", "--child", mode],
+                            env=env, capture_output=True, text=True, check=True).stdout
+    # Django やアプリのログが混ざるため、最後の行の JSON を読む
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="コールド起動とウォームアップ後の最初のリクエストの比較")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--stub-latency-ms", type=float, default=50.0)
+    parser.add_argument("--child", choices=("cold", "warm"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args.child), ensure_ascii=False))
+        return
+
+    with FakeOpenAIServer(StubConfig(latency_ms=args.stub_latency_ms)) as stub, \
+            tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, OPENAI_BASE_URL=stub.base_url, OPENAI_API_BASE=stub.base_url,
+                   CHROMA_DB_DIR=os.path.join(tmp, "chroma_db"))
+        env.setdefault("OPENAI_API_KEY", "sk-bench-000000000000000000000000")
+        env.setdefault("MODEL_NAME", "fake-model")
+        results = {"cold": [], "warm": []}
+        for _ in range(args.runs):
+            for mode in ("cold", "warm"):
+                results[mode].append(run_child(mode, env))
+
+    summary = {}
+    for mode, runs in results.items():
+        summary[mode] = {
+            "first_request_median": round(statistics.median(r["first_request"] for r in runs), 4),
+            "second_request_median": round(statistics.median(r["second_request"] for r in runs), 4),
+            "statuses": sorted({r["status"] for r in runs}),
+        }
+    summary["warm"]["ready_after_median"] = round(
+        statistics.median(r["ready_after"] for r in results["warm"]), 4)
+    summary["warm"]["steps"] = results["warm"][-1]["warmup"]["steps"]
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
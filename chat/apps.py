@@ -20,7 +20,9 @@ class ChatConfig(AppConfig):
     def ready(self):
         """
         アプリケーション起動時の初期化処理
-        AIタスクの初期化などを行う
+
+        AIタスクはここでは作らない（manage.py の各コマンドでも呼ばれるため）。
+        サーバーでは chat.warmup がバックグラウンドで作成する。
         """
         # 環境変数の読み込み
         load_dotenv()
@@ -28,10 +30,6 @@ class ChatConfig(AppConfig):
         # より一般的なエラーメッセージを使用
         if not os.getenv("OPENAI_API_KEY"):
             raise ValueError("必要な認証情報が設定されていません")
-            
-        # タスクの初期化と明示的な使用
-        from . import tasks
-        tasks.ai_receive_task.start()  # タスクを明示的に初期化
 
 def get_api_key():
     """APIキーを安全に取得する
@@ -0,0 +1,109 @@
+"""
+チャット側のバックグラウンドジョブ定義
+core.job_queue に登録され、manage.py run_job_worker で起動したワーカーで実行されます。
+AIタスクとDBマネージャーはワーカープロセスごとに初回利用時に生成します。
+
+ジョブ登録API（/chat/api/jobs/）から登録できるのは USER_JOB_KINDS のみです。
+ingest・retention_sweep・embedding_migration は全テナントやサーバー上のファイルを
+扱う管理用のジョブのため、管理コマンドからだけ登録します。
+"""
+import logging
+import threading
+
+from core.job_queue import JobQueue, register
+from core.tenant import ShardRegistry
+
+logger = logging.getLogger(__name__)
+
+# ジョブ登録APIから登録できる種別（テナントはサーバー側でリクエストから決める）
+USER_JOB_KINDS = ("chat_response", "save_conversation")
+
+_lock = threading.Lock()
+_ai_task = None
+_db_manager = None
+_shards = None
+
+
+def get_db_manager(tenant: str = None):
+    """DBマネージャーを返す（tenant 指定時はそのテナントのシャード）"""
+    global _db_manager, _shards
+    with _lock:
+        if _db_manager is None:
+            from core.db_manager import ConversationDBManager
+            _db_manager = ConversationDBManager()
+            _shards = ShardRegistry(_db_manager.for_tenant)
+    return _shards.get(tenant) if tenant else _db_manager
+
+
+def get_ai_task():
+    global _ai_task
+    with _lock:
+        if _ai_task is None:
+            from main import AITask, AI_MODEL_CONFIGS, TASK_AI_RECEIVE
+            cfg = next(cfg for cfg in AI_MODEL_CONFIGS if cfg.id == str(TASK_AI_RECEIVE))
+            _ai_task = AITask(cfg)
+            _ai_task.start()
+        return _ai_task
+
+
+@register("chat_response")
+def chat_response(payload: dict) -> dict:
+    """AI応答を生成して会話を保存する（chat_api の非同期版）"""
+    message = payload["message"]
+    memory = get_db_manager(payload.get("tenant"))
+    response = get_ai_task().respond(message, memory)
+    if isinstance(response, str) and response.startswith('[Error]'):
+        raise RuntimeError(response)
+    saved = memory.save_conversation(message, response)
+    return {"response": response, "saved": bool(saved)}
+
+
+@register("save_conversation")
+def save_conversation(payload: dict) -> dict:
+    """会話の保存（埋め込み生成を含む）"""
+    saved = get_db_manager(payload.get("tenant")).save_conversation(
+        payload["message"], payload["response"])
+    if not saved:
+        raise RuntimeError("会話の保存に失敗しました")
+    return {"saved": True}
+
+
+@register("ingest")
+def ingest(payload: dict) -> dict:
+    """ディレクトリ内のテキストをナレッジベースに取り込む"""
+    get_db_manager().load_knowledge_base(payload["directory"])
+    return {"directory": payload["directory"]}
+
+
+@register("retention_sweep")
+def retention_sweep(payload: dict) -> dict:
+    """保持期間切れの会話を削除・アーカイブする（定期実行用）"""
+    deleted, archived, archive_bytes = {}, {}, 0
+    for memory in get_db_manager().with_tenant_shards():
+        result = memory.expire_conversations(
+            dry_run=bool(payload.get("dry_run")), backfill=bool(payload.get("backfill")))
+        for total, counts in ((deleted, result.deleted), (archived, result.archived)):
+            for level, count in counts.items():
+                total[level] = total.get(level, 0) + count
+        archive_bytes += result.archive_bytes
+    return {"deleted": deleted, "archived": archived, "archive_bytes": archive_bytes}
+
+
+@register("embedding_migration")
+def embedding_migration(payload: dict) -> dict:
+    """
+    埋め込み移行を一定時間だけ進め、未完了なら続きのジョブを登録する
+
+    優先度を下げて細切れに実行するため、チャットのジョブを長時間待たせない。
+    payload の collection で移行するコレクション（テナントのシャード）を指定する。
+    """
+    memory = get_db_manager()
+    if payload.get("collection"):
+        memory = memory.open_collection(payload["collection"])
+    state = memory.run_embedding_migration(
+        max_seconds=float(payload.get("max_seconds", 120)))
+    if state.migrating:
+        JobQueue().enqueue("embedding_migration", payload, priority=9,
+                           delay=float(payload.get("pause", 1.0)))
+    return {"phase": state.phase, "coverage": round(state.coverage, 4),
+            "copied": state.copied, "tokens": state.tokens, "cost_usd": round(state.cost_usd, 4)}
@@ -0,0 +1,60 @@
+"""
+プライバシーレベルの一括再判定コマンド
+
+使用例:
+    python manage.py backfill_privacy --page-size 1000 --workers 4
+    python manage.py backfill_privacy --dry-run
+    python manage.py backfill_privacy --reset   # チェックポイントを無視して最初から
+    python manage.py backfill_privacy --all-tenants   # 共有コレクションとすべてのシャード
+    python manage.py backfill_privacy --tenant u7     # 指定したテナントのシャードのみ
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.db_manager import ConversationDBManager
+
+
+class Command(BaseCommand):
+    help = "保存済み会話の privacy_level を現在のルールで再判定し、メタデータのみ更新します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--page-size", type=int, default=1000)
+        parser.add_argument("--workers", type=int, default=None,
+                            help="判定に使うプロセス数（既定: CPU数）")
+        parser.add_argument("--checkpoint", default=None,
+                            help="チェックポイントファイル（既定: "
+                                 "<CHROMA_DB_DIR>/privacy_backfill.<コレクション名>.json）")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="更新せずに変化する件数だけを集計する")
+        parser.add_argument("--reset", action="store_true")
+        parser.add_argument("--all-tenants", action="store_true",
+                            help="共有コレクションとすべてのテナントのシャードを対象にする")
+        parser.add_argument("--tenant", default=None,
+                            help="対象のテナントのシャード（テナントキー、例: u7）")
+
+    def handle(self, *args, **options):
+        if options["checkpoint"] and options["all_tenants"]:
+            raise CommandError("--checkpoint は --all-tenants と同時に指定できません"
+                               "（チェックポイントはコレクションごとです）")
+        db_manager = ConversationDBManager()
+        for memory in db_manager.select_tenants(options["all_tenants"], options["tenant"]):
+            self._backfill(memory, options)
+
+    def _backfill(self, memory, options):
+        job = memory.privacy_backfill(
+            options["checkpoint"],
+            page_size=options["page_size"],
+            workers=options["workers"],
+            dry_run=options["dry_run"],
+        )
+        progress = job.run(reset=options["reset"])
+        if not options["dry_run"] and progress.updated:
+            # privacy_level で絞り込んだ検索結果と privacy_level 別の集計が変わるため
+            memory.invalidate_search_cache()
+            memory.rebuild_memory_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"完了 [{memory.collection_name}]: {progress.scanned}件を再判定, "
+            f"{progress.updated}件を更新 "
+            f"({progress.rows_per_sec:.0f} rows/sec, {progress.elapsed:.1f}秒)"
+        ))
+        for change, count in sorted(progress.changes.items()):
+            self.stdout.write(f"  {change}: {count}件")
@@ -0,0 +1,110 @@
+"""
+保存済み会話の重複除去コマンド
+
+使用例:
+    python manage.py dedup_memory --dry-run --eval-queries 20
+    python manage.py dedup_memory --threshold 0.85 --report dedup_report.json
+    python manage.py dedup_memory --all-tenants   # 各テナントのシャードも対象にする
+
+重複判定の索引（保存時に使う）はプロセスごとにメモリ上に持つため、このコマンドが作り直すのは
+自身の索引だけです。起動中のサーバーの索引には削除した会話が残りますが、保存時にその会話へ
+統合しようとした時点で削除済みと分かり、索引から外して判定し直すため、再起動は不要です。
+"""
+from django.core.management.base import BaseCommand
+from datetime import datetime
+import json
+import random
+
+from core.db_manager import ConversationDBManager
+from core.dedup import DEFAULT_THRESHOLD, distinct_ratio, plan_dedup
+
+
+class Command(BaseCommand):
+    help = "ほぼ重複した会話を統合・削除し、容量と検索結果の多様性の変化を報告します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+        parser.add_argument("--dry-run", action="store_true", help="削除せずに報告だけ行う")
+        parser.add_argument("--eval-queries", type=int, default=0,
+                            help="検索結果の多様性を評価するクエリ数（保存済みの発話から抽出）")
+        parser.add_argument("--k", type=int, default=5)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--report", default=None, help="JSONレポートの出力先")
+        parser.add_argument("--all-tenants", action="store_true",
+                            help="各テナントのシャードも対象にする（重複は各コレクション内で判定）")
+        parser.add_argument("--tenant", default=None, help="指定したテナントのシャードのみ対象にする")
+
+    def handle(self, *args, **options):
+        reports = [self._dedup(memory, options) for memory in
+                   ConversationDBManager().select_tenants(options["all_tenants"], options["tenant"])]
+        text = json.dumps(reports[0] if len(reports) == 1 else reports, ensure_ascii=False, indent=2)
+        if options["report"]:
+            with open(options["report"], "w", encoding="utf-8") as f:
+                f.write(text)
+        self.stdout.write(text)
+
+    def _dedup(self, db_manager, options) -> dict:
+        threshold = options["threshold"]
+        rows = list(db_manager.iter_conversations())
+        plan, index = plan_dedup(rows, threshold)
+        report = {"timestamp": datetime.now().isoformat(), "collection": db_manager.collection_name,
+                  "threshold": threshold, "dry_run": options["dry_run"], **plan.report()}
+
+        if options["eval_queries"]:
+            report["retrieval"] = self._evaluate(db_manager, rows, plan, index, threshold,
+                                                 options["eval_queries"], options["k"])
+
+        if not options["dry_run"] and plan.groups:
+            self._apply(db_manager, plan, options["batch_size"])
+        return report
+
+    def _apply(self, db_manager, plan, batch_size):
+        """残す会話の duplicate_count を更新してから重複を削除する"""
+        collection = db_manager.collection
+        keepers = list(plan.groups)
+        for i in range(0, len(keepers), batch_size):
+            batch = keepers[i:i + batch_size]
+            existing = collection.get(ids=batch, include=["metadatas"])
+            metadatas = []
+            for doc_id, metadata in zip(existing["ids"], existing["metadatas"]):
+                metadata = dict(metadata or {})
+                metadata["duplicate_count"] = (int(metadata.get("duplicate_count", 1))
+                                               + len(plan.groups[doc_id]))
+                metadatas.append(metadata)
+            if existing["ids"]:
+                collection.update(ids=existing["ids"], metadatas=metadatas)
+                db_manager._mirror("update", ids=existing["ids"], metadatas=metadatas)
+        removed = plan.removed_ids
+        for i in range(0, len(removed), batch_size):
+            # 集計・検索結果キャッシュの更新も delete_conversations に任せる
+            db_manager.delete_conversations(removed[i:i + batch_size])
+        # このプロセスの索引は次回の保存時に作り直す（サーバーの索引はモジュールの説明を参照）
+        db_manager.dedup_index.reset()
+        db_manager.invalidate_search_cache()
+
+    def _evaluate(self, db_manager, rows, plan, index, threshold, count, k):
+        """
+        保存済みの発話をクエリとして検索し、上位k件の多様性を比較する
+
+        除去後の結果は、除去前の上位2k件から削除対象を除いた上位k件で近似する
+        （埋め込みの再計算やデータ変更をせずに比較できる）。
+        """
+        removed = set(plan.removed_ids)
+        queries = [text.split("\nAI:")[0].replace("User:", "").strip()
+                   for _, text, _ in random.Random(0).sample(rows, min(count, len(rows)))]
+        before, after = [], []
+        for query in queries:
+            results = db_manager.collection.query(
+                query_embeddings=[db_manager.db.embeddings.embed_query(query)],
+                n_results=k * 2,
+                where={"type": {"$ne": "knowledge"}},
+            )
+            ids = results["ids"][0]
+            before.append(distinct_ratio(ids[:k], index, threshold))
+            after.append(distinct_ratio([i for i in ids if i not in removed][:k], index, threshold))
+        return {
+            "queries": len(queries),
+            "k": k,
+            "distinct_ratio_before": round(sum(before) / len(before), 4) if before else None,
+            "distinct_ratio_after": round(sum(after) / len(after), 4) if after else None,
+        }
@@ -0,0 +1,37 @@
+"""
+管理用のバックグラウンドジョブの登録コマンド
+ingest・retention_sweep・embedding_migration はジョブ登録APIからは登録できないため、
+このコマンドで登録します（実行は manage.py run_job_worker）。
+
+使用例:
+    python manage.py enqueue_job ingest --payload '{"directory": "./knowledge"}'
+    python manage.py enqueue_job retention_sweep --priority 8
+"""
+from django.core.management.base import BaseCommand, CommandError
+import json
+
+from core.job_queue import JobQueue, handlers
+
+
+class Command(BaseCommand):
+    help = "管理用のジョブをジョブキューに登録します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", help="ジョブ種別（例: ingest, retention_sweep）")
+        parser.add_argument("--payload", default="{}", help="ジョブの入力（JSON）")
+        parser.add_argument("--priority", type=int, default=5)
+        parser.add_argument("--max-attempts", type=int, default=3)
+
+    def handle(self, *args, **options):
+        from chat import jobs  # noqa: F401  ハンドラの登録
+        if options["kind"] not in handlers():
+            raise CommandError(f"未登録のジョブ種別です: {options['kind']}")
+        try:
+            payload = json.loads(options["payload"])
+        except json.JSONDecodeError as e:
+            raise CommandError(f"--payload が JSON ではありません: {e}")
+        if not isinstance(payload, dict):
+            raise CommandError("--payload は JSON オブジェクトで指定してください")
+        job_id = JobQueue().enqueue(options["kind"], payload, priority=options["priority"],
+                                    max_attempts=options["max_attempts"])
+        self.stdout.write(self.style.SUCCESS(f"ジョブを登録しました: id={job_id}"))
@@ -0,0 +1,46 @@
+"""
+保持期間切れの会話の削除・アーカイブコマンド
+
+使用例:
+    RETENTION_POLICY="high=delete:30,low=archive:180" python manage.py expire_memory --dry-run
+    python manage.py expire_memory --backfill   # timestamp_epoch のない旧データにも適用
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.db_manager import ConversationDBManager
+from core.retention import RetentionPolicy
+
+
+class Command(BaseCommand):
+    help = "RETENTION_POLICY に従って期限切れの会話を削除・アーカイブします"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="削除せずに件数だけを集計する")
+        parser.add_argument("--backfill", action="store_true",
+                            help="先に timestamp_epoch のない旧データへ値を付与する")
+        parser.add_argument("--archive-dir", default=None,
+                            help="アーカイブの出力先（既定: ARCHIVE_DIR または ./data/archive）")
+
+    def handle(self, *args, **options):
+        try:
+            policy = RetentionPolicy.from_env()
+        except ValueError as e:
+            raise CommandError(str(e))
+        if not policy:
+            self.stdout.write("RETENTION_POLICY が未設定のため何もしません")
+            return
+        for rule in policy.rules.values():
+            self.stdout.write(f"  {rule.privacy_level}: {rule.days:g}日後に{rule.action}")
+
+        label = "対象" if options["dry_run"] else "処理済み"
+        # 共有コレクションと各テナントのシャードを順に処理する
+        for memory in ConversationDBManager().with_tenant_shards():
+            result = memory.expire_conversations(
+                dry_run=options["dry_run"], backfill=options["backfill"],
+                archive_dir=options["archive_dir"])
+            self.stdout.write(self.style.SUCCESS(
+                f"{memory.collection_name} {label}: 削除 {sum(result.deleted.values())}件, "
+                f"アーカイブ {sum(result.archived.values())}件 "
+                f"({result.archive_bytes / 1024:.1f} KiB, {len(result.archive_files)}ファイル, "
+                f"{result.elapsed:.1f}秒)"
+            ))
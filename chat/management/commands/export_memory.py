@@ -0,0 +1,40 @@
+"""
+会話メモリのエクスポートコマンド
+
+使用例:
+    python manage.py export_memory ./backup/2024-06-01 --chunk-size 5000
+    python manage.py export_memory ./backup/text-only --no-embeddings
+    python manage.py export_memory ./backup/u7 --tenant u7   # テナントのシャード
+"""
+from django.core.management.base import BaseCommand
+
+from core.db_manager import ConversationDBManager
+from core.tenant import DEFAULT_TENANT
+from core.memory_transfer import export_collection
+
+
+class Command(BaseCommand):
+    help = "会話メモリ（本文・メタデータ・埋め込み）を圧縮カラムナファイルに書き出します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="1ファイルあたりの件数")
+        parser.add_argument("--no-embeddings", action="store_true",
+                            help="埋め込みを書き出さない（取り込み時に再計算）")
+        parser.add_argument("--writers", type=int, default=2, help="圧縮・書き込みのスレッド数")
+        parser.add_argument("--tenant", default=None,
+                            help="書き出すテナントのシャード（テナントキー、既定: 共有コレクション）")
+
+    def handle(self, *args, **options):
+        memory = ConversationDBManager().for_tenant(options["tenant"] or DEFAULT_TENANT)
+        result = export_collection(
+            memory.collection, options["directory"],
+            chunk_size=options["chunk_size"],
+            include_embeddings=not options["no_embeddings"],
+            writers=options["writers"],
+            embedding_model=str(getattr(memory.db.embeddings, "model", "") or ""),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"完了: {result.rows}件 {result.parts}ファイル {result.bytes / 2**20:.1f} MiB "
+            f"({result.rows_per_sec:.0f} rows/sec, {result.elapsed:.1f}秒)"
+        ))
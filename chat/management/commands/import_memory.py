@@ -0,0 +1,50 @@
+"""
+会話メモリのインポートコマンド（export_memory の出力を取り込む）
+
+使用例:
+    python manage.py import_memory ./backup/2024-06-01 --workers 8
+    python manage.py import_memory ./backup/2024-06-01 --reembed   # 埋め込みモデルを変えた場合
+    python manage.py import_memory ./backup/u7 --tenant u7            # テナントのシャードへ
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.db_manager import ConversationDBManager
+from core.tenant import DEFAULT_TENANT
+from core.memory_transfer import TransferError, import_collection
+
+
+class Command(BaseCommand):
+    help = "export_memory で書き出した会話メモリを一括で取り込みます（同じ id は上書き）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument("--workers", type=int, default=4, help="並列に取り込むファイル数")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--reembed", action="store_true",
+                            help="保存済みの埋め込みを使わずに再計算する")
+        parser.add_argument("--tenant", default=None,
+                            help="取り込み先のテナントのシャード（テナントキー、既定: 共有コレクション）")
+
+    def handle(self, *args, **options):
+        db_manager = ConversationDBManager().for_tenant(options["tenant"] or DEFAULT_TENANT)
+        try:
+            result = import_collection(
+                db_manager.collection, options["directory"],
+                workers=options["workers"],
+                embed=db_manager.db.embeddings.embed_documents,
+                reembed=options["reembed"],
+                batch_size=options["batch_size"],
+                embedding_model=str(getattr(db_manager.db.embeddings, "model", "") or ""),
+            )
+        except TransferError as e:
+            raise CommandError(str(e))
+        # 重複判定の索引は次回の保存時に作り直す
+        db_manager.dedup_index.reset()
+        # SEARCH_CACHE_DB で共有している他のプロセスの検索結果も無効にする
+        db_manager.invalidate_search_cache()
+        # upsert は上書きか追加かを区別できないため、集計は差分ではなく作り直す
+        db_manager.rebuild_memory_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"完了: {result.rows}件（再埋め込み {result.reembedded}件） {result.parts}ファイル "
+            f"({result.rows_per_sec:.0f} rows/sec, {result.elapsed:.1f}秒)"
+        ))
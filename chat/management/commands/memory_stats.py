@@ -0,0 +1,34 @@
+"""
+会話メモリの集計の表示・作り直しコマンド
+
+使用例:
+    python manage.py memory_stats
+    python manage.py memory_stats --rebuild --all-tenants   # 集計表を全件から作り直す
+"""
+from django.core.management.base import BaseCommand
+import json
+
+from core.db_manager import ConversationDBManager
+
+
+class Command(BaseCommand):
+    help = "会話数・トークン数・容量の集計を表示します（--rebuild で作り直し）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true",
+                            help="コレクションをメタデータのみ読み直して集計を作り直す")
+        parser.add_argument("--all-tenants", action="store_true",
+                            help="各テナントのシャードも対象にする")
+        parser.add_argument("--page-size", type=int, default=1000)
+        parser.add_argument("--days", type=int, default=30, help="日別の件数を表示する日数")
+
+    def handle(self, *args, **options):
+        db_manager = ConversationDBManager()
+        memories = db_manager.with_tenant_shards() if options["all_tenants"] else [db_manager]
+        for memory in memories:
+            if options["rebuild"]:
+                count = memory.rebuild_memory_stats(page_size=options["page_size"])
+                self.stdout.write(self.style.SUCCESS(
+                    f"{memory.collection_name}: {count}件で集計を作り直しました"))
+            self.stdout.write(json.dumps(memory.memory_stats(by_day=options["days"]),
+                                         ensure_ascii=False, indent=2))
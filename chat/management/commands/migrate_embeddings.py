@@ -0,0 +1,70 @@
+"""
+埋め込みモデルのオンライン移行コマンド
+
+使用例:
+    python manage.py migrate_embeddings start --model text-embedding-3-small
+    python manage.py migrate_embeddings status
+    python manage.py migrate_embeddings run --max-seconds 600   # フォアグラウンドで進める
+    python manage.py migrate_embeddings abort
+    python manage.py migrate_embeddings start --model text-embedding-3-small --all-tenants
+
+移行の状態はコレクションごとに持つため、テナントのシャードは --all-tenants / --tenant で
+共有コレクションと同じように移行します（ジョブもコレクションごとに登録）。
+"""
+from django.core.management.base import BaseCommand, CommandError
+from dataclasses import asdict
+import json
+
+from core.db_manager import ConversationDBManager
+from core.embedding_migration import MigrationError, abort_migration, start_migration
+from core.job_queue import JobQueue
+
+
+class Command(BaseCommand):
+    help = "会話メモリを新しい埋め込みモデルのコレクションへ稼働中のまま移行します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["start", "status", "run", "abort"])
+        parser.add_argument("--model", help="移行先の埋め込みモデル（start）")
+        parser.add_argument("--foreground", action="store_true",
+                            help="start 時にジョブを登録しない（run で進める）")
+        parser.add_argument("--max-seconds", type=float, default=None)
+        parser.add_argument("--max-batches", type=int, default=None)
+        parser.add_argument("--all-tenants", action="store_true",
+                            help="各テナントのシャードも対象にする")
+        parser.add_argument("--tenant", default=None, help="指定したテナントのシャードのみ対象にする")
+
+    def handle(self, *args, **options):
+        if options["action"] == "start" and not options["model"]:
+            raise CommandError("--model を指定してください")
+        for db_manager in ConversationDBManager().select_tenants(options["all_tenants"],
+                                                                 options["tenant"]):
+            self.stdout.write(f"[{db_manager.collection_name}]")
+            try:
+                state = self._handle_collection(db_manager, options)
+            except MigrationError as e:
+                raise CommandError(f"{db_manager.collection_name}: {e}")
+            if state is None:
+                self.stdout.write("移行の記録はありません")
+                continue
+            self.stdout.write(json.dumps({**asdict(state), "coverage": round(state.coverage, 4)},
+                                         ensure_ascii=False, indent=2))
+
+    def _handle_collection(self, db_manager, options):
+        path = db_manager.migration_state_path
+        action = options["action"]
+        if action == "start":
+            state = start_migration(path, db_manager.collection_name, options["model"])
+            if not options["foreground"]:
+                job_id = JobQueue().enqueue("embedding_migration",
+                                            {"collection": db_manager.collection_name},
+                                            priority=9)
+                self.stdout.write(f"移行ジョブを登録しました: job_id={job_id}")
+            return state
+        if action == "run":
+            return db_manager.run_embedding_migration(
+                max_batches=options["max_batches"], max_seconds=options["max_seconds"])
+        if action == "abort":
+            return abort_migration(path)
+        db_manager.refresh_migration_state(interval=0)
+        return db_manager.migration_state
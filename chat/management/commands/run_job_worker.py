@@ -0,0 +1,56 @@
+"""
+バックグラウンドジョブのワーカー起動コマンド
+
+使用例:
+    python manage.py run_job_worker --processes 2
+    python manage.py run_job_worker --kinds ingest,chat_response --once
+"""
+from django.core.management.base import BaseCommand
+import multiprocessing
+import signal
+
+from core.job_queue import JobQueue, Worker
+
+
+def _run_worker(kinds, poll_interval, lease_seconds, exit_when_idle):
+    from chat import jobs  # noqa: F401  ハンドラの登録
+    worker = Worker(JobQueue(), kinds=kinds, poll_interval=poll_interval,
+                    lease_seconds=lease_seconds)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    return worker.run(exit_when_idle=exit_when_idle)
+
+
+class Command(BaseCommand):
+    help = "ジョブキュー（core.job_queue）のワーカーを起動します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=1)
+        parser.add_argument("--kinds", default="", help="処理するジョブ種別（カンマ区切り）")
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument("--lease-seconds", type=float, default=300.0)
+        parser.add_argument("--once", action="store_true",
+                            help="実行待ちのジョブが無くなったら終了する")
+
+    def handle(self, *args, **options):
+        kinds = [k for k in options["kinds"].split(",") if k] or None
+        worker_args = (kinds, options["poll_interval"], options["lease_seconds"], options["once"])
+        if options["processes"] <= 1:
+            processed = _run_worker(*worker_args)
+            self.stdout.write(self.style.SUCCESS(f"処理したジョブ: {processed}件"))
+            return
+
+        processes = [multiprocessing.Process(target=_run_worker, args=worker_args,
+                                             name=f"job-worker-{i}")
+                     for i in range(options["processes"])]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+        self.stdout.write(self.style.SUCCESS("ジョブワーカーを終了しました"))
@@ -0,0 +1,33 @@
+"""
+アーカイブ済み会話の検索コマンド（Chroma・埋め込みを使わずにオフラインで検索）
+
+使用例:
+    python manage.py search_archive "会議資料" --limit 10
+    python manage.py search_archive "請求書" --privacy-level low --since 2024-01-01
+"""
+from django.core.management.base import BaseCommand, CommandError
+import json
+
+from core.retention import search_archive, to_epoch
+
+
+class Command(BaseCommand):
+    help = "アーカイブ（圧縮カラムナファイル）から会話を検索します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("query")
+        parser.add_argument("--limit", type=int, default=5)
+        parser.add_argument("--privacy-level", default=None)
+        parser.add_argument("--since", default=None, help="この日時以降（ISO形式）")
+        parser.add_argument("--until", default=None, help="この日時より前（ISO形式）")
+        parser.add_argument("--archive-dir", default=None)
+
+    def handle(self, *args, **options):
+        since, until = (to_epoch(options[name]) if options[name] else None
+                        for name in ("since", "until"))
+        if (options["since"] and since is None) or (options["until"] and until is None):
+            raise CommandError("--since / --until は ISO形式の日時で指定してください")
+        results = search_archive(
+            options["query"], archive_dir=options["archive_dir"], limit=options["limit"],
+            privacy_level=options["privacy_level"], since=since, until=until)
+        self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
@@ -0,0 +1,62 @@
+"""
+会話メモリのスナップショットコマンド
+
+使用例:
+    python manage.py snapshot_memory create
+    python manage.py snapshot_memory list
+    python manage.py snapshot_memory restore --at 2024-06-01T12:00:00   # サーバー停止中に実行
+    python manage.py snapshot_memory restore --at 2024-06-01T03:00:00Z  # タイムゾーン付きも可
+    python manage.py snapshot_memory prune --keep 14
+"""
+from django.core.management.base import BaseCommand, CommandError
+from datetime import datetime
+import os
+
+from core.snapshot import SnapshotError, Snapshotter, SnapshotStore
+
+
+class Command(BaseCommand):
+    help = "Chroma の永続化ディレクトリの増分スナップショットを作成・復元します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["create", "list", "restore", "prune"])
+        parser.add_argument("--source", default=None,
+                            help="対象ディレクトリ（既定: CHROMA_DB_DIR または ./data/chroma_db）")
+        parser.add_argument("--store", default=None,
+                            help="保存先（既定: SNAPSHOT_DIR または ./data/snapshots）")
+        parser.add_argument("--at", default=None,
+                            help="restore: この時刻以前の最新に戻す（ISO形式。オフセットなしはローカル時刻）")
+        parser.add_argument("--target", default=None, help="restore: 復元先（既定: --source）")
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--keep", type=int, default=7, help="prune: 残すスナップショット数")
+
+    def handle(self, *args, **options):
+        source = options["source"] or os.getenv("CHROMA_DB_DIR", "./data/chroma_db")
+        store = SnapshotStore(options["store"])
+        snapshotter = Snapshotter(source, store)
+        action = options["action"]
+        try:
+            if action == "create":
+                m = snapshotter.create()
+                self.stdout.write(self.style.SUCCESS(
+                    f"{m.id}: {len(m.files)}ファイル {m.size / 2**20:.1f} MiB "
+                    f"(新規チャンク {m.new_chunks} / 再利用 {m.reused_chunks}, "
+                    f"書き込み {m.bytes_written / 2**20:.1f} MiB, {m.elapsed:.1f}秒)"))
+            elif action == "list":
+                for m in store.manifests():
+                    self.stdout.write(f"{m.id}  {m.created_at}  {m.size / 2**20:.1f} MiB  "
+                                      f"新規 {m.bytes_written / 2**20:.1f} MiB")
+            elif action == "restore":
+                at = None
+                if options["at"]:
+                    # Python 3.11 より前の fromisoformat は末尾の Z を解釈できない
+                    value = options["at"]
+                    at = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith(("Z", "z"))
+                                                else value)
+                m = snapshotter.restore(options["target"], at=at, workers=options["workers"])
+                self.stdout.write(self.style.SUCCESS(f"{m.id}（{m.created_at}）を復元しました"))
+            else:
+                manifests, chunks = store.prune(options["keep"])
+                self.stdout.write(f"スナップショット {manifests}件、チャンク {chunks}件を削除しました")
+        except (SnapshotError, ValueError) as e:
+            raise CommandError(str(e))
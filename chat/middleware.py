@@ -0,0 +1,62 @@
+"""
+チャットアプリ用ミドルウェア
+リクエスト単位の処理時間計測とトレースの開始を行います。
+"""
+import time
+
+from core import tracing
+from core.metrics import HTTP_REQUEST_SECONDS
+from core.warmup import READINESS
+
+# 監視用のルート（最初のリクエストの計測から除く）
+PROBE_ROUTES = {"ready", "metrics"}
+
+
+class RequestTimingMiddleware:
+    """
+    リクエスト処理時間を計測するミドルウェア
+
+    ルートはURLパターン（例: chat/api/）単位で集計し、
+    パスパラメータによるラベル数の増大を防ぎます。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, "resolver_match", None)
+        route = match.route if match is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(
+            elapsed,
+            method=request.method,
+            route=route,
+            status=response.status_code,
+        )
+        if route not in PROBE_ROUTES:
+            READINESS.observe_first_request(elapsed)
+        return response
+
+
+class RequestTracingMiddleware:
+    """
+    リクエストごとにルートスパンを開始するミドルウェア
+
+    受信した traceparent ヘッダがあれば親として引き継ぎ、
+    レスポンスには X-Trace-Id ヘッダでトレースIDを返します。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with tracing.attach(request.headers.get("traceparent")), tracing.start_span(
+            f"http {request.method}", {"http.path": request.path}
+        ) as span:
+            response = self.get_response(request)
+            span.set_attribute("http.status_code", response.status_code)
+            response["X-Trace-Id"] = span.trace_id
+            return response
@@ -6,6 +6,10 @@ urlpatterns = [
     path('', views.chat_view, name='chat'),
     path('api/', views.chat_api, name='chat_api'),
     path('api/select_model/', views.select_model, name='select_model'),
+    path('api/memory/search/', views.search_memory, name='search_memory'),
+    path('api/memory/stats/', views.memory_stats, name='memory_stats'),
+    path('api/jobs/', views.job_create, name='job_create'),
+    path('api/jobs/<int:job_id>/', views.job_status, name='job_status'),
 ]
 
 import sys
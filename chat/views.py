@@ -1,65 +1,91 @@
 # 2. chat/views.py
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 import json
 import logging
 from main import AITask, AI_MODEL_CONFIGS, TASK_AI_RECEIVE, get_available_models, test_model_availability
-from core.db_manager import ConversationDBManager
 from errors.error_codes import ErrorCode, ErrorHandler
 from errors.error_logger import ErrorLogger
+from core import metrics
+from core.traffic_recorder import record_view
+from core.warmup import READINESS
+from core.logging_config import configure_logging
+from core.job_queue import JobQueue, handlers as job_handlers
+from core.tenant import ShardRegistry, tenant_key
+from . import jobs  # ジョブハンドラの登録
+import threading
+import time
 import traceback
 import sys
-import logging.handlers
-from pathlib import Path
 import os
 
+# ハンドラは core.logging_config で一元管理（main のインポート時に設定済み）
+configure_logging()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-# ファイルハンドラの設定
-log_dir = Path("logs")
-log_dir.mkdir(exist_ok=True)
-file_handler = logging.handlers.RotatingFileHandler(
-    log_dir / "chat.log",
-    maxBytes=1024*1024,  # 1MB
-    backupCount=5,
-    encoding='utf-8'
-)
-file_handler.setFormatter(
-    logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
-)
-logger.addHandler(file_handler)
-
-# コンソールハンドラの追加
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(
-    logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
-)
-logger.addHandler(console_handler)
-
-# AIタスクのグローバルインスタンスを作成
-try:
-    cfg = next(cfg for cfg in AI_MODEL_CONFIGS if cfg.id == str(TASK_AI_RECEIVE))
-    ai_task = AITask(cfg)
-    ai_task.start()
-    db_manager = ConversationDBManager()
-    logger.info("DB初期化成功 - 保存ディレクトリ: ./data/chroma_db")
-    
-    # 永続性の確認
-    if db_manager.verify_memory_persistence():
-        logger.info("メモリの永続性が確認できました")
-    else:
-        logger.warning("メモリの永続性が確認できません")
-        
-except StopIteration:
-    logger.error(f"AI初期化エラー: 設定が見つかりません (TASK_AI_RECEIVE={TASK_AI_RECEIVE})")
-    ai_task = None
-    db_manager = None
-except Exception as e:
-    logger.error(f"AI初期化エラー: {str(e)}\n{traceback.format_exc()}")
-    ai_task = None
-    db_manager = None
+
+# AIタスク・DBマネージャー（init_services() で作成。インポート時には作らない）
+ai_task = None
+db_manager = None
+# テナント（ユーザー / セッション）ごとの会話メモリ（core.tenant）
+tenant_shards = None
+_services_lock = threading.Lock()
+_services_initialized = False
+# 初期化に失敗した場合の再試行（INIT_RETRY_SECONDS から倍々に INIT_RETRY_MAX_SECONDS まで待つ）
+INIT_RETRY_SECONDS = float(os.getenv("INIT_RETRY_SECONDS", "5"))
+INIT_RETRY_MAX_SECONDS = float(os.getenv("INIT_RETRY_MAX_SECONDS", "300"))
+_init_failures = 0
+_init_retry_at = 0.0
+
+# バックグラウンドジョブのキュー（ワーカーは manage.py run_job_worker で起動）
+job_queue = JobQueue()
+
+
+def init_services():
+    """
+    AIタスクとDBマネージャーを作成する（成功後は何もしない）
+
+    通常は起動時のウォームアップ（chat.warmup）で呼ばれ、
+    ウォームアップを行わない場合は最初のリクエストで呼ばれる。
+    失敗した場合（Chroma や API キーの一時的な問題など）は、待ち時間を倍々に延ばしながら
+    以降の呼び出しで作成し直す。待ち時間中の呼び出しは何もしない（ai_task は None のまま）。
+    """
+    global ai_task, db_manager, tenant_shards, _services_initialized
+    global _init_failures, _init_retry_at
+    if _services_initialized:
+        return
+    with _services_lock:
+        if _services_initialized or time.monotonic() < _init_retry_at:
+            return
+        try:
+            cfg = next(cfg for cfg in AI_MODEL_CONFIGS if cfg.id == str(TASK_AI_RECEIVE))
+            task = AITask(cfg)
+            task.start()
+        except StopIteration:
+            logger.error(f"AI初期化エラー: 設定が見つかりません (TASK_AI_RECEIVE={TASK_AI_RECEIVE})")
+        except Exception as e:
+            logger.error(f"AI初期化エラー: {str(e)}\n{traceback.format_exc()}")
+        else:
+            # AIタスクと同じDBマネージャーを共有する（Chroma を二重に開かない）
+            ai_task, db_manager = task, task.db_manager
+            tenant_shards = ShardRegistry(db_manager.for_tenant)
+            logger.info("DB初期化成功 - 保存ディレクトリ: %s", db_manager.persist_directory)
+            _init_failures = 0
+            _services_initialized = True
+            return
+        delay = min(INIT_RETRY_MAX_SECONDS, INIT_RETRY_SECONDS * 2 ** _init_failures)
+        _init_failures += 1
+        _init_retry_at = time.monotonic() + delay
+        logger.warning("AI初期化に失敗しました（%d回目）。%.0f秒後以降の呼び出しで再試行します",
+                       _init_failures, delay)
+
+
+def memory_for(request):
+    """リクエストのテナントの会話メモリ（DBマネージャー）を返す"""
+    init_services()
+    if tenant_shards is None:
+        return None
+    return tenant_shards.get(tenant_key(request))
 
 # 環境変数の確認
 def check_environment():
@@ -75,20 +101,14 @@ def check_environment():
     
     # モデル名の確認
     model_name = os.getenv("MODEL_NAME", "gpt-3.5-turbo")
-    logger.info(f"使用するモデル: {model_name}")
+    logger.info("使用するモデル: %s", model_name)
     
     # Pythonパスの確認
-    logger.debug(f"Pythonパス: {sys.path}")
-    logger.debug(f"現在の作業ディレクトリ: {os.getcwd()}")
+    logger.debug("Pythonパス: %s", sys.path)
+    logger.debug("現在の作業ディレクトリ: %s", os.getcwd())
     
     return True
 
-# アプリケーション起動時の初期化
-if not check_environment():
-    logger.error("環境変数の確認に失敗しました")
-else:
-    logger.info("環境変数の確認が完了しました")
-
 @csrf_exempt
 def chat_view(request):
     """チャットビュー
@@ -97,13 +117,10 @@ def chat_view(request):
     POST: AIからの応答を取得
     """
     if request.method == 'POST':
-        logger.info("POSTリクエスト受信")
+        logger.debug("POSTリクエスト受信")
         try:
-            # リクエストの内容をログ
-            logger.debug(f"リクエストボディ: {request.POST}")
-            
             message = request.POST.get('message', '')
-            logger.info(f"受信メッセージ: {message}")
+            logger.debug("受信メッセージ: 長さ=%d", len(message))
             
             if not message:
                 error_msg = ErrorHandler.log_error(
@@ -117,6 +134,7 @@ def chat_view(request):
                 }, status=400)
 
             # AIタスクの状態確認
+            init_services()
             if not ai_task:
                 error_msg = ErrorHandler.log_error(
                     ErrorCode.E50001,
@@ -128,10 +146,10 @@ def chat_view(request):
                     'error_code': 'E50001'
                 }, status=500)
 
-            # AI応答の生成
-            logger.info("AI応答を生成中...")
-            response = ai_task.respond(message)
-            logger.info(f"AI応答生成完了: {response[:100]}...")  # 最初の100文字のみログ
+            # AI応答の生成（同じ質問を処理中なら結果を共有し、保存は先行リクエストに任せる）
+            memory = memory_for(request)
+            response, shared = ai_task.respond_shared(message, memory)
+            logger.debug("AI応答生成完了: 長さ=%d", len(response))
 
             # エラーチェック
             if response.startswith('[Error]'):
@@ -146,12 +164,13 @@ def chat_view(request):
                 }, status=500)
 
             # 会話の保存（タグの自動判定を利用）
-            if db_manager:
+            if shared:
+                logger.debug("同一リクエストの結果を共有したため保存を省略")
+            elif memory:
                 try:
-                    logger.info("会話の保存を開始します...")
-                    save_success = db_manager.save_conversation(message, response)
+                    save_success = memory.save_conversation(message, response)
                     if save_success:
-                        logger.info("会話の保存が完了しました")
+                        logger.debug("会話の保存が完了しました")
                     else:
                         logger.warning("会話の保存に失敗しました")
                 except Exception as e:
@@ -200,6 +219,7 @@ def chat_view(request):
     return render(request, 'chat/chat.html', context)
 
 @csrf_exempt
+@record_view("chat")
 def chat_api(request):
     """チャットAPIエンドポイント"""
     if request.method != 'POST':
@@ -209,8 +229,7 @@ def chat_api(request):
         }, status=405)
 
     try:
-        # リクエストボディをログに記録
-        logger.info(f"リクエストボディ: {request.body.decode('utf-8')}")
+        logger.debug("リクエスト受信: %dバイト", len(request.body))
         
         data = json.loads(request.body)
         message = data.get('message', '')
@@ -221,6 +240,18 @@ def chat_api(request):
                 'error_code': 'E40001'
             }, status=400)
 
+        # background 指定時はジョブとして登録し、結果は /chat/api/jobs/<id>/ で確認する
+        if data.get('background'):
+            tenant = tenant_key(request)
+            job_id = job_queue.enqueue('chat_response',
+                                       {'message': message, 'tenant': tenant},
+                                       priority=int(data.get('priority', 5)), owner=tenant)
+            return JsonResponse({
+                'status': 'queued',
+                'job_id': job_id
+            }, status=202)
+
+        init_services()
         if not ai_task:
             error_msg = ErrorHandler.log_error(
                 ErrorCode.E50001,
@@ -232,23 +263,26 @@ def chat_api(request):
                 'detail': 'OpenAI APIキーと必要な環境変数を確認してください。'
             }, status=500)
 
-        # AIの応答を取得
-        response = ai_task.respond(message)
+        # AIの応答を取得（同じ質問を処理中なら結果を共有し、保存は先行リクエストに任せる）
+        memory = memory_for(request)
+        response, shared = ai_task.respond_shared(message, memory)
         
         # エラーチェック
         if isinstance(response, str) and response.startswith('[Error]'):
+            metrics.record_error('E50002')
             return JsonResponse({
                 'error': response,
                 'error_code': 'E50002'
             }, status=500)
         
         # 会話を保存
-        if db_manager:
+        if shared:
+            logger.debug("同一リクエストの結果を共有したため保存を省略")
+        elif memory:
             try:
-                logger.info("会話の保存を開始します...")
-                save_success = db_manager.save_conversation(message, response)
+                save_success = memory.save_conversation(message, response)
                 if save_success:
-                    logger.info("会話の保存が完了しました")
+                    logger.debug("会話の保存が完了しました")
                 else:
                     logger.warning("会話の保存に失敗しました")
             except Exception as e:
@@ -264,12 +298,14 @@ def chat_api(request):
 
     except json.JSONDecodeError as e:
         logger.error(f"JSONデコードエラー: {str(e)}")
+        metrics.record_error('E40003')
         return JsonResponse({
             'error': '不正なJSONフォーマット',
             'error_code': 'E40003'
         }, status=400)
     except Exception as e:
         logger.error(f"予期せぬエラー: {str(e)}\n{traceback.format_exc()}")
+        metrics.record_error('E10003')
         return JsonResponse({
             'error': str(e),
             'error_code': 'E10003'
@@ -296,7 +332,7 @@ def select_model(request):
 
         # セッションにモデル名を保存
         request.session['selected_model'] = model_name
-        logger.info(f"モデルを選択: {model_name}")
+        logger.info("モデルを選択: %s", model_name)
         
         return JsonResponse({
             'status': 'success',
@@ -321,7 +357,7 @@ def memory_view(request):
     """記憶の確認・管理画面を表示"""
     if request.method == 'GET':
         # 記憶一覧の取得
-        memories = db_manager.get_conversations(
+        memories = memory_for(request).get_conversations(
             limit=50,  # デフォルトの表示件数
             offset=int(request.GET.get('offset', 0)),
             privacy_level=request.GET.get('privacy_level'),
@@ -337,24 +373,29 @@ def delete_memory(request):
     if request.method == 'POST':
         try:
             memory_ids = json.loads(request.body)['memory_ids']
-            db_manager.delete_conversations(memory_ids)
+            memory_for(request).delete_conversations(memory_ids)
             return JsonResponse({'status': 'success'})
         except Exception as e:
             logger.error(f"記憶削除エラー: {e}")
             return JsonResponse({'error': str(e)}, status=400)
 
 @csrf_exempt
+@record_view("search")
 def search_memory(request):
     """会話履歴を検索"""
     try:
         query = request.GET.get('query', '')
         privacy_level = request.GET.get('privacy_level')
         tags = request.GET.getlist('tags[]')
+        limit = int(request.GET.get('limit', 5))
+        offset = int(request.GET.get('offset', 0))
         
-        results = db_manager.search_conversations(
+        results = memory_for(request).search_conversations(
             query=query,
             privacy_level=privacy_level,
-            tags=tags
+            tags=tags,
+            limit=limit,
+            offset=offset
         )
         
         return JsonResponse({
@@ -369,6 +410,27 @@ def search_memory(request):
             'message': str(e)
         }, status=500)
 
+def memory_stats(request):
+    """会話メモリの集計（件数・内訳・推定トークン数・容量）を取得"""
+    memory = memory_for(request)
+    if memory is None:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'DBが初期化されていません'
+        }, status=503)
+    try:
+        days = int(request.GET.get('days', 30))
+        return JsonResponse({
+            'status': 'success',
+            'stats': memory.memory_stats(by_day=days)
+        })
+    except Exception as e:
+        logger.error(f"会話の集計の取得に失敗: {e}")
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
 @csrf_exempt
 def get_recent_memory(request):
     """最近の会話履歴を取得"""
@@ -376,7 +438,7 @@ def get_recent_memory(request):
         limit = int(request.GET.get('limit', 10))
         privacy_level = request.GET.get('privacy_level')
         
-        results = db_manager.get_recent_conversations(
+        results = memory_for(request).get_recent_conversations(
             limit=limit,
             privacy_level=privacy_level
         )
@@ -392,3 +454,70 @@ def get_recent_memory(request):
             'status': 'error',
             'message': str(e)
         }, status=500)
+
+@csrf_exempt
+def job_create(request):
+    """ジョブ登録APIエンドポイント"""
+    if request.method != 'POST':
+        return JsonResponse({
+            'error': 'POSTメソッドのみ許可されています',
+            'error_code': 'E40003'
+        }, status=405)
+
+    try:
+        data = json.loads(request.body)
+        payload = data.get('payload') if isinstance(data, dict) else None
+        if not isinstance(data, dict) or not isinstance(payload or {}, dict):
+            return JsonResponse({
+                'error': 'リクエストと payload はJSONオブジェクトで指定してください',
+                'error_code': 'E40001'
+            }, status=400)
+        kind = data.get('kind')
+        # 管理用のジョブ（取り込み・保持期間・埋め込み移行）は管理コマンドからのみ登録する
+        if kind not in jobs.USER_JOB_KINDS or kind not in job_handlers():
+            return JsonResponse({
+                'error': f'未対応のジョブ種別です: {kind}',
+                'error_code': 'E40001'
+            }, status=400)
+
+        # テナントはリクエストから決める（他のユーザーの会話メモリを指定させない）
+        tenant = tenant_key(request)
+        job_id = job_queue.enqueue(
+            kind,
+            {**(payload or {}), 'tenant': tenant},
+            priority=int(data.get('priority', 5)),
+            max_attempts=int(data.get('max_attempts', 3)),
+            owner=tenant
+        )
+        return JsonResponse({
+            'status': 'queued',
+            'job_id': job_id
+        }, status=202)
+
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.error("ジョブ登録の入力エラー: %s", e)
+        return JsonResponse({
+            'error': '不正なJSONフォーマット',
+            'error_code': 'E40003'
+        }, status=400)
+
+def job_status(request, job_id):
+    """ジョブの状態を取得（ポーリング用、登録したテナントのジョブのみ）"""
+    job = job_queue.get(job_id, owner=tenant_key(request))
+    if job is None:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'ジョブが見つかりません'
+        }, status=404)
+    return JsonResponse({
+        'status': 'success',
+        'job': job
+    })
+
+def metrics_view(request):
+    """Prometheusテキスト形式でメトリクスを出力"""
+    return HttpResponse(metrics.render_latest(), content_type=metrics.CONTENT_TYPE)
+
+def readiness_view(request):
+    """準備完了の確認（ウォームアップが終わるまで 503）"""
+    return JsonResponse(READINESS.snapshot(), status=200 if READINESS.ready else 503)
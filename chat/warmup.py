@@ -0,0 +1,77 @@
+"""
+チャットアプリの起動時ウォームアップ（core.warmup の手順定義）
+config/wsgi.py・config/asgi.py から start_warmup() で開始します。
+
+手順:
+    environment   環境変数の確認（critical）
+    memory        AIタスク・DBマネージャーの作成と Chroma のオープン、件数の確認（critical）
+    tokenizer     tiktoken のエンコーダーの読み込み
+    llm_pool      OpenAI クライアントの接続（TLS）をモデル一覧の取得で確立
+    embeddings    埋め込み API の接続を確立し、WARMUP_QUERIES の検索結果をキャッシュに載せる
+
+WARMUP=0 でウォームアップを行わず、すぐに準備完了とします（初回リクエストで初期化）。
+critical な手順が失敗した場合は、init_services と同じ間隔（INIT_RETRY_SECONDS から倍々に
+INIT_RETRY_MAX_SECONDS まで）で再実行し、成功すれば準備完了に戻ります。
+"""
+import logging
+import os
+
+from core.warmup import READINESS, Warmup
+
+logger = logging.getLogger(__name__)
+
+
+def _environment():
+    from chat import views
+    if not views.check_environment():
+        raise RuntimeError("環境変数の確認に失敗しました")
+
+
+def _memory():
+    from chat import views
+    views.init_services()
+    if views.ai_task is None or views.db_manager is None:
+        raise RuntimeError("AIタスク・DBマネージャーを初期化できませんでした")
+    if views.db_manager.verify_memory_persistence():
+        logger.info("メモリの永続性が確認できました")
+    else:
+        logger.warning("メモリの永続性が確認できません")
+
+
+def _tokenizer():
+    from core.embedding_migration import count_tokens
+    count_tokens(["warmup"])
+
+
+def _llm_pool():
+    from chat import views
+    views.ai_task.get_client().models.list()
+
+
+def _embeddings():
+    from chat import views
+    memory = views.db_manager
+    memory.db.embeddings.embed_query("warmup")
+    queries = [q.strip() for q in os.getenv("WARMUP_QUERIES", "").split("|") if q.strip()]
+    for query in queries:
+        memory.search_conversations(query)
+
+
+def build_warmup() -> Warmup:
+    """チャットアプリのウォームアップ手順"""
+    from chat import views
+    return (Warmup(READINESS, retry_seconds=views.INIT_RETRY_SECONDS,
+                   retry_max_seconds=views.INIT_RETRY_MAX_SECONDS)
+            .add("environment", _environment)
+            .add("memory", _memory)
+            .add("tokenizer", _tokenizer, critical=False)
+            .add("llm_pool", _llm_pool, critical=False)
+            .add("embeddings", _embeddings, critical=False))
+
+
+def start_warmup():
+    """ウォームアップをバックグラウンドで開始する（WARMUP=0 なら即座に準備完了）"""
+    if os.getenv("WARMUP", "1") == "0":
+        READINESS.mark_ready()
+        return None
+    return build_warmup().start()
@@ -0,0 +1,310 @@
+"""
+WebSocket によるチャット配信
+1本の接続でセッション内の複数リクエストを多重化し、モデル応答の差分（delta）や
+保存・検索の完了イベントをサーバーから送信します。config/asgi.py から /ws/chat/ で呼ばれます。
+
+プロトコル（JSON テキストフレーム、id はクライアントが付ける任意の文字列）:
+    クライアント → サーバー
+        {"type": "chat", "id": "c1", "message": "..."}
+        {"type": "search", "id": "s1", "query": "...", "privacy_level": null, "tags": []}
+        {"type": "cancel", "id": "c1"}
+    サーバー → クライアント
+        {"type": "delta", "id": "c1", "text": "..."}         応答の差分
+        {"type": "done", "id": "c1", "response": "..."}      応答の完了
+        {"type": "saved", "id": "c1", "ok": true}            会話の保存完了
+        {"type": "search_result", "id": "s1", "results": [...]}
+        {"type": "error", "id": "c1", "error": "...", "error_code": "E50002"}
+
+フロー制御:
+    - 接続ごとの送信キューは上限付き。クライアントの受信が遅いと、モデル応答を
+      読み出すスレッドが待たされる（送信データが無制限に溜まらない）
+    - 接続ごとの同時処理数は WS_MAX_INFLIGHT（既定 4）まで。超えた要求は E40004 で拒否
+    - 処理中のリクエストと同じ id の要求は E40003 で拒否（完了後は同じ id を使ってよい）
+
+接続の受け付け:
+    - Origin ヘッダーがある場合（ブラウザからの接続）は、そのホストが ALLOWED_HOSTS に
+      含まれなければ 4403 で閉じる（他サイトのページからセッションの Cookie 付きで
+      接続されるのを防ぐ）
+    - セッションがない・不正な場合は 4401 で閉じる
+"""
+from typing import Iterable, Optional
+from urllib.parse import urlsplit
+import asyncio
+import json
+import logging
+import os
+import threading
+
+from core import metrics, tracing
+from core.tenant import tenant_key_from_scope
+from errors.error_codes import ErrorCode, ErrorHandler
+
+logger = logging.getLogger(__name__)
+
+WS_PATH = "/ws/chat/"
+MAX_INFLIGHT = int(os.getenv("WS_MAX_INFLIGHT", "4"))
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+
+WS_CONNECTIONS = metrics.REGISTRY.gauge(
+    "websocket_connections",
+    "接続中の WebSocket 数",
+)
+WS_CONNECTIONS_TOTAL = metrics.REGISTRY.counter(
+    "websocket_connections_total",
+    "受け付けた WebSocket 接続の累計",
+)
+WS_MESSAGES = metrics.REGISTRY.counter(
+    "websocket_messages_total",
+    "WebSocket で送受信したメッセージ数",
+    labelnames=("direction", "type"),
+)
+
+
+class _Closed(Exception):
+    """接続が閉じられたため処理を中断する"""
+
+
+def _host_allowed(host: str, allowed_hosts: Iterable[str]) -> bool:
+    """ALLOWED_HOSTS と同じ規則（"*"、先頭 "." はサブドメインを含む）でホストを照合する"""
+    host = host.lower()
+    for pattern in allowed_hosts:
+        pattern = pattern.lower()
+        if pattern == "*" or host == pattern:
+            return True
+        if pattern.startswith(".") and (host.endswith(pattern) or host == pattern[1:]):
+            return True
+    return False
+
+
+def origin_allowed(scope, allowed_hosts: Iterable[str]) -> bool:
+    """
+    接続元ページの Origin が許可されたホストか判定する
+
+    Origin ヘッダーのない接続（ブラウザ以外のクライアント）は許可する。
+    """
+    origins = [value for name, value in scope.get("headers") or () if name.lower() == b"origin"]
+    if not origins:
+        return True
+    try:
+        host = urlsplit(origins[-1].decode("latin-1")).hostname
+    except ValueError:
+        return False
+    return bool(host) and _host_allowed(host, allowed_hosts)
+
+
+class ChatSocket:
+    """
+    1本の WebSocket 接続を処理する
+
+    Attributes:
+        ai_task: respond_stream(text, memory) を持つ AIタスク
+        db_manager: save_conversation / search_conversations を持つDBマネージャー
+            （接続したユーザーのテナントの会話メモリ）
+    """
+
+    def __init__(self, scope, receive, send, ai_task, db_manager,
+                 max_inflight: int = MAX_INFLIGHT, send_queue_size: int = SEND_QUEUE_SIZE):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.ai_task = ai_task
+        self.db_manager = db_manager
+        self.max_inflight = max_inflight
+        self._outbox: asyncio.Queue = asyncio.Queue(send_queue_size)
+        self._requests: dict = {}
+        # 処理中のリクエストの取り消し（request_id → Event。完了時に外す）
+        self._cancelled: dict = {}
+        self._closed = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # --- 送信 ---
+    async def emit(self, event: dict):
+        """送信キューに入れる（満杯なら空くまで待つ）"""
+        if self._closed:
+            raise _Closed()
+        await self._outbox.put(event)
+
+    def emit_threadsafe(self, event: dict, cancelled: Optional[threading.Event] = None):
+        """
+        ワーカースレッドから送信する（送信キューが空くまでスレッドを待たせる）
+
+        cancelled はそのリクエストの取り消し。リクエストの完了後も（同じ id が
+        再利用されても）取り消されたスレッドからは送信しない。
+        """
+        if self._closed or (cancelled is not None and cancelled.is_set()):
+            raise _Closed()
+        asyncio.run_coroutine_threadsafe(self.emit(event), self._loop).result()
+
+    async def _sender(self):
+        while True:
+            event = await self._outbox.get()
+            await self.send({"type": "websocket.send",
+                             "text": json.dumps(event, ensure_ascii=False)})
+            WS_MESSAGES.inc(direction="out", type=event["type"])
+
+    async def _error(self, request_id, code: ErrorCode, detail: str):
+        await self.emit({"type": "error", "id": request_id,
+                         "error": ErrorHandler.log_error(code, detail),
+                         "error_code": code.name})
+
+    # --- 各リクエストの処理 ---
+    def _stream_reply(self, request_id, message: str,
+                      cancelled: Optional[threading.Event] = None) -> str:
+        """モデルの応答を差分ごとに送信し、全文を返す（ワーカースレッドで実行）"""
+        chunks = []
+        stream = self.ai_task.respond_stream(message, self.db_manager)
+        try:
+            for delta in stream:
+                chunks.append(delta)
+                self.emit_threadsafe({"type": "delta", "id": request_id, "text": delta},
+                                     cancelled)
+        finally:
+            stream.close()
+        return "".join(chunks)
+
+    async def _chat(self, request_id, message: str, cancelled: threading.Event):
+        if not message:
+            await self._error(request_id, ErrorCode.E40001, "メッセージが空です")
+            return
+        try:
+            with metrics.stage_timer("ws_chat"):
+                response = await asyncio.to_thread(self._stream_reply, request_id, message,
+                                                   cancelled)
+        except _Closed:
+            return
+        except Exception as e:
+            await self._error(request_id, ErrorCode.E50002, str(e))
+            return
+        await self.emit({"type": "done", "id": request_id, "response": response})
+
+        try:
+            ok = bool(await asyncio.to_thread(self.db_manager.save_conversation, message, response))
+        except Exception as e:
+            logger.error("会話の保存中にエラー: %s", e)
+            ok = False
+        await self.emit({"type": "saved", "id": request_id, "ok": ok})
+
+    async def _search(self, request_id, data: dict):
+        try:
+            results = await asyncio.to_thread(
+                self.db_manager.search_conversations,
+                query=data.get("query", ""),
+                privacy_level=data.get("privacy_level"),
+                tags=data.get("tags") or None,
+            )
+        except Exception as e:
+            await self._error(request_id, ErrorCode.E10003, str(e))
+            return
+        await self.emit({"type": "search_result", "id": request_id, "results": results})
+
+    async def _dispatch(self, data: dict):
+        kind = data.get("type")
+        request_id = data.get("id")
+        WS_MESSAGES.inc(direction="in", type=str(kind))
+        if kind == "cancel":
+            cancelled = self._cancelled.get(request_id)
+            if cancelled is not None:
+                cancelled.set()
+                self._requests[request_id].cancel()
+            return
+        if kind not in ("chat", "search"):
+            await self._error(request_id, ErrorCode.E40003, f"未対応のメッセージ種別: {kind}")
+            return
+        if request_id in self._requests:
+            # 同じ id では応答を区別できず、取り消しも先のリクエストに効いてしまう
+            await self._error(request_id, ErrorCode.E40003,
+                              f"処理中のリクエストと id が重複しています: {request_id}")
+            return
+        if len(self._requests) >= self.max_inflight:
+            await self._error(request_id, ErrorCode.E40004,
+                              f"同時に処理できるのは {self.max_inflight} 件までです")
+            return
+        cancelled = threading.Event()
+        if kind == "chat":
+            coro = self._chat(request_id, str(data.get("message", "")).strip(), cancelled)
+        else:
+            coro = self._search(request_id, data)
+        task = asyncio.create_task(self._traced(kind, request_id, coro))
+        self._requests[request_id] = task
+        self._cancelled[request_id] = cancelled
+        task.add_done_callback(lambda _: self._finished(request_id, task))
+
+    def _finished(self, request_id, task):
+        """リクエストの完了時に id を外す（以降は同じ id を使ってよい）"""
+        if self._requests.get(request_id) is task:
+            del self._requests[request_id]
+            self._cancelled.pop(request_id, None)
+
+    async def _traced(self, kind: str, request_id, coro):
+        with tracing.start_span(f"ws.{kind}", {"ws.request_id": str(request_id)}):
+            try:
+                await coro
+            except (_Closed, asyncio.CancelledError):
+                pass
+
+    # --- 接続の処理 ---
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        event = await self.receive()
+        if event["type"] != "websocket.connect":
+            return
+        await self.send({"type": "websocket.accept"})
+        WS_CONNECTIONS.inc()
+        WS_CONNECTIONS_TOTAL.inc()
+        sender = asyncio.create_task(self._sender())
+        try:
+            while True:
+                event = await self.receive()
+                if event["type"] == "websocket.disconnect":
+                    break
+                if event["type"] != "websocket.receive":
+                    continue
+                try:
+                    data = json.loads(event.get("text") or event.get("bytes") or b"")
+                    if not isinstance(data, dict):
+                        raise ValueError("JSONオブジェクトではありません")
+                except ValueError as e:
+                    await self._error(None, ErrorCode.E40003, str(e))
+                    continue
+                await self._dispatch(data)
+        finally:
+            self._closed = True
+            WS_CONNECTIONS.dec()
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+            for task in list(self._requests.values()):
+                task.cancel()
+            # 送信キューの空きを待っているワーカースレッドを解放する
+            while not self._outbox.empty():
+                self._outbox.get_nowait()
+            await asyncio.gather(*self._requests.values(), return_exceptions=True)
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI の websocket スコープを処理する（/ws/chat/ 以外は拒否）"""
+    if scope.get("path") != WS_PATH:
+        await receive()
+        await send({"type": "websocket.close", "code": 4404})
+        return
+    from django.conf import settings
+    if not origin_allowed(scope, settings.ALLOWED_HOSTS):
+        await receive()
+        await send({"type": "websocket.close", "code": 4403})
+        return
+    # chat.views がプロセス内で共有している AIタスクとテナントのシャードを使う
+    from chat import views
+    # ウォームアップ前なら初期化を待つ（Chroma のオープンなどはスレッドで行う）
+    await asyncio.to_thread(views.init_services)
+    if views.ai_task is None or views.tenant_shards is None:
+        await receive()
+        await send({"type": "websocket.close", "code": 1011})
+        return
+    # セッションの読み出しと未オープンのシャードの作成は DB にアクセスするためスレッドで行う
+    tenant = await asyncio.to_thread(tenant_key_from_scope, scope)
+    if tenant is None:
+        # セッションのない接続に共有コレクション（全員の会話）を見せない
+        await receive()
+        await send({"type": "websocket.close", "code": 4401})
+        return
+    memory = await asyncio.to_thread(views.tenant_shards.get, tenant)
+    await ChatSocket(scope, receive, send, views.ai_task, memory).run()
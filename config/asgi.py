@@ -2,4 +2,24 @@ import os
 from django.core.asgi import get_asgi_application
  
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
-application = get_asgi_application() 
\ No newline at end of file
+django_application = get_asgi_application()
+
+# Django の初期化後に読み込む（chat.views のAIタスク・DBマネージャーを共有するため）
+from chat.websocket import websocket_application  # noqa: E402
+from chat.warmup import start_warmup  # noqa: E402
+
+# DB・HTTP接続などの初期化を最初のリクエストより前に済ませる（/ready で完了を確認）
+start_warmup()
+
+
+async def application(scope, receive, send):
+    """
+    HTTP は Django、WebSocket（/ws/chat/）は chat.websocket で処理する
+
+    WebSocket を使う場合は uvicorn / daphne などの ASGI サーバーで起動すること
+    （例: uvicorn config.asgi:application）。runserver（WSGI）では HTTP のみ動作する。
+    """
+    if scope["type"] == "websocket":
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
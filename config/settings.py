@@ -14,6 +14,8 @@ DEBUG = True
 ALLOWED_HOSTS = ['localhost', '127.0.0.1']
 
 MIDDLEWARE = [
+    'chat.middleware.RequestTimingMiddleware',
+    'chat.middleware.RequestTracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django.urls import path, include
+from chat import views as chat_views
  
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('chat/', include('chat.urls')),
+    path('metrics', chat_views.metrics_view, name='metrics'),
+    path('ready', chat_views.readiness_view, name='ready'),
 ] 
\ No newline at end of file
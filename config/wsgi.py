@@ -2,4 +2,8 @@ import os
 from django.core.wsgi import get_wsgi_application
  
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
-application = get_wsgi_application() 
\ No newline at end of file
+application = get_wsgi_application()
+
+# DB・HTTP接続などの初期化を最初のリクエストより前に済ませる（/ready で完了を確認）
+from chat.warmup import start_warmup  # noqa: E402
+start_warmup() 
\ No newline at end of file
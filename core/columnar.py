@@ -0,0 +1,143 @@
+"""
+圧縮カラムナファイルの読み書きモジュール
+アーカイブやエクスポートなど、書いた後はほとんど読まないデータを列ごとに圧縮して保存します。
+外部ライブラリ（pyarrow など）に依存しない独自の単純な形式です。
+
+ファイル形式:
+    MAGIC (b"CCOL1\\n")
+    ヘッダー長 (u32, ビッグエンディアン)
+    ヘッダー (JSON): {"rows": 行数, "meta": {...},
+                     "columns": {列名: {"offset", "length", "min", "max"}}}
+    列データ: 列ごとに JSON 配列を zlib 圧縮したもの（offset はデータ部先頭からの位置）
+              array.array の列（埋め込みベクトルなど）は生のバイト列を圧縮して保存し、
+              ヘッダーに "typecode" を持つ
+
+- 読み出し時は必要な列だけを展開する（検索で本文列だけ読む、など）
+- 数値列はヘッダーに min/max を持つため、範囲外のファイルは展開せずに読み飛ばせる
+"""
+from array import array
+from typing import Dict, Iterable, List, Optional
+import json
+import os
+import struct
+import sys
+import zlib
+
+MAGIC = b"CCOL1\n"
+EXTENSION = ".ccol"
+_HEADER_LEN = struct.Struct(">I")
+
+
+class ColumnarError(ValueError):
+    """カラムナファイルの形式が不正"""
+
+
+def _bounds(values: list) -> dict:
+    numbers = [v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    if not numbers or len(numbers) != len(values):
+        return {}
+    return {"min": min(numbers), "max": max(numbers)}
+
+
+def write_table(path: str, columns: Dict[str, list], meta: Optional[dict] = None,
+                level: int = 6) -> int:
+    """
+    列ごとのリストをファイルに書き出す（一時ファイル経由で置き換える）
+
+    Args:
+        path: 出力先
+        columns: 列名 → 値のリスト（すべて同じ長さ、値は JSON にできるもの）
+            または array.array（行数の制約なし。1行が複数要素のベクトル列に使う）
+        meta: ヘッダーに保存する任意の情報
+        level: zlib の圧縮レベル
+    Returns:
+        int: 書き出したバイト数
+    """
+    lengths = {len(values) for values in columns.values() if not isinstance(values, array)}
+    if len(lengths) > 1:
+        raise ColumnarError("列の長さが揃っていません")
+    blobs = []
+    header = {"rows": lengths.pop() if lengths else 0, "meta": meta or {}, "columns": {}}
+    offset = 0
+    for name, values in columns.items():
+        if isinstance(values, array):
+            blob = zlib.compress(values.tobytes(), level)
+            info = {"typecode": values.typecode, "byteorder": sys.byteorder}
+        else:
+            blob = zlib.compress(json.dumps(values, ensure_ascii=False).encode("utf-8"), level)
+            info = _bounds(values)
+        header["columns"][name] = {"offset": offset, "length": len(blob), **info}
+        blobs.append(blob)
+        offset += len(blob)
+    raw_header = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(raw_header)))
+        f.write(raw_header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp, path)
+    return len(MAGIC) + _HEADER_LEN.size + len(raw_header) + offset
+
+
+def _read_header(f) -> dict:
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ColumnarError("カラムナファイルではありません")
+    raw = f.read(_HEADER_LEN.size)
+    if len(raw) != _HEADER_LEN.size:
+        raise ColumnarError("ヘッダーが途中で切れています")
+    (size,) = _HEADER_LEN.unpack(raw)
+    header = json.loads(f.read(size))
+    header["_data_start"] = len(MAGIC) + _HEADER_LEN.size + size
+    return header
+
+
+def read_header(path: str) -> dict:
+    """ヘッダー（行数・meta・列ごとの範囲）だけを読む"""
+    with open(path, "rb") as f:
+        header = _read_header(f)
+    header.pop("_data_start")
+    return header
+
+
+def read_table(path: str, columns: Optional[Iterable[str]] = None) -> Dict[str, list]:
+    """
+    指定した列だけを読み出す
+
+    Args:
+        columns: 読む列名（None なら全列）。存在しない列は KeyError
+    Returns:
+        dict: 列名 → リスト（array.array で書いた列は array.array）
+    """
+    with open(path, "rb") as f:
+        header = _read_header(f)
+        names = list(header["columns"]) if columns is None else list(columns)
+        result = {}
+        for name in names:
+            info = header["columns"][name]
+            f.seek(header["_data_start"] + info["offset"])
+            blob = f.read(info["length"])
+            try:
+                raw = zlib.decompress(blob)
+                if "typecode" in info:
+                    values = array(info["typecode"])
+                    values.frombytes(raw)
+                    if info.get("byteorder", sys.byteorder) != sys.byteorder:
+                        values.byteswap()
+                    result[name] = values
+                else:
+                    result[name] = json.loads(raw)
+            except zlib.error as e:
+                raise ColumnarError(f"列 {name} の展開に失敗: {e}") from e
+        return result
+
+
+def list_files(directory: str) -> List[str]:
+    """ディレクトリ内のカラムナファイルを名前順に返す"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.endswith(EXTENSION))
@@ -6,18 +6,85 @@ from datetime import datetime
 from dotenv import load_dotenv
 import os
 from core.privacy_analyzer import PrivacyAnalyzer
-from typing import List
+from core import metrics, singleflight, tracing
+from core.embeddings import InstrumentedEmbeddings
+from core.search_cache import default_cache as default_search_cache
+from core.dedup import DedupIndex, encode_signature
+from core.retention import DEFAULT_ARCHIVE_DIR, RetentionSweeper, SweepResult
+from core.embedding_migration import (
+    STATE_FILE, EmbeddingMigration, MigrationError, MigrationState, count_tokens,
+    state_file_name,
+)
+from core.memory_stats import stats_for
+from core.privacy_backfill import PrivacyBackfill
+from core.prompt_builder import HistoryCache, latest_ids
+from core.tenant import DEFAULT_TENANT, SHARD_SEPARATOR, TENANT_QUOTA_REJECTED
+from core.tenant import collection_name as tenant_collection_name
+from typing import List, Optional
 import logging
+import sqlite3
+import threading
+import time
 import traceback
+import uuid
 import chromadb
 
 load_dotenv()  # .envファイルから環境変数を読み込む
 
 logger = logging.getLogger(__name__)
 
+# 同じ条件の同時検索をまとめる（core.singleflight）
+SEARCH_FLIGHT = singleflight.Group("db.search_conversations")
+
+DEDUP_TOTAL = metrics.REGISTRY.counter(
+    "chat_dedup_total",
+    "保存時にほぼ重複と判定された会話の件数",
+    labelnames=("mode",),
+)
+
+TENANT_MAX_CONVERSATIONS = int(os.getenv("TENANT_MAX_CONVERSATIONS", "0"))
+# 検索では最低この件数を取得してキャッシュし、次のページも同じ結果から返す
+SEARCH_PREFETCH = int(os.getenv("SEARCH_PREFETCH", "20"))
+# 同じ内容の会話が保存中のとき、統合する前に先着の保存を待つ最大秒数
+DEDUP_WAIT_SECONDS = float(os.getenv("DEDUP_WAIT_SECONDS", "30"))
+
 class ConversationDBManager:
-    def __init__(self, persist_directory=None):
-        """DBマネージャーの初期化"""
+    """
+    会話メモリ（Chroma コレクション）の管理クラス
+
+    複数のリクエストスレッドから同時に使ってよい。読み出し先と dual-write 先の組（_handles）は
+    不変のタプルとして丸ごと差し替え、各処理は最初に1度だけ読んで使う。
+    ロックは移行状態の再読み込み・重複判定索引の作成・会話数の上限の判定だけに使い、
+    埋め込み生成や Chroma への書き込み中は保持しない。
+    """
+
+    def __init__(self, persist_directory=None, collection_name=None, client=None,
+                 max_conversations=0):
+        """
+        DBマネージャーの初期化
+
+        Args:
+            persist_directory: 永続化ディレクトリ（既定: CHROMA_DB_DIR）
+            collection_name: コレクション名（既定: CHROMA_COLLECTION_NAME）
+            client: 共有する chromadb クライアント（テナントのシャード用）
+            max_conversations: 保存できる会話数の上限（0 は無制限）
+        """
+        self._requested_collection = collection_name
+        self._shared_client = client
+        self.max_conversations = max_conversations
+        # 移行状態の再読み込みと重複判定索引の作成（どちらも1スレッドだけが行う）
+        self._lock = threading.Lock()
+        # 会話数の上限の判定（保存中の件数も数える）
+        self._quota_lock = threading.Lock()
+        self._pending_saves = 0
+        self._delete_lock = threading.Lock()
+        # 保存中の新規会話（id → 保存完了で set される Event）。同じ内容の後着の保存が待つ
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._handles = (None, None)
+        # プロンプトに入れる直近の会話履歴（core.prompt_builder.HistoryCache）
+        self._history = HistoryCache()
         try:
             # 環境変数の検証
             self._verify_environment()
@@ -28,8 +95,11 @@ class ConversationDBManager:
                 os.getenv('CHROMA_DB_DIR', './data/chroma_db')
             )
             self._initialize_directory()
+            # 件数・トークン数の集計表（core.memory_stats）
+            self.stats = stats_for(self.persist_directory)
             self.privacy_analyzer = PrivacyAnalyzer()
             self.text_splitter = CharacterTextSplitter()
+            self.dedup_index = DedupIndex()
             
             # 初期設定の実行
             self._setup_initial_config()
@@ -53,7 +123,7 @@ class ConversationDBManager:
         """DBディレクトリの初期化"""
         try:
             os.makedirs(self.persist_directory, exist_ok=True)
-            logger.info(f"DBディレクトリを初期化: {self.persist_directory}")
+            logger.info("DBディレクトリを初期化: %s", self.persist_directory)
             
             # 必要なサブディレクトリの作成
             for subdir in ['collections', 'indexes']:
@@ -69,19 +139,170 @@ class ConversationDBManager:
     def _setup_initial_config(self):
         """初期設定の実行"""
         try:
-            collection_name = os.getenv('CHROMA_COLLECTION_NAME', 'conversations')
+            self.collection_name = (self._requested_collection or
+                                    os.getenv('CHROMA_COLLECTION_NAME', 'conversations'))
             # 新しい PersistentClient API を利用して永続化ディレクトリを指定
-            client = chromadb.PersistentClient(path=self.persist_directory)
-            self.db = Chroma(
-                client=client,
-                collection_name=collection_name,
-                embedding_function=OpenAIEmbeddings()
-            )
-            logger.info(f"ChromaDBコレクションを初期化: {collection_name}")
+            self.client = (self._shared_client or
+                           chromadb.PersistentClient(path=self.persist_directory))
+            # 埋め込みモデルの移行状態（core.embedding_migration）
+            self.migration_state_path = self._migration_state_path()
+            self._migration_mtime = None
+            self._migration_checked = 0.0
+            self.migration_state = None
+            self._apply_migration_state()
         except Exception as e:
             logger.error(f"初期設定エラー: {e}")
             raise
 
+    def _migration_state_path(self) -> str:
+        """
+        このコレクションの移行状態ファイル
+
+        旧形式の共有ファイル（STATE_FILE）がこのコレクションの移行であれば引き継ぐ。
+        """
+        path = os.path.join(self.persist_directory, state_file_name(self.collection_name))
+        legacy = os.path.join(self.persist_directory, STATE_FILE)
+        try:
+            if not os.path.exists(path) and os.path.exists(legacy):
+                state = MigrationState.load(legacy)
+                if state is not None and state.source_collection == self.collection_name:
+                    os.replace(legacy, path)
+                    logger.info("移行状態ファイルを引き継ぎました: %s", path)
+        except OSError as e:
+            # 別のプロセスが先に引き継いだ
+            logger.debug("旧形式の移行状態ファイルを引き継げません: %s", e)
+        return path
+
+    def for_tenant(self, tenant: str) -> "ConversationDBManager":
+        """
+        テナントのシャード（専用コレクション）を扱うDBマネージャーを作る
+
+        chromadb クライアントは共有し、会話数の上限は TENANT_MAX_CONVERSATIONS。
+        default テナントは自分自身（従来の共有コレクション）を返す。
+        """
+        if tenant == DEFAULT_TENANT:
+            return self
+        return self.open_collection(tenant_collection_name(self.collection_name, tenant))
+
+    def open_collection(self, name: str) -> "ConversationDBManager":
+        """同じ保存先の別のコレクション（テナントのシャード）を扱うDBマネージャーを作る"""
+        if name == self.collection_name:
+            return self
+        return ConversationDBManager(self.persist_directory, collection_name=name,
+                                     client=self.client,
+                                     max_conversations=TENANT_MAX_CONVERSATIONS)
+
+    def tenant_shard_names(self) -> List[str]:
+        """保存済みのテナントのシャードのコレクション名（埋め込み移行の移行先は除く）"""
+        prefix = f"{self.collection_name}{SHARD_SEPARATOR}"
+        names = []
+        for collection in self.client.list_collections():
+            name = getattr(collection, "name", collection)
+            # 移行先は <シャード名>__<モデル名>（テナントキーに "__" は含まれない）
+            if name.startswith(prefix) and "__" not in name[len(prefix):]:
+                names.append(name)
+        return sorted(names)
+
+    def with_tenant_shards(self):
+        """自分自身と、保存済みのすべてのテナントのシャードのDBマネージャーを順に返す"""
+        yield self
+        for name in self.tenant_shard_names():
+            yield self.open_collection(name)
+
+    def select_tenants(self, all_tenants: bool = False, tenant: str = None):
+        """
+        管理コマンドの対象のDBマネージャー（--all-tenants / --tenant に対応）
+
+        Args:
+            all_tenants: 共有コレクションとすべてのシャード
+            tenant: 指定したテナントのシャードのみ（テナントキー、例: u7）
+        """
+        if all_tenants:
+            return self.with_tenant_shards()
+        if tenant:
+            return [self.for_tenant(tenant)]
+        return [self]
+
+    def _open_chroma(self, collection_name: str, model: str = None):
+        embeddings = OpenAIEmbeddings(model=model) if model else OpenAIEmbeddings()
+        return Chroma(
+            client=self.client,
+            collection_name=collection_name,
+            embedding_function=InstrumentedEmbeddings(embeddings)
+        )
+
+    def _apply_migration_state(self):
+        """
+        移行状態に合わせて読み出し先（self.db）と dual-write 先（self.shadow_db）を開く
+
+        新しいオブジェクトを作り終えてから代入するため、切り替え中の検索も
+        どちらか一方のコレクションを一貫して使う。
+        """
+        path = self.migration_state_path
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        state = MigrationState.load(path) if mtime is not None else None
+        if state is not None and state.switched:
+            db = self._open_chroma(state.target_collection, state.target_model)
+            shadow = None
+        elif state is not None:
+            # 移行元は2回目以降の移行では前回の移行先（source_model はそのモデル）
+            db = self._open_chroma(state.source_collection, state.source_model or None)
+            shadow = (self._open_chroma(state.target_collection, state.target_model)
+                      if state.migrating else None)
+        else:
+            db = self._open_chroma(self.collection_name)
+            shadow = None
+        self._handles = (db, shadow)
+        self.migration_state = state
+        self._migration_mtime = mtime
+        logger.info("ChromaDBコレクションを初期化: %s%s", db._collection.name,
+                    f"（dual-write: {shadow._collection.name}）" if shadow is not None else "")
+
+    def refresh_migration_state(self, interval: float = 5.0):
+        """状態ファイルが更新されていれば読み出し先を切り替える（確認は interval 秒に1回）"""
+        now = time.monotonic()
+        if now - self._migration_checked < interval:
+            return
+        with self._lock:
+            if now - self._migration_checked < interval:
+                return  # 待っている間に別のスレッドが確認した
+            self._migration_checked = now
+            path = self.migration_state_path
+            mtime = os.path.getmtime(path) if os.path.exists(path) else None
+            if mtime != self._migration_mtime:
+                self._apply_migration_state()
+
+    @property
+    def db(self):
+        """読み出し先の Chroma（langchain）"""
+        return self._handles[0]
+
+    @property
+    def shadow_db(self):
+        """移行中の dual-write 先（移行中でなければ None）"""
+        return self._handles[1]
+
+    def _mirror(self, method: str, shadow=None, **kwargs):
+        """
+        移行中は移行先コレクションにも同じ変更を加える（失敗しても移行の突き合わせで補う）
+
+        Args:
+            shadow: 処理の開始時に読んだ dual-write 先（省略時は現在の shadow_db）
+        """
+        shadow = shadow if shadow is not None else self.shadow_db
+        if shadow is None:
+            return
+        try:
+            getattr(shadow._collection, method)(**kwargs)
+        except Exception as e:
+            logger.warning("移行先コレクションへの%sに失敗: %s", method, e)
+
+    @property
+    def collection(self):
+        """下層の chromadb Collection（メタデータのみの一括更新などに使用）"""
+        return self.db._collection
+
+    @tracing.traced("db.save_conversation")
     def save_conversation(self, message: str, response: str) -> bool:
         """
         会話を保存する
@@ -95,42 +316,48 @@ class ConversationDBManager:
         try:
             # メッセージと応答を結合
             conversation_text = f"User: {message}\nAI: {response}"
-            logger.info(f"会話の保存を開始します。テキスト長: {len(conversation_text)}")
-            logger.debug(f"会話内容:\n{conversation_text[:200]}...")  # 最初の200文字をログ
+            logger.debug("会話の保存を開始します。テキスト長: %d", len(conversation_text))
             
             # プライバシーレベルの分析
             try:
                 privacy_level = self.privacy_analyzer.analyze_privacy_level(conversation_text)
-                logger.info(f"プライバシーレベル: {privacy_level}")
+                logger.debug("プライバシーレベル: %s", privacy_level)
             except Exception as e:
                 logger.error(f"プライバシー分析でエラー: {str(e)}")
                 privacy_level = "low"  # デフォルト値を設定
             
-            # Chromaへの保存処理
+            self.refresh_migration_state()
+            # 処理中に移行の切り替えがあっても、同じ組の読み出し先・dual-write 先に書く
+            db, shadow = self._handles
+            doc_id = str(uuid.uuid4())
+
+            # ほぼ重複した会話の判定（core.dedup）。判定と索引への登録を1つのロックで行い、
+            # 同じ内容の同時保存は先着の1件だけを新規保存にする（後着は先着の保存を待って統合）
+            signature = None
+            if self.dedup_index.enabled:
+                with metrics.stage_timer("dedup"):
+                    self._ensure_dedup_index()
+                    signature = self.dedup_index.signature(conversation_text)
+                while True:
+                    duplicate = self._claim(doc_id, signature)
+                    if duplicate is None:
+                        break  # この保存が先着（索引に登録済み）
+                    merged = self._merge_duplicate(*duplicate)
+                    if merged:
+                        self.invalidate_search_cache()
+                        return True
+                    if merged is None:
+                        break  # 先着の保存が終わらないため、統合せず新規に保存する
+                    # 先着の保存が失敗した・既存側が削除済みだったため、判定し直す
+
+            saved = False
             try:
-                logger.debug("Chromaへの保存を開始")
-                self.db.add_texts(
-                    texts=[conversation_text],
-                    metadatas=[{
-                        "privacy_level": privacy_level,
-                        "timestamp": datetime.now().isoformat(),
-                        "message_length": len(message),
-                        "response_length": len(response)
-                    }]
-                )
-                # 永続化は自動で行われるため、manual persist() 呼び出しを削除しました
-                logger.info("会話の保存に成功しました")
-                return True
-                
-            except ImportError as e:
-                logger.error(f"必要なパッケージが不足しています: {str(e)}")
-                logger.error("pip install tiktokenを実行してください")
-                return False
-            except Exception as e:
-                logger.error(f"Chromaへの保存中にエラーが発生: {str(e)}")
-                logger.error(f"エラーの詳細: {type(e).__name__}")
-                logger.error(f"エラーのトレースバック:\n{traceback.format_exc()}")
-                return False
+                saved = self._store(db, shadow, doc_id, conversation_text, message, response,
+                                    privacy_level, signature)
+                return saved
+            finally:
+                if signature is not None:
+                    self._release_claim(doc_id, saved)
                 
         except Exception as e:
             logger.error(f"会話の保存処理中に予期せぬエラーが発生: {str(e)}")
@@ -138,6 +365,169 @@ class ConversationDBManager:
             logger.error(f"エラーのトレースバック:\n{traceback.format_exc()}")
             return False
 
+    def _store(self, db, shadow, doc_id: str, conversation_text: str, message: str,
+               response: str, privacy_level: str, signature) -> bool:
+        """会話を Chroma に保存する（会話数の上限を超える場合は保存しない）"""
+        if not self._reserve_quota(db._collection):
+            TENANT_QUOTA_REJECTED.inc()
+            logger.warning("会話数の上限（%d件）に達しているため保存しません: %s",
+                           self.max_conversations, self.collection_name)
+            return False
+
+        # Chromaへの保存処理
+        try:
+            logger.debug("Chromaへの保存を開始")
+            now = datetime.now()
+            metadata = {
+                "privacy_level": privacy_level,
+                "timestamp": now.isoformat(),
+                # 保持期間の判定用（Chroma の where で範囲比較できる数値）
+                "timestamp_epoch": now.timestamp(),
+                "message_length": len(message),
+                "response_length": len(response),
+                "tokens": count_tokens([conversation_text])
+            }
+            if signature is not None:
+                metadata["minhash"] = encode_signature(signature)
+            with tracing.start_span("chroma.add_texts"), metrics.stage_timer("save"):
+                ids = db.add_texts(
+                    texts=[conversation_text],
+                    metadatas=[metadata],
+                    ids=[doc_id]
+                )
+            if shadow is not None and ids:
+                with tracing.start_span("chroma.add_texts.shadow"):
+                    try:
+                        shadow.add_texts(texts=[conversation_text],
+                                         metadatas=[metadata], ids=ids)
+                    except Exception as e:
+                        logger.warning("移行先コレクションへの保存に失敗: %s", e)
+            # 永続化は自動で行われるため、manual persist() 呼び出しを削除しました
+            self._record_stats([metadata])
+            generation = self.invalidate_search_cache()
+            self._history.append(self.search_scope, generation, {
+                "id": doc_id, "text": conversation_text, "metadata": metadata})
+            logger.debug("会話の保存に成功しました")
+            return True
+
+        except ImportError as e:
+            logger.error(f"必要なパッケージが不足しています: {str(e)}")
+            logger.error("pip install tiktokenを実行してください")
+            return False
+        except Exception as e:
+            logger.error(f"Chromaへの保存中にエラーが発生: {str(e)}")
+            logger.error(f"エラーの詳細: {type(e).__name__}")
+            logger.error(f"エラーのトレースバック:\n{traceback.format_exc()}")
+            return False
+        finally:
+            self._release_quota()
+
+    def _claim(self, doc_id: str, signature):
+        """
+        重複がなければ doc_id を索引に登録し、保存中として記録する
+
+        保存中の記録は索引への登録より先に行うため、後着の保存が索引で doc_id を見つけた
+        時点で必ず待つことができる。
+
+        Returns:
+            重複があればその (id, 類似度)、なければ None（保存後に _release_claim() を呼ぶ）
+        """
+        with self._inflight_lock:
+            self._inflight[doc_id] = threading.Event()
+        duplicate = self.dedup_index.find_or_add(doc_id, signature)
+        if duplicate is not None:
+            with self._inflight_lock:
+                self._inflight.pop(doc_id, None)
+        return duplicate
+
+    def _release_claim(self, doc_id: str, saved: bool):
+        """保存の完了を記録し、待っている後着の保存を起こす（失敗時は索引から外す）"""
+        if not saved:
+            self.dedup_index.remove(doc_id)
+        with self._inflight_lock:
+            event = self._inflight.pop(doc_id, None)
+        if event is not None:
+            event.set()
+
+    def _reserve_quota(self, collection) -> bool:
+        """会話数の上限に空きがあれば1件分を確保する（保存後に _release_quota() で戻す）"""
+        if not self.max_conversations:
+            return True
+        with self._quota_lock:
+            if collection.count() + self._pending_saves >= self.max_conversations:
+                return False
+            self._pending_saves += 1
+            return True
+
+    def _release_quota(self):
+        if not self.max_conversations:
+            return
+        with self._quota_lock:
+            self._pending_saves -= 1
+
+    def _ensure_dedup_index(self):
+        """重複判定用の索引を保存済みの会話から作る（初回のみ。同時に呼ばれても1回だけ読む）"""
+        if self.dedup_index.loaded:
+            return
+        with self._lock:
+            if self.dedup_index.loaded:
+                return
+            with tracing.start_span("dedup.load_index"):
+                self.dedup_index.load(self.iter_conversations())
+        logger.info("重複判定の索引を作成しました: %d件", len(self.dedup_index.lsh))
+
+    def _merge_duplicate(self, doc_id: str, similarity: float) -> Optional[bool]:
+        """
+        ほぼ重複した会話を新規保存せず、既存の会話に統合する
+
+        merge モードでは既存側の duplicate_count と last_seen を更新する。
+
+        Returns:
+            統合した場合 True（既存側の保存が失敗した・削除済みで、判定し直す場合 False。
+            既存側の保存が DEDUP_WAIT_SECONDS 以内に終わらず、新規に保存する場合 None）
+        """
+        # 既存側がまだ保存中（同じ内容の同時保存）なら、保存が終わるのを待つ
+        with self._inflight_lock:
+            pending = self._inflight.get(doc_id)
+        if pending is not None and not pending.wait(DEDUP_WAIT_SECONDS):
+            # 統合先が保存されるとは限らないため、統合済みとはせず新規の会話として保存させる
+            logger.warning("重複した会話の保存が終わらないため新規に保存します: id=%s", doc_id)
+            return None
+        if doc_id not in self.dedup_index:
+            return False  # 先着の保存が失敗して索引から外れた
+        if self.dedup_index.mode != "merge":
+            DEDUP_TOTAL.inc(mode=self.dedup_index.mode)
+            logger.debug("重複した会話を破棄: id=%s 類似度=%.2f", doc_id, similarity)
+            return True
+        # 読み出し→加算→更新の間に同じ会話への統合が割り込むと件数が失われるため直列化する
+        with self._merge_lock:
+            existing = self.collection.get(ids=[doc_id], include=["metadatas"])
+            if not existing["ids"]:
+                # 保存は完了しているのに存在しない＝別のプロセスで削除済み。
+                # 索引にだけ残っていたため外して、判定し直しに任せる
+                self.dedup_index.remove(doc_id)
+                return False
+            DEDUP_TOTAL.inc(mode=self.dedup_index.mode)
+            logger.debug("重複した会話を統合: id=%s 類似度=%.2f", doc_id, similarity)
+            metadata = dict(existing["metadatas"][0] or {})
+            metadata["duplicate_count"] = int(metadata.get("duplicate_count", 1)) + 1
+            metadata["last_seen"] = datetime.now().isoformat()
+            self.collection.update(ids=[doc_id], metadatas=[metadata])
+            self._mirror("update", ids=[doc_id], metadatas=[metadata])
+        return True
+
+    def iter_conversations(self, page_size: int = 1000):
+        """保存済みの文書を (id, テキスト, メタデータ) で順に返す（ページ単位で読み出す）"""
+        offset = 0
+        while True:
+            page = self.collection.get(limit=page_size, offset=offset,
+                                       include=["documents", "metadatas"])
+            if not page["ids"]:
+                return
+            yield from zip(page["ids"], page["documents"], page["metadatas"])
+            offset += len(page["ids"])
+
+    @tracing.traced("db.get_all_conversations")
     def get_all_conversations(self):
         """全ての会話履歴を取得"""
         try:
@@ -163,6 +553,39 @@ class ConversationDBManager:
             logger.error(f"会話履歴の取得に失敗: {e}")
             return []
 
+    @tracing.traced("db.recent_conversations")
+    def recent_conversations(self, limit: int):
+        """
+        プロンプトに入れる直近 limit 件の会話と、会話（ナレッジを除く）の総数を返す
+
+        世代が変わらない間は保持している履歴を返す。読み直す場合もメタデータだけで
+        直近 limit 件を絞り込み、本文はその分だけ読み出す。
+
+        Returns:
+            (List[dict], int): get_all_conversations() 形式の会話と総数
+        """
+        self.refresh_migration_state()
+        scope = self.search_scope
+        # 読み出し前の世代で保持する（読み出し中の保存は次の参照で読み直しになる）
+        generation = default_search_cache().generation(scope)
+        cached = self._history.get(scope, generation, limit)
+        if cached is not None:
+            return cached
+        try:
+            rows = self.collection.get(include=["metadatas"])
+            ids, total = latest_ids(zip(rows["ids"], rows["metadatas"]), limit)
+            conversations = []
+            if ids:
+                found = self.collection.get(ids=ids, include=["documents", "metadatas"])
+                conversations = [{"id": doc_id, "text": text, "metadata": metadata}
+                                 for doc_id, text, metadata in zip(
+                                     found["ids"], found["documents"], found["metadatas"])]
+        except Exception as e:
+            logger.error(f"会話履歴の取得に失敗: {e}")
+            return [], 0
+        self._history.put(scope, generation, limit, conversations, total)
+        return conversations, total
+
     def load_knowledge_base(self, directory_path):
         """
         ドキュメントを読み込んでナレッジベースとして保存
@@ -178,19 +601,60 @@ class ConversationDBManager:
         metadatas = [{"type": "knowledge", "source": doc.metadata["source"]} for doc in texts]
         
         self.db.add_documents(texts, metadatas=metadatas)
+        self.invalidate_search_cache()
         # 永続化は自動で行われるため、manual persist() 呼び出しを削除しました
 
+    @property
+    def search_scope(self) -> str:
+        """検索結果キャッシュの単位（読み出し先のコレクション）"""
+        return f"{self.persist_directory}:{self.db._collection.name}"
+
+    def invalidate_search_cache(self) -> int:
+        """
+        会話の追加・変更・削除後に、このコレクションの検索結果キャッシュを無効にする
+
+        Returns:
+            int: 進めた後の世代（直近の会話履歴の保持にも使う）
+        """
+        return default_search_cache().invalidate(self.search_scope)
+
     def search_conversations(self, query: str, privacy_level: str = None, 
-                           tags: List[str] = None, limit: int = 5):
+                           tags: List[str] = None, limit: int = 5, offset: int = 0):
         """
-        会話履歴を検索
+        会話履歴を検索（同じ条件の検索が実行中ならその結果を共有する）
+
+        結果は core.search_cache に保存し、会話が変わるまで同じ条件の検索や
+        次のページの取得ではベクトル検索を行わない。
         
         Args:
             query: 検索クエリ
             privacy_level: プライバシーレベルでフィルタ
             tags: タグでフィルタ
             limit: 返す結果の数
+            offset: 先頭から読み飛ばす件数（ページ送り）
         """
+        self.refresh_migration_state()
+        cache = default_search_cache()
+        scope = self.search_scope
+        cache_key = singleflight.make_key(
+            singleflight.normalize(query), privacy_level, sorted(tags or [])
+        )
+        need = offset + limit
+        cached = cache.get(scope, cache_key, need)
+        if cached is not None:
+            return cached[offset:need]
+        # 検索前の世代で保存する（検索中に保存があれば、この結果は次の参照で無効になる）
+        generation = cache.generation(scope)
+        fetch_k = max(need, SEARCH_PREFETCH)
+        key = singleflight.make_key(scope, cache_key, fetch_k)
+        results = SEARCH_FLIGHT.do(key, self._search_conversations, query,
+                                   privacy_level, tags, fetch_k)
+        cache.put(scope, cache_key, generation, fetch_k, results)
+        return list(results[offset:need])
+
+    @tracing.traced("db.search_conversations")
+    def _search_conversations(self, query: str, privacy_level: str = None,
+                              tags: List[str] = None, limit: int = 5):
         try:
             # フィルタ条件の構築
             filter_dict = {}
@@ -201,11 +665,13 @@ class ConversationDBManager:
                 filter_dict["$or"] = tag_conditions
             
             # 類似度検索の実行
-            results = self.db.similarity_search_with_score(
-                query,
-                k=limit,
-                filter=filter_dict if filter_dict else None
-            )
+            with tracing.start_span("chroma.similarity_search", {"k": limit}), \
+                    metrics.stage_timer("search"):
+                results = self.db.similarity_search_with_score(
+                    query,
+                    k=limit,
+                    filter=filter_dict if filter_dict else None
+                )
             
             # 結果の整形
             conversations = []
@@ -226,11 +692,13 @@ class ConversationDBManager:
         """
         ナレッジベースから関連情報を検索
         """
-        results = self.db.similarity_search(
-            query,
-            k=k,
-            filter={"type": "knowledge"}
-        )
+        with tracing.start_span("chroma.knowledge_search", {"k": k}), \
+                metrics.stage_timer("knowledge_search"):
+            results = self.db.similarity_search(
+                query,
+                k=k,
+                filter={"type": "knowledge"}
+            )
         return results 
 
     def get_conversations(self, limit=50, offset=0, privacy_level=None, 
@@ -266,10 +734,140 @@ class ConversationDBManager:
         """
         指定されたIDの会話を削除
         """
-        query = "DELETE FROM conversations WHERE id IN ({})".format(
-            ",".join("?" * len(memory_ids))
-        )
-        self.execute_query(query, memory_ids)
+        memory_ids = list(memory_ids)
+        if not memory_ids:
+            return
+        db, shadow = self._handles
+        # 集計から差し引くため、削除前にメタデータだけを読む
+        # （同じ id の同時削除で二重に差し引かないよう、読み出しと削除をまとめて行う）
+        with self._delete_lock:
+            existing = db._collection.get(ids=memory_ids, include=["metadatas"])
+            if existing["ids"]:
+                db._collection.delete(ids=existing["ids"])
+        if existing["ids"]:
+            self._forget(existing["ids"], existing["metadatas"], shadow=shadow)
+
+    def _forget(self, memory_ids, metadatas=None, shadow=None):
+        """
+        削除した会話を重複判定の索引・移行先コレクション・検索結果キャッシュ・集計から外す
+
+        Args:
+            memory_ids: 削除した会話の id
+            metadatas: 削除した会話のメタデータ（集計から差し引く）
+            shadow: 削除時の dual-write 先（省略時は現在の shadow_db）
+        """
+        for memory_id in memory_ids:
+            self.dedup_index.remove(memory_id)
+        self._mirror("delete", shadow=shadow, ids=list(memory_ids))
+        self.invalidate_search_cache()
+        if metadatas:
+            self._record_stats(metadatas, sign=-1)
+
+    def _record_stats(self, metadatas, sign: int = 1):
+        """集計表を更新する（失敗しても保存・削除は成功扱いにし、rebuild で補う）"""
+        try:
+            self.stats.record(self.collection_name, metadatas, sign=sign)
+        except sqlite3.Error as e:
+            logger.warning("会話の集計の更新に失敗: %s", e)
+
+    def memory_stats(self, by_day: int = 30) -> dict:
+        """
+        会話メモリの集計（全件を読み出さずに返す）
+
+        Returns:
+            dict: 集計表の要約に、コレクションの件数（count）・集計とのずれ・
+                  永続化ディレクトリの使用量を加えたもの
+        """
+        summary = self.stats.summary(self.collection_name, by_day=by_day)
+        count = self.collection.count()
+        conversations = summary["conversations"]
+        summary.update({
+            "collection_count": count,
+            # ナレッジベースの文書は集計に含めないため、count 以下なら正常
+            "drift": max(0, conversations - count),
+            "disk_bytes": self.stats.disk_bytes(self.persist_directory),
+        })
+        return summary
+
+    def rebuild_memory_stats(self, page_size: int = 1000) -> int:
+        """コレクションをメタデータのみページ単位で読み直し、集計を作り直す"""
+        def pages():
+            offset = 0
+            while True:
+                page = self.collection.get(limit=page_size, offset=offset, include=["metadatas"])
+                if not page["ids"]:
+                    return
+                yield page
+                offset += len(page["ids"])
+
+        with tracing.start_span("memory_stats.rebuild"):
+            return self.stats.rebuild(self.collection_name, pages())
+
+    def run_embedding_migration(self, max_batches: int = None,
+                                max_seconds: float = None) -> MigrationState:
+        """
+        進行中の埋め込み移行を進める（完了すれば読み出し先を切り替える）
+
+        Raises:
+            MigrationError: 進行中の移行がない場合
+        """
+        self.refresh_migration_state(interval=0)
+        state = self.migration_state
+        shadow = self.shadow_db
+        if state is None or not state.migrating or shadow is None:
+            raise MigrationError("進行中の移行がありません")
+        migration = EmbeddingMigration(
+            self.db._collection, shadow._collection,
+            shadow.embeddings.embed_documents, self.migration_state_path)
+        state = migration.run(max_batches=max_batches, max_seconds=max_seconds)
+        self.refresh_migration_state(interval=0)
+        return state
+
+    def expire_conversations(self, dry_run: bool = False, backfill: bool = False,
+                             archive_dir: str = None) -> SweepResult:
+        """
+        保持ルール（RETENTION_POLICY）に従って期限切れの会話を削除・アーカイブ
+
+        Args:
+            dry_run: 件数の集計のみ行う
+            backfill: 先に timestamp_epoch のない旧データへ値を付与する
+            archive_dir: アーカイブの出力先（既定: ARCHIVE_DIR）
+        """
+        if archive_dir is None and SHARD_SEPARATOR in self.collection_name:
+            # テナントのアーカイブは混ざらないようにコレクションごとに分ける
+            archive_dir = os.path.join(os.getenv("ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR),
+                                       self.collection_name)
+        sweeper = RetentionSweeper(self.collection, archive_dir=archive_dir,
+                                   on_delete=self._forget)
+        if backfill and not dry_run:
+            sweeper.backfill_epochs()
+        return sweeper.sweep(dry_run=dry_run)
+
+    def privacy_backfill(self, checkpoint_path: str = None, **kwargs) -> PrivacyBackfill:
+        """
+        このコレクションの privacy_level を現在のルールで再判定するジョブを作る
+
+        更新は移行中の移行先コレクションにも加える。チェックポイントは既定で
+        <保存先>/privacy_backfill.<読み出し先のコレクション名>.json（処理位置はコレクションの
+        並びの位置のため、移行の切り替え後は新しいコレクションで最初から。旧形式の
+        privacy_backfill.json は共有コレクションのものとして引き継ぐ）。
+
+        Args:
+            checkpoint_path: チェックポイントファイル
+            **kwargs: PrivacyBackfill の page_size / workers / dry_run など
+        """
+        if checkpoint_path is None:
+            checkpoint_path = os.path.join(self.persist_directory,
+                                           f"privacy_backfill.{self.collection.name}.json")
+            legacy = os.path.join(self.persist_directory, "privacy_backfill.json")
+            if SHARD_SEPARATOR not in self.collection_name and os.path.exists(legacy) \
+                    and not os.path.exists(checkpoint_path):
+                os.replace(legacy, checkpoint_path)
+        return PrivacyBackfill(
+            self.collection, checkpoint_path, rules=self.privacy_analyzer.rules,
+            on_update=lambda ids, metadatas: self._mirror("update", ids=ids,
+                                                          metadatas=metadatas),
+            **kwargs)
 
     def get_recent_conversations(self, limit: int = 10, 
                                privacy_level: str = None):
@@ -295,25 +893,22 @@ class ConversationDBManager:
             raise
 
     def verify_memory_persistence(self):
-        """記憶の永続性を確認"""
+        """
+        記憶の永続性を確認（件数と集計表の突き合わせのみで、全件は読み出さない）
+        """
         try:
-            # 保存されている全ての会話を取得
-            results = self.db.get()
-            
-            if not results or not results['ids']:
+            stats = self.memory_stats(by_day=1)
+            count = stats["collection_count"]
+            if not count:
                 logger.warning("保存されている会話が見つかりません")
                 return False
-            
-            logger.info(f"保存されている会話数: {len(results['ids'])}")
-            logger.info("最新の会話:")
-            
-            # 最新の5件を表示
-            for i in range(min(5, len(results['ids']))):
-                logger.info(f"ID: {results['ids'][i]}")
-                logger.info(f"内容: {results['documents'][i][:100]}...")  # 最初の100文字
-                logger.info(f"メタデータ: {results['metadatas'][i]}")
-                logger.info("---")
-            
+
+            logger.info("保存されている会話数: %d（集計: %d件, 推定 %d tokens, %.1f MiB）",
+                        count, stats["conversations"], stats["tokens"],
+                        stats["disk_bytes"] / 2**20)
+            if stats["drift"] or (stats["conversations"] == 0 and count):
+                logger.warning("会話の集計がコレクションと一致しません。"
+                               "manage.py memory_stats --rebuild で作り直してください")
             return True
             
         except Exception as e:
@@ -0,0 +1,304 @@
+"""
+ほぼ重複した会話の検出モジュール
+文字 n-gram の MinHash 署名と LSH（バンド分割）索引で、保存済みの会話と
+ほぼ同じ内容の会話を高速に見つけます。日本語にも対応するため単語ではなく文字単位で扱います。
+
+- 書き込み時: ConversationDBManager.save_conversation が DedupIndex で重複を判定し、
+  閾値（DEDUP_THRESHOLD、既定 0.9）以上なら新規追加せずに既存側へ統合（merge）または破棄（skip）
+- オフライン: plan_dedup() で保存済みデータの重複グループを求め、
+  manage.py dedup_memory で削除・統合と容量・検索結果の多様性の変化を報告
+
+MinHash の各ハッシュは乗算シフト法 ((a*x + b) mod 2^64) >> 32 で計算します。
+"""
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import base64
+import os
+import random
+import struct
+import threading
+import unicodedata
+import zlib
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+DEFAULT_SHINGLE = 3
+DEFAULT_THRESHOLD = 0.9
+
+_MASK64 = (1 << 64) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_text(text: str) -> str:
+    """比較用の正規化（NFKC・小文字化・空白の圧縮）"""
+    return " ".join(unicodedata.normalize("NFKC", text or "").lower().split())
+
+
+def shingles(text: str, size: int = DEFAULT_SHINGLE) -> Set[int]:
+    """正規化したテキストの文字 n-gram を 32bit ハッシュの集合にする"""
+    text = normalize_text(text)
+    if len(text) <= size:
+        return {zlib.crc32(text.encode("utf-8"))} if text else set()
+    return {zlib.crc32(text[i:i + size].encode("utf-8")) for i in range(len(text) - size + 1)}
+
+
+class MinHasher:
+    """
+    MinHash 署名の生成器
+
+    Attributes:
+        num_perm: 署名の長さ（ハッシュ関数の数）
+        shingle_size: n-gram の文字数
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, shingle_size: int = DEFAULT_SHINGLE,
+                 seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._params = [(rng.getrandbits(64) | 1, rng.getrandbits(64)) for _ in range(num_perm)]
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        hashes = shingles(text, self.shingle_size)
+        if not hashes:
+            return (_MAX_HASH,) * self.num_perm
+        return tuple(
+            min(((a * x + b) & _MASK64) for x in hashes) >> 32
+            for a, b in self._params
+        )
+
+    @staticmethod
+    def similarity(a: Sequence[int], b: Sequence[int]) -> float:
+        """署名から推定した Jaccard 類似度"""
+        if not a or len(a) != len(b):
+            return 0.0
+        return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+def encode_signature(signature: Sequence[int]) -> str:
+    """署名をメタデータに保存できる文字列にする"""
+    return base64.b64encode(struct.pack(f"<{len(signature)}I", *signature)).decode("ascii")
+
+
+def decode_signature(value: str) -> Optional[Tuple[int, ...]]:
+    try:
+        raw = base64.b64decode(value, validate=True)
+        return struct.unpack(f"<{len(raw) // 4}I", raw) if raw else None
+    except (ValueError, struct.error, TypeError):
+        return None
+
+
+class LSHIndex:
+    """
+    MinHash 署名のバンド分割 LSH 索引
+
+    署名を bands 個に分け、いずれかのバンドが一致する文書を候補とする。
+    num_perm=64, bands=16（1バンド4行）の場合、類似度 0.5 付近から候補になり始め、
+    0.8 以上はほぼ確実に候補に入る。
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, bands: int = DEFAULT_BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm は bands で割り切れる必要があります")
+        self.rows = num_perm // bands
+        self.bands = bands
+        self._buckets: List[Dict[Tuple[int, ...], Set[str]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[str, Tuple[int, ...]] = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def __contains__(self, key: str):
+        return key in self._signatures
+
+    def _bands(self, signature):
+        for i in range(self.bands):
+            yield i, tuple(signature[i * self.rows:(i + 1) * self.rows])
+
+    def add(self, key: str, signature: Sequence[int]):
+        signature = tuple(signature)
+        self._signatures[key] = signature
+        for i, band in self._bands(signature):
+            self._buckets[i].setdefault(band, set()).add(key)
+
+    def remove(self, key: str):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for i, band in self._bands(signature):
+            bucket = self._buckets[i].get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[i][band]
+
+    def signature(self, key: str) -> Optional[Tuple[int, ...]]:
+        return self._signatures.get(key)
+
+    def query(self, signature: Sequence[int], threshold: float = 0.0) -> List[Tuple[str, float]]:
+        """類似度が threshold 以上の候補を (キー, 類似度) の降順で返す"""
+        candidates: Set[str] = set()
+        for i, band in self._bands(signature):
+            candidates |= self._buckets[i].get(band, set())
+        scored = [(key, MinHasher.similarity(signature, self._signatures[key]))
+                  for key in candidates]
+        return sorted((item for item in scored if item[1] >= threshold),
+                      key=lambda item: (-item[1], item[0]))
+
+
+class DedupIndex:
+    """
+    書き込み時の重複判定に使うスレッドセーフな索引
+
+    Attributes:
+        threshold: 重複とみなす推定類似度（0 以下なら判定しない）
+        mode: "merge"（既存側の件数を増やす）/ "skip"（破棄のみ）/ "off"
+    """
+
+    def __init__(self, threshold: Optional[float] = None, mode: Optional[str] = None,
+                 hasher: Optional[MinHasher] = None):
+        self.threshold = (float(os.getenv("DEDUP_THRESHOLD", DEFAULT_THRESHOLD))
+                          if threshold is None else threshold)
+        self.mode = (mode or os.getenv("DEDUP_MODE", "merge")).lower()
+        self.hasher = hasher or MinHasher()
+        self.lsh = LSHIndex(self.hasher.num_perm)
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off" and self.threshold > 0
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        return self.hasher.signature(text)
+
+    def load(self, rows: Iterable[Tuple[str, str, Optional[dict]]]):
+        """保存済みの (id, テキスト, メタデータ) から索引を作る（minhash メタデータがあれば再計算しない）"""
+        with self._lock:
+            for doc_id, text, metadata in rows:
+                metadata = metadata or {}
+                if metadata.get("type") == "knowledge":
+                    continue
+                signature = decode_signature(metadata.get("minhash", "")) if metadata.get("minhash") else None
+                if signature is None or len(signature) != self.hasher.num_perm:
+                    signature = self.hasher.signature(text)
+                self.lsh.add(doc_id, signature)
+            self.loaded = True
+
+    def find(self, signature: Sequence[int]) -> Optional[Tuple[str, float]]:
+        """閾値以上で最も近い保存済み文書を返す"""
+        with self._lock:
+            matches = self.lsh.query(signature, self.threshold)
+        return matches[0] if matches else None
+
+    def add(self, doc_id: str, signature: Sequence[int]):
+        with self._lock:
+            self.lsh.add(doc_id, signature)
+
+    def find_or_add(self, doc_id: str, signature: Sequence[int]) -> Optional[Tuple[str, float]]:
+        """
+        重複があれば返し、なければ doc_id で索引に登録する（判定と登録を1つのロックで行う）
+
+        同じ内容の会話が同時に保存されても、先に登録した1件だけが新規保存になる。
+        保存に失敗した場合は remove(doc_id) で登録を取り消すこと。
+        """
+        with self._lock:
+            matches = self.lsh.query(signature, self.threshold)
+            if matches:
+                return matches[0]
+            self.lsh.add(doc_id, signature)
+        return None
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            self.lsh.remove(doc_id)
+
+    def __contains__(self, doc_id: str):
+        with self._lock:
+            return doc_id in self.lsh
+
+    def reset(self):
+        """索引を破棄する（次回の保存時に load() し直す）"""
+        with self._lock:
+            self.lsh = LSHIndex(self.hasher.num_perm)
+            self.loaded = False
+
+
+# --- オフラインの重複除去 ---
+@dataclass
+class DedupPlan:
+    """重複除去の計画と容量の変化"""
+    scanned: int = 0
+    groups: Dict[str, List[str]] = field(default_factory=dict)  # 残す id → 削除する id
+    bytes_before: int = 0
+    bytes_removed: int = 0
+
+    @property
+    def removed_ids(self) -> List[str]:
+        return [doc_id for dups in self.groups.values() for doc_id in dups]
+
+    def report(self) -> dict:
+        removed = len(self.removed_ids)
+        return {
+            "scanned": self.scanned,
+            "duplicate_groups": len(self.groups),
+            "removed": removed,
+            "remaining": self.scanned - removed,
+            "removed_ratio": round(removed / self.scanned, 4) if self.scanned else 0.0,
+            "bytes_before": self.bytes_before,
+            "bytes_after": self.bytes_before - self.bytes_removed,
+        }
+
+
+def plan_dedup(rows: Iterable[Tuple[str, str, Optional[dict]]],
+               threshold: float = DEFAULT_THRESHOLD,
+               hasher: Optional[MinHasher] = None) -> Tuple[DedupPlan, LSHIndex]:
+    """
+    保存済みの (id, テキスト, メタデータ) から重複グループを求める
+
+    timestamp の古い順に処理し、既に残すと決めた文書に閾値以上で似ているものを
+    その文書の重複とする（最初に保存された会話が残る）。
+
+    Returns:
+        (計画, 全文書の署名を持つ LSH 索引)
+    """
+    hasher = hasher or MinHasher()
+    rows = sorted(((doc_id, text, metadata or {}) for doc_id, text, metadata in rows
+                   if (metadata or {}).get("type") != "knowledge"),
+                  key=lambda row: (str(row[2].get("timestamp", "")), row[0]))
+    plan = DedupPlan()
+    keepers = LSHIndex(hasher.num_perm)
+    everything = LSHIndex(hasher.num_perm)
+    for doc_id, text, metadata in rows:
+        size = len((text or "").encode("utf-8"))
+        plan.scanned += 1
+        plan.bytes_before += size
+        signature = decode_signature(metadata.get("minhash", "")) if metadata.get("minhash") else None
+        if signature is None or len(signature) != hasher.num_perm:
+            signature = hasher.signature(text)
+        everything.add(doc_id, signature)
+        matches = keepers.query(signature, threshold)
+        if matches:
+            plan.groups.setdefault(matches[0][0], []).append(doc_id)
+            plan.bytes_removed += size
+        else:
+            keepers.add(doc_id, signature)
+    return plan, everything
+
+
+def distinct_ratio(result_ids: Sequence[str], index: LSHIndex,
+                   threshold: float = DEFAULT_THRESHOLD) -> float:
+    """
+    検索結果のうち、互いにほぼ重複していない結果の割合（検索結果の多様性の指標）
+    """
+    if not result_ids:
+        return 1.0
+    kept: List[Tuple[int, ...]] = []
+    for doc_id in result_ids:
+        signature = index.signature(doc_id)
+        if signature is None:
+            continue
+        if all(MinHasher.similarity(signature, other) < threshold for other in kept):
+            kept.append(signature)
+    known = sum(1 for doc_id in result_ids if index.signature(doc_id) is not None)
+    return len(kept) / known if known else 1.0
@@ -0,0 +1,322 @@
+"""
+埋め込みモデルのオンライン移行モジュール
+稼働中のまま、会話メモリを新しい埋め込みモデルのコレクションへ移します。
+
+1. start_migration(): 移行先コレクション（<元の名前>__<モデル名>）を決めて状態ファイルを作る
+2. 移行中（backfilling）: ConversationDBManager は新規保存を両方のコレクションに書き込み
+   （dual-write）、検索は元のコレクションだけを使う
+3. EmbeddingMigration.run(): 既存の会話をバッチ単位で再埋め込みして移行先へ upsert する。
+   速度は EMBEDDING_MIGRATION_RATE（件/秒、既定 20）で制限し、検索用の API 枠を圧迫しない
+4. 全件を読み終えたら id の突き合わせで取りこぼし（dual-write の失敗など）を補い、
+   網羅率が 100% になった時点で状態ファイルを switched に置き換える（os.replace で原子的）
+5. 各プロセスの ConversationDBManager は状態ファイルの変化を検知して読み出し先を切り替える
+
+状態ファイルはコレクションごと（<CHROMA_DB_DIR>/embedding_migration.<コレクション名>.json）で、
+テナントのシャードもそれぞれ独立に移行できます。進捗と、推定トークン数・費用
+（EMBEDDING_PRICE_PER_1K、1000トークンあたりのドル）も記録します。
+"""
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Callable, List, Optional
+import json
+import logging
+import os
+import re
+import time
+
+from core import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+# 旧形式（全コレクションで共有していた）状態ファイル。見つかれば該当コレクションに引き継ぐ
+STATE_FILE = "embedding_migration.json"
+BACKFILLING = "backfilling"
+SWITCHED = "switched"
+ABORTED = "aborted"
+
+MIGRATION_ROWS = metrics.REGISTRY.counter(
+    "embedding_migration_rows_total",
+    "埋め込み移行で処理した会話の件数（result=copied は再埋め込み、skipped は dual-write 済み）",
+    labelnames=("result",),
+)
+MIGRATION_TOKENS = metrics.REGISTRY.counter(
+    "embedding_migration_tokens_total",
+    "埋め込み移行で再埋め込みした推定トークン数",
+)
+MIGRATION_COST = metrics.REGISTRY.counter(
+    "embedding_migration_cost_usd_total",
+    "埋め込み移行の推定費用（ドル）",
+)
+MIGRATION_COVERAGE = metrics.REGISTRY.gauge(
+    "embedding_migration_coverage",
+    "移行先コレクションに移し終えた割合（0〜1）",
+)
+
+
+class MigrationError(RuntimeError):
+    """移行の開始・切り替えができない"""
+
+
+def state_file_name(collection: str) -> str:
+    """コレクションの移行状態ファイル名"""
+    return f"embedding_migration.{collection}.json"
+
+
+def target_collection_name(source: str, model: str) -> str:
+    """移行先のコレクション名（Chroma の名前の制約に合わせて英数字と - _ のみ）"""
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", model).strip("-_")
+    return f"{source}__{slug}"[:63]
+
+
+_encoder = None
+
+
+def count_tokens(texts: List[str]) -> int:
+    """再埋め込みするテキストのトークン数（tiktoken が無ければ文字数からの概算）"""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoder = False
+    if _encoder:
+        return sum(len(_encoder.encode(text or "")) for text in texts)
+    return sum(len(text or "") // 2 + 1 for text in texts)
+
+
+@dataclass
+class MigrationState:
+    """移行の状態（状態ファイルとして保存される）"""
+    source_collection: str
+    target_collection: str
+    target_model: str
+    source_model: str = ""
+    phase: str = BACKFILLING
+    offset: int = 0
+    copied: int = 0
+    skipped: int = 0
+    source_count: int = 0
+    tokens: int = 0
+    cost_usd: float = 0.0
+    started_at: str = ""
+    updated_at: str = ""
+    switched_at: str = ""
+
+    @property
+    def migrating(self) -> bool:
+        """dual-write が必要な状態か"""
+        return self.phase == BACKFILLING
+
+    @property
+    def switched(self) -> bool:
+        return self.phase == SWITCHED
+
+    @property
+    def coverage(self) -> float:
+        if self.switched:
+            return 1.0
+        if not self.source_count:
+            return 0.0
+        return min(1.0, (self.copied + self.skipped) / self.source_count)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["MigrationState"]:
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    def save(self, path: str):
+        self.updated_at = datetime.now().isoformat()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+
+def start_migration(state_path: str, source_collection: str, target_model: str,
+                    source_model: str = "", target_collection: Optional[str] = None
+                    ) -> MigrationState:
+    """
+    移行を開始する（状態ファイルを作る）
+
+    以前の移行の記録がある場合、移行元は現在の読み出し先になる（切り替え済みなら
+    その移行先、中止済みならその移行元）。切り替え後に保存された会話を失わないよう、
+    引数の source_collection より優先する。
+
+    Raises:
+        MigrationError: 別の移行が進行中の場合・移行先が現在の読み出し先と同じ場合
+    """
+    current = MigrationState.load(state_path)
+    if current is not None and current.migrating:
+        raise MigrationError(
+            f"移行が進行中です: {current.source_collection} → {current.target_collection}")
+    if current is not None and current.switched:
+        source_collection, source_model = current.target_collection, current.target_model
+    elif current is not None:
+        source_collection, source_model = current.source_collection, current.source_model
+    target_collection = target_collection or target_collection_name(source_collection, target_model)
+    if target_collection == source_collection:
+        raise MigrationError(f"すでに {target_model} のコレクションを使っています: {source_collection}")
+    state = MigrationState(
+        source_collection=source_collection,
+        target_collection=target_collection,
+        target_model=target_model,
+        source_model=source_model,
+        started_at=datetime.now().isoformat(),
+    )
+    state.save(state_path)
+    logger.info("埋め込みの移行を開始: %s → %s (%s)",
+                state.source_collection, state.target_collection, target_model)
+    return state
+
+
+def abort_migration(state_path: str) -> Optional[MigrationState]:
+    """進行中の移行を中止する（dual-write を止める。移行先コレクションは残る）"""
+    state = MigrationState.load(state_path)
+    if state is not None and state.migrating:
+        state.phase = ABORTED
+        state.save(state_path)
+    return state
+
+
+class EmbeddingMigration:
+    """
+    既存の会話を新しい埋め込みで移行先コレクションへコピーするジョブ
+
+    Attributes:
+        source: 元の chromadb Collection（get / count を持つオブジェクト）
+        target: 移行先の chromadb Collection（get / upsert を持つオブジェクト）
+        embed: 新しいモデルの埋め込み関数（テキストのリスト → ベクトルのリスト）
+        state_path: 状態ファイル
+    """
+
+    def __init__(self, source, target, embed: Callable[[List[str]], List[List[float]]],
+                 state_path: str, batch_size: int = 100,
+                 max_rows_per_sec: Optional[float] = None,
+                 price_per_1k: Optional[float] = None,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.source = source
+        self.target = target
+        self.embed = embed
+        self.state_path = state_path
+        self.batch_size = batch_size
+        self.max_rows_per_sec = (float(os.getenv("EMBEDDING_MIGRATION_RATE", "20"))
+                                 if max_rows_per_sec is None else max_rows_per_sec)
+        self.price_per_1k = (float(os.getenv("EMBEDDING_PRICE_PER_1K", "0"))
+                             if price_per_1k is None else price_per_1k)
+        self.sleep = sleep
+
+    def _load(self) -> MigrationState:
+        state = MigrationState.load(self.state_path)
+        if state is None or not state.migrating:
+            raise MigrationError("進行中の移行がありません")
+        return state
+
+    def _copy(self, state: MigrationState, ids: List[str], documents: List[str],
+              metadatas: List[dict]) -> int:
+        """移行先にない会話だけを再埋め込みして upsert する"""
+        existing = set(self.target.get(ids=list(ids), include=[])["ids"])
+        rows = [(i, d, m) for i, d, m in zip(ids, documents, metadatas) if i not in existing]
+        state.skipped += len(ids) - len(rows)
+        MIGRATION_ROWS.inc(len(ids) - len(rows), result="skipped")
+        if not rows:
+            return 0
+        texts = [d for _, d, _ in rows]
+        with tracing.start_span("embedding_migration.batch", {"rows": len(rows)}):
+            embeddings = self.embed(texts)
+            self.target.upsert(ids=[i for i, _, _ in rows], documents=texts,
+                               metadatas=[m or None for _, _, m in rows], embeddings=embeddings)
+        tokens = count_tokens(texts)
+        cost = tokens / 1000 * self.price_per_1k
+        state.copied += len(rows)
+        state.tokens += tokens
+        state.cost_usd += cost
+        MIGRATION_ROWS.inc(len(rows), result="copied")
+        MIGRATION_TOKENS.inc(tokens)
+        MIGRATION_COST.inc(cost)
+        return len(rows)
+
+    def run_batch(self, state: MigrationState) -> int:
+        """元のコレクションから1バッチ分をコピーする（読み終えていれば 0）"""
+        page = self.source.get(limit=self.batch_size, offset=state.offset,
+                               include=["documents", "metadatas"])
+        if not page["ids"]:
+            return 0
+        self._copy(state, page["ids"], page["documents"], page["metadatas"])
+        state.offset += len(page["ids"])
+        return len(page["ids"])
+
+    def missing_ids(self, page_size: int = 1000) -> List[str]:
+        """元にあって移行先にない id（埋め込みは取得しないため軽い）"""
+        missing = []
+        offset = 0
+        while True:
+            page = self.source.get(limit=page_size, offset=offset, include=[])
+            if not page["ids"]:
+                return missing
+            offset += len(page["ids"])
+            present = set(self.target.get(ids=list(page["ids"]), include=[])["ids"])
+            missing.extend(i for i in page["ids"] if i not in present)
+
+    def _finish(self, state: MigrationState) -> bool:
+        """取りこぼしを補い、網羅率 100% なら読み出し先を切り替える"""
+        missing = self.missing_ids()
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            page = self.source.get(ids=chunk, include=["documents", "metadatas"])
+            self._copy(state, page["ids"], page["documents"], page["metadatas"])
+        if missing and self.missing_ids():
+            return False
+        state.source_count = self.source.count()
+        state.phase = SWITCHED
+        state.switched_at = datetime.now().isoformat()
+        logger.info("埋め込みの移行が完了し、読み出し先を切り替えました: %s (%d件, 推定 %d tokens, $%.4f)",
+                    state.target_collection, state.source_count, state.tokens, state.cost_usd)
+        return True
+
+    def _still_active(self, state: MigrationState) -> bool:
+        """別のプロセスで中止・再開始されていないか"""
+        current = MigrationState.load(self.state_path)
+        return (current is not None and current.migrating
+                and current.target_collection == state.target_collection)
+
+    def run(self, max_batches: Optional[int] = None,
+            max_seconds: Optional[float] = None) -> MigrationState:
+        """
+        移行を進める（進捗は1バッチごとに状態ファイルへ保存）
+
+        Args:
+            max_batches: このバッチ数を処理したら戻る（ジョブを細切れにする）
+            max_seconds: この時間を過ぎたら戻る
+        Returns:
+            MigrationState: 最新の状態（phase が switched なら完了）
+        """
+        state = self._load()
+        started = time.monotonic()
+        batches = 0
+        while True:
+            state.source_count = self.source.count()
+            batch_started = time.monotonic()
+            rows = self.run_batch(state)
+            if not self._still_active(state):
+                logger.warning("移行が中止されたため処理を終了します: %s", state.target_collection)
+                return MigrationState.load(self.state_path) or state
+            if rows == 0:
+                self._finish(state)
+                break
+            batches += 1
+            MIGRATION_COVERAGE.set(state.coverage)
+            state.save(self.state_path)
+            if max_batches is not None and batches >= max_batches:
+                break
+            if max_seconds is not None and time.monotonic() - started >= max_seconds:
+                break
+            if self.max_rows_per_sec > 0:
+                wait = rows / self.max_rows_per_sec - (time.monotonic() - batch_started)
+                if wait > 0:
+                    self.sleep(wait)
+        MIGRATION_COVERAGE.set(state.coverage)
+        state.save(self.state_path)
+        return state
@@ -0,0 +1,99 @@
+"""
+埋め込みモデルのラッパー
+Chroma に渡す埋め込み関数を包み、埋め込み生成の所要時間を
+メトリクスとトレースに記録します。
+同じテキストの埋め込みが生成中の場合は、API を呼ばずにその結果を共有します。
+検索クエリの埋め込みは (モデル, テキスト) ごとに EMBED_QUERY_CACHE_SIZE 件（既定 512）まで
+プロセス内に保持し、同じ検索の繰り返しでは API を呼びません。
+"""
+from collections import OrderedDict
+from typing import List
+import os
+import threading
+
+from core import metrics, singleflight, tracing
+
+EMBEDDING_FLIGHT = singleflight.Group("embedding")
+
+EMBED_QUERY_CACHE = metrics.REGISTRY.counter(
+    "embedding_query_cache_total",
+    "検索クエリの埋め込みキャッシュの参照回数",
+    labelnames=("result",),
+)
+
+
+class _QueryEmbeddingCache:
+    """検索クエリの埋め込みの LRU（モデルをまたいで共有する）"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._entries: "OrderedDict[tuple, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+        EMBED_QUERY_CACHE.inc(result="hit" if vector is not None else "miss")
+        return None if vector is None else list(vector)
+
+    def put(self, key: tuple, vector: List[float]):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._entries[key] = tuple(vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+QUERY_EMBEDDINGS = _QueryEmbeddingCache(int(os.getenv("EMBED_QUERY_CACHE_SIZE", "512")))
+
+
+class InstrumentedEmbeddings:
+    """
+    LangChain の Embeddings 互換ラッパー
+
+    Attributes:
+        base: 実際に埋め込みを生成するオブジェクト（OpenAIEmbeddings など）
+    """
+
+    def __init__(self, base):
+        self.base = base
+
+    def _model(self) -> str:
+        return str(getattr(self.base, "model", "") or type(self.base).__name__)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        key = singleflight.make_key("documents", self._model(), list(texts))
+        return EMBEDDING_FLIGHT.do(key, self._embed_documents, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        cache_key = (self._model(), text)
+        vector = QUERY_EMBEDDINGS.get(cache_key)
+        if vector is not None:
+            return vector
+        key = singleflight.make_key("query", self._model(), text)
+        vector = EMBEDDING_FLIGHT.do(key, self._embed_query, text)
+        QUERY_EMBEDDINGS.put(cache_key, vector)
+        return list(vector)
+
+    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with tracing.start_span("embedding.documents", {"count": len(texts)}), \
+                metrics.stage_timer("embedding"):
+            return self.base.embed_documents(texts)
+
+    def _embed_query(self, text: str) -> List[float]:
+        with tracing.start_span("embedding.query"), metrics.stage_timer("embedding"):
+            return self.base.embed_query(text)
+
+    def __getattr__(self, name):
+        # model 名など、その他の属性は元オブジェクトに委譲
+        if name == "base":
+            raise AttributeError(name)
+        return getattr(self.base, name)
@@ -0,0 +1,177 @@
+"""
+内部IF（InternalIFTask）のメッセージ符号化モジュール
+タスク間メッセージ APIPayload の2種類の表現を提供します。
+
+text:   従来の "@@@MY_AGENT_API_0419@@@,=src..,=dst..,...,=end,@@@" 形式。
+        値にカンマや API_SUFFIX を含むと壊れるため、互換用として残しています。
+binary: 長さプレフィックス付きのバイナリフレーム。任意のバイト列を値に持てます。
+
+バイナリフレームの構造（ビッグエンディアン）:
+    magic(2) version(1) body_len(4) | 各フィールド長 u32 x 6 | フィールド本体（UTF-8）
+フィールドは FIELDS の順に並びます。FrameParser は受信バッファを memoryview で
+切り出して解析するため、フレーム本体のコピーは文字列化の1回だけです。
+"""
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple, Union
+import re
+import struct
+
+
+API_PREFIX = "@@@MY_AGENT_API_0419@@@"
+API_SUFFIX = "@@@"
+
+FIELDS = ("src", "dst", "order", "f", "data", "trace")
+
+MAGIC = b"\xa7\x1f"
+VERSION = 1
+_HEADER = struct.Struct(">2sBI")
+_LENGTHS = struct.Struct(">" + "I" * len(FIELDS))
+HEADER_SIZE = _HEADER.size
+_FRAME_HEADER = struct.Struct(_HEADER.format + "I" * len(FIELDS))
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+_TEXT_RE = re.compile(re.escape(API_PREFIX) + r"(.*?)" + re.escape(API_SUFFIX), re.S)
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+@dataclass
+class APIPayload:
+    src: str
+    dst: str
+    order: str
+    f: str
+    data: str
+    trace: str = ""  # 送信元のトレースコンテキスト (traceparent 形式)
+
+
+class FrameError(ValueError):
+    """バイナリフレームが不正な場合の例外"""
+
+
+# --- text 形式 ---
+def encode_text(payload: APIPayload) -> str:
+    """APIPayload を従来のテキスト形式に変換する（trace は値がある場合のみ付与）"""
+    fields = [
+        API_PREFIX,
+        f"=src{payload.src}", f"=dst{payload.dst}", f"=order{payload.order}",
+        f"=f{payload.f}", f"=data{payload.data}"
+    ]
+    if payload.trace:
+        fields.append(f"=trace{payload.trace}")
+    return ",".join(fields + ["=end", API_SUFFIX])
+
+
+def decode_text(message: str) -> Optional[APIPayload]:
+    """従来のテキスト形式を解析する（マーカーが無ければ None）"""
+    m = _TEXT_RE.search(message)
+    if not m:
+        return None
+    kv = {}
+    for p in m.group(1).split(","):
+        if p.startswith("=src"): kv['src'] = p[4:]
+        elif p.startswith("=dst"): kv['dst'] = p[4:]
+        elif p.startswith("=order"): kv['order'] = p[6:]
+        elif p.startswith("=trace"): kv['trace'] = p[6:]
+        elif p.startswith("=f"): kv['f'] = p[2:]
+        elif p.startswith("=data"): kv['data'] = p[5:]
+    return APIPayload(**kv)
+
+
+# --- binary 形式 ---
+def encode_frame(payload: APIPayload) -> bytes:
+    """APIPayload を1つのバイナリフレームに変換する"""
+    src, dst, order, f, data, trace = (
+        str(v).encode("utf-8") for v in
+        (payload.src, payload.dst, payload.order, payload.f, payload.data, payload.trace))
+    lens = (len(src), len(dst), len(order), len(f), len(data), len(trace))
+    header = _FRAME_HEADER.pack(MAGIC, VERSION, _LENGTHS.size + sum(lens), *lens)
+    return b"".join((header, src, dst, order, f, data, trace))
+
+
+def _decode_body(body: memoryview) -> APIPayload:
+    if len(body) < _LENGTHS.size:
+        raise FrameError(f"フレームがフィールド長の表より短いです: {len(body)}")
+    lengths = _LENGTHS.unpack_from(body)
+    if sum(lengths) + _LENGTHS.size != len(body):
+        raise FrameError("フィールド長がフレーム長と一致しません")
+    values = []
+    pos = _LENGTHS.size
+    try:
+        for length in lengths:
+            values.append(str(body[pos:pos + length], "utf-8"))
+            pos += length
+    except UnicodeDecodeError as e:
+        raise FrameError(f"フィールドが UTF-8 ではありません: {e}") from e
+    return APIPayload(*values)
+
+
+def _frame_length(view: memoryview, offset: int) -> Optional[int]:
+    """offset から始まるフレームの全長（ヘッダ込み）。ヘッダが揃っていなければ None"""
+    if len(view) - offset < HEADER_SIZE:
+        return None
+    magic, version, body_len = _HEADER.unpack_from(view, offset)
+    if magic != MAGIC:
+        raise FrameError("マジックバイトが一致しません")
+    if version != VERSION:
+        raise FrameError(f"未対応のフレームバージョン: {version}")
+    if body_len > MAX_FRAME_SIZE:
+        raise FrameError(f"フレームが大きすぎます: {body_len}")
+    return HEADER_SIZE + body_len
+
+
+def decode_frames(buffer: Buffer) -> Tuple[List[APIPayload], int]:
+    """
+    バッファ先頭から完結しているフレームをすべて解析する
+
+    Args:
+        buffer: 受信済みのバイト列（bytes / bytearray / memoryview）
+    Returns:
+        (解析したペイロード, 消費したバイト数)。末尾の不完全なフレームは残す。
+    """
+    payloads = []
+    offset = 0
+    with memoryview(buffer) as view:
+        while True:
+            total = _frame_length(view, offset)
+            if total is None or len(view) - offset < total:
+                break
+            payloads.append(_decode_body(view[offset + HEADER_SIZE:offset + total]))
+            offset += total
+    return payloads, offset
+
+
+def decode_frame(buffer: Buffer) -> APIPayload:
+    """ちょうど1フレーム分のバイト列を解析する"""
+    payloads, consumed = decode_frames(buffer)
+    if len(payloads) != 1 or consumed != len(buffer):
+        raise FrameError("1フレーム分のデータではありません")
+    return payloads[0]
+
+
+class FrameParser:
+    """
+    ストリームから逐次フレームを取り出すパーサー
+
+    使用例:
+        parser = FrameParser()
+        for payload in parser.feed(chunk):
+            ...
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    @property
+    def pending(self) -> int:
+        """まだフレームになっていない受信済みバイト数"""
+        return len(self._buffer)
+
+    def feed(self, data: Buffer) -> Iterator[APIPayload]:
+        """受信データを追加し、完結したフレームを順に返す"""
+        self._buffer += data
+        payloads, consumed = decode_frames(self._buffer)
+        if consumed:
+            # memoryview を解放した後でないと bytearray は縮められない
+            del self._buffer[:consumed]
+        return iter(payloads)
@@ -0,0 +1,374 @@
+"""
+SQLite を使った永続ジョブキュー
+取り込み・再埋め込み・要約など時間のかかる処理をリクエスト処理から切り離し、
+manage.py run_job_worker で起動したワーカープロセスで実行します。
+外部のブローカー（Redis など）は不要で、Django と同じ db.sqlite3 を使います。
+
+- enqueue: ジョブを登録（優先度は小さいほど先、delay で実行開始を遅らせる）
+- lease:   実行待ちのジョブを1件取り出し、一定時間ワーカーに貸し出す
+           （期限切れのリースは再び取り出し可能になる＝ワーカー異常終了時の回復。
+            max_attempts に達していれば再取得せず failed にする）
+- ack:     成功として完了
+- fail:    失敗。max_attempts まで指数バックオフで再実行し、超えたら failed
+           ack / fail はリース中の同じワーカーのときだけ反映する（リースが切れて
+           他のワーカーに再取得されたジョブの結果を上書きしない）
+- owner:   登録したテナント。状態確認APIは owner が一致するジョブだけを返す
+
+取り出しは BEGIN IMMEDIATE で書き込みロックを取ってから行うため、
+複数プロセスで同じジョブを二重に取り出すことはありません。
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = Path(__file__).resolve().parent.parent / "db.sqlite3"
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+JOBS_TOTAL = metrics.REGISTRY.counter(
+    "job_queue_jobs_total",
+    "ジョブキューの状態遷移の件数",
+    labelnames=("kind", "event"),
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 5,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_at REAL NOT NULL,
+    lease_until REAL,
+    worker TEXT,
+    owner TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chat_jobs_ready ON chat_jobs (status, priority, run_at);
+"""
+
+
+@dataclass
+class Job:
+    """リースされたジョブ"""
+    id: int
+    kind: str
+    payload: dict
+    attempts: int
+    max_attempts: int
+    worker: str = ""
+
+
+class JobQueue:
+    """
+    SQLite ベースのジョブキュー
+
+    Attributes:
+        path: データベースファイル（既定: 環境変数 JOB_QUEUE_DB または db.sqlite3）
+        retry_backoff: 再実行までの基本待ち時間（秒、試行ごとに2倍）
+    """
+
+    def __init__(self, path: Optional[str] = None, retry_backoff: float = 5.0):
+        self.path = str(path or os.getenv("JOB_QUEUE_DB") or DEFAULT_DB_PATH)
+        self.retry_backoff = retry_backoff
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(chat_jobs)")}
+            if "owner" not in columns:  # owner 列の追加前に作られたテーブル
+                conn.execute("ALTER TABLE chat_jobs ADD COLUMN owner TEXT")
+
+    def _connect(self) -> sqlite3.Connection:
+        """スレッドごとに接続を使い回す"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, kind: str, payload: Optional[dict] = None, priority: int = 5,
+                max_attempts: int = 3, delay: float = 0.0, owner: Optional[str] = None) -> int:
+        """
+        ジョブを登録する
+
+        Args:
+            owner: 登録したテナント（get(job_id, owner) で他のテナントから見えなくする）
+
+        Returns:
+            int: ジョブID
+        """
+        now = time.time()
+        cur = self._connect().execute(
+            "INSERT INTO chat_jobs (kind, payload, status, priority, max_attempts, run_at,"
+            " owner, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload or {}, ensure_ascii=False), QUEUED, priority,
+             max_attempts, now + delay, owner, now, now),
+        )
+        JOBS_TOTAL.inc(kind=kind, event="enqueued")
+        return cur.lastrowid
+
+    def lease(self, worker: str, lease_seconds: float = 300.0,
+              kinds: Optional[Iterable[str]] = None) -> Optional[Job]:
+        """
+        実行可能なジョブを1件取り出す（無ければ None）
+
+        Args:
+            worker: ワーカー識別子
+            lease_seconds: この時間内に ack / fail されなければ他のワーカーが再取得できる
+            kinds: 取り出すジョブ種別の限定
+        """
+        now = time.time()
+        sql = ("SELECT id, kind, payload, attempts, max_attempts FROM chat_jobs"
+               " WHERE ((status = ? AND run_at <= ?)"
+               " OR (status = ? AND lease_until < ? AND attempts < max_attempts))")
+        params = [QUEUED, now, LEASED, now]
+        kinds = list(kinds or [])
+        if kinds:
+            sql += f" AND kind IN ({','.join('?' * len(kinds))})"
+            params += kinds
+        sql += " ORDER BY priority, run_at, id LIMIT 1"
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 試行回数の上限に達したままリースが切れたジョブは、再取得せず失敗とする
+            exhausted = conn.execute(
+                "SELECT id, kind FROM chat_jobs"
+                " WHERE status = ? AND lease_until < ? AND attempts >= max_attempts",
+                (LEASED, now),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE chat_jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ?"
+                " WHERE id = ?",
+                [(FAILED, "リースの期限切れ（試行回数の上限に達しました）", now, r["id"])
+                 for r in exhausted],
+            )
+            row = conn.execute(sql, params).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                self._record_exhausted(exhausted)
+                return None
+            conn.execute(
+                "UPDATE chat_jobs SET status = ?, worker = ?, lease_until = ?,"
+                " attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (LEASED, worker, now + lease_seconds, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._record_exhausted(exhausted)
+        JOBS_TOTAL.inc(kind=row["kind"], event="leased")
+        return Job(row["id"], row["kind"], json.loads(row["payload"]),
+                   row["attempts"] + 1, row["max_attempts"], worker)
+
+    @staticmethod
+    def _record_exhausted(rows):
+        for row in rows:
+            JOBS_TOTAL.inc(kind=row["kind"], event="failed")
+            logger.warning("リースが切れたジョブは試行回数の上限のため失敗とします: id=%d kind=%s",
+                           row["id"], row["kind"])
+
+    def extend(self, job_id: int, lease_seconds: float = 300.0):
+        """長時間のジョブでリースを延長する"""
+        now = time.time()
+        self._connect().execute(
+            "UPDATE chat_jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (now + lease_seconds, now, job_id, LEASED),
+        )
+
+    def _finish(self, job: Job, assignments: str, params: tuple) -> bool:
+        """
+        リース中の同じワーカー・同じ試行のときだけ更新する。更新できなければ False
+
+        同じワーカーが期限切れのジョブを再取得した場合も、前の試行の結果は反映しない。
+        """
+        cur = self._connect().execute(
+            f"UPDATE chat_jobs SET {assignments}, lease_until = NULL, updated_at = ?"
+            " WHERE id = ? AND worker = ? AND status = ? AND attempts = ?",
+            (*params, time.time(), job.id, job.worker, LEASED, job.attempts),
+        )
+        if cur.rowcount == 0:
+            JOBS_TOTAL.inc(kind=job.kind, event="stale")
+            logger.warning("リースが切れたジョブの結果は反映しません: id=%d kind=%s worker=%s",
+                           job.id, job.kind, job.worker)
+            return False
+        return True
+
+    def ack(self, job: Job, result=None) -> bool:
+        """
+        ジョブを成功として完了する
+
+        Returns:
+            bool: 反映された場合 True（リースが切れて他のワーカーに移っていた場合は False）
+        """
+        if not self._finish(job, "status = ?, result = ?, error = NULL",
+                            (DONE, json.dumps(result, ensure_ascii=False, default=str))):
+            return False
+        JOBS_TOTAL.inc(kind=job.kind, event="done")
+        return True
+
+    def fail(self, job: Job, error: str) -> bool:
+        """
+        ジョブを失敗として記録する
+
+        Returns:
+            bool: 再実行される場合 True（max_attempts に達した場合や、
+                  リースが切れて他のワーカーに移っていた場合は False）
+        """
+        now = time.time()
+        retry = job.attempts < job.max_attempts
+        if retry:
+            run_at = now + self.retry_backoff * (2 ** (job.attempts - 1))
+            updated = self._finish(job, "status = ?, error = ?, run_at = ?",
+                                   (QUEUED, error, run_at))
+        else:
+            updated = self._finish(job, "status = ?, error = ?", (FAILED, error))
+        if not updated:
+            return False
+        JOBS_TOTAL.inc(kind=job.kind, event="retried" if retry else "failed")
+        return retry
+
+    def get(self, job_id: int, owner: Optional[str] = None) -> Optional[dict]:
+        """
+        ジョブの状態を取得する（状態確認APIから使用）
+
+        Args:
+            owner: 指定した場合、登録したテナントが一致しないジョブは None
+        """
+        sql = ("SELECT id, kind, status, priority, attempts, max_attempts, result, error,"
+               " created_at, updated_at FROM chat_jobs WHERE id = ?")
+        params = [job_id]
+        if owner is not None:
+            sql += " AND owner = ?"
+            params.append(owner)
+        row = self._connect().execute(sql, params).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        """状態ごとのジョブ件数"""
+        rows = self._connect().execute(
+            "SELECT status, COUNT(*) AS n FROM chat_jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def purge(self, older_than: float) -> int:
+        """完了・失敗から older_than 秒以上経過したジョブを削除する"""
+        cur = self._connect().execute(
+            "DELETE FROM chat_jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (DONE, FAILED, time.time() - older_than),
+        )
+        return cur.rowcount
+
+
+# --- ジョブハンドラ ---
+_HANDLERS: Dict[str, Callable[[dict], object]] = {}
+
+
+def register(kind: str):
+    """
+    ジョブ種別のハンドラを登録するデコレータ
+
+    ハンドラは payload(dict) を受け取り、JSON 化可能な結果を返す。
+    例外を送出するとジョブは失敗扱い（再実行対象）になる。
+    """
+    def decorator(func):
+        _HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def handlers() -> Dict[str, Callable[[dict], object]]:
+    return dict(_HANDLERS)
+
+
+class Worker:
+    """
+    ジョブを取り出して実行するワーカー
+
+    Attributes:
+        queue: ジョブキュー
+        kinds: 処理するジョブ種別（None なら登録済みの全種別）
+        poll_interval: ジョブが無いときの待ち時間（秒）
+    """
+
+    def __init__(self, queue: JobQueue, kinds: Optional[Iterable[str]] = None,
+                 poll_interval: float = 1.0, lease_seconds: float = 300.0,
+                 name: Optional[str] = None):
+        self.queue = queue
+        self.kinds = list(kinds) if kinds else None
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.stop_event = threading.Event()
+
+    def run_once(self) -> bool:
+        """ジョブを1件処理する。処理するジョブが無ければ False"""
+        job = self.queue.lease(self.name, self.lease_seconds, self.kinds or list(_HANDLERS))
+        if job is None:
+            return False
+        handler = _HANDLERS.get(job.kind)
+        start = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"未登録のジョブ種別です: {job.kind}")
+            result = handler(job.payload)
+        except Exception as e:
+            retry = self.queue.fail(job, f"{type(e).__name__}: {e}")
+            logger.error("ジョブ失敗: id=%d kind=%s attempt=%d/%d retry=%s: %s",
+                         job.id, job.kind, job.attempts, job.max_attempts, retry, e)
+        else:
+            if self.queue.ack(job, result):
+                logger.info("ジョブ完了: id=%d kind=%s", job.id, job.kind)
+        finally:
+            metrics.observe_stage(f"job:{job.kind}", time.perf_counter() - start)
+        return True
+
+    def run(self, max_jobs: Optional[int] = None, exit_when_idle: bool = False) -> int:
+        """
+        stop_event が立つまでジョブを処理し続ける
+
+        Returns:
+            int: 処理したジョブ数
+        """
+        processed = 0
+        logger.info("ジョブワーカー開始: %s", self.name)
+        while not self.stop_event.is_set():
+            if max_jobs is not None and processed >= max_jobs:
+                break
+            if self.run_once():
+                processed += 1
+            elif exit_when_idle:
+                break
+            else:
+                self.stop_event.wait(self.poll_interval)
+        logger.info("ジョブワーカー終了: %s (%d件)", self.name, processed)
+        return processed
+
+    def stop(self):
+        self.stop_event.set()
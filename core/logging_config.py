@@ -0,0 +1,187 @@
+"""
+ログ設定の一元管理モジュール
+各モジュールが個別にハンドラを追加する代わりに、ルートロガーへ
+QueueHandler を1つだけ登録し、ファイル・コンソールへの書き込みは
+QueueListener のバックグラウンドスレッドで行います。
+これによりリクエスト処理スレッドがディスクI/Oで待たされなくなります。
+
+環境変数:
+    LOG_LEVEL: ルートロガーのレベル（デフォルト INFO）
+    LOG_LEVELS: モジュール別レベル 例 "chat.views=INFO,core.db_manager=WARNING"
+    LOG_FORMAT: text / json（デフォルト text）
+    LOG_DIR: ログ出力先ディレクトリ（デフォルト logs）
+    LOG_DEBUG_SAMPLE_RATE: DEBUGレコードを残す割合 0.0〜1.0（デフォルト 1.0）
+"""
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+from core.tracing import TraceContextFilter
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] [%(name)s] [trace=%(trace_id)s] %(message)s'
+
+_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """ログレコードを1行のJSONとして出力するフォーマッタ"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "trace_id": getattr(record, "trace_id", "-"),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    DEBUGレコードを一定割合だけ通すフィルタ
+
+    INFO以上は常に通す。乱数ではなくカウンタで間引くため、
+    割合が同じなら出力件数は決定的になる。
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = max(0.0, min(1.0, rate))
+        self._interval = int(round(1 / self.rate)) if self.rate > 0 else 0
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        if self._interval == 0:
+            return False
+        return next(self._counter) % self._interval == 0
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    メッセージの整形をリスナースレッドまで遅延させる QueueHandler
+
+    標準の QueueHandler.prepare() は呼び出し側スレッドで format() を実行するため、
+    ここではレコードをそのままキューに積む（同一プロセス内のキューに限る）。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """
+    "module=LEVEL,..." 形式の文字列を {ロガー名: レベル} に変換する
+
+    Args:
+        spec: モジュール別レベル指定
+    Returns:
+        dict: ロガー名とレベル値の対応（不正な項目は無視）
+    """
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = (part.strip() for part in item.split("=", 1))
+        value = logging.getLevelName(level.upper())
+        if name and isinstance(value, int):
+            levels[name] = value
+    return levels
+
+
+def _build_formatter(fmt: str) -> logging.Formatter:
+    if fmt == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+def configure_logging(force: bool = False) -> logging.handlers.QueueListener:
+    """
+    プロセス全体のログ設定を行う（複数回呼ばれても一度だけ適用される）
+
+    Args:
+        force: True の場合は既存のリスナーを停止して再設定する
+    Returns:
+        QueueListener: 起動済みのリスナー
+    """
+    global _listener
+    with _lock:
+        if _listener is not None and not force:
+            return _listener
+        if _listener is not None:
+            _listener.stop()
+
+        log_dir = Path(os.getenv("LOG_DIR", "logs"))
+        log_dir.mkdir(exist_ok=True)
+        formatter = _build_formatter(os.getenv("LOG_FORMAT", "text").lower())
+
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_dir / "app.log",
+            maxBytes=1024*1024,  # 1MB
+            backupCount=5,
+            encoding='utf-8'
+        )
+        file_handler.setFormatter(formatter)
+
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(formatter)
+
+        # エラーのみを日付別ファイルにも出力（旧 ErrorLogger の出力先を維持）
+        error_handler = logging.FileHandler(
+            log_dir / f"error_{datetime.now():%Y%m%d}.log", encoding='utf-8'
+        )
+        error_handler.setLevel(logging.ERROR)
+        error_handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = LazyQueueHandler(log_queue)
+        # trace_id は contextvars 由来のため呼び出し側スレッドで付与する
+        queue_handler.addFilter(TraceContextFilter())
+        try:
+            sample_rate = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+        except ValueError:
+            sample_rate = 1.0
+        queue_handler.addFilter(DebugSamplingFilter(sample_rate))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler):
+                root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").upper()))
+        for name, level in parse_levels(os.getenv("LOG_LEVELS", "")).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(
+            log_queue, file_handler, console_handler, error_handler,
+            respect_handler_level=True
+        )
+        _listener.start()
+        return _listener
+
+
+def shutdown_logging():
+    """リスナーを停止し、キューに残ったレコードを書き出す"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(shutdown_logging)
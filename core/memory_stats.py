@@ -0,0 +1,265 @@
+"""
+会話メモリの集計（件数・トークン数・容量）モジュール
+保存・削除のたびに差分だけを集計表に加え、件数や内訳を得るために
+コレクション全体を読み出さなくて済むようにします。
+
+- 集計表: <CHROMA_DB_DIR>/memory_stats.sqlite3 の (コレクション, privacy_level, 日付) ごとの
+  会話数・推定トークン数・文字数。Web とジョブワーカーなど複数プロセスから加算しても壊れない
+- トークン数は保存時にメタデータ tokens に記録し、削除時はその値を差し引く
+  （tokens のない旧データは本文の文字数から概算）
+- 一括取り込みやプライバシーレベルの再判定など、差分で追えない変更の後は rebuild() で作り直す
+  （メタデータのみをページ単位で読むため、本文や埋め込みは読み出さない）
+- 起動時の確認は collection.count() と集計の合計を比べるだけで、全件を読み出さない
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+STATS_FILE = "memory_stats.sqlite3"
+UNKNOWN = "unknown"
+# 保存時の本文 "User: {message}\nAI: {response}" のうち、発話以外の文字数
+_TEMPLATE_CHARS = len("User: \nAI: ")
+
+MEMORY_CONVERSATIONS = metrics.REGISTRY.gauge(
+    "memory_conversations",
+    "集計表上の保存済み会話数",
+    labelnames=("collection",),
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS memory_stats (
+    collection TEXT NOT NULL,
+    privacy_level TEXT NOT NULL,
+    day TEXT NOT NULL,
+    conversations INTEGER NOT NULL DEFAULT 0,
+    tokens INTEGER NOT NULL DEFAULT 0,
+    characters INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (collection, privacy_level, day)
+);
+CREATE TABLE IF NOT EXISTS memory_stats_meta (
+    collection TEXT PRIMARY KEY,
+    rebuilt_at TEXT,
+    updated_at TEXT
+);
+"""
+
+
+def _day(metadata: dict) -> str:
+    timestamp = metadata.get("timestamp")
+    if isinstance(timestamp, str) and len(timestamp) >= 10:
+        return timestamp[:10]
+    epoch = metadata.get("timestamp_epoch")
+    if isinstance(epoch, (int, float)):
+        return datetime.fromtimestamp(epoch).date().isoformat()
+    return UNKNOWN
+
+
+def contribution(metadata: Optional[dict], document: Optional[str] = None
+                 ) -> Optional[Tuple[str, str, int, int]]:
+    """
+    会話1件が集計に与える値 (privacy_level, 日付, トークン数, 文字数)
+
+    ナレッジベースの文書は会話ではないため None を返す。
+    """
+    metadata = metadata or {}
+    if metadata.get("type") == "knowledge":
+        return None
+    if "message_length" in metadata and "response_length" in metadata:
+        characters = (int(metadata["message_length"]) + int(metadata["response_length"])
+                      + _TEMPLATE_CHARS)
+    else:
+        characters = len(document or "")
+    tokens = metadata.get("tokens")
+    if not isinstance(tokens, (int, float)):
+        # core.embedding_migration.count_tokens の概算と同じ式
+        tokens = characters // 2 + 1
+    return (str(metadata.get("privacy_level") or UNKNOWN), _day(metadata),
+            int(tokens), characters)
+
+
+def disk_usage(directory: str) -> int:
+    """ディレクトリ以下のファイルサイズの合計（バイト）"""
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # 集計中に削除・置き換えられたファイル
+    return total
+
+
+class MemoryStats:
+    """
+    コレクションごとの集計表
+
+    Attributes:
+        path: 集計表の SQLite ファイル
+        disk_ttl: ディスク使用量の再計算間隔（秒）
+    """
+
+    def __init__(self, path: str, disk_ttl: float = 60.0):
+        self.path = path
+        self.disk_ttl = disk_ttl
+        self._local = threading.local()
+        self._disk_cache: Dict[str, Tuple[float, int]] = {}
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _merge(rows: Iterable[Tuple[str, str, int, int]],
+               merged: Optional[Dict[Tuple[str, str], List[int]]] = None):
+        """(privacy_level, 日付) ごとに [件数, トークン数, 文字数] へまとめる"""
+        merged = {} if merged is None else merged
+        for privacy_level, day, tokens, characters in rows:
+            bucket = merged.setdefault((privacy_level, day), [0, 0, 0])
+            bucket[0] += 1
+            bucket[1] += tokens
+            bucket[2] += characters
+        return merged
+
+    def _apply(self, conn, collection: str, merged: Dict[Tuple[str, str], List[int]], sign: int):
+        for (privacy_level, day), (count, tokens, characters) in merged.items():
+            conn.execute(
+                "INSERT INTO memory_stats"
+                " (collection, privacy_level, day, conversations, tokens, characters)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(collection, privacy_level, day) DO UPDATE SET"
+                " conversations = conversations + excluded.conversations,"
+                " tokens = tokens + excluded.tokens,"
+                " characters = characters + excluded.characters",
+                (collection, privacy_level, day, sign * count, sign * tokens, sign * characters))
+        conn.execute("DELETE FROM memory_stats WHERE collection = ? AND conversations <= 0",
+                     (collection,))
+        conn.execute(
+            "INSERT INTO memory_stats_meta (collection, updated_at) VALUES (?, ?)"
+            " ON CONFLICT(collection) DO UPDATE SET updated_at = excluded.updated_at",
+            (collection, datetime.now().isoformat()))
+
+    def record(self, collection: str, metadatas: Iterable[Optional[dict]],
+               documents: Optional[Iterable[Optional[str]]] = None, sign: int = 1):
+        """
+        保存（sign=1）または削除（sign=-1）した会話を集計に反映する
+
+        Args:
+            collection: コレクション名
+            metadatas: 会話のメタデータ
+            documents: 本文（メタデータに文字数がない旧データの概算用）
+        """
+        metadatas = list(metadatas)
+        documents = list(documents) if documents is not None else [None] * len(metadatas)
+        merged = self._merge(c for c in map(contribution, metadatas, documents) if c is not None)
+        if not merged:
+            return
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._apply(conn, collection, merged, sign)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def rebuild(self, collection: str, pages: Iterable[dict]) -> int:
+        """
+        コレクションの集計を作り直す
+
+        Args:
+            pages: collection.get(include=["metadatas"]) の結果を順に返すイテラブル
+        Returns:
+            int: 集計した会話数
+        """
+        # 保持するのは (privacy_level, 日付) ごとの合計のみ（件数によらず小さい）
+        merged: Dict[Tuple[str, str], List[int]] = {}
+        for page in pages:
+            documents = page.get("documents") or [None] * len(page["metadatas"])
+            self._merge((c for c in map(contribution, page["metadatas"], documents)
+                         if c is not None), merged)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM memory_stats WHERE collection = ?", (collection,))
+            self._apply(conn, collection, merged, 1)
+            conn.execute("UPDATE memory_stats_meta SET rebuilt_at = ? WHERE collection = ?",
+                         (datetime.now().isoformat(), collection))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        count = sum(bucket[0] for bucket in merged.values())
+        logger.info("会話の集計を作り直しました: %s (%d件)", collection, count)
+        return count
+
+    def summary(self, collection: str, by_day: int = 30) -> dict:
+        """
+        集計の要約（合計・privacy_level 別・直近 by_day 日の日別）
+        """
+        conn = self._connect()
+        total = conn.execute(
+            "SELECT COALESCE(SUM(conversations), 0), COALESCE(SUM(tokens), 0),"
+            " COALESCE(SUM(characters), 0) FROM memory_stats WHERE collection = ?",
+            (collection,)).fetchone()
+        by_privacy = {
+            level: {"conversations": count, "tokens": tokens}
+            for level, count, tokens in conn.execute(
+                "SELECT privacy_level, SUM(conversations), SUM(tokens) FROM memory_stats"
+                " WHERE collection = ? GROUP BY privacy_level ORDER BY privacy_level",
+                (collection,))
+        }
+        days = conn.execute(
+            "SELECT day, SUM(conversations) FROM memory_stats WHERE collection = ?"
+            " GROUP BY day ORDER BY day DESC LIMIT ?", (collection, by_day)).fetchall()
+        meta = conn.execute(
+            "SELECT rebuilt_at, updated_at FROM memory_stats_meta WHERE collection = ?",
+            (collection,)).fetchone()
+        MEMORY_CONVERSATIONS.set(total[0], collection=collection)
+        return {
+            "collection": collection,
+            "conversations": total[0],
+            "tokens": total[1],
+            "characters": total[2],
+            "by_privacy_level": by_privacy,
+            "by_day": dict(reversed(days)),
+            "rebuilt_at": meta[0] if meta else None,
+            "updated_at": meta[1] if meta else None,
+        }
+
+    def disk_bytes(self, directory: str) -> int:
+        """ディレクトリの使用量（disk_ttl 秒はキャッシュした値を返す）"""
+        now = time.monotonic()
+        cached = self._disk_cache.get(directory)
+        if cached is not None and now - cached[0] < self.disk_ttl:
+            return cached[1]
+        size = disk_usage(directory)
+        self._disk_cache[directory] = (now, size)
+        return size
+
+
+_stores: Dict[str, MemoryStats] = {}
+_stores_lock = threading.Lock()
+
+
+def stats_for(persist_directory: str) -> MemoryStats:
+    """永続化ディレクトリごとの集計表（プロセス内で共有）"""
+    path = os.path.join(persist_directory, STATS_FILE)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = MemoryStats(path)
+        return store
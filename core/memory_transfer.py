@@ -0,0 +1,241 @@
+"""
+会話メモリの一括エクスポート / インポートモジュール
+Chroma コレクションの内容（本文・メタデータ・埋め込み）を core.columnar の
+圧縮カラムナファイルに分割して書き出し、別の環境へ取り込みます。
+data/chroma_db ディレクトリを丸ごとコピーせずに移行・バックアップできます。
+
+出力ディレクトリの構成:
+    manifest.json          件数・埋め込みのモデルと次元数・パート一覧（最後に書くため、無ければ未完了）
+    part-000000.ccol ...   chunk_size 件ずつの列データ（id / document / metadata / embedding）
+
+- エクスポートはページ単位で読み出し、圧縮・書き込みは別スレッドで行う
+  （同時に保持するのは数ページ分のみで、件数によらずメモリ使用量は一定）
+- インポートはパート単位で並列に upsert する。埋め込みがあれば再計算しない
+- 保存済みの埋め込みのモデル・次元数が取り込み先と異なる場合は取り込まない
+  （--reembed で再計算する。異なるモデルのベクトルが混ざると検索が壊れる）
+- upsert のため、途中で失敗しても同じディレクトリから再実行すればよい
+"""
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Callable, List, Optional
+import json
+import logging
+import os
+import time
+
+from core import columnar, metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+FORMAT = "chat-memory-export"
+VERSION = 1
+# chromadb の1回の追加件数の上限（max_batch_size）より小さくしておく
+UPSERT_BATCH = 1000
+
+TRANSFER_ROWS = metrics.REGISTRY.counter(
+    "memory_transfer_rows_total",
+    "エクスポート / インポートした会話の件数",
+    labelnames=("direction",),
+)
+
+
+class TransferError(RuntimeError):
+    """エクスポートデータが不正・未完了"""
+
+
+@dataclass
+class TransferResult:
+    """エクスポート / インポートの結果"""
+    rows: int = 0
+    parts: int = 0
+    bytes: int = 0
+    reembedded: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+@dataclass
+class Manifest:
+    """エクスポートの目録"""
+    collection: str = ""
+    rows: int = 0
+    dim: Optional[int] = None
+    embedding_model: str = ""  # 空なら不明（記録前のエクスポート）
+    parts: List[dict] = field(default_factory=list)
+    created_at: str = ""
+    format: str = FORMAT
+    version: int = VERSION
+
+    @classmethod
+    def load(cls, directory: str) -> "Manifest":
+        path = os.path.join(directory, MANIFEST)
+        if not os.path.exists(path):
+            raise TransferError(f"{path} がありません（エクスポートが完了していない可能性があります）")
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format") != FORMAT or data.get("version") != VERSION:
+            raise TransferError(f"未対応のエクスポート形式です: {data.get('format')} v{data.get('version')}")
+        return cls(**data)
+
+    def save(self, directory: str):
+        path = os.path.join(directory, MANIFEST)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, ensure_ascii=False, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+
+def _flatten(embeddings) -> Optional[array]:
+    """行ごとのベクトルを float32 の1次元配列にする（1件でも欠けていれば None）"""
+    if embeddings is None or any(vec is None for vec in embeddings):
+        return None
+    flat = array("f")
+    for vec in embeddings:
+        flat.extend(map(float, vec))
+    return flat
+
+
+def _collection_dim(collection) -> Optional[int]:
+    """コレクションに保存済みの埋め込みの次元数（空なら None）"""
+    page = collection.get(limit=1, offset=0, include=["embeddings"])
+    embeddings = page.get("embeddings")
+    if not page["ids"] or embeddings is None or embeddings[0] is None:
+        return None
+    return len(embeddings[0])
+
+
+def export_collection(collection, directory: str, chunk_size: int = 5000,
+                      include_embeddings: bool = True, writers: int = 2,
+                      embedding_model: str = "") -> TransferResult:
+    """
+    コレクションの全件をカラムナファイルに書き出す
+
+    Args:
+        collection: chromadb の Collection（get を持つオブジェクト）
+        directory: 出力先ディレクトリ（既存の manifest.json は上書き）
+        chunk_size: 1ファイルあたりの件数
+        include_embeddings: 埋め込みも書き出す（False なら取り込み時に再計算）
+        writers: 圧縮・書き込みを行うスレッド数
+        embedding_model: 埋め込みのモデル名（取り込み時の照合用に manifest に記録する）
+    """
+    started = time.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    manifest = Manifest(collection=str(getattr(collection, "name", "")),
+                        embedding_model=embedding_model if include_embeddings else "",
+                        created_at=datetime.now().isoformat())
+    include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+
+    def write_part(index: int, page: dict) -> dict:
+        name = f"part-{index:06d}{columnar.EXTENSION}"
+        columns = {"id": list(page["ids"]), "document": list(page["documents"]),
+                   "metadata": [metadata or {} for metadata in page["metadatas"]]}
+        vectors = _flatten(page.get("embeddings")) if include_embeddings else None
+        if vectors is not None:
+            columns["embedding"] = vectors
+        size = columnar.write_table(os.path.join(directory, name), columns)
+        return {"file": name, "rows": len(page["ids"]), "bytes": size,
+                "embeddings": vectors is not None}
+
+    with tracing.start_span("memory.export", {"chunk_size": chunk_size}), \
+            ThreadPoolExecutor(max_workers=writers) as pool:
+        pending = []
+        offset = 0
+        while True:
+            page = collection.get(limit=chunk_size, offset=offset, include=include)
+            if not page["ids"]:
+                break
+            if manifest.dim is None and include_embeddings and page.get("embeddings") is not None:
+                first = page["embeddings"][0]
+                manifest.dim = len(first) if first is not None else None
+            pending.append(pool.submit(write_part, len(pending), page))
+            offset += len(page["ids"])
+            # 書き込み待ちのページを writers 個までに抑える（メモリ使用量を一定に保つ）
+            while sum(not f.done() for f in pending) > writers:
+                next(f for f in pending if not f.done()).result()
+        manifest.parts = [f.result() for f in pending]
+
+    manifest.rows = sum(part["rows"] for part in manifest.parts)
+    manifest.save(directory)
+    TRANSFER_ROWS.inc(manifest.rows, direction="export")
+    result = TransferResult(rows=manifest.rows, parts=len(manifest.parts),
+                            bytes=sum(part["bytes"] for part in manifest.parts),
+                            elapsed=time.perf_counter() - started)
+    logger.info("エクスポート完了: %d件 %dファイル %.1f MiB (%.0f rows/sec)",
+                result.rows, result.parts, result.bytes / 2**20, result.rows_per_sec)
+    return result
+
+
+def _check_embeddings(manifest: Manifest, collection, embedding_model: str):
+    """保存済みの埋め込みをそのまま取り込めるか（モデル・次元数が取り込み先と同じか）"""
+    if embedding_model and manifest.embedding_model and embedding_model != manifest.embedding_model:
+        raise TransferError(
+            f"埋め込みのモデルが異なります（エクスポート: {manifest.embedding_model}, "
+            f"取り込み先: {embedding_model}）。--reembed で再計算してください")
+    dim = _collection_dim(collection)
+    if dim is not None and manifest.dim is not None and dim != manifest.dim:
+        raise TransferError(
+            f"埋め込みの次元数が異なります（エクスポート: {manifest.dim}, 取り込み先: {dim}）。"
+            "--reembed で再計算してください")
+
+
+def import_collection(collection, directory: str, workers: int = 4,
+                      embed: Optional[Callable[[List[str]], List[List[float]]]] = None,
+                      reembed: bool = False, batch_size: int = UPSERT_BATCH,
+                      embedding_model: str = "") -> TransferResult:
+    """
+    export_collection() の出力をコレクションに取り込む
+
+    Args:
+        collection: chromadb の Collection（upsert を持つオブジェクト）
+        directory: エクスポートのディレクトリ
+        workers: 並列に取り込むパート数
+        embed: 埋め込みのないパート（または reembed=True）に使う埋め込み関数
+        reembed: 保存済みの埋め込みを使わずに再計算する（埋め込みモデルを変える場合）
+        batch_size: 1回の upsert の件数
+        embedding_model: 取り込み先の埋め込みのモデル名（保存済みの埋め込みとの照合用）
+    Raises:
+        TransferError: manifest がない、埋め込みが必要なのに embed がない、
+            または保存済みの埋め込みのモデル・次元数が取り込み先と異なる場合
+    """
+    started = time.perf_counter()
+    manifest = Manifest.load(directory)
+    if embed is None and (reembed or not all(part["embeddings"] for part in manifest.parts)):
+        raise TransferError("埋め込みのないデータを取り込むには埋め込み関数が必要です")
+    if not reembed and any(part["embeddings"] for part in manifest.parts):
+        _check_embeddings(manifest, collection, embedding_model)
+
+    def load_part(part: dict) -> int:
+        names = ["id", "document", "metadata"]
+        use_vectors = part["embeddings"] and not reembed
+        table = columnar.read_table(os.path.join(directory, part["file"]),
+                                    names + (["embedding"] if use_vectors else []))
+        ids, documents, metadatas = table["id"], table["document"], table["metadata"]
+        vectors = table.get("embedding")
+        dim = len(vectors) // len(ids) if vectors is not None and ids else 0
+        for start in range(0, len(ids), batch_size):
+            end = min(start + batch_size, len(ids))
+            if vectors is not None:
+                embeddings = [vectors[i * dim:(i + 1) * dim].tolist() for i in range(start, end)]
+            else:
+                embeddings = embed(documents[start:end])
+            collection.upsert(ids=ids[start:end], documents=documents[start:end],
+                              metadatas=[metadata or None for metadata in metadatas[start:end]],
+                              embeddings=embeddings)
+        TRANSFER_ROWS.inc(len(ids), direction="import")
+        return 0 if vectors is not None else len(ids)
+
+    with tracing.start_span("memory.import", {"parts": len(manifest.parts), "workers": workers}), \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        reembedded = sum(pool.map(load_part, manifest.parts))
+
+    result = TransferResult(rows=manifest.rows, parts=len(manifest.parts),
+                            bytes=sum(part["bytes"] for part in manifest.parts),
+                            reembedded=reembedded, elapsed=time.perf_counter() - started)
+    logger.info("インポート完了: %d件（再埋め込み %d件）%dファイル (%.0f rows/sec)",
+                result.rows, result.reembedded, result.parts, result.rows_per_sec)
+    return result
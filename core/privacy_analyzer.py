@@ -1,49 +1,291 @@
 """
 プライバシーレベル自動判定モジュール
 会話内容から文脈を理解し、適切なプライバシーレベルを判定します。
+
+全レベルのキーワード（英語・日本語）はトライ構造の1つの正規表現にまとめて
+コンパイルし、テキストを1回走査するだけで照合します。キーワードを追加しても
+走査回数・走査速度はほとんど変わりません。メールアドレスや電話番号などの個人情報は正規表現ルールで
+照合し、トリガー文字列（例: "@"）を含まないテキストでは走査自体を省略します。
+
+Python の re はリテラルのみで構成された正規表現なら高速に走査できますが、文字クラスや
+後読みを含むパターンを同じ選択に混ぜると大幅に遅くなるため、
+キーワードと個人情報パターンは別々にコンパイルしています。
 """
-from typing import List
-import re
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
 import logging
+import os
+import re
 
 logger = logging.getLogger(__name__)
 
+# 判定レベル（強い順）
+LEVELS = ('high', 'medium', 'low')
+_LEVEL_RANK = {level: rank for rank, level in enumerate(LEVELS)}
+_DEFAULT_LEVEL = 'low'
+
+# デフォルトのルールセット
+#   keywords: 英単語は単語境界付き（末尾の s を許容）、日本語などは部分一致で照合
+#   patterns: {ラベル: 正規表現} または
+#             {ラベル: {"pattern": 正規表現, "trigger": 文字列, "prefilter": 正規表現,
+#                       "validate": 検証名}}
+#             正規表現は小文字化したテキストに対して適用される。prefilter を指定すると、
+#             先にその（単純で速い）正規表現で候補の範囲を探し、pattern は候補の中だけで照合する。
+#             validate（VALIDATORS の名前）を指定すると、一致した文字列が検証を通る場合だけ一致とみなす
+DEFAULT_RULES = {
+    'high': {
+        'keywords': ['password', 'secret', 'private', 'confidential',
+                     'パスワード', '暗証番号', '秘密', '機密', '極秘', 'マイナンバー'],
+        'patterns': {
+            # 4-4-4-4 桁（区切りは揃える）・4-6-5 桁（Amex）・区切りなし 13〜19 桁で、Luhn 検査を通るもの。
+            # 後方参照を含む選択は全文字で試すと遅いため、13 文字以上の数字・区切りの並びだけで照合する
+            'credit_card': {
+                'prefilter': r'[0-9][0-9\s-]{11,}[0-9]',
+                'pattern': r'(?:[0-9]{4}([-\s])[0-9]{4}\1[0-9]{4}\1[0-9]{4}'
+                           r'|[0-9]{4}([-\s])[0-9]{6}\2[0-9]{5}|[0-9]{13,19})(?![0-9])',
+                'validate': 'luhn',
+            },
+            'api_key': {'pattern': r'sk-[a-z0-9_-]{16,}', 'trigger': 'sk-'},
+        },
+    },
+    'medium': {
+        'keywords': ['email', 'phone', 'address',
+                     'メールアドレス', '電話番号', '住所', '生年月日'],
+        'patterns': {
+            'email': {'pattern': r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+', 'trigger': '@'},
+            # 先頭をリテラル（0 / +）にして re の前方一致最適化を効かせる
+            'phone': r'0[0-9]{1,4}[-\s]?[0-9]{1,4}[-\s]?[0-9]{3,4}(?![0-9])',
+            'phone_intl': {
+                'pattern': r'\+[0-9]{1,3}[-\s]?[0-9]{1,4}[-\s]?[0-9]{1,4}[-\s]?[0-9]{3,4}(?![0-9])',
+                'trigger': '+',
+            },
+        },
+    },
+    'low': {
+        'keywords': ['name', 'company', 'public', '会社', '公開'],
+        'patterns': {},
+    },
+}
+
+_ASCII_WORD = re.compile(r'[a-z0-9_]', re.ASCII)
+
+
+def luhn_valid(text: str) -> bool:
+    """数字部分が Luhn のチェックディジット検査を通るか（区切り文字は無視）"""
+    digits = [int(c) for c in text if c.isdigit()]
+    if not digits:
+        return False
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        if i % 2:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return total % 10 == 0
+
+
+# パターンの一致に追加で適用する検証（ルールの "validate" で名前を指定）
+VALIDATORS = {
+    'luhn': luhn_valid,
+}
+
+
+def _rank(level: str) -> int:
+    return _LEVEL_RANK.get(level, len(LEVELS))
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """
+    キーワード群を共通接頭辞でまとめたトライ構造の正規表現に変換する
+
+    単純な "a|b|c" の選択はキーワード数に比例して遅くなるが、トライ化すると
+    各位置で1文字ずつ分岐を辿るだけになり、実質的にオートマトンとして動作する。
+    末尾は貪欲な省略可能グループになるため、最長一致が優先される。
+    """
+    root: dict = {}
+    for word in words:
+        node = root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = None
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(node[char]) for char in sorted(k for k in node if k)]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            body = '(?:' + body + ')?'
+        return body
+
+    return build(root)
+
+
+class _PatternRule:
+    """個人情報などの正規表現ルール"""
+    __slots__ = ('level', 'label', 'regex', 'trigger', 'prefilter', 'validate')
+
+    def __init__(self, level: str, label: str, spec):
+        if isinstance(spec, str):
+            spec = {'pattern': spec}
+        self.level = level
+        self.label = f'pii:{label}'
+        self.regex = re.compile(spec['pattern'], re.ASCII)
+        self.trigger = spec.get('trigger')
+        prefilter = spec.get('prefilter')
+        self.prefilter = re.compile(prefilter, re.ASCII) if prefilter else None
+        validate = spec.get('validate')
+        if validate is not None and validate not in VALIDATORS:
+            raise ValueError(f"未対応の検証です: {validate}（ルール {label}）")
+        self.validate = VALIDATORS[validate] if validate else None
+
+    def search(self, lowered: str) -> bool:
+        """左側が英数字に続く一致（長い数字列の途中など）と検証を通らない一致を除外して検索"""
+        if self.trigger and self.trigger not in lowered:
+            return False
+        if self.prefilter is None:
+            return self._search(lowered, 0, len(lowered))
+        return any(self._search(lowered, c.start(), c.end())
+                   for c in self.prefilter.finditer(lowered))
+
+    def _search(self, lowered: str, pos: int, endpos: int) -> bool:
+        while True:
+            m = self.regex.search(lowered, pos, endpos)
+            if m is None:
+                return False
+            start = m.start()
+            if (start == 0 or not (_ASCII_WORD.match(lowered, start - 1)
+                                   and _ASCII_WORD.match(lowered, start))) \
+                    and (self.validate is None or self.validate(m.group())):
+                return True
+            pos = start + 1
+
+
 class PrivacyAnalyzer:
-    def __init__(self):
-        self.privacy_keywords = {
-            'high': ['password', 'secret', 'private', 'confidential'],
-            'medium': ['email', 'phone', 'address'],
-            'low': ['name', 'company', 'public']
-        }
+    """
+    プライバシーレベル判定器
+
+    Attributes:
+        rules: レベルごとのルールセット（DEFAULT_RULES と同じ形式）
+    """
+
+    def __init__(self, rules: Optional[Dict[str, dict]] = None):
+        if rules is None:
+            rules = self._load_rules_from_env() or DEFAULT_RULES
+        self.rules = rules
+        self._keyword_regex, self._keywords = self._compile_keywords(rules)
+        self._patterns = sorted(
+            (_PatternRule(level, label, spec)
+             for level, rule in rules.items()
+             for label, spec in rule.get('patterns', {}).items()),
+            key=lambda p: _rank(p.level)
+        )
+
+    @staticmethod
+    def _load_rules_from_env() -> Optional[Dict[str, dict]]:
+        """PRIVACY_RULES_FILE で指定されたJSONファイルからルールを読み込む"""
+        path = os.getenv('PRIVACY_RULES_FILE')
+        if not path:
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error("プライバシールールの読み込みに失敗: %s", e)
+            return None
+
+    @staticmethod
+    def _compile_keywords(rules: Dict[str, dict]) -> Tuple[Optional[re.Pattern], Dict[str, Tuple[str, str]]]:
+        """
+        全レベルのキーワードを1つのトライ正規表現にまとめる
+
+        Returns:
+            (コンパイル済み正規表現, {小文字キーワード: (レベル, タグ)})
+        """
+        keywords = {}
+        for level in sorted(rules, key=_rank):
+            for keyword in rules[level].get('keywords', []):
+                # 同じキーワードが複数レベルにある場合は強いレベルを優先
+                keywords.setdefault(keyword.lower(), (level, f'keyword:{keyword}'))
+        if not keywords:
+            return None, keywords
+        return re.compile(_trie_pattern(keywords)), keywords
+
+    def _keyword_hits(self, lowered: str):
+        """キーワードの一致を (レベル, タグ) で順に返す（英単語は単語境界を確認）"""
+        if self._keyword_regex is None:
+            return
+        for m in self._keyword_regex.finditer(lowered):
+            keyword = m.group()
+            if keyword.isascii():
+                start, end = m.span()
+                if start and _ASCII_WORD.match(lowered, start - 1):
+                    continue
+                if end < len(lowered) and lowered[end] == 's':
+                    end += 1
+                if end < len(lowered) and _ASCII_WORD.match(lowered, end):
+                    continue
+            yield self._keywords[keyword]
 
     def analyze_privacy_level(self, text: str) -> str:
         """
         テキストのプライバシーレベルを分析
-        
+
         Args:
             text: 分析対象のテキスト
-            
+
         Returns:
             str: プライバシーレベル（'high', 'medium', 'low'）
         """
-        text_lower = text.lower()
-        
-        for level, keywords in self.privacy_keywords.items():
-            if any(keyword in text_lower for keyword in keywords):
-                return level
-                
-        return 'low'  # デフォルトは低レベル
+        if not text:
+            return _DEFAULT_LEVEL
+        lowered = text.lower()
+        best = _rank(_DEFAULT_LEVEL)
+        for level, _ in self._keyword_hits(lowered):
+            rank = _rank(level)
+            if rank == 0:
+                return level  # 最上位レベルが見つかれば以降の走査は不要
+            best = min(best, rank)
+        for pattern in self._patterns:
+            # 現在の判定より強いレベルのルールだけを評価する
+            if _rank(pattern.level) >= best:
+                break
+            if pattern.search(lowered):
+                best = _rank(pattern.level)
+                if best == 0:
+                    break
+        return LEVELS[best] if best < len(LEVELS) else _DEFAULT_LEVEL
+
+    def classify_batch(self, texts: Iterable[str]) -> List[str]:
+        """
+        複数テキストのプライバシーレベルをまとめて判定
+
+        Args:
+            texts: 分析対象のテキスト群
+
+        Returns:
+            list: 入力と同じ順序のプライバシーレベル
+        """
+        analyze = self.analyze_privacy_level
+        return [analyze(text) for text in texts]
 
     def analyze_additional_tags(self, text: str) -> list:
         """
         テキストから追加のコンテキストタグを抽出
-        
+
         Args:
             text: 分析対象のテキスト
-            
+
         Returns:
-            list: 抽出されたタグのリスト
+            list: 抽出されたタグのリスト（例: 'keyword:password', 'pii:email'）
         """
+        if not text:
+            return []
+        lowered = text.lower()
         tags = []
-        # 基本的なタグ付けロジックを実装
-        return tags 
\ No newline at end of file
+        for _, tag in self._keyword_hits(lowered):
+            if tag not in tags:
+                tags.append(tag)
+        tags.extend(p.label for p in self._patterns if p.search(lowered))
+        return tags
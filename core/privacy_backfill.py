@@ -0,0 +1,174 @@
+"""
+プライバシーレベルの一括再判定（バックフィル）モジュール
+プライバシールールの変更後、Chroma に保存済みの会話の privacy_level メタデータを
+再判定して更新します。
+
+- 会話はページ単位で読み出すため、件数が多くてもメモリ使用量は一定
+- 判定はプロセスプールで並列実行（ページNの判定中にページN+1を読み出す）
+- 更新はメタデータのみ（documents を渡さないため再埋め込みは発生しない）
+- 処理位置をチェックポイントファイル（コレクションごと）に保存し、中断後に再開可能
+- 更新した内容は on_update にも渡す（埋め込み移行中の移行先コレクションへの反映用。
+  ConversationDBManager.privacy_backfill() が設定する）
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Callable, List, Optional
+import hashlib
+import json
+import logging
+import os
+import time
+
+from core.privacy_analyzer import PrivacyAnalyzer
+
+logger = logging.getLogger(__name__)
+
+# ワーカープロセスごとに1つだけ生成する判定器
+_worker_analyzer: Optional[PrivacyAnalyzer] = None
+
+
+def _init_worker(rules: dict):
+    global _worker_analyzer
+    _worker_analyzer = PrivacyAnalyzer(rules)
+
+
+def _classify_chunk(texts: List[str]) -> List[str]:
+    return _worker_analyzer.classify_batch(texts)
+
+
+def rules_fingerprint(rules: dict) -> str:
+    """ルールセットのハッシュ（チェックポイントが同じルールのものか判定する）"""
+    data = json.dumps(rules, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+@dataclass
+class BackfillProgress:
+    """バックフィルの進捗（チェックポイントとして保存される）"""
+    rules_hash: str
+    offset: int = 0
+    scanned: int = 0
+    updated: int = 0
+    elapsed: float = 0.0
+    finished: bool = False
+    changes: dict = field(default_factory=dict)  # "旧→新" ごとの件数
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.scanned / self.elapsed if self.elapsed else 0.0
+
+
+class PrivacyBackfill:
+    """
+    保存済み会話のプライバシーレベルを再判定して更新するジョブ
+
+    Attributes:
+        collection: chromadb の Collection（get / update を持つオブジェクト）
+        checkpoint_path: 進捗を保存するファイル（コレクションごとに分ける）
+        on_update: 更新後に (ids, metadatas) で呼ばれるコールバック
+    """
+
+    def __init__(self, collection, checkpoint_path: str, rules: Optional[dict] = None,
+                 page_size: int = 1000, workers: Optional[int] = None,
+                 chunk_size: int = 200, dry_run: bool = False,
+                 on_update: Optional[Callable[[List[str], List[dict]], None]] = None):
+        self.collection = collection
+        self.checkpoint_path = checkpoint_path
+        self.on_update = on_update
+        self.rules = rules if rules is not None else PrivacyAnalyzer().rules
+        self.page_size = page_size
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+
+    def load_progress(self, reset: bool = False) -> BackfillProgress:
+        """チェックポイントを読み込む（ルールが変わっていれば最初から）"""
+        fingerprint = rules_fingerprint(self.rules)
+        if not reset and os.path.exists(self.checkpoint_path):
+            try:
+                with open(self.checkpoint_path, encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("rules_hash") == fingerprint:
+                    return BackfillProgress(**data)
+                logger.info("ルールが変更されているため最初から再判定します")
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning("チェックポイントの読み込みに失敗: %s", e)
+        return BackfillProgress(rules_hash=fingerprint)
+
+    def save_progress(self, progress: BackfillProgress):
+        """チェックポイントを原子的に書き込む"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_path)), exist_ok=True)
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(asdict(progress), f, ensure_ascii=False)
+        os.replace(tmp, self.checkpoint_path)
+
+    def _fetch(self, offset: int) -> dict:
+        return self.collection.get(limit=self.page_size, offset=offset,
+                                   include=["documents", "metadatas"])
+
+    def _submit(self, pool: ProcessPoolExecutor, documents: List[str]) -> List[Future]:
+        return [pool.submit(_classify_chunk, documents[i:i + self.chunk_size])
+                for i in range(0, len(documents), self.chunk_size)]
+
+    def _apply(self, page: dict, futures: List[Future], progress: BackfillProgress):
+        """判定結果のうち変化したものだけをメタデータ更新する"""
+        levels = [level for future in futures for level in future.result()]
+        ids, metadatas = [], []
+        for doc_id, metadata, level in zip(page["ids"], page["metadatas"], levels):
+            metadata = metadata or {}
+            old = metadata.get("privacy_level")
+            if metadata.get("type") == "knowledge" or old == level:
+                continue
+            key = f"{old}->{level}"
+            progress.changes[key] = progress.changes.get(key, 0) + 1
+            ids.append(doc_id)
+            metadatas.append({**metadata, "privacy_level": level})
+        if ids and not self.dry_run:
+            self.collection.update(ids=ids, metadatas=metadatas)
+            if self.on_update is not None:
+                self.on_update(ids, metadatas)
+        progress.updated += len(ids)
+        progress.scanned += len(page["ids"])
+        progress.offset += len(page["ids"])
+
+    def run(self, reset: bool = False,
+            on_progress: Optional[Callable[[BackfillProgress], None]] = None) -> BackfillProgress:
+        """
+        バックフィルを実行する
+
+        Args:
+            reset: True の場合はチェックポイントを無視して最初から
+            on_progress: ページ処理ごとに呼ばれるコールバック
+        Returns:
+            BackfillProgress: 最終的な進捗
+        """
+        progress = self.load_progress(reset)
+        if progress.finished and not reset:
+            logger.info("バックフィルは完了済みです（--reset で再実行）")
+            return progress
+        logger.info("バックフィル開始: offset=%d, workers=%d", progress.offset, self.workers)
+
+        start = time.perf_counter() - progress.elapsed
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.rules,)) as pool:
+            page = self._fetch(progress.offset)
+            while page["ids"]:
+                futures = self._submit(pool, page["documents"])
+                # 判定中に次のページを先読みする
+                next_page = self._fetch(progress.offset + len(page["ids"]))
+                self._apply(page, futures, progress)
+                progress.elapsed = time.perf_counter() - start
+                if not self.dry_run:
+                    self.save_progress(progress)
+                logger.info("再判定: %d件 (更新 %d件, %.0f rows/sec)",
+                            progress.scanned, progress.updated, progress.rows_per_sec)
+                if on_progress:
+                    on_progress(progress)
+                page = next_page
+
+        progress.finished = True
+        progress.elapsed = time.perf_counter() - start
+        if not self.dry_run:
+            self.save_progress(progress)
+        return progress
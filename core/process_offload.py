@@ -0,0 +1,218 @@
+"""
+CPU負荷の高い処理のプロセスプール実行モジュール
+テキスト分割・プライバシー判定・ローカルのコード/画像処理など、GIL を長時間握る処理を
+別プロセスで実行し、リクエスト処理やイベントループを止めないようにします。
+
+- 大きなデータ（既定 1MB 以上の str / bytes）は pickle でパイプに流さず、
+  multiprocessing.shared_memory 経由で受け渡す（入力・出力とも）
+- 一定件数を処理したらプールを作り直し、ワーカーのメモリ増加を抑える
+- 稼働率・実行件数・共有メモリ転送量をメトリクスとして記録する
+
+実行する関数はモジュールの最上位（またはクラスの staticmethod）に定義し、
+pickle で子プロセスへ渡せるようにしてください。
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import is_dataclass, replace
+from multiprocessing import shared_memory
+from typing import Callable, Optional, Tuple
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHM_THRESHOLD = 1024 * 1024
+DEFAULT_RECYCLE_AFTER = 1000
+
+OFFLOAD_TASKS = metrics.REGISTRY.counter(
+    "offload_tasks_total",
+    "プロセスプールで実行した処理の件数",
+    labelnames=("function", "status"),
+)
+OFFLOAD_BUSY_SECONDS = metrics.REGISTRY.counter(
+    "offload_busy_seconds_total",
+    "ワーカープロセスが処理に費やした時間（秒）",
+)
+OFFLOAD_UTILIZATION = metrics.REGISTRY.gauge(
+    "offload_pool_utilization",
+    "プロセスプールの稼働率（0〜1）",
+)
+OFFLOAD_INFLIGHT = metrics.REGISTRY.gauge(
+    "offload_inflight",
+    "実行中・待機中の処理数",
+)
+OFFLOAD_SHM_BYTES = metrics.REGISTRY.counter(
+    "offload_shared_memory_bytes_total",
+    "共有メモリで受け渡したバイト数",
+    labelnames=("direction",),
+)
+OFFLOAD_RECYCLES = metrics.REGISTRY.counter(
+    "offload_pool_recycles_total",
+    "ワーカー再生成（プール作り直し）の回数",
+)
+
+# 共有メモリ参照: (名前, バイト数, 元の型 "str" / "bytes")
+ShmRef = Tuple[str, int, str]
+
+
+def _to_shm(value) -> Tuple[ShmRef, shared_memory.SharedMemory]:
+    raw = value.encode("utf-8") if isinstance(value, str) else bytes(value)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(raw)))
+    shm.buf[:len(raw)] = raw
+    return (shm.name, len(raw), "str" if isinstance(value, str) else "bytes"), shm
+
+
+def _from_shm(ref: ShmRef, unlink: bool = False):
+    name, size, kind = ref
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        raw = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    return raw.decode("utf-8") if kind == "str" else raw
+
+
+def _invoke(func: Callable, payload, ref: Optional[ShmRef], threshold: int):
+    """ワーカープロセス側の実行処理"""
+    if ref is not None:
+        data = _from_shm(ref)
+        payload = replace(payload, data=data) if payload is not None else data
+    start = time.perf_counter()
+    result = func(payload)
+    elapsed = time.perf_counter() - start
+    if isinstance(result, (str, bytes)) and len(result) >= threshold:
+        out_ref, shm = _to_shm(result)
+        shm.close()  # 親プロセスが読み出した後に unlink する
+        return None, out_ref, elapsed
+    return result, None, elapsed
+
+
+class ProcessOffloader:
+    """
+    CPU負荷の高い処理を実行する管理付きプロセスプール
+
+    Attributes:
+        max_workers: ワーカープロセス数
+        recycle_after: この件数を投入するごとにプールを作り直す（0 なら無効）
+        shm_threshold: 共有メモリで受け渡すデータサイズの下限（バイト）
+    """
+
+    def __init__(self, max_workers: Optional[int] = None,
+                 recycle_after: int = DEFAULT_RECYCLE_AFTER,
+                 shm_threshold: int = DEFAULT_SHM_THRESHOLD, mp_context=None):
+        self.max_workers = max_workers or int(os.getenv("OFFLOAD_WORKERS", 0)) or os.cpu_count() or 1
+        self.recycle_after = recycle_after
+        self.shm_threshold = shm_threshold
+        self._mp_context = mp_context
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._submitted = 0
+        self._inflight = 0
+        self._busy = 0.0
+        self._started_at = time.perf_counter()
+        self._closed = False
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # 呼び出し元で self._lock を保持していること
+        if self._pool is None or (self.recycle_after and self._submitted >= self.recycle_after):
+            if self._pool is not None:
+                # 投入済みの処理は旧プールで最後まで実行される
+                self._pool.shutdown(wait=False)
+                OFFLOAD_RECYCLES.inc()
+                logger.debug("プロセスプールを再生成しました (%d件処理後)", self._submitted)
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=self._mp_context)
+            self._submitted = 0
+        return self._pool
+
+    def _pack(self, payload):
+        """大きなデータを共有メモリへ移し、(送信するペイロード, 参照, 共有メモリ) を返す"""
+        if isinstance(payload, (str, bytes, bytearray)) and len(payload) >= self.shm_threshold:
+            ref, shm = _to_shm(payload)
+            return None, ref, shm
+        data = getattr(payload, "data", None) if is_dataclass(payload) else None
+        if isinstance(data, (str, bytes)) and len(data) >= self.shm_threshold:
+            ref, shm = _to_shm(data)
+            return replace(payload, data=""), ref, shm
+        return payload, None, None
+
+    def submit(self, func: Callable, payload) -> Future:
+        """
+        func(payload) をワーカープロセスで実行する
+
+        Args:
+            func: pickle 可能な関数
+            payload: 引数（str / bytes、または data フィールドを持つ dataclass）
+        Returns:
+            Future: func の戻り値が設定される Future
+        """
+        if self._closed:
+            raise RuntimeError("ProcessOffloader は停止済みです")
+        name = getattr(func, "__qualname__", str(func))
+        sent, ref, shm = self._pack(payload)
+        if ref is not None:
+            OFFLOAD_SHM_BYTES.inc(ref[1], direction="in")
+        outer: Future = Future()
+        with self._lock:
+            inner = self._get_pool().submit(_invoke, func, sent, ref, self.shm_threshold)
+            self._submitted += 1
+            self._inflight += 1
+            OFFLOAD_INFLIGHT.set(self._inflight)
+
+        def done(f: Future):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            with self._lock:
+                self._inflight -= 1
+                OFFLOAD_INFLIGHT.set(self._inflight)
+            try:
+                result, out_ref, elapsed = f.result()
+                if out_ref is not None:
+                    OFFLOAD_SHM_BYTES.inc(out_ref[1], direction="out")
+                    result = _from_shm(out_ref, unlink=True)
+            except BaseException as e:
+                OFFLOAD_TASKS.inc(function=name, status="error")
+                outer.set_exception(e)
+                return
+            self._record_busy(elapsed)
+            OFFLOAD_TASKS.inc(function=name, status="ok")
+            outer.set_result(result)
+
+        inner.add_done_callback(done)
+        return outer
+
+    async def run(self, func: Callable, payload):
+        """submit() の asyncio 版"""
+        return await asyncio.wrap_future(self.submit(func, payload))
+
+    def _record_busy(self, elapsed: float):
+        OFFLOAD_BUSY_SECONDS.inc(elapsed)
+        with self._lock:
+            self._busy += elapsed
+            OFFLOAD_UTILIZATION.set(self.utilization())
+
+    def utilization(self) -> float:
+        """起動以降のワーカー稼働率（処理時間の合計 / (経過時間 × ワーカー数)）"""
+        capacity = (time.perf_counter() - self._started_at) * self.max_workers
+        return min(1.0, self._busy / capacity) if capacity else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "inflight": self._inflight,
+            "busy_seconds": round(self._busy, 3),
+            "utilization": round(self.utilization(), 4),
+        }
+
+    def shutdown(self, wait: bool = True):
+        self._closed = True
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
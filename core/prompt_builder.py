@@ -0,0 +1,287 @@
+"""
+プロンプト（メッセージ列）の組み立てモジュール
+プロバイダー側のプロンプトキャッシュ（先頭が一致する入力の再利用）が効くよう、
+毎ターン変わらない部分を先頭に、変わる部分を末尾に並べます。
+
+    [system] システムプロンプト                 ← 固定
+    [system] 固定知識（PROMPT_PINNED_FILE）      ← 固定
+    [user/assistant] 過去の会話（ブロック単位）   ← ブロックが埋まるまで変わらない
+    [user/assistant] 直近の会話（端数）           ← 毎ターン変わる
+    [system] 参考情報（core.retrieval の検索結果） ← 毎ターン変わる
+    [user] 今回の質問                            ← 毎ターン変わる
+
+- 過去の会話は保存時刻・id の順に並べ、取得順に左右されない
+- PROMPT_HISTORY_BLOCK 件（既定 4）ごとのブロックにまとめ、ブロックが埋まった時点で
+  先頭側に移す。移しても既存の先頭は変わらない（伸びるだけ）ためキャッシュが引き続き効く
+- 先頭側は最大 PROMPT_HISTORY_BLOCKS ブロック（既定 2）。超えると古いブロックから外れる
+- 先頭側のトークン数はハッシュごとにキャッシュし、毎回数え直さない
+- 履歴は直近 history_limit 件と会話の総数だけあれば組み立てられる。会話メモリごとに
+  HistoryCache に保持し、毎ターン全件を読み出さない
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence, Tuple
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from core import metrics
+from core.embedding_migration import count_tokens
+from core.retention import to_epoch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYSTEM_PROMPT = "あなたは過去の会話を記憶できるアシスタントです。"
+CONTEXT_HEADER = "以下は質問に関連する可能性がある参考情報です。役立つ場合のみ使ってください。"
+
+PROMPT_PREFIX_TOKENS = metrics.REGISTRY.histogram(
+    "prompt_prefix_tokens",
+    "プロンプトの固定部分（キャッシュ対象）の推定トークン数",
+    buckets=(256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+PROMPT_CACHED_RATIO = metrics.REGISTRY.histogram(
+    "prompt_cached_ratio",
+    "入力トークンのうちプロバイダー側でキャッシュされた割合",
+    buckets=(0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0),
+)
+
+
+@dataclass(frozen=True)
+class Prompt:
+    """組み立てたメッセージ列と、その固定部分の情報"""
+    messages: List[dict]
+    prefix_length: int  # 先頭から何件が固定部分か
+    prefix_hash: str
+    prefix_tokens: int
+    cache_key: Optional[str] = None  # プロバイダーに渡す prompt_cache_key
+
+
+def _sort_key(conversation: dict) -> Tuple[float, str]:
+    metadata = conversation.get("metadata") or {}
+    epoch = metadata.get("timestamp_epoch")
+    if not isinstance(epoch, (int, float)):
+        epoch = to_epoch(metadata.get("timestamp"))
+    return (epoch if epoch is not None else 0.0, str(conversation.get("id", "")))
+
+
+def latest_ids(rows: Iterable[Tuple[str, dict]], limit: int) -> Tuple[List[str], int]:
+    """
+    (id, メタデータ) の並びから、会話（ナレッジを除く）の直近 limit 件の id と会話の総数を返す
+
+    本文を読み出す前に、メタデータだけで対象を絞り込むために使う。
+    """
+    keys = [_sort_key({"id": doc_id, "metadata": metadata})
+            for doc_id, metadata in rows if (metadata or {}).get("type") != "knowledge"]
+    keys.sort()
+    latest = keys[max(0, len(keys) - limit):] if limit > 0 else []
+    return [doc_id for _, doc_id in latest], len(keys)
+
+
+class HistoryCache:
+    """
+    会話メモリ1つ分の直近の会話履歴（プロンプトに入る分だけ）
+
+    読み出し先のコレクションと世代（core.search_cache）が変わらない間は読み直さない。
+    自プロセスでの保存は append() で末尾に足し、次のターンで読み直さずに済ませる。
+    他のプロセスでの保存・削除は世代が飛ぶため、次の get() で読み直しになる。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None  # (scope, 世代, limit)
+        self._conversations: List[dict] = []
+        self._total = 0
+
+    def get(self, scope: str, generation: int, limit: int) -> Optional[Tuple[List[dict], int]]:
+        """(直近 limit 件の会話, 会話の総数)。保持していなければ None"""
+        with self._lock:
+            if self._key is None or self._key[:2] != (scope, generation) or self._key[2] < limit:
+                return None
+            return list(self._conversations[max(0, len(self._conversations) - limit):]), self._total
+
+    def put(self, scope: str, generation: int, limit: int, conversations: Sequence[dict],
+            total: int):
+        """読み出した履歴を保持する（generation は読み出しを始める前の世代）"""
+        ordered = sorted(conversations, key=_sort_key)
+        with self._lock:
+            self._key = (scope, generation, limit)
+            self._conversations = ordered[max(0, len(ordered) - limit):] if limit > 0 else []
+            self._total = total
+
+    def append(self, scope: str, generation: int, conversation: dict):
+        """
+        保存した会話を末尾に足す
+
+        generation は保存後に進めた世代。保持している世代の次でなければ
+        （他の保存・削除が間に入った場合）保持を捨てて次回読み直す。
+        """
+        with self._lock:
+            if self._key is None:
+                return
+            cached_scope, cached_generation, limit = self._key
+            if cached_scope != scope or cached_generation + 1 != generation:
+                self._key = None
+                return
+            ordered = sorted(self._conversations + [conversation], key=_sort_key)
+            self._conversations = ordered[max(0, len(ordered) - limit):]
+            self._total += 1
+            self._key = (scope, generation, limit)
+
+    def clear(self):
+        with self._lock:
+            self._key = None
+
+
+def _turn_messages(conversation: dict) -> List[dict]:
+    """保存形式 "User: ...\nAI: ..." の会話を user / assistant のメッセージにする"""
+    text = conversation.get("text") or ""
+    if "User:" not in text or "AI:" not in text:
+        return []
+    user_msg, ai_msg = text.split("AI:", 1)
+    return [{"role": "user", "content": user_msg.replace("User:", "").strip()},
+            {"role": "assistant", "content": ai_msg.strip()}]
+
+
+class PromptBuilder:
+    """
+    キャッシュしやすい順序でメッセージ列を組み立てる
+
+    Attributes:
+        system_prompt: システムプロンプト
+        pinned: 毎回含める固定知識（None なら含めない）
+        block_size: 先頭側に移す会話のまとまりの件数
+        max_blocks: 先頭側に含めるブロック数の上限
+    """
+
+    def __init__(self, system_prompt: str = DEFAULT_SYSTEM_PROMPT, pinned: Optional[str] = None,
+                 block_size: Optional[int] = None, max_blocks: Optional[int] = None,
+                 token_cache_size: int = 256):
+        self.system_prompt = system_prompt
+        self.pinned = pinned
+        self.block_size = max(1, block_size if block_size is not None
+                              else int(os.getenv("PROMPT_HISTORY_BLOCK", "4")))
+        self.max_blocks = max(0, max_blocks if max_blocks is not None
+                              else int(os.getenv("PROMPT_HISTORY_BLOCKS", "2")))
+        self._token_cache: "OrderedDict[str, int]" = OrderedDict()
+        self._token_cache_size = token_cache_size
+        self._lock = threading.Lock()
+
+    @property
+    def history_limit(self) -> int:
+        """組み立てに必要な直近の会話の件数（先頭側の最大件数 + 端数）"""
+        return (self.max_blocks + 1) * self.block_size
+
+    @classmethod
+    def from_env(cls) -> "PromptBuilder":
+        """PROMPT_SYSTEM / PROMPT_PINNED_FILE / PROMPT_HISTORY_BLOCK(S) から作る"""
+        pinned = None
+        path = os.getenv("PROMPT_PINNED_FILE")
+        if path:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    pinned = f.read().strip() or None
+            except OSError as e:
+                logger.warning("固定知識のファイルを読めません: %s (%s)", path, e)
+        return cls(system_prompt=os.getenv("PROMPT_SYSTEM", DEFAULT_SYSTEM_PROMPT), pinned=pinned)
+
+    def split_history(self, conversations: Sequence[dict],
+                      total: Optional[int] = None) -> Tuple[List[dict], List[dict]]:
+        """
+        会話履歴を (先頭側, 末尾側) に分ける
+
+        先頭側は block_size の倍数の位置で区切り、その手前 max_blocks ブロック分。
+        末尾側は区切りより後の端数（block_size 件未満）。
+
+        Args:
+            conversations: 会話（順不同）。total を渡す場合は直近 history_limit 件以上
+            total: 会話の総数（conversations が直近の一部のとき。区切りの位置は総数で決まる）
+        """
+        ordered = sorted(conversations, key=_sort_key)
+        total = len(ordered) if total is None else max(total, len(ordered))
+        # ordered[0] の通し番号（conversations が直近の一部なら 0 より大きい）
+        offset = total - len(ordered)
+        boundary = total - total % self.block_size - offset
+        start = max(0, boundary - self.max_blocks * self.block_size)
+        return ordered[start:boundary], ordered[boundary:]
+
+    def build(self, conversations: Sequence[dict], text: str,
+              cache_key: Optional[str] = None, context: Sequence[str] = (),
+              total: Optional[int] = None) -> Prompt:
+        """
+        会話履歴と今回の質問からメッセージ列を組み立てる
+
+        Args:
+            conversations: get_all_conversations() 形式の会話（順不同）
+            text: 今回の質問
+            cache_key: 同じ先頭を持つリクエストをまとめるためのキー（会話メモリごとなど）
+            context: 今回の質問の直前に差し込む参考情報（固定部分には含めない）
+            total: 会話の総数（conversations が直近の一部のとき）
+        """
+        older, recent = self.split_history(conversations, total)
+        return self.assemble(older, recent, text, cache_key=cache_key, context=context)
+
+    def assemble(self, older: Sequence[dict], recent: Sequence[dict], text: str,
+                 cache_key: Optional[str] = None, context: Sequence[str] = ()) -> Prompt:
+        """split_history() で分けた履歴からメッセージ列を組み立てる"""
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if self.pinned:
+            messages.append({"role": "system", "content": self.pinned})
+        for conversation in older:
+            messages.extend(_turn_messages(conversation))
+        prefix_length = len(messages)
+        for conversation in recent:
+            messages.extend(_turn_messages(conversation))
+        if context:
+            messages.append({"role": "system",
+                             "content": "\n\n".join([CONTEXT_HEADER, *context])})
+        messages.append({"role": "user", "content": text})
+
+        prefix = messages[:prefix_length]
+        prefix_hash = hashlib.sha256(json.dumps(prefix, ensure_ascii=False, sort_keys=True)
+                                     .encode("utf-8")).hexdigest()[:16]
+        prefix_tokens = self._prefix_tokens(prefix_hash, prefix)
+        PROMPT_PREFIX_TOKENS.observe(prefix_tokens)
+        return Prompt(messages, prefix_length, prefix_hash, prefix_tokens, cache_key)
+
+    def _prefix_tokens(self, prefix_hash: str, prefix: List[dict]) -> int:
+        with self._lock:
+            tokens = self._token_cache.get(prefix_hash)
+            if tokens is not None:
+                self._token_cache.move_to_end(prefix_hash)
+                return tokens
+        tokens = count_tokens([m["content"] for m in prefix])
+        with self._lock:
+            self._token_cache[prefix_hash] = tokens
+            while len(self._token_cache) > self._token_cache_size:
+                self._token_cache.popitem(last=False)
+        return tokens
+
+
+def cached_tokens(usage) -> int:
+    """usage（OpenAI 形式）のうちキャッシュから読まれた入力トークン数"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return int(details.get("cached_tokens") or 0)
+    return int(getattr(details, "cached_tokens", 0) or 0)
+
+
+def record_cache_usage(usage, span=None) -> int:
+    """
+    応答の usage からキャッシュされた入力トークン数を記録する
+
+    Returns:
+        int: キャッシュされたトークン数
+    """
+    if usage is None:
+        return 0
+    cached = cached_tokens(usage)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    if cached:
+        metrics.TOKENS_TOTAL.inc(cached, kind="cached")
+    if prompt_tokens:
+        PROMPT_CACHED_RATIO.observe(cached / prompt_tokens)
+    if span is not None:
+        span.set_attribute("tokens.cached", cached)
+    return cached
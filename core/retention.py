@@ -0,0 +1,300 @@
+"""
+会話データの保持期間（リテンション）管理モジュール
+privacy_level ごとに保持日数と期限切れ後の扱い（削除 / アーカイブ）を設定し、
+期限切れの会話を一括で処理します。
+
+設定（環境変数 RETENTION_POLICY、未設定なら何も期限切れにしない）:
+    RETENTION_POLICY="high=delete:30,medium=archive:90,low=archive:180"
+
+- 期限の判定には数値メタデータ timestamp_epoch を使い、Chroma の where 条件
+  （privacy_level と $lt）で期限切れの会話だけをバッチ単位で取り出して削除する
+  （全件走査しない）。timestamp_epoch のない旧データは backfill_epochs() で付与する
+- アーカイブは core.columnar の圧縮カラムナファイル（ARCHIVE_DIR、既定 ./data/archive）に
+  書き出してから削除する。search_archive() で Chroma を使わずに検索できる
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+import heapq
+import json
+import logging
+import os
+import time
+
+from core import columnar, metrics, tracing
+from core.dedup import shingles
+
+logger = logging.getLogger(__name__)
+
+DELETE = "delete"
+ARCHIVE = "archive"
+ACTIONS = (DELETE, ARCHIVE)
+DEFAULT_ARCHIVE_DIR = "./data/archive"
+
+RETENTION_ROWS = metrics.REGISTRY.counter(
+    "retention_rows_total",
+    "保持期間切れで処理した会話の件数",
+    labelnames=("privacy_level", "action"),
+)
+ARCHIVE_BYTES = metrics.REGISTRY.counter(
+    "retention_archive_bytes_total",
+    "アーカイブファイルに書き出したバイト数",
+)
+
+
+@dataclass(frozen=True)
+class RetentionRule:
+    """1つの privacy_level の保持ルール"""
+    privacy_level: str
+    action: str
+    days: float
+
+    def cutoff(self, now: float) -> float:
+        """これより古い timestamp_epoch の会話が期限切れ"""
+        return now - self.days * 86400
+
+
+@dataclass
+class RetentionPolicy:
+    """privacy_level ごとの保持ルール"""
+    rules: Dict[str, RetentionRule] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, spec: str) -> "RetentionPolicy":
+        """
+        "high=delete:30,low=archive:180" 形式の設定を解釈する
+
+        Raises:
+            ValueError: 形式が不正な場合
+        """
+        rules = {}
+        for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+            try:
+                level, rest = item.split("=", 1)
+                action, days = rest.split(":", 1)
+                rule = RetentionRule(level.strip(), action.strip().lower(), float(days))
+            except ValueError:
+                raise ValueError(f"保持ルールの形式が不正です: {item!r}（例: high=delete:30）")
+            if rule.action not in ACTIONS:
+                raise ValueError(f"保持ルールの action は {ACTIONS} のいずれかです: {item!r}")
+            if rule.days < 0:
+                raise ValueError(f"保持日数は0以上です: {item!r}")
+            rules[rule.privacy_level] = rule
+        return cls(rules)
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        return cls.parse(os.getenv("RETENTION_POLICY", ""))
+
+    def __bool__(self):
+        return bool(self.rules)
+
+
+def to_epoch(timestamp) -> Optional[float]:
+    """ISO形式の timestamp メタデータを UNIX 時刻にする（解釈できなければ None）"""
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    try:
+        return datetime.fromisoformat(str(timestamp)).timestamp()
+    except ValueError:
+        return None
+
+
+@dataclass
+class SweepResult:
+    """期限切れ処理の結果"""
+    dry_run: bool = False
+    deleted: Dict[str, int] = field(default_factory=dict)
+    archived: Dict[str, int] = field(default_factory=dict)
+    archive_files: List[str] = field(default_factory=list)
+    archive_bytes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def total(self) -> int:
+        return sum(self.deleted.values()) + sum(self.archived.values())
+
+
+class RetentionSweeper:
+    """
+    期限切れの会話を削除・アーカイブする
+
+    Attributes:
+        collection: chromadb の Collection（get / update / delete を持つオブジェクト）
+        policy: 保持ルール
+        archive_dir: アーカイブファイルの出力先
+        on_delete: 削除した id とメタデータのリストを受け取るコールバック（重複判定索引・集計の更新など）
+    """
+
+    def __init__(self, collection, policy: Optional[RetentionPolicy] = None,
+                 archive_dir: Optional[str] = None, batch_size: int = 1000,
+                 on_delete: Optional[Callable[[List[str], List[dict]], None]] = None,
+                 clock: Callable[[], float] = time.time):
+        self.collection = collection
+        self.policy = policy if policy is not None else RetentionPolicy.from_env()
+        self.archive_dir = archive_dir or os.getenv("ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR)
+        self.batch_size = batch_size
+        self.on_delete = on_delete
+        self.clock = clock
+        self._archive_seq = 0
+
+    def backfill_epochs(self) -> int:
+        """
+        timestamp_epoch のない会話に timestamp から値を付与する（メタデータのみ更新）
+
+        Returns:
+            int: 更新した件数
+        """
+        updated = 0
+        offset = 0
+        while True:
+            page = self.collection.get(limit=self.batch_size, offset=offset, include=["metadatas"])
+            if not page["ids"]:
+                break
+            offset += len(page["ids"])
+            ids, metadatas = [], []
+            for doc_id, metadata in zip(page["ids"], page["metadatas"]):
+                metadata = metadata or {}
+                if "timestamp_epoch" in metadata or "timestamp" not in metadata:
+                    continue
+                epoch = to_epoch(metadata["timestamp"])
+                if epoch is None:
+                    continue
+                ids.append(doc_id)
+                metadatas.append({**metadata, "timestamp_epoch": epoch})
+            if ids:
+                self.collection.update(ids=ids, metadatas=metadatas)
+                updated += len(ids)
+        logger.info("timestamp_epoch を付与: %d件", updated)
+        return updated
+
+    def sweep(self, dry_run: bool = False) -> SweepResult:
+        """保持ルールに従って期限切れの会話を処理する"""
+        started = time.perf_counter()
+        result = SweepResult(dry_run=dry_run)
+        now = self.clock()
+        with tracing.start_span("retention.sweep", {"dry_run": dry_run}):
+            for rule in self.policy.rules.values():
+                count = self._sweep_rule(rule, now, result, dry_run)
+                target = result.archived if rule.action == ARCHIVE else result.deleted
+                target[rule.privacy_level] = count
+        result.elapsed = time.perf_counter() - started
+        logger.info("保持期間切れの処理%s: 削除=%s アーカイブ=%s (%.1f秒)",
+                    "（dry-run）" if dry_run else "", result.deleted, result.archived,
+                    result.elapsed)
+        return result
+
+    def _sweep_rule(self, rule: RetentionRule, now: float, result: SweepResult,
+                    dry_run: bool) -> int:
+        where = {"$and": [
+            {"privacy_level": rule.privacy_level},
+            {"timestamp_epoch": {"$lt": rule.cutoff(now)}},
+        ]}
+        include = ["documents", "metadatas"] if rule.action == ARCHIVE else ["metadatas"]
+        count = 0
+        while True:
+            # 削除する場合は常に先頭から取り出す（削除済みの分だけ次のバッチが繰り上がる）
+            page = self.collection.get(where=where, limit=self.batch_size,
+                                       offset=count if dry_run else 0, include=include)
+            ids = page["ids"]
+            if not ids:
+                return count
+            count += len(ids)
+            if dry_run:
+                continue
+            if rule.action == ARCHIVE:
+                # 書き出しに成功してから削除する（途中で失敗してもデータは失われない）
+                path, size = self._archive(rule.privacy_level, page)
+                result.archive_files.append(path)
+                result.archive_bytes += size
+            self.collection.delete(ids=ids)
+            RETENTION_ROWS.inc(len(ids), privacy_level=rule.privacy_level, action=rule.action)
+            if self.on_delete is not None:
+                self.on_delete(list(ids), list(page["metadatas"]))
+
+    def _archive(self, privacy_level: str, page: dict):
+        metadatas = [metadata or {} for metadata in page["metadatas"]]
+        epochs = [metadata.get("timestamp_epoch") for metadata in metadatas]
+        stamp = datetime.fromtimestamp(self.clock()).strftime("%Y%m%dT%H%M%S")
+        self._archive_seq += 1
+        path = os.path.join(self.archive_dir, f"conversations-{privacy_level}-{stamp}-"
+                                              f"{self._archive_seq:04d}{columnar.EXTENSION}")
+        size = columnar.write_table(path, {
+            "id": list(page["ids"]),
+            "text": list(page["documents"]),
+            "timestamp_epoch": epochs,
+            "metadata": [json.dumps(metadata, ensure_ascii=False) for metadata in metadatas],
+        }, meta={"privacy_level": privacy_level, "archived_at": self.clock()})
+        ARCHIVE_BYTES.inc(size)
+        return path, size
+
+
+def search_archive(query: str, archive_dir: Optional[str] = None, limit: int = 5,
+                   privacy_level: Optional[str] = None, since: Optional[float] = None,
+                   until: Optional[float] = None, shingle_size: int = 2) -> List[dict]:
+    """
+    アーカイブを文字 n-gram の一致率で検索する（埋め込み・Chroma は使わない）
+
+    privacy_level と期間（since / until、UNIX 時刻）はファイルのヘッダーで判定し、
+    対象外のファイルは展開しない。対象ファイルも本文列だけを展開する。
+
+    Returns:
+        list: {"id", "text", "metadata", "score", "archive"} のリスト（score の降順）
+    """
+    archive_dir = archive_dir or os.getenv("ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR)
+    terms = shingles(query, shingle_size)
+    if not terms:
+        return []
+    hits = []  # (score, 通し番号, ファイル, 行) のヒープ
+    seq = 0
+    for path in columnar.list_files(archive_dir):
+        header = columnar.read_header(path)
+        if privacy_level and header["meta"].get("privacy_level") != privacy_level:
+            continue
+        bounds = header["columns"].get("timestamp_epoch", {})
+        if since is not None and "max" in bounds and bounds["max"] < since:
+            continue
+        if until is not None and "min" in bounds and bounds["min"] >= until:
+            continue
+        needed = ["text"] + (["timestamp_epoch"] if since is not None or until is not None else [])
+        table = columnar.read_table(path, needed)
+        epochs = table.get("timestamp_epoch")
+        for row, text in enumerate(table["text"]):
+            if epochs is not None:
+                epoch = epochs[row]
+                if epoch is None or (since is not None and epoch < since) \
+                        or (until is not None and epoch >= until):
+                    continue
+            score = len(terms & shingles(text, shingle_size)) / len(terms)
+            if score <= 0:
+                continue
+            seq += 1
+            item = (score, -seq, path, row)
+            if len(hits) < limit:
+                heapq.heappush(hits, item)
+            else:
+                heapq.heappushpop(hits, item)
+
+    results = []
+    by_file: Dict[str, dict] = {}
+    for score, _, path, row in sorted(hits, reverse=True):
+        if path not in by_file:
+            by_file[path] = columnar.read_table(path, ["id", "text", "metadata"])
+        table = by_file[path]
+        results.append({
+            "id": table["id"][row],
+            "text": table["text"][row],
+            "metadata": json.loads(table["metadata"][row]),
+            "score": round(score, 4),
+            "archive": os.path.basename(path),
+        })
+    return results
+
+
+def iter_archive(archive_dir: Optional[str] = None) -> Iterable[dict]:
+    """アーカイブ済みの会話を1件ずつ返す"""
+    archive_dir = archive_dir or os.getenv("ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR)
+    for path in columnar.list_files(archive_dir):
+        table = columnar.read_table(path, ["id", "text", "metadata"])
+        for doc_id, text, metadata in zip(table["id"], table["text"], table["metadata"]):
+            yield {"id": doc_id, "text": text, "metadata": json.loads(metadata)}
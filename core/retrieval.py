@@ -0,0 +1,271 @@
+"""
+応答生成前の検索（RAG）モジュール
+ナレッジベースと会話メモリを同時に検索し、締め切り（RAG_DEADLINE_MS）内に
+返った結果だけを使ってプロンプトに差し込む参考情報を選びます。
+
+- 各検索は共有のスレッドプールで並行に実行し、全体で1つの締め切りを持つ
+- 締め切りまでに返らなかった・失敗した検索は使わない（すべてそうなら参考情報なし）
+  まだ始まっていない検索は取り消し、実行中のものはバックグラウンドで終わらせて応答は待たせない
+- 実行中・待機中の検索は RAG_MAX_INFLIGHT（既定は RAG_WORKERS）件までとし、
+  プールが埋まっているときは新しい検索を行わない（遅い検索がプールに積み上がらないように）
+- 結果はベクトル検索の順位と、質問との文字 n-gram の重なりを合わせた
+  ローカルのスコアで並べ直す（追加の API 呼び出しはしない）
+- 同じ内容・プロンプトに既に含まれる会話は除き、RAG_TOKEN_BUDGET 以内に収める
+- 段階ごとの所要時間を chat_stage_seconds（rag_*）とスパンの属性に記録する
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from core import metrics, tracing
+from core.dedup import normalize_text, shingles
+from core.embedding_migration import count_tokens
+
+logger = logging.getLogger(__name__)
+
+RAG_RETRIEVALS = metrics.REGISTRY.counter(
+    "rag_retrievals_total",
+    "応答前の検索の件数（result=ok / partial / timeout / error / empty / shed）",
+    labelnames=("result",),
+)
+RAG_SOURCE_FAILURES = metrics.REGISTRY.counter(
+    "rag_source_failures_total",
+    "締め切り超過・例外・プールの飽和（shed）で使わなかった検索の件数",
+    labelnames=("source", "reason"),
+)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _shared_executor() -> ThreadPoolExecutor:
+    """検索用の共有スレッドプール（RAG_WORKERS、既定 8）"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=int(os.getenv("RAG_WORKERS", "8")),
+                                           thread_name_prefix="rag")
+        return _executor
+
+
+@dataclass
+class Passage:
+    """検索で見つかった1件の参考情報"""
+    source: str  # knowledge / memory
+    text: str
+    rank: int  # 検索結果内の順位（0始まり）
+    metadata: dict = field(default_factory=dict)
+    score: float = 0.0
+
+
+@dataclass
+class Retrieval:
+    """検索の結果"""
+    passages: List[Passage]
+    timings: Dict[str, float]  # 段階名 → 秒
+    result: str  # ok / partial / timeout / error / empty
+    tokens: int = 0
+
+    def context(self) -> List[str]:
+        """プロンプトに差し込むテキストの一覧"""
+        return [p.text for p in self.passages]
+
+
+def lexical_overlap(query: str, text: str, size: int = 2) -> float:
+    """質問の文字 n-gram のうち、text に含まれる割合（0〜1）"""
+    query_grams = shingles(query, size)
+    if not query_grams:
+        return 0.0
+    return len(query_grams & shingles(text, size)) / len(query_grams)
+
+
+def rerank(query: str, passages: Iterable[Passage], lexical_weight: float = 0.5) -> List[Passage]:
+    """
+    ベクトル検索の順位と文字 n-gram の重なりを合わせたスコアで並べ直す
+
+    Args:
+        query: 質問
+        passages: 各検索の結果（rank は検索ごとの順位）
+        lexical_weight: 重なりの重み（残りが順位の重み）
+    """
+    ranked = []
+    for passage in passages:
+        passage.score = (lexical_weight * lexical_overlap(query, passage.text)
+                         + (1 - lexical_weight) / (passage.rank + 1))
+        ranked.append(passage)
+    ranked.sort(key=lambda p: (-p.score, p.source, p.rank))
+    return ranked
+
+
+def select_within_budget(passages: Iterable[Passage], token_budget: int,
+                         exclude: Iterable[str] = ()) -> List[Passage]:
+    """
+    重複と exclude に含まれる内容を除き、トークン数の合計が token_budget 以内になるよう選ぶ
+
+    予算を超える1件は飛ばし、後続の短いものは引き続き候補にする。
+    """
+    seen = {normalize_text(text) for text in exclude}
+    selected, used = [], 0
+    for passage in passages:
+        key = normalize_text(passage.text)
+        if not key or key in seen:
+            continue
+        tokens = count_tokens([passage.text])
+        if used + tokens > token_budget:
+            continue
+        seen.add(key)
+        selected.append(passage)
+        used += tokens
+    return selected
+
+
+def knowledge_source(memory, query: str, k: int) -> Callable[[], List[Passage]]:
+    """ConversationDBManager.search_knowledge を検索元にする"""
+    def search():
+        return [Passage("knowledge", doc.page_content, rank, dict(doc.metadata or {}))
+                for rank, doc in enumerate(memory.search_knowledge(query, k=k))]
+    return search
+
+
+def memory_source(memory, query: str, k: int) -> Callable[[], List[Passage]]:
+    """ConversationDBManager.search_conversations を検索元にする（ナレッジは除く）"""
+    def search():
+        results = memory.search_conversations(query, limit=k)
+        return [Passage("memory", item["text"], rank, dict(item.get("metadata") or {}))
+                for rank, item in enumerate(results)
+                if (item.get("metadata") or {}).get("type") != "knowledge"]
+    return search
+
+
+class Retriever:
+    """
+    締め切り付きで複数の検索を並行に行い、参考情報を選ぶ
+
+    Attributes:
+        deadline: 全検索の締め切り（秒）
+        k: 各検索で取得する件数
+        token_budget: 差し込む参考情報のトークン数の上限
+        max_inflight: 同時に実行中・待機中にできる検索の数（超えた分は行わない）
+    """
+
+    def __init__(self, deadline: Optional[float] = None, k: Optional[int] = None,
+                 token_budget: Optional[int] = None,
+                 executor: Optional[ThreadPoolExecutor] = None,
+                 max_inflight: Optional[int] = None):
+        self.deadline = (deadline if deadline is not None
+                         else float(os.getenv("RAG_DEADLINE_MS", "300")) / 1000)
+        self.k = k if k is not None else int(os.getenv("RAG_K", "4"))
+        self.token_budget = (token_budget if token_budget is not None
+                             else int(os.getenv("RAG_TOKEN_BUDGET", "800")))
+        self._executor = executor
+        self.max_inflight = (max_inflight if max_inflight is not None
+                             else int(os.getenv("RAG_MAX_INFLIGHT", os.getenv("RAG_WORKERS", "8"))))
+        self._inflight = threading.BoundedSemaphore(self.max_inflight)
+
+    @classmethod
+    def from_env(cls) -> Optional["Retriever"]:
+        """RAG=0 なら None（検索しない）"""
+        if os.getenv("RAG", "1") == "0":
+            return None
+        return cls()
+
+    def sources_for(self, memory, query: str,
+                    knowledge=None) -> Dict[str, Callable[[], List[Passage]]]:
+        """
+        標準の検索元
+
+        Args:
+            memory: 会話を検索する ConversationDBManager（テナントのシャード）
+            knowledge: ナレッジを検索する ConversationDBManager。ナレッジは共有コレクションにだけ
+                取り込まれるため、シャードを memory に渡す場合は共有の DBマネージャーを渡す
+                （省略時は memory）
+        """
+        return {"knowledge": knowledge_source(knowledge or memory, query, self.k),
+                "memory": memory_source(memory, query, self.k)}
+
+    def retrieve(self, query: str, sources: Dict[str, Callable[[], List[Passage]]],
+                 exclude: Iterable[str] = ()) -> Retrieval:
+        """
+        検索元を並行に実行し、締め切りまでに返った結果から参考情報を選ぶ
+
+        Args:
+            query: 質問
+            sources: 検索元の名前 → Passage の一覧を返す関数
+            exclude: プロンプトに既に含まれるテキスト（重複して差し込まない）
+        """
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+        executor = self._executor or _shared_executor()
+
+        def timed(name, func):
+            begin = time.perf_counter()
+            try:
+                return func()
+            finally:
+                timings[name] = time.perf_counter() - begin
+
+        with tracing.start_span("rag.retrieve", {"deadline_ms": round(self.deadline * 1000)}) as span:
+            # 検索中のスパンを rag.retrieve の子にするため、コンテキストを引き継いで実行する
+            futures = {}
+            shed = 0
+            for name, func in sources.items():
+                if not self._inflight.acquire(blocking=False):
+                    shed += 1
+                    RAG_SOURCE_FAILURES.inc(source=name, reason="shed")
+                    continue
+                future = executor.submit(contextvars.copy_context().run, timed, name, func)
+                # 終了・取り消しのどちらでも枠を返す
+                future.add_done_callback(lambda _: self._inflight.release())
+                futures[future] = name
+            done, pending = wait(futures, timeout=self.deadline)
+
+            passages: List[Passage] = []
+            failed = 0
+            for future in pending:
+                future.cancel()  # 始まっていなければ実行しない
+                RAG_SOURCE_FAILURES.inc(source=futures[future], reason="timeout")
+            for future in done:
+                name = futures[future]
+                try:
+                    passages.extend(future.result())
+                except Exception as e:
+                    failed += 1
+                    RAG_SOURCE_FAILURES.inc(source=name, reason="error")
+                    logger.warning("検索 %s に失敗しました: %s", name, e)
+            timings["wait"] = time.perf_counter() - started
+
+            begin = time.perf_counter()
+            selected = select_within_budget(rerank(query, passages), self.token_budget, exclude)
+            timings["rerank"] = time.perf_counter() - begin
+            timings["total"] = time.perf_counter() - started
+            # 締め切りを過ぎた検索は後から timings に書き込むため、ここで確定させる
+            timings = dict(timings)
+
+            if shed and not futures:
+                result = "shed"
+            elif pending and len(pending) == len(futures):
+                result = "timeout"
+            elif pending or failed or shed:
+                result = "partial" if len(pending) + failed < len(futures) else "error"
+            else:
+                result = "ok" if selected else "empty"
+            if pending:
+                logger.warning("検索が締め切り(%.0fms)に間に合いませんでした: %s",
+                               self.deadline * 1000, ", ".join(sorted(futures[f] for f in pending)))
+            if shed:
+                logger.warning("検索プールが埋まっているため %d 件の検索を行いませんでした", shed)
+
+            tokens = count_tokens([p.text for p in selected]) if selected else 0
+            RAG_RETRIEVALS.inc(result=result)
+            span.set_attribute("rag.result", result)
+            span.set_attribute("rag.passages", len(selected))
+            span.set_attribute("rag.tokens", tokens)
+            for stage, seconds in timings.items():
+                metrics.observe_stage(f"rag_{stage}", seconds)
+                span.set_attribute(f"rag.{stage}_ms", round(seconds * 1000, 1))
+        return Retrieval(selected, timings, result, tokens)
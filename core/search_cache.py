@@ -0,0 +1,234 @@
+"""
+会話検索の結果キャッシュ
+search_conversations の結果を (クエリ, フィルタ, 世代) ごとに保存し、同じ検索や
+ページ送り・フィルタの切り替えの繰り返しで埋め込み生成とベクトル検索を省きます。
+
+- 世代（generation）: コレクションごとのカウンター。会話の保存・統合・削除で1つ進み、
+  古い世代の結果は使われない（期限切れではなく変更の有無で正確に無効化する）
+- 1段目: プロセス内の LRU（SEARCH_CACHE_SIZE 件、既定 1024）
+- 2段目: SQLite ファイル（SEARCH_CACHE_DB、既定 <CHROMA_DB_DIR>/search_cache.sqlite3）を
+  複数プロセスで共有する。世代もこのファイルで管理するため、ジョブワーカーや管理コマンドでの
+  保存・削除も Web プロセスの結果を無効化する
+- SEARCH_CACHE_DB=off では1段目のみ。他のプロセスでの変更は検知できないため、
+  エントリは SEARCH_CACHE_TTL 秒（既定 30）で期限切れにする
+- 結果は取得した件数（k）と一緒に保存し、k 以内のページは同じエントリから切り出す
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_REQUESTS = metrics.REGISTRY.counter(
+    "search_cache_requests_total",
+    "検索結果キャッシュの参照回数",
+    labelnames=("tier", "result"),
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_cache_generations (
+    scope TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_cache_entries (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    k INTEGER NOT NULL,
+    results TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+"""
+
+
+class _DiskTier:
+    """複数プロセスで共有する SQLite の2段目キャッシュ"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def generation(self, scope: str) -> int:
+        row = self._connect().execute(
+            "SELECT generation FROM search_cache_generations WHERE scope = ?", (scope,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, scope: str) -> int:
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO search_cache_generations (scope, generation) VALUES (?, 1)"
+            " ON CONFLICT(scope) DO UPDATE SET generation = generation + 1", (scope,))
+        generation = self.generation(scope)
+        # 古い世代のエントリは二度と使われないため消す
+        conn.execute("DELETE FROM search_cache_entries WHERE scope = ? AND generation < ?",
+                     (scope, generation))
+        return generation
+
+    def get(self, scope: str, key: str, generation: int) -> Optional[Tuple[int, list]]:
+        row = self._connect().execute(
+            "SELECT k, results FROM search_cache_entries"
+            " WHERE scope = ? AND key = ? AND generation = ?", (scope, key, generation)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def put(self, scope: str, key: str, generation: int, k: int, results: list):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO search_cache_entries"
+            " (scope, key, generation, k, results, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (scope, key, generation, k, json.dumps(results, ensure_ascii=False, default=str),
+             time.time()))
+
+
+class SearchCache:
+    """
+    世代で無効化する検索結果キャッシュ
+
+    Attributes:
+        capacity: プロセス内に保持するエントリ数（0 でキャッシュしない）
+        disk_path: 共有する SQLite ファイル（None なら1段目のみ）
+        ttl: 1段目のみの場合のエントリの有効期間（秒、0 は無期限）。
+            共有ファイルがあれば世代で正確に無効化できるため使わない
+    """
+
+    def __init__(self, capacity: Optional[int] = None, disk_path: Optional[str] = None,
+                 ttl: Optional[float] = None):
+        self.capacity = (int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+                         if capacity is None else capacity)
+        self.disk = None
+        if disk_path:
+            try:
+                self.disk = _DiskTier(disk_path)
+            except (OSError, sqlite3.Error) as e:
+                logger.warning("検索結果キャッシュの共有ファイルを開けません（プロセス内のみ）: %s (%s)",
+                               disk_path, e)
+        self.ttl = 0.0 if self.disk is not None else (
+            float(os.getenv("SEARCH_CACHE_TTL", "30")) if ttl is None else ttl)
+        # (scope, key) → (世代, k, 結果, 保存時刻)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[int, int, list, float]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def generation(self, scope: str) -> int:
+        """コレクションの現在の世代"""
+        if self.disk is not None:
+            return self.disk.generation(scope)
+        with self._lock:
+            return self._generations.get(scope, 0)
+
+    def invalidate(self, scope: str) -> int:
+        """コレクションの世代を進める（それまでの結果はすべて無効になる）"""
+        if self.disk is not None:
+            generation = self.disk.bump(scope)
+        else:
+            with self._lock:
+                generation = self._generations[scope] = self._generations.get(scope, 0) + 1
+        with self._lock:
+            for entry_key in [k for k in self._entries if k[0] == scope]:
+                del self._entries[entry_key]
+        return generation
+
+    def get(self, scope: str, key: str, need: int) -> Optional[List[dict]]:
+        """
+        先頭 need 件を含む結果があれば返す（無ければ None）
+
+        保存時の k 未満しか結果がない場合は、それが全件なので need に満たなくても返す。
+        """
+        if not self.enabled:
+            return None
+        generation = self.generation(scope)
+        with self._lock:
+            entry = self._entries.get((scope, key))
+            if entry is not None and self.ttl and time.monotonic() - entry[3] > self.ttl:
+                del self._entries[(scope, key)]
+                entry = None
+            if entry is not None and entry[0] == generation and \
+                    (entry[1] >= need or len(entry[2]) < entry[1]):
+                self._entries.move_to_end((scope, key))
+                SEARCH_CACHE_REQUESTS.inc(tier="memory", result="hit")
+                return copy.deepcopy(entry[2])
+        SEARCH_CACHE_REQUESTS.inc(tier="memory", result="miss")
+        if self.disk is None:
+            return None
+        found = self.disk.get(scope, key, generation)
+        if found is None or (found[0] < need and len(found[1]) >= found[0]):
+            SEARCH_CACHE_REQUESTS.inc(tier="disk", result="miss")
+            return None
+        SEARCH_CACHE_REQUESTS.inc(tier="disk", result="hit")
+        self._remember(scope, key, generation, found[0], found[1])
+        return copy.deepcopy(found[1])
+
+    def put(self, scope: str, key: str, generation: int, k: int, results: List[dict]):
+        """
+        検索結果を保存する
+
+        generation は検索を始める前に generation() で取得した値を渡す
+        （検索中に保存があった場合、その結果は次の参照で無効と判定される）。
+        """
+        if not self.enabled:
+            return
+        results = copy.deepcopy(results)
+        self._remember(scope, key, generation, k, results)
+        if self.disk is not None:
+            try:
+                self.disk.put(scope, key, generation, k, results)
+            except sqlite3.Error as e:
+                logger.warning("検索結果キャッシュの書き込みに失敗: %s", e)
+
+    def _remember(self, scope, key, generation, k, results):
+        with self._lock:
+            self._entries[(scope, key)] = (generation, k, results, time.monotonic())
+            self._entries.move_to_end((scope, key))
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+_default: Optional[SearchCache] = None
+_default_lock = threading.Lock()
+
+
+def default_disk_path() -> Optional[str]:
+    """共有ファイルの場所（SEARCH_CACHE_DB、既定は CHROMA_DB_DIR の中。off で使わない）"""
+    path = os.getenv("SEARCH_CACHE_DB")
+    if path is None:
+        return os.path.join(os.getenv("CHROMA_DB_DIR", "./data/chroma_db"), "search_cache.sqlite3")
+    if path.strip().lower() in ("", "0", "off", "none"):
+        return None
+    return path
+
+
+def default_cache() -> SearchCache:
+    """プロセスで共有するキャッシュ（SEARCH_CACHE_SIZE / SEARCH_CACHE_DB / SEARCH_CACHE_TTL で設定）"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = SearchCache(disk_path=default_disk_path())
+        return _default
@@ -0,0 +1,115 @@
+"""
+同一リクエストの重複実行抑止（singleflight）モジュール
+同じ入力の処理が実行中のときに届いた呼び出しは、新たに実行せず
+先行する呼び出し（リーダー）の結果を待って共有します。
+再送・ダブルクリック・チームで共有しているプロンプトなどで、
+モデル呼び出しや検索・埋め込みが重複するのを防ぎます。
+
+キャッシュではないため、リーダーの処理が終わった後の呼び出しは改めて実行されます。
+"""
+from typing import Callable, Dict, Tuple
+import hashlib
+import json
+import threading
+import unicodedata
+
+from core import metrics
+
+SINGLEFLIGHT_CALLS = metrics.REGISTRY.counter(
+    "singleflight_calls_total",
+    "singleflight 経由の呼び出し件数（role=leader は実行、follower は結果の共有）",
+    labelnames=("group", "role"),
+)
+SINGLEFLIGHT_RATIO = metrics.REGISTRY.gauge(
+    "singleflight_coalescing_ratio",
+    "重複として結果を共有した呼び出しの割合",
+    labelnames=("group",),
+)
+
+
+def normalize(text: str) -> str:
+    """キー用にテキストを正規化する（NFKC・前後の空白除去・連続空白の圧縮）"""
+    return " ".join(unicodedata.normalize("NFKC", text or "").split())
+
+
+def make_key(*parts) -> str:
+    """任意の値の組からキーを作る"""
+    data = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class Group:
+    """
+    キーごとに実行中の呼び出しを1つにまとめるグループ
+
+    Attributes:
+        name: メトリクス上のグループ名
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._leaders = 0
+        self._followers = 0
+
+    def do_shared(self, key: str, func: Callable, *args, **kwargs) -> Tuple[object, bool]:
+        """
+        func を実行する。同じキーの処理が実行中ならその結果を待つ
+
+        Returns:
+            (結果, 共有されたか)。共有された場合（follower）は True。
+            リーダーが例外を送出した場合は、待っていた呼び出しにも同じ例外を送出する。
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self._followers += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._leaders += 1
+                leader = True
+            self._record(leader)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def do(self, key: str, func: Callable, *args, **kwargs):
+        """do_shared() の結果だけを返す版"""
+        return self.do_shared(key, func, *args, **kwargs)[0]
+
+    def _record(self, leader: bool):
+        SINGLEFLIGHT_CALLS.inc(group=self.name, role="leader" if leader else "follower")
+        total = self._leaders + self._followers
+        SINGLEFLIGHT_RATIO.set(self._followers / total, group=self.name)
+
+    def inflight(self) -> int:
+        """実行中のキー数"""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,441 @@
+"""
+会話メモリ（Chroma の永続化ディレクトリ）の増分スナップショットモジュール
+稼働中のまま一貫したスナップショットを取り、指定した時刻の状態に復元します。
+
+保存先（SNAPSHOT_DIR、既定 ./data/snapshots）の構成:
+    chunks/ab/abcdef...     内容のハッシュ（sha256）を名前にしたチャンク
+                            （圧縮できるものだけ zlib 圧縮。先頭1バイトで区別）
+    manifests/<時刻>.json   スナップショットごとのファイル一覧とチャンクの並び
+
+一貫性:
+    - SQLite（*.sqlite3）は sqlite3 のオンラインバックアップ API で一時ファイルに複製してから
+      取り込む。数ページずつ複製するため書き込みを長時間止めない
+    - HNSW のセグメントファイルは読み取り前後で mtime / サイズが変わっていないことを確認し、
+      変わっていれば読み直す
+    - セグメントファイルを先に、SQLite を最後に取り込む。Chroma は起動時にセグメントの
+      永続化位置以降の更新を SQLite の埋め込みキューから再生するため、SQLite の方が新しい
+      組み合わせは正しく復元できる
+
+増分:
+    ファイルを固定長（既定 1 MiB、SQLite のページサイズの倍数）のチャンクに分け、
+    既に保存済みのハッシュは書き込まない。前回から mtime / サイズが変わっていない
+    セグメントファイルはハッシュ計算も省略する。
+
+同時実行:
+    保存先の .lock をロックする。create / restore は共有ロック（同時に複数実行してよい）、
+    prune は排他ロック。マニフェストを書く前の create のチャンクを prune が
+    参照されていないとみなして消すことはない。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from core import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_DIR = "./data/snapshots"
+CHUNK_SIZE = 1 << 20
+SQLITE_SUFFIXES = (".sqlite3", ".sqlite", ".db")
+# SQLite 本体と一緒に複製されるため個別には取り込まないファイル
+SKIP_SUFFIXES = ("-wal", "-shm", "-journal")
+_STAMP_FORMAT = "%Y%m%dT%H%M%S%f"
+LOCK_FILE = ".lock"
+# チャンクファイルの先頭1バイト（圧縮の有無）
+_ZLIB = b"z"
+_RAW = b"r"
+_PROBE_SIZE = 64 * 1024
+_MIN_RATIO = 0.9
+
+SNAPSHOT_BYTES = metrics.REGISTRY.counter(
+    "snapshot_bytes_total",
+    "スナップショットで読み込んだ / 新たに保存した（圧縮後）バイト数",
+    labelnames=("kind",),
+)
+SNAPSHOT_CHUNKS = metrics.REGISTRY.counter(
+    "snapshot_chunks_total",
+    "スナップショットのチャンク数（result=new は新規保存、reused は保存済み）",
+    labelnames=("result",),
+)
+
+
+class SnapshotError(RuntimeError):
+    """スナップショットが見つからない・壊れている"""
+
+
+@dataclass
+class FileEntry:
+    """スナップショット内の1ファイル"""
+    path: str  # 元のディレクトリからの相対パス（区切りは /）
+    size: int
+    mtime_ns: int
+    chunks: List[str] = field(default_factory=list)
+    sqlite: bool = False
+
+
+@dataclass
+class Manifest:
+    """1回分のスナップショット"""
+    id: str
+    created_at: str
+    source: str
+    files: List[FileEntry] = field(default_factory=list)
+    bytes_read: int = 0
+    bytes_written: int = 0
+    new_chunks: int = 0
+    reused_chunks: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def size(self) -> int:
+        return sum(entry.size for entry in self.files)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Manifest":
+        files = [FileEntry(**entry) for entry in data.pop("files", [])]
+        return cls(files=files, **data)
+
+
+class SnapshotStore:
+    """
+    チャンクとマニフェストの保存先
+
+    Attributes:
+        root: 保存先ディレクトリ
+        chunk_size: チャンクの大きさ（バイト）
+    """
+
+    def __init__(self, root: Optional[str] = None, chunk_size: int = CHUNK_SIZE,
+                 compress_level: int = 1):
+        self.root = root or os.getenv("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+        self.chunk_size = chunk_size
+        self.compress_level = compress_level
+        self.chunk_dir = os.path.join(self.root, "chunks")
+        self.manifest_dir = os.path.join(self.root, "manifests")
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+    @contextmanager
+    def lock(self, exclusive: bool = False):
+        """
+        保存先のロック（create / restore は共有、prune は排他）
+
+        別のプロセスのロックが外れるまで待つ。fcntl のない環境では常に排他ロックになる。
+        """
+        with open(os.path.join(self.root, LOCK_FILE), "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue  # LK_LOCK は約10秒で諦めるため待ち直す
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    # --- チャンク ---
+    def _chunk_path(self, digest: str) -> str:
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def has_chunk(self, digest: str) -> bool:
+        return os.path.exists(self._chunk_path(digest))
+
+    def put_chunk(self, data: bytes) -> Tuple[str, int]:
+        """チャンクを保存する（保存済みなら何もしない）。(ハッシュ, 書き込んだバイト数) を返す"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            SNAPSHOT_CHUNKS.inc(result="reused")
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        blob = self._encode(data)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+        SNAPSHOT_CHUNKS.inc(result="new")
+        SNAPSHOT_BYTES.inc(len(blob), kind="written")
+        return digest, len(blob)
+
+    def _encode(self, data: bytes) -> bytes:
+        """
+        先頭 64 KiB を試しに圧縮し、縮む場合だけ全体を圧縮する
+
+        埋め込みベクトルのようにほぼ圧縮できないデータで zlib に時間を使わないため。
+        """
+        probe = data[:_PROBE_SIZE]
+        if len(zlib.compress(probe, self.compress_level)) < len(probe) * _MIN_RATIO:
+            return _ZLIB + zlib.compress(data, self.compress_level)
+        return _RAW + data
+
+    def get_chunk(self, digest: str) -> bytes:
+        try:
+            with open(self._chunk_path(digest), "rb") as f:
+                blob = f.read()
+            data = zlib.decompress(blob[1:]) if blob[:1] == _ZLIB else blob[1:]
+        except (OSError, zlib.error) as e:
+            raise SnapshotError(f"チャンク {digest} を読み込めません: {e}") from e
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise SnapshotError(f"チャンク {digest} の内容が一致しません")
+        return data
+
+    # --- マニフェスト ---
+    def save_manifest(self, manifest: Manifest):
+        path = os.path.join(self.manifest_dir, f"{manifest.id}.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(asdict(manifest), f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+    def manifests(self) -> List[Manifest]:
+        """保存済みのスナップショットを古い順に返す"""
+        result = []
+        for name in sorted(os.listdir(self.manifest_dir)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.manifest_dir, name), encoding="utf-8") as f:
+                    result.append(Manifest.from_dict(json.load(f)))
+        return result
+
+    def find(self, at: Optional[datetime] = None) -> Manifest:
+        """
+        指定時刻以前で最新のスナップショットを返す（at が None なら最新）
+
+        at がタイムゾーン付きの場合はローカル時刻に直して比較する
+        （created_at はタイムゾーンなしのローカル時刻）。
+
+        Raises:
+            SnapshotError: 該当するスナップショットがない場合
+        """
+        if at is not None and at.tzinfo is not None:
+            at = at.astimezone().replace(tzinfo=None)
+        candidates = [m for m in self.manifests()
+                      if at is None or datetime.fromisoformat(m.created_at) <= at]
+        if not candidates:
+            raise SnapshotError(f"{at or '現在'} 以前のスナップショットがありません")
+        return candidates[-1]
+
+    def prune(self, keep: int) -> Tuple[int, int]:
+        """
+        新しい keep 件を残して古いスナップショットを消し、参照されないチャンクを削除する
+
+        実行中の create / restore が終わるまで待ってから行う（排他ロック）。
+
+        Returns:
+            (削除したスナップショット数, 削除したチャンク数)
+        """
+        with self.lock(exclusive=True):
+            return self._prune(keep)
+
+    def _prune(self, keep: int) -> Tuple[int, int]:
+        manifests = self.manifests()
+        removed = manifests[:-keep] if keep > 0 else manifests
+        for manifest in removed:
+            os.remove(os.path.join(self.manifest_dir, f"{manifest.id}.json"))
+        live = {digest for m in self.manifests() for entry in m.files for digest in entry.chunks}
+        chunks = 0
+        for prefix in os.listdir(self.chunk_dir):
+            directory = os.path.join(self.chunk_dir, prefix)
+            for name in os.listdir(directory):
+                if name not in live:
+                    os.remove(os.path.join(directory, name))
+                    chunks += 1
+        return len(removed), chunks
+
+
+def _is_sqlite(name: str) -> bool:
+    return name.endswith(SQLITE_SUFFIXES)
+
+
+def _backup_sqlite(src: str, dst: str, pages: int = 256):
+    """
+    オンラインバックアップ API で複製する
+
+    WAL モードでは読み取りトランザクションが書き込みを妨げないため一度に複製する
+    （途中で書き込まれてもやり直しにならない）。それ以外は pages ページごとに書き込み側へ譲る。
+    """
+    source = sqlite3.connect(src)
+    target = sqlite3.connect(dst)
+    try:
+        wal = source.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+        source.backup(target, pages=-1 if wal else pages, sleep=0.001)
+    finally:
+        target.close()
+        source.close()
+
+
+class Snapshotter:
+    """
+    ディレクトリの増分スナップショットを取る・復元する
+
+    Attributes:
+        source: 対象ディレクトリ（Chroma の persist_directory）
+        store: 保存先
+    """
+
+    def __init__(self, source: str, store: Optional[SnapshotStore] = None,
+                 retries: int = 3, workers: int = 4):
+        self.source = os.path.abspath(source)
+        self.store = store or SnapshotStore()
+        self.retries = retries
+        self.workers = max(1, workers)
+
+    def _walk(self) -> List[str]:
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(self.source):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.endswith(SKIP_SUFFIXES) or name.endswith(".tmp"):
+                    continue
+                paths.append(os.path.relpath(os.path.join(dirpath, name), self.source))
+        # SQLite は最後に取り込む（モジュールの説明を参照）
+        return sorted(paths, key=lambda p: (_is_sqlite(p), p))
+
+    def _store_file(self, path: str, manifest: Manifest) -> List[str]:
+        """ファイルをチャンクに分けて保存する（ハッシュ計算と圧縮はスレッドで並列に行う）"""
+        futures = []
+        with open(path, "rb") as f, ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                data = f.read(self.store.chunk_size)
+                if not data:
+                    break
+                manifest.bytes_read += len(data)
+                SNAPSHOT_BYTES.inc(len(data), kind="read")
+                futures.append(pool.submit(self.store.put_chunk, data))
+                # 読み込み済みで未処理のチャンクを workers の2倍までに抑える
+                if len(futures) > self.workers * 2:
+                    futures[-self.workers * 2 - 1].result()
+        chunks = []
+        for future in futures:
+            digest, written = future.result()
+            chunks.append(digest)
+            manifest.bytes_written += written
+            if written:
+                manifest.new_chunks += 1
+            else:
+                manifest.reused_chunks += 1
+        return chunks
+
+    def _snapshot_segment(self, rel: str, previous: Dict[str, FileEntry],
+                          manifest: Manifest) -> FileEntry:
+        path = os.path.join(self.source, rel)
+        for _ in range(self.retries + 1):
+            before = os.stat(path)
+            old = previous.get(rel.replace(os.sep, "/"))
+            if old is not None and (old.size, old.mtime_ns) == (before.st_size, before.st_mtime_ns) \
+                    and all(self.store.has_chunk(d) for d in old.chunks):
+                manifest.reused_chunks += len(old.chunks)
+                SNAPSHOT_CHUNKS.inc(len(old.chunks), result="reused")
+                return FileEntry(old.path, old.size, old.mtime_ns, list(old.chunks))
+            chunks = self._store_file(path, manifest)
+            after = os.stat(path)
+            if (before.st_size, before.st_mtime_ns) == (after.st_size, after.st_mtime_ns):
+                return FileEntry(rel.replace(os.sep, "/"), after.st_size, after.st_mtime_ns, chunks)
+            logger.debug("読み取り中に更新されたため読み直します: %s", rel)
+        raise SnapshotError(f"{rel} が更新され続けているため一貫した複製を取れません")
+
+    def _snapshot_sqlite(self, rel: str, manifest: Manifest) -> FileEntry:
+        path = os.path.join(self.source, rel)
+        fd, tmp = tempfile.mkstemp(suffix=".sqlite3", dir=self.store.root)
+        os.close(fd)
+        try:
+            _backup_sqlite(path, tmp)
+            chunks = self._store_file(tmp, manifest)
+            stat = os.stat(path)
+            return FileEntry(rel.replace(os.sep, "/"), os.path.getsize(tmp),
+                             stat.st_mtime_ns, chunks, sqlite=True)
+        finally:
+            os.remove(tmp)
+
+    def create(self) -> Manifest:
+        """スナップショットを取る（保存先の共有ロックを持って行う）"""
+        with self.store.lock():
+            return self._create()
+
+    def _create(self) -> Manifest:
+        started = time.perf_counter()
+        now = datetime.now()
+        manifest = Manifest(id=now.strftime(_STAMP_FORMAT), created_at=now.isoformat(),
+                            source=self.source)
+        try:
+            previous = {entry.path: entry for entry in self.store.find().files}
+        except SnapshotError:
+            previous = {}
+        with tracing.start_span("snapshot.create", {"source": self.source}):
+            for rel in self._walk():
+                if _is_sqlite(rel):
+                    entry = self._snapshot_sqlite(rel, manifest)
+                else:
+                    entry = self._snapshot_segment(rel, previous, manifest)
+                manifest.files.append(entry)
+        manifest.elapsed = time.perf_counter() - started
+        self.store.save_manifest(manifest)
+        logger.info("スナップショットを作成: %s（%dファイル %.1f MiB, 新規 %.1f MiB, %.1f秒）",
+                    manifest.id, len(manifest.files), manifest.size / 2**20,
+                    manifest.bytes_written / 2**20, manifest.elapsed)
+        return manifest
+
+    def restore(self, target: Optional[str] = None, at: Optional[datetime] = None,
+                workers: int = 4) -> Manifest:
+        """
+        指定時刻以前で最新のスナップショットを target に復元する
+
+        一時ディレクトリに展開してから入れ替えるため、途中で失敗しても target は壊れない。
+        既存の target は <target>.before-restore-<時刻> に退避する。
+        復元はアプリケーション（Chroma を開いているプロセス）を止めてから行うこと。
+        """
+        with self.store.lock():
+            return self._restore(target, at, workers)
+
+    def _restore(self, target: Optional[str], at: Optional[datetime], workers: int) -> Manifest:
+        target = os.path.abspath(target or self.source)
+        manifest = self.store.find(at)
+        parent = os.path.dirname(target)
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".restore-", dir=parent)
+
+        def write(entry: FileEntry):
+            path = os.path.join(staging, *entry.path.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                for digest in entry.chunks:
+                    f.write(self.store.get_chunk(digest))
+
+        started = time.perf_counter()
+        try:
+            with tracing.start_span("snapshot.restore", {"snapshot": manifest.id}), \
+                    ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                list(pool.map(write, manifest.files))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        if os.path.exists(target):
+            os.replace(target, f"{target}.before-restore-{datetime.now().strftime(_STAMP_FORMAT)}")
+        os.replace(staging, target)
+        logger.info("スナップショット %s を %s に復元しました（%.1f MiB, %.1f秒）",
+                    manifest.id, target, manifest.size / 2**20, time.perf_counter() - started)
+        return manifest
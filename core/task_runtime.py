@@ -0,0 +1,308 @@
+"""
+タスク間メッセージの非同期ランタイム
+TaskManager に登録された BaseTask を asyncio 上で並行に動かし、
+InternalIFTask のメッセージをタスクIDごとの受信キュー（inbox）へ配送します。
+
+- inbox は上限付きの優先度キュー。満杯なら送信側が待たされる（バックプレッシャー）
+- 優先度は小さいほど先に処理（同じ優先度なら到着順）
+- send() は処理結果の Future を返し、処理前に cancel() すればそのメッセージは破棄される
+- タスクの start() は別スレッドで実行するため、CUI の input() ループなどが
+  他タスクの処理を止めることはない
+- タスクごとの処理件数・スループット・キュー滞留時間を stats() で取得できる
+
+宛先タスクは handle(payload) を実装している必要があります（async def でも可）。
+同時に処理するメッセージ数はタスクの concurrency 属性（既定 1）で指定します。
+cpu_bound = True のタスクは handle の代わりに staticmethod の cpu_work(payload) を
+core.process_offload のプロセスプールで実行します（cpu_work がなければ open() で TypeError）。
+"""
+from dataclasses import dataclass
+from typing import Dict, Optional, Union
+import asyncio
+import inspect
+import itertools
+import logging
+import time
+
+from core import internal_if_codec, metrics, tracing
+from core.process_offload import ProcessOffloader
+from core.internal_if_codec import APIPayload
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+DEFAULT_INBOX_SIZE = 100
+
+
+class InboxFullError(RuntimeError):
+    """宛先の inbox が満杯で、指定時間内に送信できなかった場合の例外"""
+
+
+class UnknownTaskError(LookupError):
+    """宛先タスクが登録されていない（または handle を持たない）場合の例外"""
+
+
+@dataclass
+class TaskStats:
+    """タスクごとの処理統計"""
+    received: int = 0
+    processed: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    queue_wait_total: float = 0.0
+    queue_wait_max: float = 0.0
+    busy_seconds: float = 0.0
+
+    def snapshot(self, elapsed: float, queued: int) -> dict:
+        done = self.processed + self.failed
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "queued": queued,
+            "throughput_per_s": round(done / elapsed, 2) if elapsed else 0.0,
+            "queue_wait_avg_ms": round(self.queue_wait_total / done * 1000, 3) if done else 0.0,
+            "queue_wait_max_ms": round(self.queue_wait_max * 1000, 3),
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+
+class TaskRuntime:
+    """
+    BaseTask 群を asyncio 上で動かすランタイム
+
+    Attributes:
+        tasks: {タスクID: タスク}（TaskManager.tasks と同じもの）
+        inbox_size: 各 inbox の上限
+    """
+
+    def __init__(self, tasks: Dict[int, object], inbox_size: int = DEFAULT_INBOX_SIZE,
+                 offloader: Optional[ProcessOffloader] = None):
+        self.tasks = tasks
+        self.inbox_size = inbox_size
+        self.offloader = offloader
+        self._inboxes: Dict[int, asyncio.PriorityQueue] = {}
+        self._workers: Dict[int, list] = {}
+        self._stats: Dict[int, TaskStats] = {}
+        self._seq = itertools.count()
+        self._started_at: Optional[float] = None
+
+    # --- 送信 ---
+    async def send(self, dst: int, payload: APIPayload, priority: int = PRIORITY_NORMAL,
+                   timeout: Optional[float] = None) -> asyncio.Future:
+        """
+        宛先タスクの inbox にメッセージを入れる
+
+        Args:
+            dst: 宛先タスクID
+            payload: 送信するメッセージ
+            priority: 優先度（小さいほど先に処理）
+            timeout: inbox が満杯の場合に待つ最大秒数（None なら空くまで待つ）
+        Returns:
+            asyncio.Future: handle() の戻り値（例外）が設定される Future
+        Raises:
+            UnknownTaskError: 宛先が存在しない場合
+            InboxFullError: timeout 内に inbox が空かなかった場合
+        """
+        inbox = self._inboxes.get(int(dst))
+        if inbox is None:
+            raise UnknownTaskError(f"宛先タスクが見つかりません: dst={dst}")
+        future = asyncio.get_running_loop().create_future()
+        item = (priority, next(self._seq), time.perf_counter(), payload, future)
+        try:
+            await asyncio.wait_for(inbox.put(item), timeout)
+        except asyncio.TimeoutError:
+            raise InboxFullError(f"inbox が満杯です: dst={dst}") from None
+        self._stats[int(dst)].received += 1
+        return future
+
+    def try_send(self, dst: int, payload: APIPayload,
+                 priority: int = PRIORITY_NORMAL) -> Optional[asyncio.Future]:
+        """待たずに送信する。inbox が満杯なら None を返す"""
+        inbox = self._inboxes.get(int(dst))
+        if inbox is None:
+            raise UnknownTaskError(f"宛先タスクが見つかりません: dst={dst}")
+        future = asyncio.get_running_loop().create_future()
+        try:
+            inbox.put_nowait((priority, next(self._seq), time.perf_counter(), payload, future))
+        except asyncio.QueueFull:
+            return None
+        self._stats[int(dst)].received += 1
+        return future
+
+    async def route(self, message: Union[str, bytes, APIPayload],
+                    priority: int = PRIORITY_NORMAL,
+                    timeout: Optional[float] = None) -> asyncio.Future:
+        """InternalIFTask.send() が作ったメッセージ（text / binary）を宛先へ配送する"""
+        if isinstance(message, APIPayload):
+            payload = message
+        elif isinstance(message, str):
+            payload = internal_if_codec.decode_text(message)
+        else:
+            payload = internal_if_codec.decode_frame(message)
+        if payload is None:
+            raise ValueError("内部IFメッセージではありません")
+        return await self.send(int(payload.dst), payload, priority, timeout)
+
+    async def request(self, dst: int, payload: APIPayload, priority: int = PRIORITY_NORMAL,
+                      timeout: Optional[float] = None):
+        """送信して処理結果を待つ"""
+        return await (await self.send(dst, payload, priority, timeout))
+
+    # --- 受信・処理 ---
+    async def _call(self, task, payload: APIPayload):
+        handler = getattr(task, "handle", None)
+        with tracing.attach(payload.trace), tracing.start_span(
+            "task.handle", {"task.id": task.id, "task.name": task.name,
+                            "message.order": payload.order}
+        ):
+            if getattr(task, "cpu_bound", False):
+                return await self.offloader.run(type(task).cpu_work, payload)
+            if inspect.iscoroutinefunction(handler):
+                return await handler(payload)
+            # 同期処理はスレッドで実行（contextvars はスレッドに引き継がれる）
+            return await asyncio.to_thread(handler, payload)
+
+    async def _worker(self, task_id: int):
+        task = self.tasks[task_id]
+        inbox = self._inboxes[task_id]
+        stats = self._stats[task_id]
+        while True:
+            _, _, enqueued, payload, future = await inbox.get()
+            try:
+                if future.cancelled():
+                    stats.cancelled += 1
+                    continue
+                wait = time.perf_counter() - enqueued
+                stats.queue_wait_total += wait
+                stats.queue_wait_max = max(stats.queue_wait_max, wait)
+                metrics.observe_stage("task_queue_wait", wait)
+                started = time.perf_counter()
+                try:
+                    result = await self._call(task, payload)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    stats.failed += 1
+                    logger.error("[%s] メッセージ処理エラー: %s", task.name, e)
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    stats.processed += 1
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    stats.busy_seconds += time.perf_counter() - started
+            finally:
+                inbox.task_done()
+
+    # --- ライフサイクル ---
+    def open(self):
+        """
+        handle を持つタスクの inbox とワーカーを用意する（実行中のループ内で呼ぶ）
+
+        Raises:
+            TypeError: cpu_bound = True のタスクに staticmethod の cpu_work がない場合
+                （最初のメッセージの処理時ではなく、起動時に検出する）
+        """
+        self._started_at = time.perf_counter()
+        for task_id, task in self.tasks.items():
+            cpu_bound = getattr(task, "cpu_bound", False)
+            if not (hasattr(task, "handle") or cpu_bound) or task_id in self._inboxes:
+                continue
+            if cpu_bound and not isinstance(
+                    inspect.getattr_static(type(task), "cpu_work", None), staticmethod):
+                raise TypeError(f"cpu_bound のタスク {task_id} に staticmethod の cpu_work がありません")
+            if cpu_bound and self.offloader is None:
+                self.offloader = ProcessOffloader()
+            self._inboxes[task_id] = asyncio.PriorityQueue(self.inbox_size)
+            self._stats[task_id] = TaskStats()
+            self._workers[task_id] = [
+                asyncio.create_task(self._worker(task_id), name=f"task-{task_id}-{i}")
+                for i in range(max(1, getattr(task, "concurrency", 1)))
+            ]
+
+    async def cancel(self, task_id: int):
+        """タスクのワーカーを止め、未処理のメッセージをキャンセルする"""
+        workers = self._workers.pop(task_id, [])
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        inbox = self._inboxes.pop(task_id, None)
+        while inbox is not None and not inbox.empty():
+            future = inbox.get_nowait()[4]
+            if future.cancel():
+                self._stats[task_id].cancelled += 1
+
+    async def join(self):
+        """現在キューにあるメッセージがすべて処理されるまで待つ"""
+        await asyncio.gather(*(inbox.join() for inbox in self._inboxes.values()))
+
+    async def close(self):
+        for task_id in list(self._workers):
+            await self.cancel(task_id)
+        if self.offloader is not None:
+            await asyncio.to_thread(self.offloader.shutdown)
+
+    @staticmethod
+    def _start(task):
+        with tracing.start_span("task.start", {"task.id": task.id, "task.name": task.name}):
+            task.start()
+
+    async def run(self, main=None):
+        """
+        全タスクの start() をスレッドで並行に起動し、終了まで動かす
+
+        main（コルーチン）を渡した場合はその完了まで、渡さない場合は全タスクの
+        start() が戻るまで動かす。終了時には全タスクの stop() を呼ぶ。
+        スレッドで実行中の start() は強制終了できないため、stop() で
+        ループを抜けられるように実装しておくこと。
+        """
+        self.open()
+        starters = [asyncio.to_thread(self._start, task) for task in self.tasks.values()]
+        background = []
+        try:
+            if main is None:
+                await _run_group(starters)
+            else:
+                background = [asyncio.ensure_future(s) for s in starters]
+                await _run_group([main])
+        finally:
+            await self.close()
+            for task in self.tasks.values():
+                try:
+                    task.stop()
+                except Exception as e:
+                    logger.error("[%s] 停止エラー: %s", task.name, e)
+            for starter in background:
+                if starter.done() and not starter.cancelled() and starter.exception():
+                    logger.error("起動エラー: %s", starter.exception())
+
+    def stats(self) -> Dict[int, dict]:
+        """タスクIDごとの処理統計（プロセスプールの稼働状況は offloader.stats()）"""
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        return {
+            task_id: stats.snapshot(elapsed, self._inboxes[task_id].qsize()
+                                    if task_id in self._inboxes else 0)
+            for task_id, stats in self._stats.items()
+        }
+
+
+async def _run_group(coros: list):
+    """asyncio.TaskGroup（3.11+）でまとめて実行する。3.10 では gather で代替"""
+    if hasattr(asyncio, "TaskGroup"):
+        async with asyncio.TaskGroup() as group:
+            for coro in coros:
+                group.create_task(coro)
+        return
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,171 @@
+"""
+ユーザー（テナント）ごとの会話メモリの分割モジュール
+会話メモリをテナントごとの Chroma コレクション（シャード）に分け、
+検索や履歴の読み出しが他のユーザーの件数に影響されないようにします。
+
+- テナントキー: TENANT_MODE=user のとき、認証済みユーザーは "u<ユーザーID>"、
+  未認証はセッションキーから "s<ハッシュ>"
+- TENANT_MODE=shared（既定）では全員が従来どおり1つのコレクションを共有する。
+  共有コレクションの既存の会話はテナントに振り分ける手段がまだないため、
+  user に切り替えると各ユーザーからは見えなくなる（管理コマンドは --all-tenants / --tenant で
+  シャードも対象にできる）
+- シャード: <CHROMA_COLLECTION_NAME>__t_<テナントキー>。初回アクセス時に開き、
+  開いているシャードは LRU で TENANT_MAX_OPEN（既定 64）個までに抑える
+- 割り当て: 1テナントあたりの会話数の上限 TENANT_MAX_CONVERSATIONS（0 は無制限）
+"""
+from collections import OrderedDict
+from http.cookies import SimpleCookie
+from typing import Callable, Dict, Generic, Optional, TypeVar
+import hashlib
+import logging
+import os
+import re
+import threading
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+SHARD_SEPARATOR = "__t_"
+
+TENANT_SHARDS_OPEN = metrics.REGISTRY.gauge(
+    "tenant_shards_open",
+    "開いているテナントのシャード数",
+)
+TENANT_SHARD_EVENTS = metrics.REGISTRY.counter(
+    "tenant_shard_events_total",
+    "テナントのシャードの操作回数（event=open / hit / evict）",
+    labelnames=("event",),
+)
+TENANT_QUOTA_REJECTED = metrics.REGISTRY.counter(
+    "tenant_quota_rejected_total",
+    "割り当て超過で保存しなかった会話の件数",
+)
+
+T = TypeVar("T")
+
+
+def tenant_mode() -> str:
+    return os.getenv("TENANT_MODE", "shared").lower()
+
+
+def _hashed(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+
+
+def tenant_key(request) -> str:
+    """
+    Django のリクエストからテナントキーを求める
+
+    未認証でセッションがまだない場合はセッションを作る（応答で Cookie が設定される）。
+    """
+    if tenant_mode() == "shared":
+        return DEFAULT_TENANT
+    user = getattr(request, "user", None)
+    if user is not None and getattr(user, "is_authenticated", False):
+        return f"u{user.pk}"
+    session = getattr(request, "session", None)
+    if session is None:
+        return DEFAULT_TENANT
+    if not session.session_key:
+        session.save()
+    return f"s{_hashed(session.session_key)}"
+
+
+def tenant_key_from_scope(scope: dict) -> Optional[str]:
+    """
+    ASGI スコープ（WebSocket）の Cookie からテナントキーを求める
+
+    Django のセッションを読み、ログイン済みならユーザーID、それ以外はセッションキーを使う。
+    セッションの Cookie がない・無効な場合は None（共有コレクションには割り当てない）。
+    """
+    if tenant_mode() == "shared":
+        return DEFAULT_TENANT
+    cookies = SimpleCookie()
+    for name, value in scope.get("headers") or []:
+        if name == b"cookie":
+            cookies.load(value.decode("latin-1"))
+    from django.conf import settings
+    morsel = cookies.get(getattr(settings, "SESSION_COOKIE_NAME", "sessionid"))
+    if morsel is None or not morsel.value:
+        return None
+    from importlib import import_module
+    store = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value)
+    user_id = store.get("_auth_user_id")
+    if user_id is not None:
+        return f"u{user_id}"
+    if not store.exists(morsel.value):
+        return None
+    return f"s{_hashed(morsel.value)}"
+
+
+def collection_name(base: str, tenant: str) -> str:
+    """
+    テナントのコレクション名（default は base そのもの）
+
+    Chroma のコレクション名の制約（英数字と ._-、63文字以内）に合わせる。
+    """
+    if tenant == DEFAULT_TENANT:
+        return base
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", tenant).strip("-_")
+    name = f"{base}{SHARD_SEPARATOR}{slug}"
+    if len(name) > 63 or slug != tenant:
+        name = f"{base[:40]}{SHARD_SEPARATOR}{_hashed(tenant)}"
+    return name
+
+
+class ShardRegistry(Generic[T]):
+    """
+    テナントごとのシャード（ConversationDBManager など）を遅延生成して LRU で保持する
+
+    Attributes:
+        factory: テナントキーからシャードを作る関数
+        capacity: 同時に開いておくシャード数
+    """
+
+    def __init__(self, factory: Callable[[str], T], capacity: Optional[int] = None):
+        self.factory = factory
+        self.capacity = capacity or int(os.getenv("TENANT_MAX_OPEN", "64"))
+        self._shards: "OrderedDict[str, T]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._opening: Dict[str, threading.Lock] = {}
+
+    def get(self, tenant: str) -> T:
+        """シャードを返す（開いていなければ開く。同じテナントを同時に開くことはない）"""
+        with self._lock:
+            shard = self._shards.get(tenant)
+            if shard is not None:
+                self._shards.move_to_end(tenant)
+                TENANT_SHARD_EVENTS.inc(event="hit")
+                return shard
+            opening = self._opening.setdefault(tenant, threading.Lock())
+        with opening:
+            with self._lock:
+                shard = self._shards.get(tenant)
+                if shard is not None:
+                    return shard
+            shard = self.factory(tenant)
+            TENANT_SHARD_EVENTS.inc(event="open")
+            with self._lock:
+                self._shards[tenant] = shard
+                self._opening.pop(tenant, None)
+                while len(self._shards) > self.capacity:
+                    evicted, _ = self._shards.popitem(last=False)
+                    TENANT_SHARD_EVENTS.inc(event="evict")
+                    logger.debug("テナントのシャードを閉じました: %s", evicted)
+                TENANT_SHARDS_OPEN.set(len(self._shards))
+        return shard
+
+    def peek(self, tenant: str) -> Optional[T]:
+        """開いている場合だけシャードを返す"""
+        with self._lock:
+            return self._shards.get(tenant)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._shards)
+
+    def __contains__(self, tenant: str):
+        with self._lock:
+            return tenant in self._shards
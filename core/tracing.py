@@ -0,0 +1,290 @@
+"""
+軽量トレーシングモジュール（OpenTelemetry風）
+HTTPビューから AITask.respond、埋め込み生成、Chroma書き込みまでを
+1つのトレースIDで追跡できるようにします。
+
+- スパンの親子関係は contextvars で同一スレッド／コルーチン内に伝搬
+- タスク間メッセージには traceparent 形式の文字列で伝搬
+- エクスポータはメモリ内またはローカルファイル(JSON Lines)
+- サンプリング率はルートスパンで決定し、子スパンはそれを継承
+
+環境変数:
+    TRACE_SAMPLE_RATE: サンプリング率 0.0〜1.0（デフォルト 0.0 = 無効）
+    TRACE_EXPORTER: memory / file（デフォルト memory）
+    TRACE_FILE: file エクスポータの出力先（デフォルト logs/traces.jsonl）
+"""
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SpanContext:
+    """スパンの識別情報（プロセス・タスク境界を越えて伝搬する部分）"""
+    trace_id: str
+    span_id: str
+    sampled: bool = True
+
+    def to_header(self) -> str:
+        """traceparent 形式 (00-<trace>-<span>-<flags>) の文字列に変換"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @classmethod
+    def from_header(cls, value: Optional[str]) -> Optional["SpanContext"]:
+        """traceparent 形式の文字列から復元（不正な場合は None）"""
+        if not value:
+            return None
+        parts = value.strip().split("-")
+        if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            return None
+        return cls(trace_id=parts[1], span_id=parts[2], sampled=parts[3] == "01")
+
+
+@dataclass
+class Span:
+    """1区間の処理を表すスパン"""
+    name: str
+    context: SpanContext
+    parent_id: Optional[str] = None
+    attributes: Dict[str, object] = field(default_factory=dict)
+    start_time: float = field(default_factory=time.time)
+    end_time: Optional[float] = None
+    status: str = "ok"
+    _start_perf: float = field(default_factory=time.perf_counter, repr=False)
+    duration: Optional[float] = None
+
+    @property
+    def trace_id(self) -> str:
+        return self.context.trace_id
+
+    @property
+    def span_id(self) -> str:
+        return self.context.span_id
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException):
+        self.status = "error"
+        self.attributes["exception.type"] = type(exc).__name__
+        self.attributes["exception.message"] = str(exc)
+
+    def finish(self):
+        self.end_time = time.time()
+        self.duration = time.perf_counter() - self._start_perf
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start_time,
+            "duration_ms": round((self.duration or 0) * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class InMemoryExporter:
+    """直近のスパンをメモリ上のリングバッファに保持するエクスポータ"""
+
+    def __init__(self, max_spans: int = 10000):
+        self._spans = deque(maxlen=max_spans)
+
+    def export(self, span: Span):
+        self._spans.append(span)
+
+    def spans(self, trace_id: Optional[str] = None) -> List[Span]:
+        spans = list(self._spans)
+        if trace_id:
+            spans = [s for s in spans if s.trace_id == trace_id]
+        return spans
+
+    def clear(self):
+        self._spans.clear()
+
+
+class FileExporter:
+    """スパンをJSON Lines形式でローカルファイルに追記するエクスポータ"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+# 別タスク・別プロセスから受け取った親コンテキスト
+_remote_parent: ContextVar[Optional[SpanContext]] = ContextVar("remote_parent", default=None)
+
+
+class Tracer:
+    """スパンの生成・サンプリング・エクスポートを行うトレーサ"""
+
+    def __init__(self, exporter=None, sample_rate: float = 0.0):
+        self.exporter = exporter or InMemoryExporter()
+        self.sample_rate = sample_rate
+
+    def _should_sample(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    @contextmanager
+    def start_span(self, name: str, attributes: Optional[dict] = None):
+        """
+        スパンを開始し、with ブロック終了時に記録する
+
+        Args:
+            name: スパン名（例: "db.save_conversation"）
+            attributes: 付加情報
+        Yields:
+            Span: 開始したスパン
+        """
+        parent = _current_span.get()
+        if parent is not None:
+            parent_ctx = parent.context
+        else:
+            parent_ctx = _remote_parent.get()
+
+        if parent_ctx is not None:
+            ctx = SpanContext(parent_ctx.trace_id, _new_id(8), parent_ctx.sampled)
+            parent_id = parent_ctx.span_id
+        else:
+            ctx = SpanContext(_new_id(16), _new_id(8), self._should_sample())
+            parent_id = None
+
+        span = Span(name=name, context=ctx, parent_id=parent_id,
+                    attributes=dict(attributes or {}))
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish()
+            if ctx.sampled:
+                try:
+                    self.exporter.export(span)
+                except Exception as e:
+                    logger.warning(f"スパンのエクスポートに失敗: {e}")
+
+
+def _new_id(num_bytes: int) -> str:
+    return os.urandom(num_bytes).hex()
+
+
+def _build_default_tracer() -> Tracer:
+    try:
+        sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+    except ValueError:
+        logger.warning("TRACE_SAMPLE_RATE の値が不正です。0として扱います")
+        sample_rate = 0.0
+    if os.getenv("TRACE_EXPORTER", "memory").lower() == "file":
+        exporter = FileExporter(os.getenv("TRACE_FILE", "logs/traces.jsonl"))
+    else:
+        exporter = InMemoryExporter()
+    return Tracer(exporter=exporter, sample_rate=sample_rate)
+
+
+_tracer = _build_default_tracer()
+
+
+def get_tracer() -> Tracer:
+    """プロセス共通のトレーサを返す"""
+    return _tracer
+
+
+def set_tracer(tracer: Tracer):
+    """プロセス共通のトレーサを差し替える（テストや設定変更用）"""
+    global _tracer
+    _tracer = tracer
+
+
+def start_span(name: str, attributes: Optional[dict] = None):
+    """共通トレーサでスパンを開始する（with 文で使用）"""
+    return _tracer.start_span(name, attributes)
+
+
+def current_span() -> Optional[Span]:
+    """現在アクティブなスパンを返す"""
+    return _current_span.get()
+
+
+def current_trace_header() -> str:
+    """現在のトレースコンテキストを traceparent 形式で返す（無い場合は空文字）"""
+    span = _current_span.get()
+    if span is not None:
+        return span.context.to_header()
+    remote = _remote_parent.get()
+    return remote.to_header() if remote else ""
+
+
+def current_trace_id() -> str:
+    """ログ相関用に現在のトレースIDを返す（無い場合は "-"）"""
+    span = _current_span.get()
+    if span is not None:
+        return span.trace_id
+    remote = _remote_parent.get()
+    return remote.trace_id if remote else "-"
+
+
+@contextmanager
+def attach(header: Optional[str]):
+    """
+    受信したトレースコンテキストを親として with ブロック内に適用する
+
+    Args:
+        header: traceparent 形式の文字列（空・不正な場合は何もしない）
+    """
+    ctx = SpanContext.from_header(header)
+    if ctx is None:
+        yield
+        return
+    token = _remote_parent.set(ctx)
+    span_token = _current_span.set(None)
+    try:
+        yield
+    finally:
+        _current_span.reset(span_token)
+        _remote_parent.reset(token)
+
+
+def traced(name: Optional[str] = None):
+    """関数呼び出しをスパンで囲むデコレータ"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _tracer.start_span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TraceContextFilter(logging.Filter):
+    """ログレコードに trace_id を付与し、ログとトレースを相関させるフィルタ"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id()
+        return True
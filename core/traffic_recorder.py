@@ -0,0 +1,176 @@
+"""
+トラフィック記録モジュール
+chat_api / search_memory へのリクエストを匿名化して追記専用ログに記録し、
+後から bench.replay で同じトラフィックを再生できるようにします。
+
+記録は環境変数 TRAFFIC_RECORD_PATH が設定されている場合のみ有効です（オプトイン）。
+1行1レコードのJSON（短いキー名）で、以下を保持します:
+    t:  記録開始からの経過秒
+    k:  種別（chat / search）
+    q:  匿名化したリクエスト内容
+    ms: サーバー側の処理時間（ミリ秒）
+    s:  HTTPステータス
+    p:  プロバイダー応答（応答テキスト・トークン数・TTFT）
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_PHONE_RE = re.compile(r"(?<!\d)(?:\+?\d{1,3}[-\s]?)?(?:\d{2,4}[-\s]?){2}\d{3,4}(?!\d)")
+
+# リクエスト処理中にプロバイダー応答を集めるための入れ物
+_provider_calls: ContextVar[Optional[list]] = ContextVar("provider_calls", default=None)
+
+
+def anonymize(text: str) -> str:
+    """メールアドレスと電話番号をプレースホルダに置き換える"""
+    if not text:
+        return text
+    text = _EMAIL_RE.sub("<email>", text)
+    return _PHONE_RE.sub("<phone>", text)
+
+
+class TrafficRecorder:
+    """
+    匿名化したトラフィックを追記専用ファイルに書き出すレコーダー
+
+    Attributes:
+        path: 出力先ファイル（None の場合は無効）
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._lock = threading.Lock()
+        self._origin = time.time()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            logger.info("トラフィック記録を有効化: %s", path)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def write(self, kind: str, request: dict, started: float, elapsed: float,
+              status: int, provider: Optional[list] = None):
+        """1リクエスト分のレコードを追記する"""
+        if not self.enabled:
+            return
+        entry = {
+            "t": round(started - self._origin, 4),
+            "k": kind,
+            "q": request,
+            "ms": round(elapsed * 1000, 2),
+            "s": status,
+        }
+        if provider:
+            entry["p"] = provider
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+_recorder = TrafficRecorder(os.getenv("TRAFFIC_RECORD_PATH"))
+
+
+def get_recorder() -> TrafficRecorder:
+    return _recorder
+
+
+def set_recorder(recorder: TrafficRecorder):
+    """レコーダーを差し替える（テストや実行時の切り替え用）"""
+    global _recorder
+    _recorder = recorder
+
+
+def note_provider_response(text: str, usage=None, ttft: Optional[float] = None):
+    """
+    プロバイダーの応答を現在のリクエストの記録に追加する
+
+    記録中でなければ何もしない。AITask から呼び出される。
+    """
+    calls = _provider_calls.get()
+    if calls is None:
+        return
+    calls.append({
+        "text": anonymize(text),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "ttft_ms": round(ttft * 1000, 2) if ttft is not None else None,
+    })
+
+
+@contextmanager
+def capture() -> Iterator[list]:
+    """with ブロック内のプロバイダー応答を集める"""
+    calls = []
+    token = _provider_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _provider_calls.reset(token)
+
+
+def _extract_request(kind: str, request) -> dict:
+    if kind == "chat":
+        try:
+            message = json.loads(request.body or b"{}").get("message", "")
+        except ValueError:
+            message = ""
+        return {"message": anonymize(message)}
+    return {
+        "query": anonymize(request.GET.get("query", "")),
+        "privacy_level": request.GET.get("privacy_level"),
+        "tags": request.GET.getlist("tags[]"),
+    }
+
+
+def record_view(kind: str):
+    """
+    Django ビューのトラフィックを記録するデコレータ
+
+    Args:
+        kind: 記録上の種別（chat / search）
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            recorder = _recorder
+            if not recorder.enabled:
+                return view(request, *args, **kwargs)
+            started = time.time()
+            perf_start = time.perf_counter()
+            with capture() as calls:
+                response = view(request, *args, **kwargs)
+            elapsed = time.perf_counter() - perf_start
+            try:
+                recorder.write(kind, _extract_request(kind, request), started, elapsed,
+                               response.status_code, calls)
+            except Exception as e:
+                logger.warning("トラフィックの記録に失敗: %s", e)
+            return response
+        return wrapper
+    return decorator
+
+
+def read_log(path: str) -> Iterator[dict]:
+    """記録ファイルを先頭から順に読み出す（壊れた行は読み飛ばす）"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.warning("不正な記録行を読み飛ばしました")
@@ -0,0 +1,200 @@
+"""
+起動時のウォームアップと準備完了（readiness）の管理モジュール
+デプロイ直後の最初のリクエストが、クライアントの生成・Chroma のオープン・
+トークナイザーの読み込み・TLS 接続の確立をまとめて負担しないよう、
+サーバーの起動直後にバックグラウンドで済ませます。
+
+- Warmup: 名前付きの手順（step）を順に実行し、所要時間と失敗を記録する。
+  critical な手順が失敗した場合は準備完了にならない（ロードバランサーに外してもらう）。
+  retry_seconds を指定すると、準備完了になるまで間隔を倍々に空けて再実行する
+- Readiness: 状態（pending / warming / ready / failed）。/ready はこれを返し、ready になるまで 503
+- 最初のリクエストの処理時間をウォームアップ済みか否かのラベル付きで記録する
+  （first_request_seconds{warmed="true|false"} でコールド起動との差を比較できる）
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+import threading
+import time
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+WARMUP_STEP_SECONDS = metrics.REGISTRY.gauge(
+    "warmup_step_seconds",
+    "ウォームアップの各手順の所要時間（秒）",
+    labelnames=("step",),
+)
+WARMUP_READY = metrics.REGISTRY.gauge(
+    "warmup_ready",
+    "ウォームアップが完了して準備ができていれば 1",
+)
+FIRST_REQUEST_SECONDS = metrics.REGISTRY.gauge(
+    "first_request_seconds",
+    "プロセス起動後の最初のリクエストの処理時間（秒）",
+    labelnames=("warmed",),
+)
+
+
+class Readiness:
+    """ウォームアップの進捗と準備完了の状態（スレッドセーフ）"""
+
+    def __init__(self):
+        self.state = PENDING
+        self.steps: Dict[str, dict] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._first_request_seen = False
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def begin(self):
+        with self._lock:
+            self.state = WARMING
+            self.started_at = time.time()
+            self.finished_at = None
+            self.steps = {}
+            self._done.clear()
+        WARMUP_READY.set(0)
+
+    def record(self, name: str, seconds: float, critical: bool, error: Optional[str] = None):
+        with self._lock:
+            self.steps[name] = {"status": "failed" if error else "ok",
+                                "seconds": round(seconds, 4), "critical": critical,
+                                "error": error}
+        WARMUP_STEP_SECONDS.set(seconds, step=name)
+
+    def finish(self, ok: bool):
+        with self._lock:
+            self.state = READY if ok else FAILED
+            self.finished_at = time.time()
+        WARMUP_READY.set(1 if ok else 0)
+        self._done.set()
+
+    def mark_ready(self):
+        """ウォームアップを行わない場合（WARMUP=0）に、すぐ準備完了とする"""
+        self.begin()
+        self.finish(True)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """ウォームアップの終了を待ち、準備完了なら True を返す"""
+        self._done.wait(timeout)
+        return self.ready
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = None
+            if self.started_at is not None:
+                elapsed = round((self.finished_at or time.time()) - self.started_at, 4)
+            return {"state": self.state, "elapsed": elapsed,
+                    "steps": {name: dict(step) for name, step in self.steps.items()}}
+
+    def observe_first_request(self, seconds: float):
+        """プロセスの最初のリクエストの処理時間を記録する（2回目以降は何もしない）"""
+        if self._first_request_seen:
+            return
+        with self._lock:
+            if self._first_request_seen:
+                return
+            self._first_request_seen = True
+            warmed = self.state == READY and bool(self.steps)
+        FIRST_REQUEST_SECONDS.set(seconds, warmed=str(warmed).lower())
+        logger.info("最初のリクエストの処理時間: %.3f秒（ウォームアップ%s）",
+                    seconds, "済み" if warmed else "なし")
+
+
+class Warmup:
+    """
+    ウォームアップの手順を順に実行する
+
+    Attributes:
+        readiness: 結果を記録する Readiness
+        retry_seconds: 失敗後の最初の再実行までの秒数（None なら再実行しない）
+        retry_max_seconds: 再実行の間隔の上限（秒）
+    """
+
+    def __init__(self, readiness: Optional[Readiness] = None,
+                 retry_seconds: Optional[float] = None, retry_max_seconds: float = 300):
+        self.readiness = readiness if readiness is not None else READINESS
+        self.steps: List[Tuple[str, Callable[[], None], bool]] = []
+        self.retry_seconds = retry_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self._stopped = threading.Event()
+
+    def add(self, name: str, func: Callable[[], None], critical: bool = True) -> "Warmup":
+        """
+        手順を追加する
+
+        Args:
+            name: 手順名（/ready とメトリクスに表示）
+            func: 実行する関数（失敗時は例外を送出する）
+            critical: 失敗したら準備完了にしない
+        """
+        self.steps.append((name, func, critical))
+        return self
+
+    def run(self) -> bool:
+        """すべての手順を実行し、準備完了になれば True を返す"""
+        self.readiness.begin()
+        started = time.perf_counter()
+        ok = True
+        for name, func, critical in self.steps:
+            step_started = time.perf_counter()
+            error = None
+            try:
+                func()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                if critical:
+                    ok = False
+                    logger.error("ウォームアップ %s に失敗: %s", name, error)
+                else:
+                    logger.warning("ウォームアップ %s に失敗（続行）: %s", name, error)
+            seconds = time.perf_counter() - step_started
+            self.readiness.record(name, seconds, critical, error)
+            logger.info("ウォームアップ %s: %.3f秒", name, seconds)
+        self.readiness.finish(ok)
+        logger.info("ウォームアップ%s: %.3f秒", "完了" if ok else "失敗",
+                    time.perf_counter() - started)
+        return ok
+
+    def run_until_ready(self) -> bool:
+        """
+        準備完了になるまで run() を繰り返す
+
+        critical な手順が失敗した場合、retry_seconds から倍々に retry_max_seconds まで
+        待って再実行する。retry_seconds が None の場合や stop() された場合は False を返す。
+        """
+        failures = 0
+        while not self.run():
+            if self.retry_seconds is None:
+                return False
+            delay = min(self.retry_max_seconds, self.retry_seconds * 2 ** failures)
+            failures += 1
+            logger.warning("ウォームアップを%.1f秒後に再実行します（%d回目の失敗）", delay, failures)
+            if self._stopped.wait(delay):
+                return False
+        return True
+
+    def stop(self):
+        """再実行の待機をやめる"""
+        self._stopped.set()
+
+    def start(self) -> threading.Thread:
+        """バックグラウンドのスレッドで run_until_ready() を実行する"""
+        thread = threading.Thread(target=self.run_until_ready, name="warmup", daemon=True)
+        thread.start()
+        return thread
+
+
+# プロセスで共有する準備状態（/ready とリクエスト計測が参照する）
+READINESS = Readiness()
@@ -2,6 +2,7 @@
 エラーコード定義ファイル
 """
 from enum import Enum, auto
+from core.metrics import record_error
 
 class ErrorCode(Enum):
     """エラーコードの定義
@@ -37,6 +38,7 @@ class ErrorCode(Enum):
     E40001 = "無効な入力"
     E40002 = "必須パラメータの欠落"
     E40003 = "不正なリクエスト形式"
+    E40004 = "同時リクエスト数の上限超過"
 
 class ErrorHandler:
     """エラーハンドリングクラス"""
@@ -55,6 +57,7 @@ class ErrorHandler:
         error_msg = f"[{error_code.name}] {error_code.value}"
         if detail:
             error_msg += f" - {detail}"
+        record_error(error_code.name)
             
         # TODO: ログファイルへの書き込み処理を実装
         print(f"Error: {error_msg}")  # 一時的な実装
@@ -6,9 +6,8 @@ CUIモードでは従来の対話ループ、HTMLモードではDjangoチャッ
 音声モードは未実装となっています。
 """
 import abc
+import asyncio
 import sys
-import re
-from dataclasses import dataclass
 from enum import Enum
 from typing import Optional
 from openai import OpenAI
@@ -18,8 +17,13 @@ from core.db_manager import ConversationDBManager
 from dotenv import load_dotenv
 import os
 from errors.error_codes import ErrorCode, ErrorHandler
+from core import internal_if_codec, metrics, singleflight, task_runtime, tracing, traffic_recorder
+from core.internal_if_codec import APIPayload
+from core.prompt_builder import Prompt, PromptBuilder, record_cache_usage
+from core.retrieval import Retriever
+from core.logging_config import configure_logging
 import logging
-import logging.handlers
+import threading
 import time
 import webbrowser
 import chromadb
@@ -27,32 +31,9 @@ import chromadb
 # 環境変数の読み込み
 load_dotenv()
 
-# ロガーの設定
+# ロガーの設定（ハンドラは core.logging_config で一元管理）
+configure_logging()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-# ログディレクトリの作成
-log_dir = Path("logs")
-log_dir.mkdir(exist_ok=True)
-
-# ファイルハンドラの設定
-file_handler = logging.handlers.RotatingFileHandler(
-    log_dir / "main.log",
-    maxBytes=1024*1024,  # 1MB
-    backupCount=5,
-    encoding='utf-8'
-)
-file_handler.setFormatter(
-    logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
-)
-logger.addHandler(file_handler)
-
-# コンソールハンドラの追加
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(
-    logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
-)
-logger.addHandler(console_handler)
 
 # --- Provider Enum ---
 class Provider(Enum):
@@ -96,45 +77,43 @@ from anthropic import Anthropic
 import google.generativeai as genai
 
 # --- Internal IF Definitions ---
-API_PREFIX = "@@@MY_AGENT_API_0419@@@"
-API_SUFFIX = "@@@"
-@dataclass
-class APIPayload:
-    src: str
-    dst: str
-    order: str
-    f: str
-    data: str
+# APIPayload と符号化処理は core.internal_if_codec に集約
+INTERNAL_IF_FORMAT = os.getenv("INTERNAL_IF_FORMAT", "text")
 
 class InternalIFTask:
     """
     内部IFタスク (ID=16):
-    - 各AIタスクは send() で他タスクへAPI文字列を送信。
+    - 各AIタスクは send() で他タスクへAPIメッセージを送信。
     - recv() で解析して APIPayload を取得し次処理へ。
+    - 送信時にアクティブなトレースがあれば trace フィールドで伝搬する。
+    - wire_format="binary" の場合は長さプレフィックス付きフレーム（bytes）を送信する。
+      recv() は str なら従来のテキスト形式、bytes 系ならバイナリフレームとして解析する。
     """
-    def __init__(self): self.id = TASK_INTERNAL_IF; self.name = "Internal IF"
+    def __init__(self, wire_format: str = INTERNAL_IF_FORMAT):
+        self.id = TASK_INTERNAL_IF; self.name = "Internal IF"
+        if wire_format not in ("text", "binary"):
+            raise ValueError(f"未対応の内部IF形式: {wire_format}")
+        self.wire_format = wire_format
     def send(self, src, dst, order, f, data):
-        msg = ",".join([
-            API_PREFIX,
-            f"=src{src}", f"=dst{dst}", f"=order{order}",
-            f"=f{f}", f"=data{data}", "=end", API_SUFFIX
-        ])
-        print(f"[{self.name}] send: {msg}")
+        payload = APIPayload(str(src), str(dst), str(order), str(f), str(data),
+                             tracing.current_trace_header() or "")
+        if self.wire_format == "binary":
+            msg = internal_if_codec.encode_frame(payload)
+        else:
+            msg = internal_if_codec.encode_text(payload)
+        logger.debug("[%s] send: %s -> %s order=%s (%d)", self.name, src, dst, order, len(msg))
         return msg
     def recv(self, message):
-        m = re.search(re.escape(API_PREFIX)+r"(.*?)"+re.escape(API_SUFFIX), message)
-        if not m: return None
-        parts = m.group(1).split(","); kv={}
-        for p in parts:
-            if p.startswith("=src"): kv['src']=p[4:]
-            elif p.startswith("=dst"): kv['dst']=p[4:]
-            elif p.startswith("=order"): kv['order']=p[6:]
-            elif p.startswith("=f"): kv['f']=p[2:]
-            elif p.startswith("=data"): kv['data']=p[5:]
-        return APIPayload(**kv)
+        if isinstance(message, str):
+            return internal_if_codec.decode_text(message)
+        return internal_if_codec.decode_frame(message)
 
 # --- Task Base & Manager ---
 class BaseTask(abc.ABC):
+    # CPU負荷の高いタスクは cpu_bound=True とし、cpu_work(payload) を staticmethod で必ず実装する
+    # （未実装なら TaskRuntime.open() で TypeError）。TaskRuntime がプロセスプール
+    # （core.process_offload）で実行するため、インスタンスの状態は参照できない。
+    cpu_bound = False
     def __init__(self, task_id: int, name: str): self.id=task_id; self.name=name; self._running=False
     @abc.abstractmethod
     def start(self): pass
@@ -143,13 +122,51 @@ class BaseTask(abc.ABC):
     @abc.abstractmethod
     def status(self)->str: pass
     def info(self)->str: return f"[{self.id}] {self.name} - {self.status()}"
+    def traced_call(self, operation: str, func, *args, trace: str = "", **kwargs):
+        """
+        タスクの処理をスパンで囲んで実行する
+
+        Args:
+            operation: 操作名（start, stop, respond など）
+            func: 実行する関数
+            trace: 受信メッセージ由来の traceparent（APIPayload.trace）
+        """
+        with tracing.attach(trace), tracing.start_span(
+            f"task.{operation}", {"task.id": self.id, "task.name": self.name}
+        ):
+            return func(*args, **kwargs)
 
 class TaskManager:
-    def __init__(self): self.tasks={}
+    def __init__(self): self.tasks={}; self.runtime=None
     def register(self, task:BaseTask): self.tasks[task.id]=task; print(f"Registered {task.info()}")
-    def start_all(self): [t.start() for t in self.tasks.values()]
-    def stop_all(self): [t.stop() for t in self.tasks.values()]
+    def start_all(self):
+        with tracing.start_span("task_manager.start_all"):
+            [t.traced_call("start", t.start) for t in self.tasks.values()]
+    def stop_all(self):
+        with tracing.start_span("task_manager.stop_all"):
+            [t.traced_call("stop", t.stop) for t in self.tasks.values()]
     def show_status(self): [print(t.info()) for t in self.tasks.values()]
+    def deliver(self, payload: APIPayload):
+        """
+        受信したメッセージを宛先タスクへ渡す（送信元のトレースを引き継ぐ）
+
+        宛先タスクは handle(payload) を実装している必要がある。
+        """
+        task = self.tasks.get(int(payload.dst))
+        if task is None or not hasattr(task, "handle"):
+            logger.warning(f"宛先タスクが見つかりません: dst={payload.dst}")
+            return None
+        return task.traced_call("handle", task.handle, payload, trace=payload.trace)
+    def run_async(self, main=None, inbox_size: int = task_runtime.DEFAULT_INBOX_SIZE):
+        """
+        asyncio ランタイム上で全タスクを並行に動かす（core.task_runtime 参照）
+
+        Args:
+            main: ランタイムを受け取ってコルーチンを返す関数。省略時は全タスクの start() が戻るまで動く
+            inbox_size: タスクごとの受信キューの上限
+        """
+        self.runtime = task_runtime.TaskRuntime(self.tasks, inbox_size)
+        return asyncio.run(self.runtime.run(main(self.runtime) if main else None))
 
 # AIモデルの設定クラスを修正
 class AIModelConfig:
@@ -171,7 +188,7 @@ class AIModelConfig:
         
         # モデル名の取得と検証
         model_name = os.getenv("MODEL_NAME", "gpt-4.1").strip()  # 余分な空白やコメントを削除
-        logger.debug(f"環境変数から取得したモデル名: {model_name}")
+        logger.debug("環境変数から取得したモデル名: %s", model_name)
         
         # コメントが含まれている場合は削除
         if "#" in model_name:
@@ -180,11 +197,28 @@ class AIModelConfig:
         
         self.model_name = model_name
 
+# 同じ質問の同時リクエストをまとめる（core.singleflight）
+RESPOND_FLIGHT = singleflight.Group("ai_task.respond")
+
 class AITask(BaseTask):
+    """
+    AIモデルに応答を要求するタスク
+
+    Django の複数のリクエストスレッドから1つのインスタンスを共有してよい。
+    OpenAI クライアント（内部の httpx 接続プール）と ConversationDBManager は
+    スレッドセーフで、リクエストごとの状態はすべて引数とローカル変数で受け渡す。
+    ロック（再入可能）はクライアントの作成と開始・停止の状態だけを守る。
+    """
+
     def __init__(self, cfg: AIModelConfig):
         super().__init__(int(cfg.id), cfg.name)
         self.cfg = cfg
         self.client = None
+        self._lock = threading.RLock()
+        # プロバイダー側のプロンプトキャッシュが効く順序でメッセージを組み立てる（core.prompt_builder）
+        self.prompt_builder = PromptBuilder.from_env()
+        # ナレッジベース・会話メモリからの参考情報の検索（RAG=0 で無効、core.retrieval）
+        self.retriever = Retriever.from_env()
         # DBマネージャーをインスタンス化
         self.db_manager = ConversationDBManager()
         self._init_client()
@@ -200,7 +234,9 @@ class AITask(BaseTask):
         
         try:
             if self.cfg.provider == Provider.OPENAI:
-                self.client = OpenAI(api_key=key)
+                with self._lock:
+                    if self.client is None:
+                        self.client = OpenAI(api_key=key)
                 print(f"OpenAIクライアントを初期化しました: {self.cfg.model_name}")
             else:
                 return ErrorHandler.log_error(
@@ -214,53 +250,61 @@ class AITask(BaseTask):
             )
 
     def start(self):
-        self._running = True
+        with self._lock:
+            if self._running:
+                return  # 複数の呼び出し元（ウォームアップ・最初のリクエスト）から呼ばれてもよい
+            self._running = True
         print(f"{self.name}: init (model={self.cfg.model_name})")
 
     def stop(self):
-        self._running = False
+        with self._lock:
+            self._running = False
         print(f"{self.name}: stopped")
 
     def status(self) -> str:
-        return 'running' if self._running else 'stopped'
+        with self._lock:
+            return 'running' if self._running else 'stopped'
+
+    def get_client(self):
+        """OpenAI クライアントを返す（起動時に作成できなかった場合はここで作り直す）"""
+        client = self.client
+        if client is None:
+            with self._lock:
+                if self.client is None:
+                    self._init_client()
+                client = self.client
+            if client is None:
+                raise RuntimeError("OpenAIクライアントが初期化されていません")
+        return client
+
+    def respond(self, text: str, memory=None) -> str:
+        """AIに対して応答を要求する（同じ質問を処理中ならその結果を共有する）"""
+        return self.respond_shared(text, memory)[0]
+
+    def respond_shared(self, text: str, memory=None):
+        """
+        respond() と同じ処理で、(応答, 共有されたか) を返す
 
-    def respond(self, text: str) -> str:
-        """AIに対して応答を要求する"""
+        同じモデル・同じ会話メモリへの同じ質問（正規化後）が処理中の場合は
+        モデルを呼ばずにその結果を待つ。
+        共有された場合、会話の保存は先行リクエスト側で行われるため呼び出し元では保存しないこと。
+
+        Args:
+            memory: 履歴を読むDBマネージャー（テナントのシャード）。省略時は self.db_manager
+        """
+        memory = memory or self.db_manager
+        key = singleflight.make_key(self.cfg.id, self.cfg.model_name,
+                                    memory.collection_name, singleflight.normalize(text))
+        return RESPOND_FLIGHT.do_shared(key, self._respond, text, memory)
+
+    @tracing.traced("ai_task.respond")
+    def _respond(self, text: str, memory=None) -> str:
         try:
             if self.cfg.provider == Provider.OPENAI:
-                # 過去の会話履歴を取得して整形
-                conversations = self.db_manager.get_all_conversations()
-                messages = []
-                
-                # システムメッセージを追加
-                messages.append({
-                    "role": "system",
-                    "content": "あなたは過去の会話を記憶できるアシスタントです。"
-                })
-                
-                # 過去の会話を追加（最新の5件）
-                for conv in conversations[-5:]:
-                    # 会話テキストからユーザーとAIの発言を分離
-                    if "User:" in conv["text"] and "AI:" in conv["text"]:
-                        user_msg, ai_msg = conv["text"].split("AI:", 1)
-                        user_content = user_msg.replace("User:", "").strip()
-                        ai_content = ai_msg.strip()
-                        
-                        messages.append({"role": "user", "content": user_content})
-                        messages.append({"role": "assistant", "content": ai_content})
-                
-                # 現在の質問を追加
-                messages.append({"role": "user", "content": text})
-                
-                logger.debug(f"送信するメッセージ履歴: {len(messages)}件")
+                prompt = self._prepare_messages(text, memory)
                 
                 # OpenAI APIにリクエスト
-                response = self.client.chat.completions.create(
-                    model=self.cfg.model_name,
-                    messages=messages
-                )
-                
-                return response.choices[0].message.content
+                return self._complete(prompt)
                 
             else:
                 return ErrorHandler.log_error(
@@ -270,8 +314,106 @@ class AITask(BaseTask):
                 
         except Exception as e:
             logger.error(f"AI応答生成エラー: {e}")
+            metrics.record_error(ErrorCode.E50002.name)
             return str(e)
 
+    def respond_stream(self, text: str, memory=None):
+        """
+        AIの応答を差分（delta）ごとに返すジェネレータ（WebSocket 配信用）
+
+        respond() と異なり、エラーは文字列ではなく例外として送出する。
+        同じスレッドで最後まで（または close() まで）消費すること。
+        """
+        if self.cfg.provider != Provider.OPENAI:
+            raise ValueError(f"プロバイダー {self.cfg.provider} は未対応です")
+        with tracing.start_span("ai_task.respond_stream"):
+            try:
+                prompt = self._prepare_messages(text, memory)
+                with tracing.start_span("llm.chat_completion"):
+                    yield from self._stream_completion(prompt)
+            except Exception as e:
+                logger.error(f"AI応答生成エラー: {e}")
+                metrics.record_error(ErrorCode.E50002.name)
+                raise
+
+    def _prepare_messages(self, text: str, memory=None) -> Prompt:
+        """
+        過去の会話履歴（memory、省略時は self.db_manager）を取得し、送信するメッセージ列を組み立てる
+
+        履歴はプロンプトに入る直近の分だけ読む（会話メモリごとに保持し、保存時に更新される）。
+        """
+        memory = memory or self.db_manager
+        with metrics.stage_timer("history_read"):
+            conversations, total = memory.recent_conversations(self.prompt_builder.history_limit)
+        older, recent = self.prompt_builder.split_history(conversations, total)
+
+        # 同じ会話メモリへのリクエストをプロバイダー側の同じキャッシュに振り分けてもらう
+        cache_key = (f"{self.cfg.model_name}:{memory.collection_name}"
+                     if os.getenv("PROMPT_CACHE_KEY", "1") != "0" else None)
+        context = []
+        if self.retriever is not None:
+            # 履歴としてプロンプトに入る会話は参考情報として重ねて差し込まない
+            retrieval = self.retriever.retrieve(
+                text, self.retriever.sources_for(memory, text, knowledge=self.db_manager),
+                exclude=[c.get("text") or "" for c in older + recent])
+            context = retrieval.context()
+        with metrics.stage_timer("prompt_build"):
+            prompt = self.prompt_builder.assemble(older, recent, text, cache_key=cache_key,
+                                                  context=context)
+        
+        logger.debug("送信するメッセージ履歴: %d件（固定部分 %d件, 推定 %d tokens）",
+                     len(prompt.messages), prompt.prefix_length, prompt.prefix_tokens)
+        return prompt
+
+    @tracing.traced("llm.chat_completion")
+    def _complete(self, prompt: Prompt) -> str:
+        """ストリーミングでモデルを呼び出し、応答全文を返す"""
+        return "".join(self._stream_completion(prompt))
+
+    def _stream_completion(self, prompt: Prompt):
+        """
+        ストリーミングでモデルを呼び出し、応答の差分を順に返す
+
+        最初のトークン到着までの時間(TTFT)・全体のレイテンシ・トークン使用量
+        （プロバイダー側でキャッシュされた入力トークン数を含む）を記録する。
+        """
+        span = tracing.current_span()
+        start = time.perf_counter()
+        first_token_at = None
+        usage = None
+        chunks = []
+        if span is not None:
+            span.set_attribute("prompt.prefix_tokens", prompt.prefix_tokens)
+        stream = self.get_client().chat.completions.create(
+            model=self.cfg.model_name,
+            messages=prompt.messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            extra_body={"prompt_cache_key": prompt.cache_key} if prompt.cache_key else None
+        )
+        for chunk in stream:
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        metrics.observe_stage("time_to_first_token", first_token_at - start)
+                    chunks.append(delta)
+                    yield delta
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+                metrics.record_token_usage(chunk.usage)
+                record_cache_usage(chunk.usage, span)
+                if span is not None:
+                    span.set_attribute("tokens.prompt", chunk.usage.prompt_tokens)
+                    span.set_attribute("tokens.completion", chunk.usage.completion_tokens)
+        metrics.observe_stage("model_latency", time.perf_counter() - start)
+        if span is not None and first_token_at is not None:
+            span.set_attribute("ttft_ms", round((first_token_at - start) * 1000, 1))
+        traffic_recorder.note_provider_response(
+            "".join(chunks), usage, first_token_at - start if first_token_at else None
+        )
+
 class CUIInterfaceTask(BaseTask):
     def __init__(self, ai: AITask):
         """
@@ -393,9 +535,9 @@ AI_MODEL_CONFIGS = [
 ]
 
 # デバッグ用のログ出力を追加
-logger.debug(f"利用可能なAIモデル設定:")
+logger.debug("利用可能なAIモデル設定:")
 for cfg in AI_MODEL_CONFIGS:
-    logger.debug(f"- ID: {cfg.id}, 名前: {cfg.name}, プロバイダー: {cfg.provider}")
+    logger.debug("- ID: %s, 名前: %s, プロバイダー: %s", cfg.id, cfg.name, cfg.provider)
 
 # 環境変数の確認関数を修正
 def check_environment():
@@ -575,9 +717,6 @@ if __name__ == "__main__":
         memory_status = db_manager.verify_memory_persistence()
         if memory_status:
             logger.info("記憶システムは正常に動作しています")
-            logger.info("保存されている会話を確認します")
-            conversations = db_manager.get_all_conversations()
-            logger.info(f"保存されている会話数: {len(conversations)}")
         else:
             logger.warning("記憶システムに問題が見つかりました")
             
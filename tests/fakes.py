@@ -0,0 +1,82 @@
+"""
+テスト用の chromadb Collection の代わり
+
+get / upsert / add / update / delete / count を持ち、行は id → (id, document, metadata, embedding)
+で保持する（embedding は省略できる）。get の where は $and・$lt・等値だけに対応する。
+"""
+import threading
+
+
+def _match(metadata, where):
+    if "$and" in where:
+        return all(_match(metadata, cond) for cond in where["$and"])
+    for key, cond in where.items():
+        value = metadata.get(key)
+        if isinstance(cond, dict):
+            if value is None or not value < cond["$lt"]:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+class FakeCollection:
+    """
+    メモリ上のコレクション（スレッドセーフ）
+
+    Attributes:
+        rows: id → (id, document, metadata[, embedding])（挿入順）
+        gets: get の呼び出し回数
+        updates: update に渡された id の一覧（呼び出しごと）
+    """
+
+    name = "conversations"
+
+    def __init__(self, rows=(), name=None):
+        self.rows = {r[0]: tuple(r) for r in rows}
+        if name is not None:
+            self.name = name
+        self.gets = 0
+        self.updates = []
+        self.lock = threading.Lock()
+
+    def count(self):
+        with self.lock:
+            return len(self.rows)
+
+    def get(self, ids=None, limit=None, offset=0, include=(), where=None):
+        with self.lock:
+            self.gets += 1
+            if ids is not None:
+                rows = [self.rows[i] for i in ids if i in self.rows]
+            else:
+                rows = [r for r in self.rows.values() if where is None or _match(r[2], where)]
+                rows = rows[offset:None if limit is None else offset + limit]
+        result = {"ids": [r[0] for r in rows], "documents": [r[1] for r in rows],
+                  "metadatas": [dict(r[2] or {}) for r in rows]}
+        if "embeddings" in include:
+            result["embeddings"] = [r[3] if len(r) > 3 else None for r in rows]
+        return result
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        with self.lock:
+            for row in zip(ids, documents, metadatas, embeddings):
+                self.rows[row[0]] = row
+
+    def add(self, ids, documents, metadatas):
+        with self.lock:
+            for doc_id, document, metadata in zip(ids, documents, metadatas):
+                self.rows[doc_id] = (doc_id, document, dict(metadata))
+
+    def update(self, ids, metadatas):
+        with self.lock:
+            self.updates.append(list(ids))
+            for doc_id, metadata in zip(ids, metadatas):
+                row = self.rows.get(doc_id)
+                if row is not None:
+                    self.rows[doc_id] = (row[0], row[1], metadata, *row[3:])
+
+    def delete(self, ids):
+        with self.lock:
+            for doc_id in ids:
+                self.rows.pop(doc_id, None)
@@ -0,0 +1,25 @@
+from bench.stats import check_thresholds, compare_runs, percentile, summarize
+
+
+def test_percentile_interpolates():
+    values = [10, 20, 30, 40]
+    assert percentile(values, 50) == 25
+    assert percentile(values, 100) == 40
+    assert percentile([], 95) == 0.0
+
+
+def test_summarize_and_thresholds():
+    result = summarize([0.01] * 99 + [1.0], errors=0, wall_time_s=1.0)
+    assert result["p50_ms"] == 10
+    assert result["throughput_rps"] == 100
+    violations = check_thresholds({"search": result},
+                                  {"search": {"p99_ms": 15, "min_throughput_rps": 10}})
+    assert violations == ["search.p99_ms=19.9 > 15"]
+
+
+def test_compare_runs_flags_p95_regression():
+    base = {"search": {"p95_ms": 100, "p99_ms": 200}}
+    current = {"search": {"p95_ms": 130, "p99_ms": 210}}
+    assert compare_runs(base, current, max_regression_pct=20) == [
+        "search.p95_ms: 100 -> 130 (+30.0%)"
+    ]
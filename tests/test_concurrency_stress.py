@@ -0,0 +1,86 @@
+"""
+AITask / ConversationDBManager の同時実行の負荷試験
+
+OpenAI はローカルのスタブ（bench.fake_openai）に向け、1つのインスタンスを
+64スレッドから同時に使って結果の正しさとスループットの伸びを確認する。
+chromadb・langchain・openai がない環境では skip される。
+"""
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import pytest
+
+from bench.fake_openai import FakeOpenAIServer, StubConfig
+
+pytest.importorskip("chromadb")
+pytest.importorskip("langchain_community")
+pytest.importorskip("openai")
+
+THREADS = 64
+
+
+@pytest.fixture()
+def stub_env(tmp_path, monkeypatch):
+    with FakeOpenAIServer(StubConfig(latency_ms=50, jitter_ms=0, token_delay_ms=0,
+                                     embedding_latency_ms=10, embedding_dim=64)) as stub:
+        monkeypatch.setenv("OPENAI_BASE_URL", stub.base_url)
+        monkeypatch.setenv("OPENAI_API_BASE", stub.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test-000000000000000000000000")
+        monkeypatch.setenv("MODEL_NAME", "fake-model")
+        monkeypatch.setenv("CHROMA_DB_DIR", str(tmp_path / "chroma_db"))
+        monkeypatch.setenv("DEDUP_MODE", "merge")
+        yield stub
+
+
+def _run(func, items, workers):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(func, items))
+    return results, time.perf_counter() - started
+
+
+def test_concurrent_saves_are_counted_once(stub_env):
+    db_manager_module = pytest.importorskip("core.db_manager")
+    memory = db_manager_module.ConversationDBManager()
+
+    saved, _ = _run(lambda i: memory.save_conversation(f"質問{i}: 在庫数を教えて {i * 7919}",
+                                                       f"回答{i}: 倉庫{i}に{i * 31}個あります"),
+                    range(THREADS), THREADS)
+    assert all(saved)
+    assert memory.collection.count() == THREADS
+    assert memory.memory_stats()["conversations"] == THREADS
+
+    # 同じ内容の同時保存は1件だけが新規保存になり、残りは統合される
+    duplicated, _ = _run(lambda i: memory.save_conversation("同じ質問です", "同じ回答です"),
+                         range(THREADS), THREADS)
+    assert all(duplicated)
+    assert memory.collection.count() == THREADS + 1
+    rows = memory.collection.get(where={"duplicate_count": {"$gte": 2}}, include=["metadatas"])
+    assert [m["duplicate_count"] for m in rows["metadatas"]] == [THREADS]
+
+    # 同時の検索と削除が混ざっても件数と集計が一致する
+    ids = memory.collection.get(limit=16, include=[])["ids"]
+    _run(lambda i: (memory.delete_conversations(ids) if i % 8 == 0
+                    else memory.search_conversations(f"在庫 {i}", limit=3)),
+         range(THREADS), THREADS)
+    assert memory.collection.count() == THREADS + 1 - len(ids)
+    assert memory.memory_stats()["conversations"] == THREADS + 1 - len(ids)
+
+
+def test_shared_ai_task_scales_with_threads(stub_env):
+    main = pytest.importorskip("main")
+    task = main.AITask(main.AIModelConfig(str(main.TASK_AI_RECEIVE), "Reception AI",
+                                          main.Provider.OPENAI))
+    task.start()
+    task.start()  # 再入しても二重に開始しない
+    assert task.status() == "running"
+
+    serial, serial_elapsed = _run(lambda i: task.respond(f"直列の質問 {i}"), range(8), 1)
+    parallel, parallel_elapsed = _run(lambda i: task.respond(f"並列の質問 {i}"),
+                                      range(THREADS), THREADS)
+    assert all(isinstance(r, str) and r for r in serial + parallel)
+    assert len(parallel) == THREADS
+    serial_rps = len(serial) / serial_elapsed
+    parallel_rps = len(parallel) / parallel_elapsed
+    # スタブの遅延（50ms）が支配的なため、並列ならスループットが大きく伸びる
+    assert parallel_rps >= serial_rps * 4, (serial_rps, parallel_rps)
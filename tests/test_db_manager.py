@@ -0,0 +1,104 @@
+"""
+ConversationDBManager の保存・重複統合・上限・削除の同時実行
+
+Chroma は開かず、メモリ上の偽コレクションに差し替えて 64スレッドから同時に使う。
+core.db_manager の import に必要なパッケージ（chromadb・langchain）がない環境では skip される。
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import threading
+import time
+
+import pytest
+
+from core import search_cache
+from fakes import FakeCollection
+
+pytest.importorskip("chromadb")
+pytest.importorskip("langchain_community")
+db_manager_module = pytest.importorskip("core.db_manager")
+
+THREADS = 64
+
+
+class FakeChroma:
+    """langchain の Chroma のうち保存に使う操作だけを持つ"""
+
+    def __init__(self, name):
+        self._collection = FakeCollection(name=name)
+        self.gate = None  # 次の保存を、この Event が set されるまで止める
+
+    def add_texts(self, texts, metadatas, ids):
+        gate, self.gate = self.gate, None
+        if gate is not None:
+            gate.wait(5)
+        time.sleep(0.001)  # 保存中に他のスレッドが割り込めるようにする
+        self._collection.add(ids=ids, documents=texts, metadatas=metadatas)
+        return ids
+
+
+@pytest.fixture()
+def memory(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("MODEL_NAME", "fake-model")
+    monkeypatch.setenv("DEDUP_MODE", "merge")
+    monkeypatch.setattr(search_cache, "_default",
+                        search_cache.SearchCache(disk_path=str(tmp_path / "search_cache.sqlite3")))
+    monkeypatch.setattr(db_manager_module.ConversationDBManager, "_open_chroma",
+                        lambda self, name, model=None: FakeChroma(name))
+    return db_manager_module.ConversationDBManager(persist_directory=str(tmp_path / "chroma_db"),
+                                                   client=object())
+
+
+def _distinct(i):
+    digest = hashlib.sha256(str(i).encode()).hexdigest()
+    return f"質問 {digest[:32]}", f"回答 {digest[32:]}"
+
+
+def _run(func, items):
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        return list(pool.map(func, items))
+
+
+def test_concurrent_saves_merges_quota_and_deletes(memory):
+    def save(i):
+        if i % 2:
+            return memory.save_conversation(*_distinct(i))
+        return memory.save_conversation("同じ質問です", "同じ回答です")
+
+    assert all(_run(save, range(THREADS)))
+    collection = memory.collection
+    assert collection.count() == THREADS // 2 + 1
+    counts = [m.get("duplicate_count", 1) for m in collection.get()["metadatas"]]
+    assert sorted(counts)[-1] == THREADS // 2 and sum(counts) == THREADS
+    assert memory.stats.summary(memory.collection_name)["conversations"] == THREADS // 2 + 1
+
+    # 会話数の上限：空きの分だけが保存される
+    memory.max_conversations = collection.count() + 7
+    saved = _run(lambda i: memory.save_conversation(*_distinct(THREADS + i)), range(THREADS))
+    assert saved.count(True) == 7
+    assert collection.count() == memory.max_conversations
+    assert memory.stats.summary(memory.collection_name)["conversations"] == memory.max_conversations
+
+    # 同じ id の同時削除でも集計から二重に差し引かない
+    ids = collection.get()["ids"]
+    _run(lambda i: memory.delete_conversations(ids[i % 4::4]), range(THREADS))
+    assert collection.count() == 0
+    assert memory.stats.summary(memory.collection_name)["conversations"] == 0
+
+
+def test_merge_wait_timeout_stores_a_new_row(memory, monkeypatch):
+    monkeypatch.setattr(db_manager_module, "DEDUP_WAIT_SECONDS", 0.05)
+    gate = threading.Event()
+    memory.db.gate = gate
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        first = pool.submit(memory.save_conversation, "同じ質問です", "同じ回答です")
+        while not memory._inflight:
+            time.sleep(0.001)
+        # 先着の保存が終わらないため、統合せず新規に保存する
+        assert memory.save_conversation("同じ質問です", "同じ回答です") is True
+        assert memory.collection.count() == 1
+        gate.set()
+        assert first.result() is True
+    assert memory.collection.count() == 2
+    assert all("duplicate_count" not in m for m in memory.collection.get()["metadatas"])
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from core.dedup import (
+    DedupIndex,
+    LSHIndex,
+    MinHasher,
+    decode_signature,
+    distinct_ratio,
+    encode_signature,
+    plan_dedup,
+)
+
+BASE = "User: 明日の会議の資料はどこに置けばいいですか？\nAI: 共有フォルダの「会議資料」に置いてください。"
+NEAR = "User: 明日の会議の資料はどこに置けばいいですか\nAI: 共有フォルダの「会議資料」に置いてください。"
+OTHER = "User: 週末の天気を教えてください。\nAI: 土曜日は晴れ、日曜日は雨の予報です。"
+
+
+def test_signature_similarity():
+    hasher = MinHasher()
+    base = hasher.signature(BASE)
+    assert hasher.similarity(base, hasher.signature(BASE)) == 1.0
+    assert hasher.similarity(base, hasher.signature(NEAR)) >= 0.8
+    assert hasher.similarity(base, hasher.signature(OTHER)) < 0.3
+    # 全角・半角や空白の違いは同一視する
+    assert hasher.signature("ＡＢＣ  def") == hasher.signature("abc def")
+
+
+def test_signature_roundtrip():
+    signature = MinHasher().signature(BASE)
+    assert decode_signature(encode_signature(signature)) == signature
+    assert decode_signature("!!") is None
+
+
+def test_lsh_query_and_remove():
+    hasher = MinHasher()
+    index = LSHIndex(hasher.num_perm)
+    index.add("base", hasher.signature(BASE))
+    index.add("other", hasher.signature(OTHER))
+    matches = index.query(hasher.signature(NEAR), threshold=0.8)
+    assert [key for key, _ in matches] == ["base"]
+    index.remove("base")
+    assert index.query(hasher.signature(NEAR), threshold=0.8) == []
+    assert len(index) == 1
+
+
+def test_dedup_index_threshold_and_load():
+    index = DedupIndex(threshold=0.8, mode="merge")
+    minhash = encode_signature(index.signature(BASE))
+    index.load([("base", "", {"minhash": minhash}),
+                ("doc", OTHER, {"type": "knowledge"})])
+    assert index.loaded
+    assert index.find(index.signature(NEAR))[0] == "base"
+    assert index.find(index.signature(OTHER)) is None
+
+    assert not DedupIndex(threshold=0.8, mode="off").enabled
+    strict = DedupIndex(threshold=1.0, mode="skip")
+    strict.add("base", strict.signature(BASE))
+    assert strict.find(strict.signature(NEAR)) is None
+    strict.reset()
+    assert not strict.loaded and strict.find(strict.signature(BASE)) is None
+
+
+def test_find_or_add_admits_one_of_concurrent_duplicates():
+    index = DedupIndex(threshold=0.8, mode="merge")
+    signature = index.signature(BASE)
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        results = list(pool.map(lambda i: index.find_or_add(f"id{i}", signature), range(64)))
+    admitted = [i for i, found in enumerate(results) if found is None]
+    assert len(admitted) == 1
+    assert all(found[0] == f"id{admitted[0]}" for found in results if found is not None)
+    assert index.find_or_add("other", index.signature(OTHER)) is None
+    assert "other" in index
+    index.remove("other")
+    assert "other" not in index
+
+
+def test_plan_dedup_keeps_oldest():
+    rows = [
+        ("b", NEAR, {"timestamp": "2024-01-02T00:00:00"}),
+        ("a", BASE, {"timestamp": "2024-01-01T00:00:00"}),
+        ("c", BASE, {"timestamp": "2024-01-03T00:00:00"}),
+        ("d", OTHER, {"timestamp": "2024-01-01T00:00:00"}),
+        ("k", BASE, {"type": "knowledge"}),
+    ]
+    plan, index = plan_dedup(rows, threshold=0.8)
+    assert plan.groups == {"a": ["b", "c"]}
+    report = plan.report()
+    assert report["scanned"] == 4
+    assert report["removed"] == 2 and report["remaining"] == 2
+    assert report["bytes_after"] < report["bytes_before"]
+
+    assert distinct_ratio(["a", "b", "c", "d"], index, 0.8) == 0.5
+    assert distinct_ratio(["a", "d"], index, 0.8) == 1.0
+    assert distinct_ratio([], index, 0.8) == 1.0
@@ -0,0 +1,107 @@
+import pytest
+
+from core.embedding_migration import (
+    BACKFILLING,
+    SWITCHED,
+    EmbeddingMigration,
+    MigrationError,
+    MigrationState,
+    abort_migration,
+    start_migration,
+    target_collection_name,
+)
+from fakes import FakeCollection
+
+
+def _embed(texts):
+    return [[float(len(t))] for t in texts]
+
+
+def _setup(tmp_path, n=10):
+    source = FakeCollection((f"id{i}", f"会話{i}", {"n": i}, [0.0]) for i in range(n))
+    target = FakeCollection()
+    path = str(tmp_path / "migration.json")
+    start_migration(path, "conversations", "text-embedding-3-small")
+    return source, target, path
+
+
+def test_start_and_abort(tmp_path):
+    path = str(tmp_path / "migration.json")
+    state = start_migration(path, "conversations", "text-embedding-3-small")
+    assert state.target_collection == "conversations__text-embedding-3-small"
+    assert MigrationState.load(path).phase == BACKFILLING
+    with pytest.raises(MigrationError):
+        start_migration(path, "conversations", "other")
+    assert abort_migration(path).phase == "aborted"
+    assert not MigrationState.load(path).migrating
+    assert target_collection_name("c", "org/model v2") == "c__org-model-v2"
+
+
+def test_restart_after_switch_migrates_from_current_collection(tmp_path):
+    path = str(tmp_path / "migration.json")
+    first = start_migration(path, "conversations", "model-a")
+    first.phase = SWITCHED
+    first.save(path)
+    # 切り替え後の読み出し先（model-a のコレクション）が次の移行元になる
+    second = start_migration(path, "conversations", "model-b")
+    assert second.source_collection == "conversations__model-a"
+    assert second.source_model == "model-a"
+    assert second.target_collection == "conversations__model-a__model-b"
+    # 中止した場合も、中止した移行の移行元から始め直す
+    abort_migration(path)
+    third = start_migration(path, "conversations", "model-c")
+    assert third.source_collection == "conversations__model-a"
+    with pytest.raises(MigrationError):
+        abort_migration(path)
+        start_migration(path, "conversations", "x", target_collection="conversations__model-a")
+
+
+def test_migration_skips_dual_written_and_switches(tmp_path):
+    source, target, path = _setup(tmp_path)
+    # dual-write 済みの会話は再埋め込みしない
+    target.upsert(["id3"], ["会話3"], [{"n": 3}], [[9.0]])
+    sleeps = []
+    migration = EmbeddingMigration(source, target, _embed, path, batch_size=4,
+                                   max_rows_per_sec=1000, price_per_1k=0.02,
+                                   sleep=sleeps.append)
+
+    state = migration.run(max_batches=1)
+    assert state.phase == BACKFILLING and state.offset == 4
+    assert 0 < state.coverage < 1
+    assert MigrationState.load(path).offset == 4
+
+    state = migration.run()
+    assert state.phase == SWITCHED and state.coverage == 1.0
+    assert (state.copied, state.skipped) == (9, 1)
+    assert state.tokens > 0 and state.cost_usd > 0
+    assert set(target.rows) == set(source.rows)
+    assert target.rows["id3"][3] == [9.0]
+    assert target.rows["id0"][3] == [3.0]
+    assert sleeps and all(s > 0 for s in sleeps)
+    assert MigrationState.load(path).switched
+    with pytest.raises(MigrationError):
+        migration.run()
+
+
+def test_finish_copies_rows_missed_by_offset(tmp_path):
+    source, target, path = _setup(tmp_path, n=3)
+    migration = EmbeddingMigration(source, target, _embed, path, batch_size=2,
+                                   max_rows_per_sec=0)
+    migration.run(max_batches=1)
+    # 読み終えた位置より前に追加された（dual-write にも失敗した）会話
+    source.rows = {"new": ("new", "新しい会話", {}, [0.0]), **source.rows}
+    state = migration.run()
+    assert state.switched and "new" in target.rows and migration.missing_ids() == []
+
+
+def test_run_stops_when_aborted(tmp_path):
+    source, target, path = _setup(tmp_path)
+
+    def embed_then_abort(texts):
+        abort_migration(path)
+        return _embed(texts)
+
+    migration = EmbeddingMigration(source, target, embed_then_abort, path, batch_size=2,
+                                   max_rows_per_sec=0)
+    state = migration.run()
+    assert state.phase == "aborted" and len(target.rows) == 2
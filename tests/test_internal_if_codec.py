@@ -0,0 +1,50 @@
+import pytest
+
+from core.internal_if_codec import (
+    APIPayload, FrameError, FrameParser, decode_frame, decode_frames, decode_text,
+    encode_frame, encode_text,
+)
+
+
+def test_text_format_round_trip_is_unchanged():
+    payload = APIPayload("12", "25", "save", "1", "hello", "00-abc-def-01")
+    message = encode_text(payload)
+    assert message == ("@@@MY_AGENT_API_0419@@@,=src12,=dst25,=ordersave,=f1,"
+                       "=datahello,=trace00-abc-def-01,=end,@@@")
+    assert decode_text("noise " + message + " noise") == payload
+    assert decode_text("no markers") is None
+
+
+def test_binary_frame_carries_arbitrary_data():
+    data = "a,b,=end,@@@ 改行\n\x00 終了"
+    payload = APIPayload("12", "25", "save", "1", data)
+    frame = encode_frame(payload)
+    assert decode_frame(frame) == payload
+    assert decode_frame(memoryview(bytearray(frame))) == payload
+
+
+def test_parser_handles_split_and_coalesced_frames():
+    payloads = [APIPayload("1", "2", f"o{i}", "f", "x" * i) for i in range(50)]
+    stream = b"".join(encode_frame(p) for p in payloads)
+    parser = FrameParser()
+    received = []
+    for i in range(0, len(stream), 7):
+        received.extend(parser.feed(stream[i:i + 7]))
+    assert received == payloads and parser.pending == 0
+
+    partial, consumed = decode_frames(stream[:-3])
+    assert partial == payloads[:-1] and consumed == len(stream) - len(encode_frame(payloads[-1]))
+
+
+def test_invalid_frames_raise():
+    frame = encode_frame(APIPayload("1", "2", "o", "f", "d"))
+    with pytest.raises(FrameError):
+        decode_frame(b"XX" + frame[2:])
+    with pytest.raises(FrameError):
+        decode_frame(frame + b"\x00")
+    # フィールド長の表より短いフレーム・UTF-8 でないフィールドも FrameError
+    short = b"\xa7\x1f\x01" + (4).to_bytes(4, "big") + b"\x00" * 4
+    with pytest.raises(FrameError):
+        decode_frame(short)
+    with pytest.raises(FrameError):
+        decode_frame(frame[:-1] + b"\xff")
@@ -0,0 +1,87 @@
+from core import job_queue
+from core.job_queue import DONE, FAILED, LEASED, QUEUED, JobQueue, Worker
+
+
+def test_lease_order_and_expired_lease_recovery(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    low = queue.enqueue("a", {"n": 1}, priority=9)
+    high = queue.enqueue("a", {"n": 2}, priority=0)
+    queue.enqueue("a", {"n": 3}, delay=60)
+
+    job = queue.lease("w1", lease_seconds=-1)  # すぐに期限切れになるリース
+    assert job.id == high and job.payload == {"n": 2} and job.attempts == 1
+    assert queue.get(high)["status"] == LEASED
+
+    again = queue.lease("w2")
+    assert again.id == high and again.attempts == 2
+    assert queue.lease("w2").id == low
+    assert queue.lease("w2") is None  # delay 中のジョブは取り出されない
+
+
+def test_fail_retries_with_backoff_then_gives_up(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), retry_backoff=0)
+    job_id = queue.enqueue("a", max_attempts=2)
+    assert queue.fail(queue.lease("w"), "boom") is True
+    assert queue.get(job_id)["status"] == QUEUED
+    assert queue.fail(queue.lease("w"), "boom") is False
+    job = queue.get(job_id)
+    assert job["status"] == FAILED and job["attempts"] == 2 and job["error"] == "boom"
+
+
+def test_expired_lease_at_max_attempts_is_failed_not_released(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    job_id = queue.enqueue("a", max_attempts=2)
+    assert queue.lease("w1", lease_seconds=-1).attempts == 1
+    assert queue.lease("w2", lease_seconds=-1).attempts == 2
+    before = job_queue.JOBS_TOTAL.value(kind="a", event="failed")
+    assert queue.lease("w3") is None
+    job = queue.get(job_id)
+    assert job["status"] == FAILED and job["attempts"] == 2
+    assert job_queue.JOBS_TOTAL.value(kind="a", event="failed") == before + 1
+
+
+def test_worker_runs_registered_handlers(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "_HANDLERS", {})
+
+    @job_queue.register("double")
+    def double(payload):
+        return {"value": payload["value"] * 2}
+
+    @job_queue.register("broken")
+    def broken(payload):
+        raise ValueError("bad input")
+
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    ok = queue.enqueue("double", {"value": 21})
+    bad = queue.enqueue("broken", max_attempts=1)
+    assert Worker(queue, poll_interval=0).run(exit_when_idle=True) == 2
+    assert queue.get(ok)["status"] == DONE and queue.get(ok)["result"] == {"value": 42}
+    assert queue.get(bad)["error"] == "ValueError: bad input"
+    assert queue.counts() == {DONE: 1, FAILED: 1}
+
+
+def test_stale_lease_cannot_overwrite_result(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    job_id = queue.enqueue("a")
+    stale = queue.lease("w1", lease_seconds=-1)
+    current = queue.lease("w2")
+    assert current.id == stale.id == job_id
+    assert queue.ack(stale, {"from": "w1"}) is False
+    assert queue.fail(stale, "late") is False
+    assert queue.get(job_id)["status"] == LEASED
+    assert queue.ack(current, {"from": "w2"}) is True
+    assert queue.get(job_id)["result"] == {"from": "w2"}
+
+    # 同じワーカーが再取得した場合も、前の試行の結果は反映しない
+    again_id = queue.enqueue("a")
+    first = queue.lease("w1", lease_seconds=-1)
+    second = queue.lease("w1")
+    assert first.id == second.id == again_id
+    assert queue.ack(first) is False and queue.ack(second) is True
+
+
+def test_get_is_scoped_to_owner(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    job_id = queue.enqueue("chat_response", {"message": "秘密"}, owner="s1")
+    assert queue.get(job_id, owner="s1")["id"] == job_id
+    assert queue.get(job_id, owner="s2") is None
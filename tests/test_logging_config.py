@@ -0,0 +1,24 @@
+import logging
+
+from core.logging_config import DebugSamplingFilter, JsonFormatter, parse_levels
+
+
+def _record(level, msg="m"):
+    return logging.LogRecord("t", level, __file__, 1, msg, None, None)
+
+
+def test_parse_levels_ignores_invalid_items():
+    levels = parse_levels("chat.views=info, core=WARNING,bad,x=NOPE")
+    assert levels == {"chat.views": logging.INFO, "core": logging.WARNING}
+
+
+def test_debug_sampling_keeps_info_and_thins_debug():
+    f = DebugSamplingFilter(0.25)
+    kept = sum(f.filter(_record(logging.DEBUG)) for _ in range(100))
+    assert kept == 25
+    assert f.filter(_record(logging.INFO))
+
+
+def test_json_formatter_uses_lazy_args():
+    record = logging.LogRecord("t", logging.INFO, __file__, 1, "n=%d", (3,), None)
+    assert '"msg": "n=3"' in JsonFormatter().format(record)
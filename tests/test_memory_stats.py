@@ -0,0 +1,73 @@
+import threading
+
+from core.memory_stats import MemoryStats, contribution, disk_usage
+
+
+def _metadata(level, day, tokens=None, message="hello", response="world"):
+    metadata = {"privacy_level": level, "timestamp": f"{day}T10:00:00",
+                "message_length": len(message), "response_length": len(response)}
+    if tokens is not None:
+        metadata["tokens"] = tokens
+    return metadata
+
+
+def test_contribution_uses_saved_tokens_and_skips_knowledge():
+    assert contribution(_metadata("low", "2024-06-01", tokens=7)) == ("low", "2024-06-01", 7, 21)
+    # tokens のない旧データは文字数から概算
+    level, day, tokens, characters = contribution({"timestamp_epoch": 0.0}, "x" * 10)
+    assert level == "unknown" and tokens == 6 and characters == 10
+    assert contribution({"type": "knowledge"}, "doc") is None
+
+
+def test_record_and_delete_incrementally(tmp_path):
+    stats = MemoryStats(str(tmp_path / "stats.sqlite3"))
+    saved = [_metadata("low", "2024-06-01", 10), _metadata("low", "2024-06-02", 20),
+             _metadata("high", "2024-06-02", 5)]
+    for metadata in saved:
+        stats.record("c", [metadata])
+    summary = stats.summary("c")
+    assert summary["conversations"] == 3 and summary["tokens"] == 35
+    assert summary["by_privacy_level"] == {"high": {"conversations": 1, "tokens": 5},
+                                           "low": {"conversations": 2, "tokens": 30}}
+    assert summary["by_day"] == {"2024-06-01": 1, "2024-06-02": 2}
+
+    stats.record("c", saved[:2], sign=-1)
+    summary = stats.summary("c")
+    assert summary["conversations"] == 1 and summary["by_day"] == {"2024-06-02": 1}
+    assert stats.summary("other")["conversations"] == 0
+
+
+def test_rebuild_replaces_counts(tmp_path):
+    stats = MemoryStats(str(tmp_path / "stats.sqlite3"))
+    stats.record("c", [_metadata("low", "2024-06-01", 10)] * 5)
+    pages = [{"metadatas": [_metadata("high", "2024-06-03", 1)] * 2},
+             {"metadatas": [{"type": "knowledge"}, _metadata("low", "2024-06-03", 1)]}]
+    assert stats.rebuild("c", pages) == 3
+    summary = stats.summary("c")
+    assert summary["conversations"] == 3 and summary["rebuilt_at"]
+    assert summary["by_privacy_level"]["high"]["conversations"] == 2
+
+
+def test_concurrent_records_from_two_stores(tmp_path):
+    path = str(tmp_path / "stats.sqlite3")
+    stores = [MemoryStats(path), MemoryStats(path)]
+
+    def save(store):
+        for _ in range(50):
+            store.record("c", [_metadata("low", "2024-06-01", 1)])
+
+    threads = [threading.Thread(target=save, args=(store,)) for store in stores * 2]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert stores[0].summary("c")["conversations"] == 200
+
+
+def test_disk_usage_is_cached(tmp_path):
+    (tmp_path / "a").write_bytes(b"x" * 100)
+    stats = MemoryStats(str(tmp_path / "stats.sqlite3"), disk_ttl=60)
+    first = stats.disk_bytes(str(tmp_path))
+    (tmp_path / "b").write_bytes(b"x" * 100)
+    assert stats.disk_bytes(str(tmp_path)) == first
+    assert disk_usage(str(tmp_path)) == first + 100
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from core import columnar
+from core.memory_transfer import (
+    MANIFEST,
+    TransferError,
+    export_collection,
+    import_collection,
+)
+from fakes import FakeCollection
+
+
+def _rows(n=25):
+    return [(f"id{i}", f"User: 質問{i}\nAI: 回答{i}", {"privacy_level": "low", "n": i},
+             [i / 4, -i / 4, 0.5]) for i in range(n)]
+
+
+def test_export_import_roundtrip(tmp_path):
+    source = FakeCollection(_rows())
+    result = export_collection(source, str(tmp_path), chunk_size=10, writers=2)
+    assert (result.rows, result.parts) == (25, 3)
+
+    manifest = json.loads((tmp_path / MANIFEST).read_text(encoding="utf-8"))
+    assert manifest["dim"] == 3 and [p["rows"] for p in manifest["parts"]] == [10, 10, 5]
+    assert "embedding" in columnar.read_header(str(tmp_path / manifest["parts"][0]["file"]))["columns"]
+
+    def no_embed(texts):
+        raise AssertionError("埋め込みがあるのに再計算された")
+
+    target = FakeCollection()
+    result = import_collection(target, str(tmp_path), workers=3, embed=no_embed, batch_size=4)
+    assert result.rows == 25 and result.reembedded == 0
+    assert target.rows == source.rows
+
+    # 再実行しても同じ id は上書きされるだけ
+    import_collection(target, str(tmp_path), workers=2)
+    assert len(target.rows) == 25
+
+
+def test_import_without_embeddings_reembeds(tmp_path):
+    export_collection(FakeCollection(_rows(5)), str(tmp_path), include_embeddings=False)
+    with pytest.raises(TransferError):
+        import_collection(FakeCollection(), str(tmp_path))
+
+    calls = []
+
+    def embed(texts):
+        calls.append(len(texts))
+        return [[1.0, 2.0] for _ in texts]
+
+    target = FakeCollection()
+    result = import_collection(target, str(tmp_path), embed=embed, batch_size=2)
+    assert result.reembedded == 5 and calls == [2, 2, 1]
+    assert target.rows["id3"][3] == [1.0, 2.0]
+
+
+def test_import_requires_finished_export(tmp_path):
+    with pytest.raises(TransferError):
+        import_collection(FakeCollection(), str(tmp_path))
+
+
+def test_import_refuses_mismatched_embeddings(tmp_path):
+    export_collection(FakeCollection(_rows(5)), str(tmp_path), embedding_model="model-a")
+    assert json.loads((tmp_path / MANIFEST).read_text(encoding="utf-8"))["embedding_model"] == "model-a"
+
+    with pytest.raises(TransferError, match="モデル"):
+        import_collection(FakeCollection(), str(tmp_path), embedding_model="model-b")
+    existing = FakeCollection([("old", "User: x\nAI: y", {}, [0.0] * 8)])
+    with pytest.raises(TransferError, match="次元数"):
+        import_collection(existing, str(tmp_path), embedding_model="model-a")
+    assert list(existing.rows) == ["old"]
+
+    # 再計算すれば取り込める
+    result = import_collection(existing, str(tmp_path), embedding_model="model-b", reembed=True,
+                               embed=lambda texts: [[1.0] * 8 for _ in texts])
+    assert result.reembedded == 5 and len(existing.rows) == 6
+    import_collection(FakeCollection(), str(tmp_path), embedding_model="model-a")
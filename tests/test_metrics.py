@@ -0,0 +1,25 @@
+from core.metrics import MetricsRegistry
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    hist = registry.histogram("stage_seconds", "test", labelnames=("stage",),
+                              buckets=(0.1, 1.0))
+    hist.observe(0.05, stage="save")
+    hist.observe(0.5, stage="save")
+    hist.observe(5, stage="save")
+
+    text = registry.render()
+    assert 'stage_seconds_bucket{stage="save",le="0.1"} 1' in text
+    assert 'stage_seconds_bucket{stage="save",le="1"} 2' in text
+    assert 'stage_seconds_bucket{stage="save",le="+Inf"} 3' in text
+    assert 'stage_seconds_count{stage="save"} 3' in text
+
+
+def test_counter_and_label_escaping():
+    registry = MetricsRegistry()
+    counter = registry.counter("errors_total", "test", labelnames=("code",))
+    counter.inc(code='E"1')
+    counter.inc(2, code='E"1')
+    assert counter.value(code='E"1') == 3
+    assert 'errors_total{code="E\\"1"} 3' in registry.render()
@@ -0,0 +1,62 @@
+from core.privacy_analyzer import PrivacyAnalyzer
+
+
+def test_levels_for_keywords_and_pii():
+    analyzer = PrivacyAnalyzer()
+    assert analyzer.analyze_privacy_level("My Password is hunter2") == "high"
+    assert analyzer.analyze_privacy_level("これは極秘の資料です") == "high"
+    assert analyzer.analyze_privacy_level("連絡先は taro@example.com です") == "medium"
+    assert analyzer.analyze_privacy_level("電話は 090-1234-5678 まで") == "medium"
+    assert analyzer.analyze_privacy_level("今日はいい天気ですね") == "low"
+    assert analyzer.analyze_privacy_level("") == "low"
+
+
+def test_word_boundaries_for_ascii_keywords():
+    analyzer = PrivacyAnalyzer()
+    assert analyzer.analyze_privacy_level("please readdress the issue") == "low"
+    assert analyzer.analyze_privacy_level("store the secrets safely") == "high"
+    assert analyzer.analyze_privacy_level("ref 12090-1234-5678") == "low"
+
+
+def test_highest_level_wins_regardless_of_order():
+    analyzer = PrivacyAnalyzer()
+    assert analyzer.analyze_privacy_level("email first, then confidential") == "high"
+
+
+def test_custom_rules_and_batch():
+    analyzer = PrivacyAnalyzer(rules={
+        "high": {"keywords": ["給与"]},
+        "medium": {"patterns": {"zip": r"[0-9]{3}-[0-9]{4}"}},
+    })
+    assert analyzer.classify_batch(["給与明細", "〒100-0001", "password"]) == [
+        "high", "medium", "low"
+    ]
+
+
+def test_additional_tags():
+    tags = PrivacyAnalyzer().analyze_additional_tags("email: a@b.io password")
+    assert tags == ["keyword:email", "keyword:password", "pii:email"]
+
+
+def test_credit_card_requires_luhn_and_digit_groups():
+    analyzer = PrivacyAnalyzer()
+    assert analyzer.analyze_privacy_level("カード 4111 1111 1111 1111 です") == "high"
+    assert analyzer.analyze_privacy_level("card 4111-1111-1111-1111") == "high"
+    assert analyzer.analyze_privacy_level("amex 3782-822463-10005") == "high"
+    assert analyzer.analyze_privacy_level("no. 4111111111111111") == "high"
+    # チェックディジットが合わない番号・区切りの揃わない数字列・長い数字列の一部は対象外
+    assert analyzer.analyze_privacy_level("注文番号 4111 1111 1111 1112") == "low"
+    assert analyzer.analyze_privacy_level("4111-1111 1111-1111") == "low"
+    assert analyzer.analyze_privacy_level("id 94111111111111111118") == "low"
+
+
+def test_prefilter_limits_pattern_to_candidate_spans():
+    analyzer = PrivacyAnalyzer(rules={
+        "high": {"patterns": {"order": {"pattern": r"ord-[0-9]{3}", "prefilter": r"ord-[0-9]+"}}},
+    })
+    assert analyzer.analyze_additional_tags("x ord-12 y ord-345") == ["pii:order"]
+    assert analyzer.analyze_privacy_level("ord-12 ord-3") == "low"
+    # 候補の範囲の途中から始まるカード番号も検出する
+    default = PrivacyAnalyzer()
+    assert default.analyze_privacy_level("ref 2024-10 000 4111 1111 1111 1111") == "high"
+    assert default.analyze_privacy_level("1234-5678-9012 と 4111 1111 1111 1111") == "high"
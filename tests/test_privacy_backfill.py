@@ -0,0 +1,63 @@
+import json
+
+from core.privacy_analyzer import DEFAULT_RULES
+from core.privacy_backfill import PrivacyBackfill
+from fakes import FakeCollection
+
+
+def _rows():
+    return [
+        ("a", "User: my password is x", {"privacy_level": "low", "timestamp": "t"}),
+        ("b", "User: hello", {"privacy_level": "low"}),
+        ("c", "User: mail a@b.io", {"privacy_level": "high"}),
+        ("d", "knowledge text password", {"type": "knowledge"}),
+    ]
+
+
+def test_backfill_updates_only_changed_metadata(tmp_path):
+    collection = FakeCollection(_rows())
+    job = PrivacyBackfill(collection, str(tmp_path / "cp.json"), rules=DEFAULT_RULES,
+                          page_size=2, workers=1)
+    progress = job.run()
+
+    assert progress.finished and progress.scanned == 4 and progress.updated == 2
+    assert collection.rows["a"][2] == {"privacy_level": "high", "timestamp": "t"}
+    assert collection.rows["c"][2]["privacy_level"] == "medium"
+    assert collection.rows["d"][2] == {"type": "knowledge"}
+    assert progress.changes == {"low->high": 1, "high->medium": 1}
+
+
+def test_updates_are_passed_to_on_update(tmp_path):
+    mirrored = []
+    job = PrivacyBackfill(FakeCollection(_rows()), str(tmp_path / "cp.json"),
+                          rules=DEFAULT_RULES, page_size=2, workers=1,
+                          on_update=lambda ids, metadatas: mirrored.append(
+                              (ids, [m["privacy_level"] for m in metadatas])))
+    job.run()
+    assert mirrored == [(["a"], ["high"]), (["c"], ["medium"])]
+
+
+def test_backfill_resumes_from_checkpoint(tmp_path):
+    checkpoint = tmp_path / "cp.json"
+    collection = FakeCollection(_rows())
+    job = PrivacyBackfill(collection, str(checkpoint), rules=DEFAULT_RULES,
+                          page_size=2, workers=1)
+    progress = job.load_progress()
+    progress.offset = progress.scanned = 2
+    job.save_progress(progress)
+
+    progress = job.run()
+    assert progress.scanned == 4
+    assert collection.updates == [["c"]]
+    assert json.loads(checkpoint.read_text())["finished"] is True
+    # ルールが変わればチェックポイントは無効になる
+    other = PrivacyBackfill(collection, str(checkpoint), rules={"low": {"keywords": []}})
+    assert other.load_progress().offset == 0
+
+
+def test_dry_run_does_not_write(tmp_path):
+    collection = FakeCollection(_rows())
+    job = PrivacyBackfill(collection, str(tmp_path / "cp.json"), rules=DEFAULT_RULES,
+                          page_size=10, workers=1, dry_run=True)
+    assert job.run().updated == 2
+    assert collection.updates == [] and not (tmp_path / "cp.json").exists()
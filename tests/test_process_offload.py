@@ -0,0 +1,78 @@
+import asyncio
+import os
+
+import pytest
+
+from core.internal_if_codec import APIPayload
+from core.process_offload import OFFLOAD_SHM_BYTES, ProcessOffloader
+from core.task_runtime import TaskRuntime
+
+
+def _upper_data(payload):
+    return payload.data.upper()
+
+
+def _pid(_):
+    return os.getpid()
+
+
+class CountTask:
+    id, name, cpu_bound = 21, "cpu", True
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    @staticmethod
+    def cpu_work(payload):
+        return len(payload.data), os.getpid()
+
+
+def test_large_payloads_use_shared_memory_both_ways():
+    offloader = ProcessOffloader(max_workers=1, shm_threshold=1024)
+    before_in = OFFLOAD_SHM_BYTES.value(direction="in")
+    before_out = OFFLOAD_SHM_BYTES.value(direction="out")
+    try:
+        payload = APIPayload("1", "21", "o", "f", "あ" * 2000)
+        assert offloader.submit(_upper_data, payload).result(30) == "あ" * 2000
+        assert offloader.submit(_upper_data, APIPayload("1", "2", "o", "f", "ab")).result(30) == "AB"
+    finally:
+        offloader.shutdown()
+    assert OFFLOAD_SHM_BYTES.value(direction="in") - before_in == 6000
+    assert OFFLOAD_SHM_BYTES.value(direction="out") - before_out == 6000
+    assert 0.0 <= offloader.utilization() <= 1.0
+
+
+def test_workers_are_recycled():
+    offloader = ProcessOffloader(max_workers=1, recycle_after=2)
+    try:
+        pids = [offloader.submit(_pid, None).result(30) for _ in range(4)]
+    finally:
+        offloader.shutdown()
+    assert pids[0] == pids[1] and pids[2] == pids[3] and pids[0] != pids[2]
+
+
+def test_runtime_runs_cpu_bound_tasks_in_process_pool():
+    results = []
+
+    async def main(runtime):
+        results.append(await runtime.request(21, APIPayload("1", "21", "o", "f", "abc")))
+
+    runtime = TaskRuntime({21: CountTask()}, offloader=ProcessOffloader(max_workers=1))
+    asyncio.run(runtime.run(main(runtime)))
+    [(length, pid)] = results
+    assert length == 3 and pid != os.getpid()
+    assert runtime.stats()[21]["processed"] == 1
+
+
+def test_runtime_rejects_cpu_bound_task_without_cpu_work():
+    class Missing:
+        id, name, cpu_bound = 22, "cpu", True
+
+    async def main():
+        with pytest.raises(TypeError):
+            TaskRuntime({22: Missing()}).open()
+
+    asyncio.run(main())
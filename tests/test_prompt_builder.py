@@ -0,0 +1,114 @@
+import random
+from types import SimpleNamespace
+
+from core import metrics, prompt_builder
+from core.prompt_builder import (
+    HistoryCache,
+    PromptBuilder,
+    cached_tokens,
+    latest_ids,
+    record_cache_usage,
+)
+
+
+def _conversations(n):
+    return [{"id": f"id{i:03d}", "text": f"User: 質問{i}\nAI: 回答{i}",
+             "metadata": {"timestamp_epoch": 1_700_000_000 + i}} for i in range(n)]
+
+
+def test_prefix_is_stable_within_block_and_extends_at_boundary():
+    builder = PromptBuilder(block_size=4, max_blocks=2)
+    first = builder.build(_conversations(4), "質問A")
+    # 同じブロック内で会話が増えても先頭は変わらない
+    for n in (5, 6, 7):
+        prompt = builder.build(_conversations(n), f"質問{n}")
+        assert prompt.prefix_hash == first.prefix_hash
+        assert prompt.messages[:prompt.prefix_length] == first.messages[:first.prefix_length]
+    # ブロックが埋まると先頭は伸びるが、既存の先頭はそのまま
+    extended = builder.build(_conversations(8), "質問B")
+    assert extended.prefix_length == first.prefix_length + 8
+    assert extended.messages[:first.prefix_length] == first.messages[:first.prefix_length]
+    assert extended.messages[-1] == {"role": "user", "content": "質問B"}
+
+
+def test_old_blocks_fall_out_of_prefix():
+    builder = PromptBuilder(block_size=2, max_blocks=1)
+    older, recent = builder.split_history(_conversations(5))
+    assert [c["id"] for c in older] == ["id002", "id003"]
+    assert [c["id"] for c in recent] == ["id004"]
+
+
+def test_recent_window_splits_like_full_history():
+    builder = PromptBuilder(block_size=4, max_blocks=2)
+    assert builder.history_limit == 12
+    for n in (3, 8, 13, 14, 19, 24):
+        conversations = _conversations(n)
+        ids, total = latest_ids([(c["id"], c["metadata"]) for c in reversed(conversations)]
+                                + [("k", {"type": "knowledge"})], builder.history_limit)
+        assert total == n
+        window = [c for c in conversations if c["id"] in ids]
+        assert builder.build(window, "q", total=total).messages == \
+            builder.build(conversations, "q").messages
+
+
+def test_history_cache_appends_own_saves_and_drops_on_gaps():
+    cache = HistoryCache()
+    conversations = _conversations(5)
+    cache.put("c", 3, 4, conversations, 5)
+    assert cache.get("c", 3, 4) == (conversations[1:], 5)
+    assert cache.get("c", 4, 4) is None and cache.get("d", 3, 4) is None
+    assert cache.get("c", 3, 8) is None  # 保持しているより多くは返せない
+    # 自プロセスの保存（世代が1つ進む）は読み直さずに足す
+    latest = _conversations(6)[5]
+    cache.append("c", 4, latest)
+    assert cache.get("c", 4, 4) == (conversations[2:] + [latest], 6)
+    # 他の保存・削除が間に入った（世代が飛んだ）場合は読み直す
+    cache.append("c", 6, _conversations(7)[6])
+    assert cache.get("c", 6, 4) is None
+
+
+def test_order_does_not_depend_on_retrieval_order():
+    builder = PromptBuilder(block_size=3, max_blocks=2)
+    conversations = _conversations(7)
+    shuffled = conversations[:]
+    random.Random(0).shuffle(shuffled)
+    assert builder.build(shuffled, "q").messages == builder.build(conversations, "q").messages
+
+
+def test_system_and_pinned_come_first(tmp_path, monkeypatch):
+    pinned = tmp_path / "pinned.txt"
+    pinned.write_text("社内規程: 会議は10時から\n", encoding="utf-8")
+    monkeypatch.setenv("PROMPT_PINNED_FILE", str(pinned))
+    monkeypatch.setenv("PROMPT_SYSTEM", "テスト用のシステムプロンプト")
+    prompt = PromptBuilder.from_env().build(_conversations(1), "q", cache_key="m:c")
+    assert prompt.messages[0] == {"role": "system", "content": "テスト用のシステムプロンプト"}
+    assert prompt.messages[1] == {"role": "system", "content": "社内規程: 会議は10時から"}
+    assert prompt.prefix_length == 2
+    assert prompt.cache_key == "m:c"
+
+
+def test_prefix_tokens_are_counted_once(monkeypatch):
+    calls = []
+
+    def counting(texts):
+        calls.append(len(texts))
+        return 42
+
+    monkeypatch.setattr(prompt_builder, "count_tokens", counting)
+    builder = PromptBuilder(block_size=2)
+    for n in (2, 3):
+        assert builder.build(_conversations(n), "q").prefix_tokens == 42
+    assert len(calls) == 1
+
+
+def test_cached_tokens_from_usage():
+    as_object = SimpleNamespace(prompt_tokens=100,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=64))
+    as_dict = SimpleNamespace(prompt_tokens=100, prompt_tokens_details={"cached_tokens": 32})
+    assert cached_tokens(as_object) == 64
+    assert cached_tokens(as_dict) == 32
+    assert cached_tokens(SimpleNamespace(prompt_tokens=10)) == 0
+    before = metrics.TOKENS_TOTAL.value(kind="cached")
+    assert record_cache_usage(as_object) == 64
+    assert metrics.TOKENS_TOTAL.value(kind="cached") == before + 64
+    assert record_cache_usage(None) == 0
@@ -0,0 +1,82 @@
+import pytest
+
+from core import columnar
+from core.retention import RetentionPolicy, RetentionSweeper, search_archive
+from fakes import FakeCollection
+
+DAY = 86400
+NOW = 1_700_000_000.0
+
+
+def _rows():
+    rows = []
+    for i in range(5):
+        rows.append((f"h{i}", f"User: 暗証番号は{i}です", {"privacy_level": "high",
+                                                    "timestamp_epoch": NOW - (i * 20) * DAY}))
+        rows.append((f"l{i}", f"User: 会議資料{i}の置き場所", {"privacy_level": "low",
+                                                     "timestamp_epoch": NOW - (i * 50) * DAY}))
+    rows.append(("k", "ナレッジ", {"type": "knowledge"}))
+    return rows
+
+
+def test_policy_parse():
+    policy = RetentionPolicy.parse("high=delete:30, low=archive:90")
+    assert policy.rules["high"].action == "delete" and policy.rules["low"].days == 90
+    assert not RetentionPolicy.parse("")
+    for spec in ("high=drop:30", "high:30", "high=delete:-1"):
+        with pytest.raises(ValueError):
+            RetentionPolicy.parse(spec)
+
+
+def test_sweep_deletes_and_archives(tmp_path):
+    collection = FakeCollection(_rows())
+    deleted = []
+    sweeper = RetentionSweeper(collection, RetentionPolicy.parse("high=delete:30,low=archive:90"),
+                               archive_dir=str(tmp_path), batch_size=1,
+                               on_delete=lambda ids, metadatas: deleted.extend(ids), clock=lambda: NOW)
+
+    preview = sweeper.sweep(dry_run=True)
+    assert preview.deleted == {"high": 3} and preview.archived == {"low": 3}
+    assert len(collection.rows) == 11
+
+    result = sweeper.sweep()
+    assert result.deleted == {"high": 3} and result.archived == {"low": 3}
+    assert sorted(collection.rows) == ["h0", "h1", "k", "l0", "l1"]
+    assert sorted(deleted) == ["h2", "h3", "h4", "l2", "l3", "l4"]
+    assert len(result.archive_files) == 3 and result.archive_bytes > 0
+
+    hits = search_archive("会議資料3", archive_dir=str(tmp_path))
+    assert hits[0]["id"] == "l3" and hits[0]["metadata"]["privacy_level"] == "low"
+    assert search_archive("会議資料", archive_dir=str(tmp_path), privacy_level="high") == []
+    recent = search_archive("会議資料", archive_dir=str(tmp_path), since=NOW - 160 * DAY)
+    assert [hit["id"] for hit in recent] == ["l2", "l3"]
+
+
+def test_backfill_epochs():
+    collection = FakeCollection([
+        ("a", "x", {"privacy_level": "high", "timestamp": "2024-01-01T00:00:00"}),
+        ("b", "y", {"privacy_level": "high", "timestamp": "broken"}),
+        ("c", "z", {"privacy_level": "high", "timestamp_epoch": 1.0}),
+    ])
+    sweeper = RetentionSweeper(collection, RetentionPolicy.parse("high=delete:1"), batch_size=2)
+    assert sweeper.backfill_epochs() == 1
+    assert "timestamp_epoch" in collection.rows["a"][2]
+    assert sweeper.sweep().deleted == {"high": 2}
+    assert list(collection.rows) == ["b"]
+
+
+def test_columnar_roundtrip_and_header(tmp_path):
+    path = str(tmp_path / "t.ccol")
+    columnar.write_table(path, {"id": ["a", "b"], "n": [3, 1], "text": ["あ", None]},
+                         meta={"k": "v"})
+    header = columnar.read_header(path)
+    assert header["rows"] == 2 and header["meta"] == {"k": "v"}
+    assert header["columns"]["n"]["min"] == 1 and "min" not in header["columns"]["text"]
+    assert columnar.read_table(path, ["text"]) == {"text": ["あ", None]}
+    assert columnar.read_table(path)["n"] == [3, 1]
+    assert columnar.list_files(str(tmp_path)) == [path]
+    with pytest.raises(columnar.ColumnarError):
+        columnar.write_table(path, {"a": [1], "b": []})
+    (tmp_path / "bad.ccol").write_bytes(b"nope")
+    with pytest.raises(columnar.ColumnarError):
+        columnar.read_header(str(tmp_path / "bad.ccol"))
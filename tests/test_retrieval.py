@@ -0,0 +1,147 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from core import tracing
+from core.prompt_builder import PromptBuilder
+from core.retrieval import (
+    RAG_RETRIEVALS,
+    Passage,
+    Retriever,
+    knowledge_source,
+    memory_source,
+    rerank,
+    select_within_budget,
+)
+
+
+def _source(*texts, source="knowledge", delay=0.0):
+    def search():
+        if delay:
+            time.sleep(delay)
+        return [Passage(source, text, rank) for rank, text in enumerate(texts)]
+    return search
+
+
+def test_sources_run_concurrently_within_deadline():
+    barrier = threading.Barrier(2, timeout=2)
+
+    def waiting(text):
+        def search():
+            barrier.wait()  # 並行に実行されなければ締め切りまでに揃わない
+            return [Passage("memory", text, 0)]
+        return search
+
+    retrieval = Retriever(deadline=1.0, token_budget=1000).retrieve(
+        "在庫", {"knowledge": waiting("倉庫Aの在庫は10個"), "memory": waiting("倉庫Bの在庫は3個")})
+    assert retrieval.result == "ok"
+    assert sorted(retrieval.context()) == ["倉庫Aの在庫は10個", "倉庫Bの在庫は3個"]
+    assert {"knowledge", "memory", "wait", "rerank", "total"} <= set(retrieval.timings)
+
+
+def test_slow_source_is_dropped_at_deadline():
+    before = RAG_RETRIEVALS.value(result="partial")
+    started = time.perf_counter()
+    retrieval = Retriever(deadline=0.05, token_budget=1000).retrieve(
+        "会議", {"knowledge": _source("会議は10時から"),
+               "memory": _source("会議室はB", source="memory", delay=0.5)})
+    assert time.perf_counter() - started < 0.4
+    assert retrieval.result == "partial"
+    assert retrieval.context() == ["会議は10時から"]
+    assert "memory" not in retrieval.timings
+    assert RAG_RETRIEVALS.value(result="partial") == before + 1
+
+
+def test_all_sources_late_or_failing_degrade_to_no_context():
+    def boom():
+        raise ConnectionError("chroma unavailable")
+
+    timeout = Retriever(deadline=0.02).retrieve("q", {"memory": _source("x", delay=0.3)})
+    assert timeout.result == "timeout" and timeout.context() == []
+    error = Retriever(deadline=0.5).retrieve("q", {"knowledge": boom})
+    assert error.result == "error" and error.context() == []
+
+
+def test_rerank_prefers_lexical_overlap():
+    passages = [Passage("knowledge", "週末の天気は晴れです", 0),
+                Passage("memory", "経費精算の締め日は毎月25日です", 1)]
+    ranked = rerank("経費精算の締め日はいつ？", passages)
+    assert ranked[0].text.startswith("経費精算")
+    assert ranked[0].score > ranked[1].score
+
+
+def test_budget_skips_duplicates_excluded_and_oversized(monkeypatch):
+    monkeypatch.setattr("core.retrieval.count_tokens", lambda texts: sum(len(t) for t in texts))
+    passages = [Passage("knowledge", "A" * 50, 0), Passage("memory", "Ｂ b", 0),
+                Passage("knowledge", "b  b", 1), Passage("memory", "履歴にある会話", 1),
+                Passage("knowledge", "短い", 2)]
+    selected = select_within_budget(passages, token_budget=10, exclude=["履歴にある会話"])
+    assert [p.text for p in selected] == ["Ｂ b", "短い"]
+
+
+def test_default_sources_adapt_db_manager():
+    memory = SimpleNamespace(
+        search_knowledge=lambda q, k: [SimpleNamespace(page_content="規程", metadata={"source": "a.txt"})],
+        search_conversations=lambda q, limit: [
+            {"text": "User: q\nAI: a", "metadata": {"privacy_level": "public"}},
+            {"text": "規程", "metadata": {"type": "knowledge"}}])
+    assert [(p.source, p.text) for p in knowledge_source(memory, "q", 3)()] == [("knowledge", "規程")]
+    assert [p.text for p in memory_source(memory, "q", 3)()] == ["User: q\nAI: a"]
+
+    # ナレッジは共有の DBマネージャー、会話はテナントのシャードから検索する
+    shard = SimpleNamespace(search_knowledge=lambda q, k: [],
+                            search_conversations=lambda q, limit: [])
+    sources = Retriever(k=3).sources_for(shard, "q", knowledge=memory)
+    assert [p.text for p in sources["knowledge"]()] == ["規程"]
+    assert sources["memory"]() == []
+
+
+def test_search_spans_are_children_of_retrieve():
+    seen = []
+
+    def search():
+        seen.append(tracing.current_span().name)
+        return []
+
+    assert Retriever(deadline=1.0).retrieve("q", {"knowledge": search}).result == "empty"
+    assert seen == ["rag.retrieve"]
+
+
+def test_context_goes_after_the_cacheable_prefix():
+    conversations = [{"id": f"{i}", "text": f"User: 質問{i}\nAI: 回答{i}",
+                      "metadata": {"timestamp_epoch": i}} for i in range(5)]
+    builder = PromptBuilder(block_size=4)
+    plain = builder.build(conversations, "質問")
+    prompt = builder.build(conversations, "質問", context=["倉庫Aの在庫は10個"])
+    assert prompt.prefix_hash == plain.prefix_hash
+    assert prompt.messages[-2]["role"] == "system"
+    assert "倉庫Aの在庫は10個" in prompt.messages[-2]["content"]
+    assert prompt.messages[-1] == {"role": "user", "content": "質問"}
+
+
+def test_stale_searches_do_not_pile_up_on_a_saturated_pool():
+    from concurrent.futures import ThreadPoolExecutor
+
+    started = []
+
+    def slow(name):
+        def search():
+            started.append(name)
+            time.sleep(0.2)
+            return [Passage("memory", name, 0)]
+        return search
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    retriever = Retriever(deadline=0.05, executor=executor, max_inflight=2)
+    results = [retriever.retrieve("q", {"knowledge": slow(f"k{i}"), "memory": slow(f"m{i}")}).result
+               for i in range(20)]
+    executor.shutdown(wait=True)
+    # 取り消しと枠の上限により、実行されるのは同時実行数の数回分だけ
+    assert len(started) <= 8
+    assert results[0] == "timeout"
+    assert "shed" in results
+    # 遅い検索が終われば枠が戻り、次の検索は通常どおり行われる
+    fresh = ThreadPoolExecutor(max_workers=2)
+    retriever._executor = fresh
+    assert retriever.retrieve("q", {"knowledge": _source("x")}).result == "ok"
+    fresh.shutdown()
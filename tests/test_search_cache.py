@@ -0,0 +1,134 @@
+import threading
+
+from core.embeddings import QUERY_EMBEDDINGS, InstrumentedEmbeddings
+from core.search_cache import SearchCache
+
+
+def _results(n):
+    return [{"text": f"t{i}", "metadata": {"privacy_level": "low"}, "similarity_score": i / 10}
+            for i in range(n)]
+
+
+def test_hit_until_generation_changes():
+    cache = SearchCache(capacity=8)
+    generation = cache.generation("c")
+    cache.put("c", "q", generation, 20, _results(20))
+    assert cache.get("c", "q", 5)[:5] == _results(5)
+    assert cache.get("c", "other", 5) is None
+    cache.invalidate("c")
+    assert cache.get("c", "q", 5) is None
+
+
+def test_pages_within_k_are_served_and_beyond_k_miss():
+    cache = SearchCache(capacity=8)
+    cache.put("c", "q", 0, 20, _results(20))
+    assert cache.get("c", "q", 20) is not None
+    assert cache.get("c", "q", 25) is None
+    # k 件に満たない結果はそれが全件なので、どのページでも使える
+    cache.put("c", "short", 0, 20, _results(3))
+    assert cache.get("c", "short", 40) == _results(3)
+
+
+def test_put_with_stale_generation_is_never_served():
+    cache = SearchCache(capacity=8)
+    generation = cache.generation("c")
+    cache.invalidate("c")  # 検索中に会話が保存された
+    cache.put("c", "q", generation, 20, _results(20))
+    assert cache.get("c", "q", 5) is None
+
+
+def test_returned_results_are_copies_and_scopes_are_independent():
+    cache = SearchCache(capacity=8)
+    cache.put("a", "q", 0, 5, _results(5))
+    cache.put("b", "q", 0, 5, _results(2))
+    cache.get("a", "q", 5)[0]["metadata"]["privacy_level"] = "high"
+    assert cache.get("a", "q", 5) == _results(5)
+    cache.invalidate("a")
+    assert cache.get("a", "q", 5) is None
+    assert cache.get("b", "q", 5) == _results(2)
+
+
+def test_lru_eviction_and_disabled_cache():
+    cache = SearchCache(capacity=2)
+    for key in ("q1", "q2", "q3"):
+        cache.put("c", key, 0, 5, _results(1))
+    assert len(cache) == 2 and cache.get("c", "q1", 1) is None
+    disabled = SearchCache(capacity=0)
+    disabled.put("c", "q", 0, 5, _results(1))
+    assert disabled.get("c", "q", 1) is None
+
+
+def test_disk_tier_is_shared_and_invalidated_across_instances(tmp_path):
+    path = str(tmp_path / "search_cache.sqlite3")
+    web, worker = SearchCache(capacity=8, disk_path=path), SearchCache(capacity=8, disk_path=path)
+    web.put("c", "q", web.generation("c"), 20, _results(20))
+    assert worker.get("c", "q", 5) == _results(20)
+    # 別プロセスでの保存が世代を進めると、プロセス内の1段目も使われなくなる
+    worker.invalidate("c")
+    assert web.get("c", "q", 5) is None
+
+
+def test_disk_tier_from_threads(tmp_path):
+    cache = SearchCache(capacity=0, disk_path=str(tmp_path / "c.sqlite3"))
+    errors = []
+
+    def bump():
+        try:
+            for _ in range(20):
+                cache.invalidate("c")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors and cache.generation("c") == 80
+
+
+def test_query_embeddings_are_cached_per_model():
+    QUERY_EMBEDDINGS.clear()
+
+    class Base:
+        calls = 0
+
+        def __init__(self, model):
+            self.model = model
+
+        def embed_query(self, text):
+            Base.calls += 1
+            return [float(len(text))]
+
+    first = InstrumentedEmbeddings(Base("m1"))
+    assert first.embed_query("abc") == [3.0]
+    first.embed_query("abc").append(9.0)
+    assert first.embed_query("abc") == [3.0]
+    assert Base.calls == 1
+    InstrumentedEmbeddings(Base("m2")).embed_query("abc")
+    assert Base.calls == 2
+    QUERY_EMBEDDINGS.clear()
+
+
+def test_memory_only_entries_expire(monkeypatch):
+    from core import search_cache
+    now = [1000.0]
+    monkeypatch.setattr(search_cache.time, "monotonic", lambda: now[0])
+    cache = SearchCache(capacity=8, ttl=30)
+    cache.put("c", "q", 0, 5, _results(5))
+    now[0] += 10
+    assert cache.get("c", "q", 5) == _results(5)
+    # 他のプロセスでの変更は検知できないため、期限を過ぎたら検索し直す
+    now[0] += 30
+    assert cache.get("c", "q", 5) is None
+
+
+def test_default_disk_path(monkeypatch, tmp_path):
+    from core.search_cache import default_disk_path
+    monkeypatch.delenv("SEARCH_CACHE_DB", raising=False)
+    monkeypatch.setenv("CHROMA_DB_DIR", str(tmp_path))
+    assert default_disk_path() == str(tmp_path / "search_cache.sqlite3")
+    monkeypatch.setenv("SEARCH_CACHE_DB", "off")
+    assert default_disk_path() is None
+    shared = SearchCache(capacity=8, disk_path=str(tmp_path / "sub" / "cache.sqlite3"))
+    assert shared.disk is not None and shared.ttl == 0
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+
+from core.embeddings import InstrumentedEmbeddings
+from core.singleflight import SINGLEFLIGHT_CALLS, Group, make_key, normalize
+
+
+def _concurrent(group, key, func, callers=5):
+    """リーダーが実行中の間に残りの呼び出しを到着させる"""
+    entered = threading.Event()
+    release = threading.Event()
+
+    def leader_func():
+        entered.set()
+        release.wait(5)
+        return func()
+
+    with ThreadPoolExecutor(callers) as pool:
+        first = pool.submit(group.do_shared, key, leader_func)
+        entered.wait(5)
+        others = [pool.submit(group.do_shared, key, leader_func) for _ in range(callers - 1)]
+        while sum(c.followers for c in group._calls.values()) < callers - 1:
+            time.sleep(0.001)
+        release.set()
+        return [first] + others
+
+
+def test_duplicate_callers_share_the_leaders_result():
+    group = Group("test.share")
+    calls = []
+    futures = _concurrent(group, "k", lambda: calls.append(1) or "answer")
+    results = [f.result() for f in futures]
+    assert calls == [1]
+    assert results[0] == ("answer", False)
+    assert all(r == ("answer", True) for r in results[1:])
+    assert SINGLEFLIGHT_CALLS.value(group="test.share", role="follower") == 4
+    assert group.inflight() == 0
+    # 完了後の呼び出しは改めて実行される
+    assert group.do("k", lambda: "again") == "again"
+
+
+def test_leader_exception_is_raised_to_followers():
+    group = Group("test.error")
+
+    def boom():
+        raise RuntimeError("provider down")
+
+    for future in _concurrent(group, "k", boom, callers=3):
+        with pytest.raises(RuntimeError, match="provider down"):
+            future.result()
+
+
+def test_keys_normalize_whitespace_and_width():
+    assert normalize("  ｈｅｌｌｏ \n world ") == "hello world"
+    assert make_key("m", normalize("a  b")) == make_key("m", normalize(" a b"))
+    assert make_key("m", "a", None) != make_key("m", "a", "high")
+
+
+def test_embeddings_are_coalesced_per_model_and_text():
+    from core.embeddings import EMBEDDING_FLIGHT, QUERY_EMBEDDINGS
+    QUERY_EMBEDDINGS.clear()
+    release = threading.Event()
+
+    class Base:
+        def __init__(self, model):
+            self.model = model
+            self.calls = []
+
+        def embed_query(self, text):
+            self.calls.append(text)
+            release.wait(5)
+            return [float(len(text))]
+
+    m1, m2 = Base("m1"), Base("m2")
+    callers = [InstrumentedEmbeddings(m1)] * 5 + [InstrumentedEmbeddings(m2)] * 3
+    with ThreadPoolExecutor(len(callers)) as pool:
+        futures = [pool.submit(e.embed_query, "同時に埋め込むテキスト") for e in callers]
+        # 同じモデル・テキストの後着は、先着の生成が終わるまで待っている
+        while sum(c.followers for c in EMBEDDING_FLIGHT._calls.values()) < len(callers) - 2:
+            time.sleep(0.001)
+        release.set()
+        results = [f.result() for f in futures]
+    assert results == [[11.0]] * len(callers)
+    assert m1.calls == ["同時に埋め込むテキスト"] and m2.calls == ["同時に埋め込むテキスト"]
+    assert callers[0].model == "m1"
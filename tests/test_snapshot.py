@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta, timezone
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from core.snapshot import SnapshotError, Snapshotter, SnapshotStore
+
+
+def _make_source(root):
+    os.makedirs(root / "segment")
+    conn = sqlite3.connect(root / "chroma.sqlite3")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, body TEXT)")
+    conn.executemany("INSERT INTO t (body) VALUES (?)", [("会話" * 50,)] * 500)
+    conn.commit()
+    conn.close()
+    (root / "segment" / "data_level0.bin").write_bytes(os.urandom(300_000))
+    (root / "segment" / "header.bin").write_bytes(b"header")
+
+
+def _rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        return conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_incremental_snapshot_and_restore_to_timestamp(tmp_path):
+    source = tmp_path / "chroma_db"
+    _make_source(source)
+    store = SnapshotStore(str(tmp_path / "snapshots"), chunk_size=64 * 1024)
+    snapshotter = Snapshotter(str(source), store)
+
+    first = snapshotter.create()
+    assert first.new_chunks > 0 and first.files[-1].path == "chroma.sqlite3"
+
+    conn = sqlite3.connect(source / "chroma.sqlite3")
+    conn.execute("INSERT INTO t (body) VALUES ('追加')")
+    conn.commit()
+    conn.close()
+    second = snapshotter.create()
+    # 変更のないセグメントファイルは再利用され、書き込みは一部のチャンクのみ
+    assert second.reused_chunks > second.new_chunks
+    assert second.bytes_written < first.bytes_written
+
+    restored = tmp_path / "restored"
+    snapshotter.restore(str(restored), at=datetime.fromisoformat(first.created_at))
+    assert _rows(restored / "chroma.sqlite3") == 500
+    assert (restored / "segment" / "data_level0.bin").read_bytes() == \
+        (source / "segment" / "data_level0.bin").read_bytes()
+
+    snapshotter.restore(str(restored))
+    assert _rows(restored / "chroma.sqlite3") == 501
+    assert any(name.startswith("restored.before-restore-") for name in os.listdir(tmp_path))
+
+    with pytest.raises(SnapshotError):
+        store.find(datetime(2000, 1, 1))
+
+
+def test_snapshot_while_writing(tmp_path):
+    source = tmp_path / "chroma_db"
+    _make_source(source)
+    stop = threading.Event()
+
+    def writer():
+        conn = sqlite3.connect(source / "chroma.sqlite3")
+        while not stop.is_set():
+            conn.execute("INSERT INTO t (body) VALUES ('書き込み中')")
+            conn.commit()
+        conn.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        snapshotter = Snapshotter(str(source), SnapshotStore(str(tmp_path / "snapshots")))
+        snapshotter.create()
+    finally:
+        stop.set()
+        thread.join()
+    snapshotter.restore(str(tmp_path / "restored"))
+    assert _rows(tmp_path / "restored" / "chroma.sqlite3") >= 500
+
+
+def test_prune_and_corruption(tmp_path):
+    source = tmp_path / "chroma_db"
+    _make_source(source)
+    store = SnapshotStore(str(tmp_path / "snapshots"), chunk_size=64 * 1024)
+    snapshotter = Snapshotter(str(source), store)
+    snapshotter.create()
+    (source / "segment" / "data_level0.bin").write_bytes(os.urandom(300_000))
+    latest = snapshotter.create()
+
+    assert store.prune(keep=1)[0] == 1 and len(store.manifests()) == 1
+    snapshotter.restore(str(tmp_path / "restored"))
+
+    digest = latest.files[0].chunks[0]
+    with open(store._chunk_path(digest), "r+b") as f:
+        f.seek(10)
+        f.write(b"\x00\x01\x02")
+    with pytest.raises(SnapshotError):
+        snapshotter.restore(str(tmp_path / "restored2"))
+    assert not os.path.exists(tmp_path / "restored2")
+
+
+def test_find_accepts_timezone_aware_time(tmp_path):
+    source = tmp_path / "chroma_db"
+    _make_source(source)
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    created = Snapshotter(str(source), store).create()
+    later = datetime.now(timezone(timedelta(hours=-3))) + timedelta(seconds=5)
+    assert store.find(later).id == created.id
+    with pytest.raises(SnapshotError):
+        store.find(datetime(2000, 1, 1, tzinfo=timezone.utc))
+
+
+def test_prune_waits_for_running_create(tmp_path):
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    pruned = threading.Event()
+
+    def prune():
+        store.prune(keep=0)
+        pruned.set()
+
+    with store.lock():  # 実行中の create（マニフェストを書く前）
+        digest, _ = store.put_chunk(b"chunk of a running snapshot")
+        worker = threading.Thread(target=prune)
+        worker.start()
+        assert not pruned.wait(0.3)
+        assert store.has_chunk(digest)
+    worker.join(5)
+    assert pruned.is_set() and not store.has_chunk(digest)
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+
+import pytest
+
+from core.internal_if_codec import APIPayload, encode_frame, encode_text
+from core.task_runtime import (
+    PRIORITY_HIGH, PRIORITY_LOW, InboxFullError, TaskRuntime, UnknownTaskError,
+)
+
+
+class EchoTask:
+    def __init__(self, task_id, gate=None):
+        self.id = task_id
+        self.name = f"echo{task_id}"
+        self.gate = gate
+        self.seen = []
+        self.started = self.stopped = False
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.stopped = True
+
+    async def handle(self, payload):
+        if self.gate is not None:
+            await self.gate.wait()
+        self.seen.append(payload.order)
+        return payload.data.upper()
+
+
+def _payload(order, dst="12", data="x"):
+    return APIPayload("1", dst, order, "f", data)
+
+
+def test_routes_text_and_binary_messages_and_collects_stats():
+    task = EchoTask(12)
+
+    async def main(runtime):
+        a = await runtime.route(encode_text(_payload("a", data="hi")))
+        b = await runtime.route(encode_frame(_payload("b", data="a,b")))
+        assert await a == "HI" and await b == "A,B"
+
+    runtime = TaskRuntime({12: task})
+    asyncio.run(runtime.run(main(runtime)))
+    stats = runtime.stats()[12]
+    assert task.started and task.stopped
+    assert stats["processed"] == 2 and stats["queued"] == 0
+
+
+def test_priority_backpressure_and_cancellation():
+    async def scenario():
+        gate = asyncio.Event()
+        task = EchoTask(12, gate)
+        runtime = TaskRuntime({12: task}, inbox_size=3)
+        runtime.open()
+        first = await runtime.send(12, _payload("first"))
+        await asyncio.sleep(0)  # ワーカーが first を取り出して gate で待つ
+        low = await runtime.send(12, _payload("low"), PRIORITY_LOW)
+        dropped = await runtime.send(12, _payload("dropped"))
+        high = await runtime.send(12, _payload("high"), PRIORITY_HIGH)
+        with pytest.raises(InboxFullError):
+            await runtime.send(12, _payload("overflow"), timeout=0.01)
+        assert runtime.try_send(12, _payload("overflow")) is None
+        dropped.cancel()
+        gate.set()
+        await asyncio.gather(first, low, high)
+        await runtime.join()
+        with pytest.raises(UnknownTaskError):
+            await runtime.send(99, _payload("x", dst="99"))
+        await runtime.close()
+        return task.seen, runtime.stats()[12]
+
+    seen, stats = asyncio.run(scenario())
+    assert seen == ["first", "high", "low"]
+    assert stats["cancelled"] == 1 and stats["processed"] == 3
+
+
+def test_blocking_start_does_not_block_message_handling():
+    release = threading.Event()
+
+    class BlockingTask:
+        id, name = 1, "cui"
+
+        def start(self):
+            release.wait(5)
+
+        def stop(self):
+            release.set()
+
+    class SyncTask(EchoTask):
+        def handle(self, payload):
+            return threading.current_thread() is not threading.main_thread()
+
+    async def main(runtime):
+        assert await runtime.request(12, _payload("a")) is True
+
+    runtime = TaskRuntime({1: BlockingTask(), 12: SyncTask(12)})
+    asyncio.run(runtime.run(main(runtime)))
+    assert release.is_set()
@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from core.tenant import DEFAULT_TENANT, ShardRegistry, collection_name, tenant_key
+
+
+class FakeSession:
+    def __init__(self, key=None):
+        self.session_key = key
+
+    def save(self):
+        self.session_key = "new-session"
+
+
+class FakeUser:
+    def __init__(self, pk=None):
+        self.pk = pk
+        self.is_authenticated = pk is not None
+
+
+class FakeRequest:
+    def __init__(self, user=None, session=None):
+        self.user = user or FakeUser()
+        self.session = session
+
+
+def test_tenant_key(monkeypatch):
+    monkeypatch.delenv("TENANT_MODE", raising=False)
+    assert tenant_key(FakeRequest(FakeUser(7), FakeSession("abc"))) == DEFAULT_TENANT
+
+    monkeypatch.setenv("TENANT_MODE", "user")
+    assert tenant_key(FakeRequest(FakeUser(7), FakeSession("abc"))) == "u7"
+    anonymous = tenant_key(FakeRequest(session=FakeSession("abc")))
+    assert anonymous.startswith("s") and "abc" not in anonymous
+    assert anonymous == tenant_key(FakeRequest(session=FakeSession("abc")))
+    session = FakeSession()
+    assert tenant_key(FakeRequest(session=session)).startswith("s")
+    assert session.session_key == "new-session"
+    assert tenant_key(FakeRequest()) == DEFAULT_TENANT
+
+    monkeypatch.setenv("TENANT_MODE", "shared")
+    assert tenant_key(FakeRequest(FakeUser(7))) == DEFAULT_TENANT
+
+
+def test_collection_name():
+    assert collection_name("conversations", DEFAULT_TENANT) == "conversations"
+    assert collection_name("conversations", "u7") == "conversations__t_u7"
+    odd = collection_name("conversations", "ユーザー/1")
+    assert odd.startswith("conversations__t_") and len(odd) <= 63
+    assert len(collection_name("c" * 60, "u1")) <= 63
+
+
+def test_registry_lru_and_single_open():
+    opened = []
+    gate = threading.Event()
+
+    def factory(tenant):
+        opened.append(tenant)
+        gate.wait(5)
+        return {"tenant": tenant}
+
+    registry = ShardRegistry(factory, capacity=2)
+    with ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(registry.get, "a") for _ in range(8)]
+        time.sleep(0.05)
+        gate.set()
+        shards = [f.result() for f in futures]
+    assert opened == ["a"] and all(shard is shards[0] for shard in shards)
+
+    registry.get("b")
+    registry.get("a")  # a を最近使ったものにする
+    registry.get("c")  # 最も古い b が閉じられる
+    assert "b" not in registry and "a" in registry and len(registry) == 2
+    assert registry.peek("b") is None
+    registry.get("b")
+    assert opened == ["a", "b", "c", "b"]
@@ -0,0 +1,35 @@
+from core.tracing import InMemoryExporter, SpanContext, Tracer, attach, current_trace_header
+import core.tracing as tracing
+
+
+def test_child_spans_share_trace_and_parent():
+    exporter = InMemoryExporter()
+    tracer = Tracer(exporter=exporter, sample_rate=1.0)
+    with tracer.start_span("root") as root:
+        with tracer.start_span("child") as child:
+            pass
+    assert child.trace_id == root.trace_id
+    assert child.parent_id == root.span_id
+    assert [s.name for s in exporter.spans()] == ["child", "root"]
+
+
+def test_unsampled_trace_is_not_exported():
+    exporter = InMemoryExporter()
+    tracer = Tracer(exporter=exporter, sample_rate=0.0)
+    with tracer.start_span("root"):
+        with tracer.start_span("child"):
+            pass
+    assert exporter.spans() == []
+
+
+def test_attach_propagates_remote_parent(monkeypatch):
+    exporter = InMemoryExporter()
+    monkeypatch.setattr(tracing, "_tracer", Tracer(exporter=exporter, sample_rate=1.0))
+    with tracing.start_span("sender"):
+        header = current_trace_header()
+
+    with attach(header), tracing.start_span("receiver") as span:
+        pass
+    parent = SpanContext.from_header(header)
+    assert span.trace_id == parent.trace_id
+    assert span.parent_id == parent.span_id
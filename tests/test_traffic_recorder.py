@@ -0,0 +1,24 @@
+from core import traffic_recorder
+from core.traffic_recorder import TrafficRecorder, anonymize, capture, read_log
+
+
+def test_anonymize_masks_email_and_phone():
+    text = anonymize("mail me at taro.y@example.co.jp or 090-1234-5678")
+    assert text == "mail me at <email> or <phone>"
+
+
+def test_recorder_appends_compact_lines_with_provider_calls(tmp_path):
+    path = tmp_path / "traffic.jsonl"
+    recorder = TrafficRecorder(str(path))
+    with capture() as calls:
+        traffic_recorder.note_provider_response("hello a@b.io", None, 0.12)
+    recorder.write("chat", {"message": "hi"}, recorder._origin + 1.5, 0.25, 200, calls)
+
+    [entry] = list(read_log(str(path)))
+    assert entry["k"] == "chat" and entry["t"] == 1.5 and entry["ms"] == 250.0
+    assert entry["p"][0]["text"] == "hello <email>"
+    assert entry["p"][0]["ttft_ms"] == 120.0
+
+
+def test_note_provider_response_outside_capture_is_noop():
+    traffic_recorder.note_provider_response("ignored")
@@ -0,0 +1,90 @@
+import threading
+
+from core.warmup import FAILED, PENDING, READY, Readiness, Warmup
+
+
+def test_ready_only_after_all_steps():
+    readiness = Readiness()
+    gate = threading.Event()
+    seen = []
+
+    def slow():
+        seen.append(readiness.ready)
+        gate.wait(5)
+
+    warmup = Warmup(readiness).add("memory", slow).add("tokenizer", lambda: None)
+    assert readiness.state == PENDING and not readiness.ready
+    thread = warmup.start()
+    assert not readiness.wait(timeout=0.05)
+    gate.set()
+    thread.join(5)
+    assert readiness.ready and seen == [False]
+    snapshot = readiness.snapshot()
+    assert snapshot["state"] == READY
+    assert list(snapshot["steps"]) == ["memory", "tokenizer"]
+    assert all(step["status"] == "ok" for step in snapshot["steps"].values())
+
+
+def test_critical_failure_keeps_readiness_failing():
+    readiness = Readiness()
+
+    def boom():
+        raise RuntimeError("chroma unavailable")
+
+    assert not Warmup(readiness).add("memory", boom).add("tokenizer", lambda: None).run()
+    snapshot = readiness.snapshot()
+    assert snapshot["state"] == FAILED
+    assert "chroma unavailable" in snapshot["steps"]["memory"]["error"]
+    assert snapshot["steps"]["tokenizer"]["status"] == "ok"
+
+
+def test_non_critical_failure_is_recorded_but_ready():
+    readiness = Readiness()
+
+    def boom():
+        raise ConnectionError("tls")
+
+    assert Warmup(readiness).add("llm_pool", boom, critical=False).run()
+    assert readiness.ready
+    assert readiness.snapshot()["steps"]["llm_pool"]["status"] == "failed"
+
+
+def test_first_request_is_recorded_once():
+    from core.warmup import FIRST_REQUEST_SECONDS
+    readiness = Readiness()
+    readiness.mark_ready()
+    readiness.observe_first_request(1.5)
+    readiness.observe_first_request(0.01)
+    assert FIRST_REQUEST_SECONDS.value(warmed="false") == 1.5
+
+
+def test_failed_warmup_recovers_on_retry():
+    readiness = Readiness()
+    attempts = []
+
+    def flaky():
+        attempts.append(readiness.state)
+        if len(attempts) < 3:
+            raise RuntimeError("chroma unavailable")
+
+    warmup = Warmup(readiness, retry_seconds=0.01, retry_max_seconds=0.02).add("memory", flaky)
+    thread = warmup.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert len(attempts) == 3
+    snapshot = readiness.snapshot()
+    assert snapshot["state"] == READY and snapshot["steps"]["memory"]["status"] == "ok"
+
+
+def test_retry_stops_when_asked():
+    readiness = Readiness()
+
+    def boom():
+        raise RuntimeError("down")
+
+    warmup = Warmup(readiness, retry_seconds=10).add("memory", boom)
+    thread = warmup.start()
+    assert not readiness.wait(timeout=2)
+    warmup.stop()
+    thread.join(5)
+    assert not thread.is_alive() and readiness.state == FAILED
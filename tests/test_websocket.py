@@ -0,0 +1,144 @@
+import asyncio
+import json
+import threading
+
+from chat.websocket import WS_CONNECTIONS, ChatSocket, origin_allowed
+
+
+class FakeAI:
+    def __init__(self, gate=None):
+        self.gate = gate
+
+    def respond_stream(self, text, memory=None):
+        for word in ("hello ", "from ", text):
+            if self.gate is not None:
+                self.gate.wait(5)
+            yield word
+
+
+class FakeDB:
+    def __init__(self):
+        self.saved = []
+
+    def save_conversation(self, message, response):
+        self.saved.append((message, response))
+        return True
+
+    def search_conversations(self, query, privacy_level=None, tags=None):
+        return [{"content": f"hit:{query}"}]
+
+
+class FakeClient:
+    """ASGI の receive / send を模したクライアント"""
+
+    def __init__(self, frames):
+        self.inbox = asyncio.Queue()
+        self.sent = []
+        self.inbox.put_nowait({"type": "websocket.connect"})
+        for frame in frames:
+            self.inbox.put_nowait({"type": "websocket.receive", "text": json.dumps(frame)})
+
+    async def receive(self):
+        return await self.inbox.get()
+
+    async def send(self, message):
+        self.sent.append(message)
+        if message["type"] == "websocket.send":
+            event = json.loads(message["text"])
+            if event["type"] in ("saved", "search_result", "error"):
+                self.finished = getattr(self, "finished", 0) + 1
+
+    def events(self, request_id=None):
+        events = [json.loads(m["text"]) for m in self.sent if m["type"] == "websocket.send"]
+        return [e for e in events if request_id is None or e["id"] == request_id]
+
+
+async def _run(client, socket, expected):
+    async def wait_and_disconnect():
+        while getattr(client, "finished", 0) < expected:
+            await asyncio.sleep(0.01)
+        await client.inbox.put({"type": "websocket.disconnect"})
+    await asyncio.wait_for(asyncio.gather(socket.run(), wait_and_disconnect()), 5)
+
+
+def test_chat_streams_deltas_and_pushes_saved_and_search_events():
+    client = FakeClient([
+        {"type": "chat", "id": "c1", "message": "world"},
+        {"type": "search", "id": "s1", "query": "q"},
+        {"type": "bogus", "id": "x"},
+    ])
+    db = FakeDB()
+    socket = ChatSocket({}, client.receive, client.send, FakeAI(), db)
+    asyncio.run(_run(client, socket, expected=3))
+
+    assert client.sent[0] == {"type": "websocket.accept"}
+    chat = client.events("c1")
+    assert [e["type"] for e in chat] == ["delta", "delta", "delta", "done", "saved"]
+    assert chat[3]["response"] == "hello from world"
+    assert db.saved == [("world", "hello from world")]
+    assert client.events("s1")[0]["results"] == [{"content": "hit:q"}]
+    assert client.events("x")[0]["error_code"] == "E40003"
+    assert WS_CONNECTIONS.value() == 0
+
+
+def test_inflight_limit_rejects_extra_requests():
+    gate = threading.Event()
+    client = FakeClient([
+        {"type": "chat", "id": "c1", "message": "a"},
+        {"type": "chat", "id": "c2", "message": "b"},
+    ])
+    socket = ChatSocket({}, client.receive, client.send, FakeAI(gate), FakeDB(), max_inflight=1)
+
+    async def scenario():
+        task = asyncio.create_task(_run(client, socket, expected=2))
+        while not client.events("c2"):
+            await asyncio.sleep(0.01)
+        gate.set()
+        await task
+
+    asyncio.run(scenario())
+    assert client.events("c2")[0]["error_code"] == "E40004"
+    assert client.events("c1")[-1]["type"] == "saved"
+
+
+def test_reused_inflight_id_is_rejected_and_freed_after_completion():
+    gate = threading.Event()
+    client = FakeClient([
+        {"type": "chat", "id": "c1", "message": "a"},
+        {"type": "chat", "id": "c1", "message": "b"},
+    ])
+    db = FakeDB()
+    socket = ChatSocket({}, client.receive, client.send, FakeAI(gate), db)
+
+    async def scenario():
+        task = asyncio.create_task(_run(client, socket, expected=3))
+        while not any(e["type"] == "error" for e in client.events("c1")):
+            await asyncio.sleep(0.01)
+        gate.set()
+        while not any(e["type"] == "saved" for e in client.events("c1")):
+            await asyncio.sleep(0.01)
+        # 完了後は同じ id を使ってよい
+        await client.inbox.put({"type": "websocket.receive",
+                                "text": json.dumps({"type": "chat", "id": "c1", "message": "c"})})
+        await task
+
+    asyncio.run(scenario())
+    types = [e["type"] for e in client.events("c1")]
+    assert types[0] == "error" and client.events("c1")[0]["error_code"] == "E40003"
+    assert types.count("saved") == 2
+    assert [m for m, _ in db.saved] == ["a", "c"]
+    assert socket._requests == {} and socket._cancelled == {}
+
+
+def test_origin_must_match_allowed_hosts():
+    def scope(origin):
+        return {"headers": [(b"host", b"localhost:8000")] +
+                ([(b"origin", origin.encode())] if origin else [])}
+
+    allowed = ["localhost", "127.0.0.1", ".example.com"]
+    assert origin_allowed(scope("http://localhost:8000"), allowed)
+    assert origin_allowed(scope("https://chat.example.com"), allowed)
+    assert origin_allowed(scope(None), allowed)  # ブラウザ以外のクライアント
+    assert not origin_allowed(scope("https://evil.test"), allowed)
+    assert not origin_allowed(scope("https://localhost.evil.test"), allowed)
+    assert not origin_allowed(scope("null"), allowed)